@@ -0,0 +1,193 @@
+import json
+import os
+import random
+import socket
+import ssl
+import threading
+import time
+
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+
+# ==========================
+# KONFIGURASI
+# ==========================
+# (token per detik, kapasitas burst) per API.
+# Kuota service account: Sheets 60 read & 60 write / menit per user,
+# Drive jauh lebih longgar (~200 / detik per project).
+API_RATES = {
+    "drive": (float(os.getenv("DRIVE_QPS", "10")), 20),
+    "sheets_read": (float(os.getenv("SHEETS_READ_QPS", "1.0")), 30),
+    "sheets_write": (float(os.getenv("SHEETS_WRITE_QPS", "1.0")), 30),
+}
+
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 32.0
+
+RETRYABLE_STATUS = {500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "RATE_LIMIT_EXCEEDED"}
+
+# Error jaringan: request mungkin sudah diproses server
+NETWORK_ERRORS = (socket.timeout, TimeoutError, ConnectionError, ssl.SSLError)
+
+
+# ==========================
+# TOKEN BUCKET
+# ==========================
+class TokenBucket:
+    """
+    Pacing request per API (thread-safe, per proses).
+    Rate turun setengah saat kena 429 lalu naik perlahan (AIMD).
+    """
+
+    def __init__(self, rate, capacity):
+        self.nominal_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        waited = 0.0
+
+        while True:
+            with self.lock:
+                self._refill()
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+
+                delay = (1 - self.tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+    def penalize(self):
+        with self.lock:
+            self.rate = max(self.nominal_rate / 8, self.rate / 2)
+            self.tokens = 0
+
+    def reward(self):
+        with self.lock:
+            if self.rate < self.nominal_rate:
+                self.rate = min(self.nominal_rate, self.rate + self.nominal_rate * 0.05)
+
+
+_BUCKETS = {name: TokenBucket(rate, capacity) for name, (rate, capacity) in API_RATES.items()}
+
+
+# ==========================
+# KLASIFIKASI ERROR
+# ==========================
+def _error_reason(error):
+    try:
+        detail = json.loads(error.content.decode("utf-8"))["error"]
+    except Exception:
+        return ""
+
+    errors = detail.get("errors") or [{}]
+    return errors[0].get("reason") or detail.get("status") or ""
+
+
+def is_rate_limited(error):
+    if not isinstance(error, HttpError):
+        return False
+
+    status = error.resp.status
+    return status == 429 or (status == 403 and _error_reason(error) in RATE_LIMIT_REASONS)
+
+
+def is_retryable(error, idempotent=True):
+    """
+    429 / rate limit selalu aman diulang (request ditolak sebelum diproses).
+    5xx dan timeout hanya diulang untuk request idempoten.
+    """
+    if is_rate_limited(error):
+        return True
+
+    if isinstance(error, HttpError):
+        return idempotent and error.resp.status in RETRYABLE_STATUS
+
+    if isinstance(error, NETWORK_ERRORS) or "timed out" in str(error).lower():
+        return idempotent
+
+    return False
+
+
+def backoff_delay(attempt):
+    """Exponential backoff dengan full jitter."""
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+# ==========================
+# EXECUTOR
+# ==========================
+def call_with_retry(fn, api="drive", idempotent=True, max_attempts=RETRY_MAX_ATTEMPTS):
+    """Jalankan fn() dengan pacing token bucket dan retry sesuai klasifikasi error."""
+    bucket = _BUCKETS[api]
+
+    for attempt in range(max_attempts):
+        bucket.acquire()
+
+        try:
+            result = fn()
+
+        except Exception as e:
+            if is_rate_limited(e):
+                bucket.penalize()
+
+            if attempt == max_attempts - 1 or not is_retryable(e, idempotent):
+                raise
+
+            delay = backoff_delay(attempt)
+            print(f"⚠️ {api}: {type(e).__name__} ({e}), retry {attempt + 1}/{max_attempts - 1} dalam {delay:.1f} detik")
+            time.sleep(delay)
+            continue
+
+        bucket.reward()
+        return result
+
+
+def api_for_request(uri, method):
+    if "sheets.googleapis.com" in uri:
+        return "sheets_read" if method == "GET" else "sheets_write"
+    return "drive"
+
+
+# POST yang aman diulang: menulis / menghapus nilai sel yang sama.
+# spreadsheets:batchUpdate (addSheet, insertDimension, ...) TIDAK termasuk.
+IDEMPOTENT_POST_OPS = ("/values:batchUpdate", "/values:batchClear", "/values:batchGetByDataFilter")
+
+
+def is_idempotent_request(uri, method):
+    # POST (append / create / batchUpdate struktur) bisa menggandakan data
+    # jika diulang setelah timeout
+    if method != "POST":
+        return True
+    return any(op in uri.split("?")[0] for op in IDEMPOTENT_POST_OPS)
+
+
+class PacedHttpRequest(HttpRequest):
+    """HttpRequest yang execute()-nya lewat token bucket & retry policy."""
+
+    def execute(self, http=None, num_retries=0):
+        return call_with_retry(
+            lambda: HttpRequest.execute(self, http=http),
+            api=api_for_request(self.uri, self.method),
+            idempotent=is_idempotent_request(self.uri, self.method)
+        )
+
+
+def build_service(service_name, version, **kwargs):
+    """build() googleapiclient dengan PacedHttpRequest untuk semua request."""
+    return build(service_name, version, requestBuilder=PacedHttpRequest, **kwargs)
@@ -1,27 +1,34 @@
 import streamlit as st
 import pandas as pd
+import logging
 import os
 import time
 import st_aggrid
-import numpy as np
-import re
+import hashlib
 
 
 from datetime import datetime
 from validator import validate_voucher, validate_calculate
-from vin_generator import generate_vin, create_cancel_row, get_log_path, generate_vin_from_drive, generate_vou_from_drive, generate_vin_from_drive_log, create_negative_excel, dataframe_to_excel_bytes, upload_excel_bytes, get_log_filename, get_log_pml_filename, get_log_filename_outward, generate_vou_from_drive, generate_pml_from_drive, generate_pml_outward_from_drive, split_upload_with_log, split_upload_with_log_outward, get_last_seq_no, generate_pml_id
-from drive_utils import upload_or_update_drive_file, get_period_drive_folders, get_or_create_folder, get_or_create_ceding_folders, get_drive_service, find_drive_file, acquire_drive_lock, release_drive_lock, upload_dataframe_to_drive, load_log_from_drive, upload_log_dataframe, load_voucher_excel_from_drive, calculate_due_date, get_exchange_rate, load_log_from_gsheet, update_gsheet, append_gsheet, create_log_gsheet, get_or_create_outward_folders, upload_dataframe_to_drive_outward, init_sheets_service, download_file_from_drive, download_file_csv_from_drive, update_pml_status_to_splitted, update_pml_status_to_calculated, create_review_spreadsheet, get_pml_metadata
+from vin_generator import generate_vin, create_cancel_row, get_log_path, generate_vin_from_drive, generate_vou_from_drive, generate_vin_from_drive_log, create_negative_excel, dataframe_to_excel_bytes, upload_excel_bytes, get_log_filename_outward, generate_pml_from_drive, generate_pml_outward_from_drive, split_upload_with_log, split_upload_with_log_outward, split_metric_spec, plan_split, get_last_seq_no, generate_pml_id, build_log_metrics, INWARD_ADMIN_METRICS, INWARD_CLAIM_METRICS, OUTWARD_ADMIN_METRICS, OUTWARD_CLAIM_METRICS
+from drive_utils import upload_or_update_drive_file, get_drive_service, find_drive_file, acquire_drive_locks, release_drive_locks, drive_lock, upload_dataframe_to_drive, load_log_from_drive, upload_log_dataframe, load_voucher_excel_from_drive, calculate_due_date, get_exchange_rate, load_log_if_changed, load_logs, append_gsheet, create_log_gsheet, upload_dataframe_to_drive_outward, init_sheets_service, download_file_from_drive, download_file_csv_from_drive, transition_pml_status, pml_row_versions, log_has_row, create_review_spreadsheet, get_pml_metadata, start_ledger_replicator
 from lock_utils import acquire_lock, release_lock
+from log_schema import LOG_COLUMNS, LOG_COLUMNS_OUTWARD
+from template_registry import template_columns, TEMPLATE_INWARD_ADMIN, TEMPLATE_INWARD_CLAIM, TEMPLATE_OUTWARD_ADMIN, TEMPLATE_OUTWARD_CLAIM
+from drive_transfer import streamlit_progress
+from date_parser import parse_date_column
+from frame_utils import compact_frame, expand_frame, MISSING_KEY_LABEL
+from period_context import get_period_context, load_period_logs
+from job_queue import init_job_queue, submit_job, list_jobs, get_job_result, ACTIVE_STATUSES, STATUS_DONE
+from ledger import init_ledger, ledger_status
+from api_retry import is_retryable, backoff_delay
+from log_replica import init_log_replica, replica_sync_logs, replica_query, replica_pml_ids, replica_distinct, replica_periods, aggregate_summary, verify_aggregates, rebuild_aggregates, KIND_PML, KIND_PML_OUTWARD, KIND_VOUCHER, KIND_VOUCHER_OUTWARD
+from posting_journal import init_posting_journal, open_entries, resolve_target, run_step, finish, pending_entries, KIND_CEDING, KIND_SPLIT, STEP_LOG, STEP_FILE
 from zoneinfo import ZoneInfo
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, JsCode
 from io import BytesIO
-from st_aggrid import JsCode
 from datetime import date
 from google.oauth2 import service_account
 
-if "is_processing_split" not in st.session_state:
-    st.session_state.is_processing_split = False
-
 creds = service_account.Credentials.from_service_account_info(
     st.secrets["gcp_service_account"],
     scopes=[
@@ -79,11 +86,27 @@ MONTH_ID = [
 # ==========================
 # CONFIG
 # ==========================
+# Modul pendukung (replika, transfer, loader periode) melapor lewat logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+
+@st.cache_resource
+def init_local_stores():
+    """Store SQLite lokal (APP_DATA_DIR) & replikator ledger, sekali per proses server."""
+    init_job_queue()
+    init_ledger()
+    init_posting_journal()
+    init_log_replica()
+    start_ledger_replicator()
+
+
 st.set_page_config(
     page_title="Retakaful Voucher Tools",
     layout="centered"
 )
 
+init_local_stores()
+
 if "log_period" not in st.session_state:
     now = datetime.now(ZoneInfo("Asia/Jakarta"))
     st.session_state["log_period"] = {
@@ -97,23 +120,380 @@ CONFIG_FOLDER_ID = st.secrets["config_folder_id"]
 RATE_FOLDER_ID = st.secrets["rate_folder_id"]
 
 
-st.title("📄 Retakaful Voucher Tools")
-st.write("")
+# ==========================
+# BACKGROUND JOB
+# ==========================
+JOB_STATUS_ICON = {
+    "QUEUED": "🕒",
+    "RUNNING": "⏳",
+    "DONE": "✅",
+    "FAILED": "❌",
+    "INTERRUPTED": "⛔"
+}
+
+if "job_hooks" not in st.session_state:
+    st.session_state["job_hooks"] = {}
+
+
+def queue_job(kind, label, fn, total=0, lock_keys=None, clear_keys=None):
+    """
+    Antrikan job ke worker, lalu catat key session yang di-reset saat job selesai.
+    """
+    job_id = submit_job(kind, label, fn, total=total, lock_keys=lock_keys)
+
+    st.session_state["job_hooks"][job_id] = {
+        "clear_keys": list(clear_keys or [])
+    }
+
+    return job_id
+
+
+def apply_job_result(job_id):
+    hook = st.session_state["job_hooks"].pop(job_id, {})
+
+    for key in hook.get("clear_keys", []):
+        st.session_state.pop(key, None)
+
+    # Hasil dilepas dari memori setelah dipakai session ini
+    result = get_job_result(job_id, pop=True) or {}
+
+    for key, value in result.get("session", {}).items():
+        st.session_state[key] = value
+
+
+@st.fragment(run_every=2)
+def render_job_panel():
+    # Ledger lokal -> spreadsheet log (write-behind)
+    replication = ledger_status()
+
+    if replication["pending"]:
+        st.caption(
+            f"🔁 Replikasi log: {replication['pending']} baris menunggu "
+            f"(lag {int(replication['lag'])} detik)"
+        )
+
+    if replication["error"]:
+        st.warning(f"⚠️ Replikasi log gagal, dicoba ulang: {replication['error']}")
+
+    jobs = list_jobs(limit=10)
+
+    if not jobs:
+        st.caption("Belum ada job.")
+        return
+
+    finished = False
+
+    for job in jobs:
+
+        icon = JOB_STATUS_ICON.get(job["status"], "")
+
+        st.markdown(f"{icon} **{job['label']}**  \n`{job['kind']}` · {job['status']}")
+
+        if job["status"] in ACTIVE_STATUSES:
+
+            caption = (
+                f"{job['done']}/{job['total']}"
+                if job["total"]
+                else f"{(job['progress'] or 0):.0%}"
+            )
+
+            if job["eta"] is not None:
+                caption += f" · ETA {int(job['eta'])} detik"
 
-tab_upload, tab_split, tab_calc = st.tabs([
-    "📤 Upload File",
-    "🧩 Split File",
-    "🧮 Calculate",
-    #"🔄 Update Voucher",
-    # "📥 Create Voucher",
-])
+            st.progress(job["progress"] or 0, text=caption)
+
+        if job["message"]:
+            st.caption(job["message"])
+
+        if job["error"]:
+            st.error(job["error"])
+
+        if job["items"]:
+            with st.expander(f"Detail ({len(job['items'])})"):
+                st.dataframe(
+                    pd.DataFrame(job["items"]),
+                    hide_index=True,
+                    use_container_width=True
+                )
+
+        # ==========================
+        # JOB SELESAI
+        # ==========================
+        if job["status"] in ACTIVE_STATUSES:
+            continue
+
+        if job["id"] in st.session_state["job_hooks"]:
+            apply_job_result(job["id"])
+            finished = True
+
+        elif job["status"] == STATUS_DONE and "session" in (get_job_result(job["id"]) or {}):
+            # Hasil job dari session lain / sebelum reload
+            if st.button("📥 Muat hasil", key=f"load_job_{job['id']}"):
+                apply_job_result(job["id"])
+                finished = True
+
+    if finished:
+        st.rerun()
 
 
 # ==========================
-# SIMPAN VOUCHER
+# POSTING TERTUNDA (JOURNAL)
 # ==========================
+# Status PML selama posting berjalan, yang dikembalikan ke POSTED saat pemulihan
+JOURNAL_CLAIM_STATUS = {
+    KIND_CEDING: "CALCULATED",
+    KIND_SPLIT: "SPLITTED"
+}
+
+
+def release_claims(job, service, sheets_service, log_pml_drive_id, claims, kind, pml_lock):
+    """
+    Jalur gagal job: PML yang sudah di-claim tapi tidak selesai dikembalikan
+    ke POSTED (lease log PML diambil lagi sebentar). Jika itu pun gagal
+    (mis. lock tidak didapat), PML dipastikan tercatat di journal supaya
+    muncul di panel posting tertunda dan bisa dikembalikan dari sana.
+    """
+    if not claims:
+        return
+
+    try:
+        with drive_lock(service, pml_lock) as lease:
+            transition_pml_status(
+                sheets_service,
+                log_pml_drive_id,
+                list(claims),
+                to_status="POSTED",
+                from_status=JOURNAL_CLAIM_STATUS[kind],
+                expected_versions=claims,
+                lease=lease
+            )
 
-with tab_upload:
+    except Exception as e:
+        print(f"⚠️ Claim {list(claims)} gagal dikembalikan ke POSTED: {e}")
+        job.text(f"⚠️ {len(claims)} PML tertahan di {JOURNAL_CLAIM_STATUS[kind]}, kembalikan lewat panel posting tertunda")
+
+        open_entries(log_pml_drive_id, claims, kind, claim_versions=claims, job_id=job.job_id)
+
+
+def render_pending_postings(sheets_service, log_pml_drive_id, pml_lock, log_df, snapshot_key, key_prefix, voucher_log_df=None):
+    """
+    Tampilkan posting yang terputus (PML tertahan di CALCULATED / SPLITTED
+    tanpa selesai). Setelah dikembalikan ke POSTED, PML dapat dipilih lagi
+    dan langkah yang sudah tercatat di journal tidak diulang.
+    """
+    status_by_pml = dict(zip(log_df["PML ID"].astype(str), log_df["STATUS"]))
+
+    # Rekonsiliasi: target voucher yang sudah tercatat di log voucher
+    logged_vouchers = set()
+    if voucher_log_df is not None and "Voucher No" in voucher_log_df.columns:
+        logged_vouchers = set(voucher_log_df["Voucher No"].dropna().astype(str))
+
+    stuck = [
+        e for e in pending_entries(scope=log_pml_drive_id)
+        if status_by_pml.get(e["source"]) == JOURNAL_CLAIM_STATUS.get(e["kind"])
+    ]
+
+    if not stuck:
+        return
+
+    with st.expander(f"⚠️ {len(stuck)} posting tertunda (terputus sebelum selesai)"):
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    "PML ID": e["source"],
+                    "Proses": e["kind"],
+                    "Target": e["target"] or "-",
+                    "Langkah selesai": ", ".join(e["steps"]) or "-",
+                    "Di log voucher": (
+                        ("✅" if e["target"] in logged_vouchers else "❌")
+                        if e["kind"] == KIND_CEDING and e["target"] else "-"
+                    ),
+                    "Job": e["job_id"] or "-"
+                }
+                for e in stuck
+            ]),
+            hide_index=True,
+            use_container_width=True
+        )
+
+        if st.button("↩️ Kembalikan ke POSTED untuk dilanjutkan", key=f"{key_prefix}_resume_pending"):
+
+            reverted, conflicts = {}, {}
+
+            # Status PML hanya diubah di bawah lease log PML
+            with drive_lock(get_drive_service(), pml_lock) as lease:
+                for kind, from_status in JOURNAL_CLAIM_STATUS.items():
+                    entries = [e for e in stuck if e["kind"] == kind]
+                    if not entries:
+                        continue
+
+                    applied, failed = transition_pml_status(
+                        sheets_service,
+                        log_pml_drive_id,
+                        [e["source"] for e in entries],
+                        to_status="POSTED",
+                        from_status=from_status,
+                        expected_versions={e["source"]: e["claim_version"] for e in entries},
+                        lease=lease
+                    )
+
+                    reverted.update(applied)
+                    conflicts.update(failed)
+
+            for pml_id, reason in conflicts.items():
+                st.warning(f"{pml_id}: {reason}")
+
+            if reverted:
+                st.session_state.pop(snapshot_key, None)
+                st.success(f"✅ {len(reverted)} PML kembali ke POSTED, pilih ulang untuk melanjutkan posting.")
+                st.rerun()
+
+
+def render_replica_search(ctx, kind, key_prefix):
+    """
+    Query lintas periode dari replika SQLite lokal
+    (mis. semua PML POSTED satu account sepanjang tahun).
+    """
+    with st.expander("🗂️ Cari Lintas Periode"):
+
+        col_r1, col_r2, col_r3 = st.columns(3)
+
+        with col_r1:
+            query_year = st.number_input("Tahun", value=ctx.year, step=1, key=f"{key_prefix}_replica_year")
+
+        # Muat semua log bulanan tahun tsb (paralel) ke replika
+        if st.button(f"📚 Muat Log Jan – Des {int(query_year)}", key=f"{key_prefix}_replica_load"):
+            with st.spinner("Memuat log semua periode..."):
+                loaded_df = load_period_logs(
+                    creds,
+                    ctx.root_folder_id,
+                    start=(int(query_year), 1),
+                    end=(int(query_year), 12),
+                    kind=kind
+                )
+            st.success(f"✅ {loaded_df['Periode'].nunique() if not loaded_df.empty else 0} periode dimuat")
+
+        with col_r2:
+            status_options = ["(Semua)"] + replica_distinct("status", kind=kind)
+            query_status = st.selectbox("STATUS", status_options, key=f"{key_prefix}_replica_status")
+
+        with col_r3:
+            account_options = ["(Semua)"] + replica_distinct("account_with", kind=kind, year=int(query_year))
+            query_account = st.selectbox("Account With", account_options, key=f"{key_prefix}_replica_account")
+
+        result = replica_query(
+            kind=kind,
+            year=int(query_year),
+            status=None if query_status == "(Semua)" else query_status,
+            account_with=None if query_account == "(Semua)" else query_account
+        )
+
+        loaded = sorted({month for y, month, k, _, _ in replica_periods() if k == kind and y == int(query_year)})
+        st.caption(f"Periode di replika: {', '.join(f'{m:02d}' for m in loaded) or '-'}")
+
+        if result.empty:
+            st.info("Tidak ada data")
+        else:
+            st.write(f"{len(result)} baris")
+            st.dataframe(result, hide_index=True, use_container_width=True)
+
+
+def render_aggregate_summary(ctx, kinds, key_prefix):
+    """
+    Ringkasan total per Account With x COB x Curr x Biz Type dari tabel
+    agregat replika (tidak men-scan ulang log).
+    """
+    with st.expander("📊 Ringkasan Periode"):
+
+        col_s1, col_s2 = st.columns(2)
+
+        with col_s1:
+            log_label = st.radio("Log", list(kinds), horizontal=True, key=f"{key_prefix}_agg_log")
+
+        with col_s2:
+            scope = st.radio("Cakupan", ["Periode ini", "Year to date"], horizontal=True, key=f"{key_prefix}_agg_scope")
+
+        months = ctx.month if scope == "Periode ini" else list(range(1, ctx.month + 1))
+
+        summary = aggregate_summary(kind=kinds[log_label], year=ctx.year, month=months)
+
+        if summary.empty:
+            st.info("Belum ada data di replika untuk cakupan ini")
+        else:
+            st.dataframe(summary, hide_index=True, use_container_width=True)
+
+        if st.button("🔁 Verifikasi & Bangun Ulang Agregat", key=f"{key_prefix}_agg_rebuild"):
+            mismatched = verify_aggregates()
+
+            if mismatched:
+                rebuild_aggregates()
+                st.warning(f"⚠️ {len(mismatched)} grup tidak sesuai, agregat sudah dibangun ulang")
+            else:
+                st.success("✅ Agregat konsisten dengan data log")
+
+
+def render_split_plan(df, split_columns, spec, file_hash, key_prefix):
+    """
+    Dry-run split untuk kolom terpilih: jumlah PML, baris & total kontrol per
+    grup, perkiraan API call / ukuran / waktu. Return True jika split boleh
+    diproses (split besar dan baris dengan kolom split kosong harus
+    dikonfirmasi dulu).
+    """
+    plan = plan_split(df, split_columns, spec=spec, file_hash=file_hash)
+
+    st.markdown("### 🧭 Rencana Split")
+
+    col_p1, col_p2, col_p3, col_p4 = st.columns(4)
+    col_p1.metric("PML Hasil Split", f"{plan['group_count']:,}")
+    col_p2.metric("Baris", f"{plan['rows']:,}")
+    col_p3.metric("API Call (Drive / Sheets)", f"{plan['api_calls']['drive']:,} / {plan['api_calls']['sheets']:,}")
+    col_p4.metric("Perkiraan Waktu", f"{plan['seconds'] / 60:,.1f} menit")
+
+    st.caption(
+        f"Perkiraan ukuran file: {plan['bytes'] / (1024 * 1024):,.2f} MB · "
+        + ("laju dari riwayat job split" if plan["throughput_measured"] else "laju default (belum ada riwayat job split)")
+    )
+
+    if plan["control_diff"] > 0.01:
+        st.error(f"❌ Total grup berbeda {plan['control_diff']:,.2f} dari total file sumber")
+
+    with st.expander(f"Detail {plan['group_count']:,} grup"):
+        st.dataframe(
+            plan["groups"].style.format({c: "{:,.2f}" for c in plan["groups"].columns if c not in ("Split Key", "Rows")}),
+            hide_index=True,
+            use_container_width=True
+        )
+
+    confirmed = True
+
+    # Baris dengan kolom split kosong menjadi PML "(kosong)" tersendiri
+    if plan["missing_rows"]:
+        st.warning(
+            f"⚠️ {plan['missing_rows']:,} baris memiliki nilai kosong di kolom split "
+            f"dan akan dijadikan PML \"{MISSING_KEY_LABEL}\" tersendiri."
+        )
+
+        confirmed = st.checkbox(
+            f"Saya yakin {plan['missing_rows']:,} baris tanpa nilai split dijadikan PML \"{MISSING_KEY_LABEL}\"",
+            key=f"{key_prefix}_split_missing_{plan['missing_rows']}"
+        ) and confirmed
+
+    if plan["needs_confirmation"]:
+        st.warning(f"⚠️ Split ini akan membuat {plan['group_count']:,} PML, file dan baris log. Pastikan kolom split sudah benar.")
+
+        confirmed = st.checkbox(
+            f"Saya yakin membuat {plan['group_count']:,} PML dari split ini",
+            key=f"{key_prefix}_split_confirm_{plan['group_count']}"
+        ) and confirmed
+
+    return confirmed
+
+
+# ==========================
+# SIMPAN VOUCHER
+# ==========================
+@st.fragment
+def render_upload_tab():
     st.subheader("📤 Upload File")
     
     # ===== ROW 1 =====
@@ -165,133 +545,15 @@ with tab_upload:
 
     if reins_type == "INWARD":
 
-        columns_template = [
-            "No",
-            "TL Detail ID",
-            "Trans Category",
-            "Policy Category",
-            "Certificate No",
-            "Insured Full Name",
-            "Gender",
-            "Main Pol No",
-            "Main Policy",
-            "Pol Holder No",
-            "Policy Holder",
-            "Birth Date",
-            "Age At",
-            "Issue Date",
-            "Term Year",
-            "Term Month",
-            "Expired Date",
-            "Medical",
-            "Smoker",
-            "Ced Risk Code",
-            "Life Risk Name",
-            "K.O.B Code",
-            "Ced Product Code",
-            "Ced Coverage Code",
-            "Ced Product Desc",
-            "Ccy Code",
-            "Sum Insured",
-            "Sum At Risk",
-            "Reins Sum Insured",
-            "Ced Retention",
-            "Reins Sum At Risk",
-            "Pay Period Type",
-            "Ced EM Rate",
-            "Ced ER Rate",
-            "Reins Premium",
-            "Reins EM Premium",
-            "Reins ER Premium",
-            "Reins Oth. Premium",
-            "Reins Total Premium",
-            "Reins Comm",
-            "Reins EM Comm",
-            "Reins ER Comm",
-            "Reins Oth. Comm",
-            "Reins Profit Share",
-            "Reins Overriding",
-            "Reins Broker Fee",
-            "Reins Total Comm",
-            "Reins Tabarru",
-            "Reins Ujrah",
-            "Reins Nett Premium",
-            "Valuation Date",
-            "Terminate Date",
-            "TL Detail Remarks",
-            "CBY",
-            "CBM",
-            "COB",
-            "Voucher ID",
-            "PML ID",
-            "References No",
-            "Elapse No",
-            "Ref Voucher ID"
-        ]
-
-        columns_template_claim = [
-            "BookYear",
-            "BookMonth",
-            "CedBookYear",
-            "CedBookMonth",
-            "Company Name",
-            "Policy Holder No",
-            "Policy Holder",
-            "Certificate No",
-            "Insured Name",
-            "Birth Date",
-            "Age",
-            "Gender",
-            "Sum Insured IDR",
-            "Sum Reinsured IDR",
-            "MedicalCategory",
-            "Product",
-            "Coverage Code",
-            "ClassOfBusiness",
-            "PayPeriodType",
-            "KindOfBusiness",
-            "Issue Date",
-            "Term Year",
-            "Term Month",
-            "End Date Policy",
-            "Claim Date",
-            "Claim Register Date",
-            "Payment Date",
-            "Currency",
-            "ExchangeRate",
-            "Amount of Claim IDR",
-            "Reins Claim IDR",
-            "Marein Share IDR",
-            "Cause Of Claim",
-            "Voucher ID",
-            "References No"        
-        ]
-
-        LOG_COLUMNS = [
-            "Seq No", "Department", "Biz Type", "Voucher No",
-            "Account With", "Cedant Company", "PIC",
-            "Product", "CBY", "CBM", "OBY", "OBM",
-            "KOB", "COB", "MOP", "Curr",
-            "Total Contribution", "Commission", "Overriding",
-            "Total Commission", "Gross Premium Income",
-            "Tabarru", "Ujrah", "Claim", "Balance", "Check Balance",
-            "Rate Exchange",
-            "Kontribusi (IDR)", "Commission (IDR)", "Overiding (IDR)",
-            "Total Commission (IDR)", "Gross Premium Income (IDR)",
-            "Tabarru (IDR)", "Ujrah (IDR)", "Claim (IDR)",
-            "Balance (IDR)", "Check Balance (IDR)",
-            "REMARKS", "PML ID", "STATUS", "CREATED AT", "CREATED BY",
-            "Due Date", "Subject Email", "Email Date",
-            "CANCELED AT", "CANCELED BY", "CANCEL OF VOUCHER", "CANCEL REASON"
-        ]
+        columns_template = template_columns(TEMPLATE_INWARD_ADMIN)
 
+        columns_template_claim = template_columns(TEMPLATE_INWARD_CLAIM)
 
         if uploaded_file:
             # ==========================
             # READ FILE
             # ==========================
             df = pd.read_excel(uploaded_file)
-            original_columns = df.columns.tolist()
             df.columns = df.columns.str.strip().str.lower()
 
             for col in ["certificate no", "main pol no", "pol holder no"]:
@@ -331,6 +593,9 @@ with tab_upload:
 
             st.success("✅ Validasi berhasil")
 
+            # Representasi ringkas setelah validasi (categorical + downcast)
+            df = compact_frame(df)
+
 
             # ==========================
             # PREVIEW + FILTER (DINAMIS)
@@ -387,19 +652,10 @@ with tab_upload:
             # ==========================
             # PERIOD & LOG
             # ==========================
-            year = st.session_state["log_period"]["year"]
-            month = st.session_state["log_period"]["month"]
-
-            # ==========================
-            # DRIVE FOLDER PER PERIODE (STEP 3)
-            # ==========================
-            drive_folders = get_period_drive_folders(
-                year=year,
-                month=month,
-                root_folder_id=ROOT_DRIVE_FOLDER_ID
-            )
+            ctx = get_period_context(creds, ROOT_DRIVE_FOLDER_ID)
 
-            PERIOD_DRIVE_ID = drive_folders["period_id"]
+            year = ctx.year
+            month = ctx.month
 
 
             # ==========================
@@ -569,28 +825,15 @@ with tab_upload:
                     st.stop()
 
                 #lock_path = log_path + ".lock"
-                service = get_drive_service()
+                service = ctx.drive
 
                 with st.spinner("⏳ Menyimpan voucher, mohon tunggu..."):
 
-                    try:
-                        service = get_drive_service()                    
-
-                        drive_folders = get_period_drive_folders(
-                            year=int(year),
-                            month=int(month),
-                            root_folder_id=ROOT_DRIVE_FOLDER_ID
-                        )
-
-                        PML_folders = get_period_drive_folders(
-                            year=int(year),
-                            month=int(month),
-                            root_folder_id=ROOT_DRIVE_FOLDER_ID
-                        )
-
-                        PERIOD_DRIVE_ID = drive_folders["period_id"]
+                    leases = []
 
-                        acquire_drive_lock(service, PERIOD_DRIVE_ID)
+                    try:
+                        # 🔒 Lock hanya resource yang ditulis (log PML)
+                        leases = acquire_drive_locks(service, [ctx.pml_log_lock])
 
                         # reload log terbaru setelah lock
                         # if os.path.exists(log_path):
@@ -598,39 +841,20 @@ with tab_upload:
                         # else:
                         #     log_df = pd.DataFrame()
 
-                        pml_drive = get_or_create_folder(
-                            service=service,
-                            folder_name="Folder PML",
-                            parent_id=PERIOD_DRIVE_ID
-                        )
-
-                        PML_DRIVE_ID = pml_drive
+                        PML_DRIVE_ID = ctx.pml_folder_id
 
                         pml_id, seq_no, file_id = generate_pml_from_drive(
                             service=service,
                             period_folder_id=PML_DRIVE_ID,
                             year=int(year),
                             month=int(month),
-                            find_drive_file=find_drive_file,
+                            find_drive_file=ctx.find_drive_file,
                             department=department,
                             biz_type = biz_type
                         )
 
                         # Upload voucher (selalu CREATE)
-                        log_pml_drive_id = find_drive_file(
-                            service=service,
-                            filename=get_log_pml_filename(int(year), int(month)),
-                            # filename="log_produksi.xlsx",
-                            parent_id=PML_DRIVE_ID,
-                            mime_type="application/vnd.google-apps.spreadsheet"
-                        )
-
-                        rate_exchange = get_exchange_rate(
-                            service=service,
-                            config_folder_id=CONFIG_FOLDER_ID,
-                            currency=curr,
-                            month=month
-                        )
+                        log_pml_drive_id = ctx.pml_log_id
 
                         if department == "ADMIN" and biz_type in ["Kontribusi", "Refund", "Alteration", "Retur", "Revise", "Batal", "Cancel"]:
                             if biz_type == "Kontribusi":
@@ -640,6 +864,8 @@ with tab_upload:
                                 df["trans category"] = "TERMINATE"
                                 df["policy category"] = "T"
 
+                            metrics = build_log_metrics(df, INWARD_ADMIN_METRICS).iloc[0].to_dict()
+
                             log_pml = {
                                 "Seq No": seq_no,
                                 "Department":department,
@@ -652,15 +878,7 @@ with tab_upload:
                                 "CBY": df["cby"][0],
                                 "CBM": df["cbm"][0],
                                 "Curr":curr,
-                                "Total Contribution": df["reins total premium"].sum(),
-                                "Commission": df["reins comm"].sum() + df["reins em comm"].sum() + df["reins er comm"].sum() + df["reins oth. comm"].sum() + df["reins profit share"].sum() + df["reins broker fee"].sum(),
-                                "Overriding": df["reins overriding"].sum() if "reins overriding" in df.columns else 0,
-                                "Total Commission": (df["reins comm"].sum() + df["reins em comm"].sum() + df["reins er comm"].sum() + df["reins oth. comm"].sum() + df["reins profit share"].sum() + df["reins broker fee"].sum()) + (df["reins overriding"].sum() if "reins overriding" in df.columns else 0),
-                                "Gross Premium Income": df["reins total premium"].sum() - (df["reins comm"].sum() + df["reins em comm"].sum() + df["reins er comm"].sum() + df["reins oth. comm"].sum() + df["reins profit share"].sum() + df["reins broker fee"].sum() + (df["reins overriding"].sum() if "reins overriding" in df.columns else 0)),
-                                "Tabarru": df["reins tabarru"].sum(),
-                                "Ujrah": df["reins ujrah"].sum(),
-                                "Claim": 0,
-                                "Balance": df["reins total premium"].sum() - (df["reins comm"].sum() + df["reins em comm"].sum() + df["reins er comm"].sum() + df["reins oth. comm"].sum() + df["reins profit share"].sum() + df["reins broker fee"].sum()) - (df["reins overriding"].sum() if "reins overriding" in df.columns else 0) - (df["claim"].sum() if "claim" in df.columns else 0),
+                                **metrics,
                                 "REMARKS": remarks,
                                 "STATUS": "POSTED",
                                 #"ENTRY_TYPE": entry_type,
@@ -675,6 +893,8 @@ with tab_upload:
                             }
 
                         elif department == "CLAIM":
+                            metrics = build_log_metrics(df, INWARD_CLAIM_METRICS).iloc[0].to_dict()
+
                             log_pml = {
                                 "Seq No": seq_no,
                                 "Department":department,
@@ -687,15 +907,7 @@ with tab_upload:
                                 "CBY": df["cedbookyear"][0],
                                 "CBM": df["cedbookmonth"][0],
                                 "Curr":curr,
-                                "Total Contribution": 0,
-                                "Commission": 0,
-                                "Overriding": 0,
-                                "Total Commission": 0,
-                                "Gross Premium Income": 0,
-                                "Tabarru": 0,
-                                "Ujrah": 0,
-                                "Claim": df["marein share idr"].sum(),
-                                "Balance": 0 - (df["marein share idr"].sum() if "marein share idr" in df.columns else 0),
+                                **metrics,
                                 "REMARKS": remarks,
                                 "STATUS": "POSTED",
                                 #"ENTRY_TYPE": entry_type,
@@ -720,11 +932,12 @@ with tab_upload:
                             log_pml_drive_id = create_log_gsheet(
                                 service=service,
                                 parent_id=PML_DRIVE_ID,
-                                filename=get_log_pml_filename(int(year), int(month)),
+                                filename=ctx.pml_log_name,
                                 columns=list(log_pml.keys())
                             )
+                            ctx.remember_file(ctx.pml_log_name, PML_DRIVE_ID, log_pml_drive_id)
 
-                        sheets_service = init_sheets_service(creds)
+                        sheets_service = ctx.sheets
 
                         append_gsheet(
                             service=sheets_service,
@@ -732,6 +945,8 @@ with tab_upload:
                             row_dict=log_pml
                         )
 
+                        upload_bar = st.progress(0.0, text="📤 Upload PML")
+
                         if department == "ADMIN" and biz_type in ["Kontribusi", "Refund", "Alteration", "Retur", "Revise", "Batal", "Cancel"]:
                             upload_dataframe_to_drive(
                                 service=service,
@@ -740,7 +955,8 @@ with tab_upload:
                                 voucher_id=pml_id,
                                 filename=f"{pml_id}.xlsx",
                                 folder_id=PML_DRIVE_ID,
-                                file_type = "PML"
+                                file_type = "PML",
+                                progress=streamlit_progress(upload_bar, "📤 Upload PML")
                             )
 
                         elif department == "CLAIM" :
@@ -751,7 +967,8 @@ with tab_upload:
                                 voucher_id=pml_id,
                                 filename=f"{pml_id}.xlsx",
                                 folder_id=PML_DRIVE_ID,
-                                file_type="PML"
+                                file_type="PML",
+                                progress=streamlit_progress(upload_bar, "📤 Upload PML")
                             )
 
                         end_time = time.time()
@@ -765,201 +982,19 @@ with tab_upload:
                             st.stop()
 
                     finally:
-                        release_drive_lock(service, PERIOD_DRIVE_ID)
+                        release_drive_locks(service, leases)
 
     elif reins_type == "OUTWARD":
 
-        columns_template_outward = [
-            "Out PL Detail ID",
-            "Retro Type",
-            "Acc With Name",
-            "Policy Category",
-            "KOB Code",
-            "Ref Offer Insured Risk ID",
-            "Main Pol No",
-            "Main Policy",
-            "Pol Holder No",
-            "Policy Holder",
-            "Certificate No",
-            "Insured Full Name",
-            "Birth Date",
-            "Gender",
-            "Issue Date",
-            "Age At",
-            "Term Year",
-            "Term Month",
-            "Expired Date",
-            "RI Period From",
-            "RI Period Until",
-            "Smoker",
-            "Medical",
-            "Ced Product Code",
-            "Ced Coverage Code",
-            "Ced Risk Code",
-            "Life Risk Detail",
-            "PA Class Category",
-            "Ccy Code",
-            "Sum Insured",
-            "Sum At Risk",
-            "Reins Sum Insured",
-            "Reins Sum At Risk",
-            "Marein Sum Insured",
-            "Marein Sum At Risk",
-            "Own Retention",
-            "Excess OR",
-            "Check_1",
-            "Retro Sum Insured",
-            "Retro Sum At Risk",
-            "Premium Ccy",
-            "Exchange Rate",
-            "Out Tty Rate",
-            "Inw Tty Rate",
-            "EM Rate",
-            "ER Rate",
-            "Retro Premium",
-            "Retro EM Premium",
-            "Retro ER Premium",
-            "Retro Oth Premium",
-            "Retro Total Premium",
-            "Retro Comm",
-            "Retro EM Comm",
-            "Retro ER Comm",
-            "Retro Oth Comm",
-            "Retro Profit Share",
-            "Retro Total Comm",
-            "Retro Tabarru",
-            "Retro Ujrah",
-            "Check_2",
-            "Retro Overriding",
-            "Retro Sliding Scale",
-            "Retro Inw Brokerage",
-            "Reins Nett Premium",
-            "Retro Nett Premium",
-            "Check_3",
-            "Is Accum Policy",
-            "Is Calculated",
-            "PL Detail ID",
-            "Inw Vouc ID",
-            "Out Vouc ID",
-            "Inw Tty Product Code",
-            "Inw Book Year",
-            "Inw Book Month",
-            "Ced Book Year",
-            "Ced Book Month",
-            "Inw Pay Period Type",
-            "Out Pay Period Type",
-            "COB",
-            "Valuation Date",
-            "Term Condition Remark",
-            "App Date",
-            "Input Date",
-            "Input Username",
-            "Modif Date",
-            "Modif Username",
-            "References No"
-        ]
-
-        columns_template_claim_outward = [
-            "No",
-            "Retro Type",
-            "Cedant Name",
-            "DLA Out Voucher ID",
-            "Main Pol No",
-            "Main Policy",
-            "Pol Holder No",
-            "Policy Holder",
-            "Certificate No",
-            "Insured Name",
-            "Birth Date",
-            "Age",
-            "Gender",
-            "Ced Product Code",
-            "Ced Coverage Code",
-            "Ced Risk Code",
-            "COB Detail",
-            "Issue Date",
-            "Term Year",
-            "Term Month",
-            "KOB Code",
-            "Smoker",
-            "Medical",
-            "Claim Date",
-            "Cause Of Claim",
-            "Inw Book Year",
-            "Inw Book Month",
-            "Ced Book Year",
-            "Ced Book Month",
-            "Method of Payment",
-            "Curr",
-            "Reins Claim",
-            "Your Share",
-            "Reinsurer Name",
-            "Voucher ID",
-            "Out Voucher ID",
-            "Voucher Desc"
-        ]
-
-        LOG_COLUMNS_OUTWARD = [
-            "Seq No",
-            "Department",
-            "Biz Type",
-            "Retro Type",
-            "Inward VIN Ref",
-            "Voucher No",
-            "Account With",
-            "Cedant Company",
-            "PIC",
-            "Product",
-            "CBY",
-            "CBM",
-            "OBY",
-            "OBM",
-            "KOB",
-            "COB",
-            "MOP",
-            "Curr",
-            "Total Contribution",
-            "Commission",
-            "Overiding",
-            "Total Commission",
-            "Gross Premium Income",
-            "Tabarru",
-            "Ujrah",
-            "Ujrah Spc",
-            "Claim",
-            "Balance",
-            "Check Balance",
-            "Rate Exchange",
-            "Kontribusi (IDR)",
-            "Commission (IDR)",
-            "Overiding (IDR)",
-            "Total Commission (IDR)",
-            "Gross Premium Income (IDR)",
-            "Tabarru (IDR)",
-            "Ujrah (IDR)",
-            "Ujrah Spc (IDR)",
-            "Claim (IDR)",
-            "Balance (IDR)",
-            "Check Balance (IDR)",
-            "REMARKS",
-            "PML ID",
-            "STATUS",
-            "CREATED AT",
-            "CREATED BY",
-            "Due Date",
-            "CANCELED AT",
-            "CANCELED BY",
-            "CANCEL OF VOUCHER",
-            "CANCEL REASON"
-        ]
+        columns_template_outward = template_columns(TEMPLATE_OUTWARD_ADMIN)
 
+        columns_template_claim_outward = template_columns(TEMPLATE_OUTWARD_CLAIM)
 
         if uploaded_file:
             # ==========================
             # READ FILE
             # ==========================
             df = pd.read_excel(uploaded_file)
-            original_columns = df.columns.tolist()
             df.columns = df.columns.str.strip().str.lower()
 
             for col in ["certificate no", "main pol no", "pol holder no"]:
@@ -979,6 +1014,9 @@ with tab_upload:
 
             st.success("✅ Validasi berhasil")
 
+            # Representasi ringkas setelah validasi (categorical + downcast)
+            df = compact_frame(df)
+
 
             # ==========================
             # PREVIEW + FILTER (DINAMIS)
@@ -1052,19 +1090,10 @@ with tab_upload:
             # ==========================
             # PERIOD & LOG
             # ==========================
-            year = st.session_state["log_period"]["year"]
-            month = st.session_state["log_period"]["month"]
-
-            # ==========================
-            # DRIVE FOLDER PER PERIODE (STEP 3)
-            # ==========================
-            drive_folders = get_period_drive_folders(
-                year=year,
-                month=month,
-                root_folder_id=ROOT_DRIVE_FOLDER_ID
-            )
+            ctx = get_period_context(creds, ROOT_DRIVE_FOLDER_ID)
 
-            PERIOD_DRIVE_ID = drive_folders["period_id"]
+            year = ctx.year
+            month = ctx.month
 
 
             # ==========================
@@ -1208,28 +1237,15 @@ with tab_upload:
                     st.stop()
 
                 #lock_path = log_path + ".lock"
-                service = get_drive_service()
+                service = ctx.drive
 
                 with st.spinner("⏳ Menyimpan voucher, mohon tunggu..."):
 
-                    try:
-                        service = get_drive_service()                    
-
-                        drive_folders = get_period_drive_folders(
-                            year=int(year),
-                            month=int(month),
-                            root_folder_id=ROOT_DRIVE_FOLDER_ID
-                        )
-
-                        PML_folders = get_period_drive_folders(
-                            year=int(year),
-                            month=int(month),
-                            root_folder_id=ROOT_DRIVE_FOLDER_ID
-                        )
-
-                        PERIOD_DRIVE_ID = drive_folders["period_id"]
+                    leases = []
 
-                        acquire_drive_lock(service, PERIOD_DRIVE_ID)
+                    try:
+                        # 🔒 Lock hanya resource yang ditulis (log PML outward)
+                        leases = acquire_drive_locks(service, [ctx.pml_log_outward_lock])
 
                         # reload log terbaru setelah lock
                         # if os.path.exists(log_path):
@@ -1237,41 +1253,24 @@ with tab_upload:
                         # else:
                         #     log_df = pd.DataFrame()
 
-                        pml_drive = get_or_create_folder(
-                            service=service,
-                            folder_name="Folder PML (Outward)",
-                            parent_id=PERIOD_DRIVE_ID
-                        )
-
-                        PML_DRIVE_ID = pml_drive
+                        PML_DRIVE_ID = ctx.pml_outward_folder_id
 
                         pml_id, seq_no, file_id = generate_pml_outward_from_drive(
                             service=service,
                             period_folder_id=PML_DRIVE_ID,
                             year=int(year),
                             month=int(month),
-                            find_drive_file=find_drive_file,
+                            find_drive_file=ctx.find_drive_file,
                             department=department,
                             biz_type = biz_type
                         )
 
                         # Upload voucher (selalu CREATE)
-                        log_pml_drive_id = find_drive_file(
-                            service=service,
-                            filename=f"{get_log_pml_filename(int(year), int(month))} (Outward)",
-                            # filename="log_produksi.xlsx",
-                            parent_id=PML_DRIVE_ID,
-                            mime_type="application/vnd.google-apps.spreadsheet"
-                        )
-
-                        rate_exchange = get_exchange_rate(
-                            service=service,
-                            config_folder_id=CONFIG_FOLDER_ID,
-                            currency=curr,
-                            month=month
-                        )
+                        log_pml_drive_id = ctx.pml_log_outward_id
 
                         if department == "ADMIN" and biz_type in ["Kontribusi", "Refund", "Alteration", "Retur", "Revise", "Batal", "Cancel"]:
+                            metrics = build_log_metrics(df, OUTWARD_ADMIN_METRICS).iloc[0].to_dict()
+
                             log_pml = {
                                 "Seq No": seq_no,
                                 "Department":department,
@@ -1284,15 +1283,7 @@ with tab_upload:
                                 "CBY": df["ced book year"][0],
                                 "CBM": df["ced book month"][0],
                                 "Curr":curr,
-                                "Total Contribution": df["retro total premium"].sum(),
-                                "Commission": df["retro total comm"].sum(),
-                                "Overriding": df["retro overriding"].sum() if "retro overriding" in df.columns else 0,
-                                "Total Commission": (df["retro total comm"].sum()) + (df["retro overriding"].sum() if "retro overriding" in df.columns else 0),
-                                "Gross Premium Income": df["retro total premium"].sum() - ((df["retro total comm"].sum()) + (df["retro overriding"].sum() if "retro overriding" in df.columns else 0)),
-                                "Tabarru": df["retro tabarru"].sum(),
-                                "Ujrah": df["retro ujrah"].sum(),
-                                "Claim": 0,
-                                "Balance": df["retro total premium"].sum() - df["retro total comm"].sum() - (df["retro overriding"].sum() if "retro overriding" in df.columns else 0) - (df["claim"].sum() if "claim" in df.columns else 0),
+                                **metrics,
                                 "REMARKS": remarks,
                                 "STATUS": "POSTED",
                                 #"ENTRY_TYPE": entry_type,
@@ -1307,6 +1298,8 @@ with tab_upload:
                             }
 
                         elif department == "CLAIM":
+                            metrics = build_log_metrics(df, OUTWARD_CLAIM_METRICS).iloc[0].to_dict()
+
                             log_pml = {
                                 "Seq No": seq_no,
                                 "Department":department,
@@ -1319,15 +1312,7 @@ with tab_upload:
                                 "CBY": df["ced book year"][0],
                                 "CBM": df["ced book month"][0],
                                 "Curr":curr,
-                                "Total Contribution": 0,
-                                "Commission": 0,
-                                "Overriding": 0,
-                                "Total Commission": 0,
-                                "Gross Premium Income": 0,
-                                "Tabarru": 0,
-                                "Ujrah": 0,
-                                "Claim": df["your share"].sum(),
-                                "Balance": 0 - (df["your share"].sum() if "your share" in df.columns else 0),
+                                **metrics,
                                 "REMARKS": remarks,
                                 "STATUS": "POSTED",
                                 #"ENTRY_TYPE": entry_type,
@@ -1352,11 +1337,12 @@ with tab_upload:
                             log_pml_drive_id = create_log_gsheet(
                                 service=service,
                                 parent_id=PML_DRIVE_ID,
-                                filename=f"{get_log_pml_filename(int(year), int(month))} (Outward)",
+                                filename=ctx.pml_log_outward_name,
                                 columns=list(log_pml.keys())
                             )
+                            ctx.remember_file(ctx.pml_log_outward_name, PML_DRIVE_ID, log_pml_drive_id)
 
-                        sheets_service = init_sheets_service(creds)
+                        sheets_service = ctx.sheets
 
                         append_gsheet(
                             service=sheets_service,
@@ -1364,6 +1350,8 @@ with tab_upload:
                             row_dict=log_pml
                         )
 
+                        upload_bar = st.progress(0.0, text="📤 Upload PML")
+
                         if department == "ADMIN" and biz_type in ["Kontribusi", "Refund", "Alteration", "Retur", "Revise", "Batal", "Cancel"]:
                             upload_dataframe_to_drive(
                                 service=service,
@@ -1372,7 +1360,8 @@ with tab_upload:
                                 voucher_id=pml_id,
                                 filename=f"{pml_id}.xlsx",
                                 folder_id=PML_DRIVE_ID,
-                                file_type = "PML"
+                                file_type = "PML",
+                                progress=streamlit_progress(upload_bar, "📤 Upload PML")
                             )
 
                         elif department == "CLAIM":
@@ -1384,7 +1373,8 @@ with tab_upload:
                                 voucher_id=pml_id,
                                 filename=f"{pml_id}.xlsx",
                                 folder_id=PML_DRIVE_ID,
-                                file_type="PML"
+                                file_type="PML",
+                                progress=streamlit_progress(upload_bar, "📤 Upload PML")
                             )
 
                         end_time = time.time()
@@ -1398,13 +1388,14 @@ with tab_upload:
                             st.stop()
 
                     finally:
-                        release_drive_lock(service, PERIOD_DRIVE_ID)
+                        release_drive_locks(service, leases)
 
 
 # ==========================
 # TAB SPLIT
 # ==========================
-with tab_split:
+@st.fragment
+def render_split_tab():
     st.subheader("🧩 Split File")
 
     reins_type = st.selectbox(
@@ -1416,145 +1407,25 @@ with tab_split:
 
     if reins_type == "INWARD":
 
-        columns_template = [
-            "No",
-            "TL Detail ID",
-            "Trans Category",
-            "Policy Category",
-            "Certificate No",
-            "Insured Full Name",
-            "Gender",
-            "Main Pol No",
-            "Main Policy",
-            "Pol Holder No",
-            "Policy Holder",
-            "Birth Date",
-            "Age At",
-            "Issue Date",
-            "Term Year",
-            "Term Month",
-            "Expired Date",
-            "Medical",
-            "Smoker",
-            "Ced Risk Code",
-            "Life Risk Name",
-            "K.O.B Code",
-            "Ced Product Code",
-            "Ced Coverage Code",
-            "Ced Product Desc",
-            "Ccy Code",
-            "Sum Insured",
-            "Sum At Risk",
-            "Reins Sum Insured",
-            "Ced Retention",
-            "Reins Sum At Risk",
-            "Pay Period Type",
-            "Ced EM Rate",
-            "Ced ER Rate",
-            "Reins Premium",
-            "Reins EM Premium",
-            "Reins ER Premium",
-            "Reins Oth. Premium",
-            "Reins Total Premium",
-            "Reins Comm",
-            "Reins EM Comm",
-            "Reins ER Comm",
-            "Reins Oth. Comm",
-            "Reins Profit Share",
-            "Reins Overriding",
-            "Reins Broker Fee",
-            "Reins Total Comm",
-            "Reins Tabarru",
-            "Reins Ujrah",
-            "Reins Nett Premium",
-            "Valuation Date",
-            "Terminate Date",
-            "TL Detail Remarks",
-            "CBY",
-            "CBM",
-            "COB",
-            "Voucher ID",
-            "PML ID",
-            "References No",
-            "Elapse No",
-            "Ref Voucher ID"
-        ]
-
-        columns_template_claim = [
-            "BookYear",
-            "BookMonth",
-            "CedBookYear",
-            "CedBookMonth",
-            "Company Name",
-            "Policy Holder No",
-            "Policy Holder",
-            "Certificate No",
-            "Insured Name",
-            "Birth Date",
-            "Age",
-            "Gender",
-            "Sum Insured IDR",
-            "Sum Reinsured IDR",
-            "MedicalCategory",
-            "Product",
-            "Coverage Code",
-            "ClassOfBusiness",
-            "PayPeriodType",
-            "KindOfBusiness",
-            "Issue Date",
-            "Term Year",
-            "Term Month",
-            "End Date Policy",
-            "Claim Date",
-            "Claim Register Date",
-            "Payment Date",
-            "Currency",
-            "ExchangeRate",
-            "Amount of Claim IDR",
-            "Reins Claim IDR",
-            "Marein Share IDR",
-            "Cause Of Claim",
-            "Voucher ID",
-            "References No"        
-        ]
-
-        LOG_COLUMNS = [
-            "Seq No", "Department", "Biz Type", "Voucher No",
-            "Account With", "Cedant Company", "PIC",
-            "Product", "CBY", "CBM", "OBY", "OBM",
-            "KOB", "COB", "MOP", "Curr",
-            "Total Contribution", "Commission", "Overriding",
-            "Total Commission", "Gross Premium Income",
-            "Tabarru", "Ujrah", "Claim", "Balance", "Check Balance",
-            "Rate Exchange",
-            "Kontribusi (IDR)", "Commission (IDR)", "Overiding (IDR)",
-            "Total Commission (IDR)", "Gross Premium Income (IDR)",
-            "Tabarru (IDR)", "Ujrah (IDR)", "Claim (IDR)",
-            "Balance (IDR)", "Check Balance (IDR)",
-            "REMARKS", "PML ID", "STATUS", "CREATED AT", "CREATED BY",
-            "Due Date", "Subject Email", "Email Date",
-            "CANCELED AT", "CANCELED BY", "CANCEL OF VOUCHER", "CANCEL REASON"
-        ]
-
-        drive_service = get_drive_service()
-        sheets_service = init_sheets_service(creds)
-
-        service = get_drive_service()
-
-        year = st.session_state["log_period"]["year"]
-        month = st.session_state["log_period"]["month"]
+        columns_template = template_columns(TEMPLATE_INWARD_ADMIN)
+
+        columns_template_claim = template_columns(TEMPLATE_INWARD_CLAIM)
+
+        ctx = get_period_context(creds, ROOT_DRIVE_FOLDER_ID)
+
+        drive_service = ctx.drive
+        sheets_service = ctx.sheets
+
+        service = ctx.drive
+
+        year = ctx.year
+        month = ctx.month
 
         # 1. SETUP PARAMETER AWAL (Di luar try agar finally bisa mengaksesnya)
-        PERIOD_DRIVE_ID = None
         df_posted = pd.DataFrame() # Default kosong agar tidak NameError
         
         # Ambil Folder ID berdasarkan Tahun/Bulan
-        drive_folders = get_period_drive_folders(
-            year=int(year),
-            month=int(month),
-            root_folder_id=ROOT_DRIVE_FOLDER_ID
-        )
-        PERIOD_DRIVE_ID = drive_folders.get("period_id")
+        PERIOD_DRIVE_ID = ctx.period_id
 
         if not PERIOD_DRIVE_ID:
             st.error("Folder periode tidak ditemukan di Drive.")
@@ -1565,25 +1436,13 @@ with tab_split:
             # acquire_drive_lock(drive_service, PERIOD_DRIVE_ID)
 
             # 3. MENCARI & MEMBACA DATA
-            # Cari Folder PML
-            pml_drive_id = get_or_create_folder(
-                service=drive_service,
-                folder_name="Folder PML",
-                parent_id=PERIOD_DRIVE_ID
-            )
-
             # Cari File Log Spreadsheet
-            log_pml_drive_id = find_drive_file(
-                service=drive_service,
-                filename=get_log_pml_filename(int(year), int(month)),
-                parent_id=pml_drive_id,
-                mime_type="application/vnd.google-apps.spreadsheet"
-            )
+            log_pml_drive_id = ctx.pml_log_id
 
             if log_pml_drive_id:
                 # PENTING: Baca isi pakai SHEETS SERVICE
-                # Pastikan load_log_from_gsheet menggunakan range "'Nama Sheet'!A:Z" (dengan kutip satu)
-                df_log = load_log_from_gsheet(sheets_service, log_pml_drive_id)
+                # Isi sheet hanya di-download ulang jika version file di Drive berubah
+                df_log, log_version = load_log_if_changed(drive_service, sheets_service, log_pml_drive_id)
                 
                 if not df_log.empty and 'STATUS' in df_log.columns:
                     # Filter hanya yang POSTED
@@ -1610,6 +1469,7 @@ with tab_split:
 
             if log_snapshot_key not in st.session_state:
                 st.session_state[log_snapshot_key] = df_posted.copy()
+                st.session_state[f"{log_snapshot_key}_version"] = log_version
 
             df_working = st.session_state[log_snapshot_key]
 
@@ -1629,7 +1489,8 @@ with tab_split:
                 current_posted_count  = len(df_posted)
                 snapshot_posted_count = len(df_working)
 
-                if current_posted_count != snapshot_posted_count:
+                # Banner dipicu oleh kenaikan version file log di Drive
+                if log_version != st.session_state.get(f"{log_snapshot_key}_version"):
                     st.warning(
                         f"⚠️ Log PML telah diperbarui oleh user lain "
                         f"({snapshot_posted_count} → {current_posted_count} baris POSTED). "
@@ -1654,46 +1515,13 @@ with tab_split:
             cols_numeric = ["Total Contribution", "Commission", "Overriding", "Total Commission",
                             "Gross Premium Income", "Tabarru", "Ujrah", "Claim", "Balance"]
 
-            def clean_number(x):
-                if pd.isna(x):
-                    return np.nan
-                
-                # Kalau sudah numerik asli (int/float dari gspread), langsung pakai
-                if isinstance(x, (int, float)):
-                    return x
-                
-                x = str(x).strip()
-                if x.lower() in ("none", "nan", ""):
-                    return np.nan
-                
-                # 🔹 Deteksi format akuntansi: (1,234.56) → negatif
-                is_negative = False
-                if x.startswith("(") and x.endswith(")"):
-                    is_negative = True
-                    x = x[1:-1].strip()  # buang tanda kurung
-                
-                # Buang simbol mata uang / karakter selain digit, koma, titik, minus
-                x = re.sub(r"[^\d,.\-]", "", x)
-                
-                # Format US/internasional: koma = ribuan, titik = desimal
-                # (berdasarkan contoh Anda: "10,223.84", "1866132.832")
-                x = x.replace(",", "")
-                
-                result = pd.to_numeric(x, errors="coerce")
-                
-                if is_negative and pd.notna(result):
-                    result = -abs(result)
-                
-                return result
-
-            for col in cols_numeric:
-                df_to_edit[col] = df_to_edit[col].apply(clean_number)
-                # 🔹 Paksa numerik di level KOLOM, lalu ganti kosong jadi 0
-                df_to_edit[col] = pd.to_numeric(df_to_edit[col], errors="coerce").fillna(0)
+            # Kolom numerik sudah float64 dari log schema
+            df_to_edit[cols_numeric] = df_to_edit[cols_numeric].fillna(0)
 
             edited_df = st.data_editor(
                 df_to_edit,
                 column_config={
+                    "ROW VERSION": None,  # versi baris (compare-and-set), tidak ditampilkan
                     "Pilih": st.column_config.CheckboxColumn(
                         "Pilih",
                         help="Pilih baris ini untuk di-split",
@@ -1735,35 +1563,10 @@ with tab_split:
                 st.success(f"✅ Baris terpilih: **{selected_pml_id}**")
 
                 # 1. Mengambil data asli dari file PML yang sudah di-upload sebelumnya
-                pml_drive = get_or_create_folder(
-                    service=service,
-                    folder_name="Folder PML",
-                    parent_id=PERIOD_DRIVE_ID
-                )
-
-                PML_DRIVE_ID = pml_drive
-
-
-                pml_file_id = find_drive_file(
-                    service=service,
-                    filename=f"{selected_pml_id}.xlsx",
-                    parent_id=PML_DRIVE_ID,
-                    mime_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-
-                service = get_drive_service()
-
-                # Folder
-                pml_drive = get_or_create_folder(
-                    service=service,
-                    folder_name="Folder PML",
-                    parent_id=PERIOD_DRIVE_ID
-                )
-
-                PML_DRIVE_ID = pml_drive
+                PML_DRIVE_ID = ctx.pml_folder_id
 
                 # Cari file
-                pml_file_id = find_drive_file(
+                pml_file_id = ctx.find_drive_file(
                     service=service,
                     filename=f"{selected_pml_id}.xlsx",
                     parent_id=PML_DRIVE_ID,
@@ -1778,8 +1581,15 @@ with tab_split:
                 # ==========================
                 # LOAD FILE
                 # ==========================
-                file_stream = download_file_from_drive(service, pml_file_id)
-                df = pd.read_excel(file_stream)
+                download_bar = st.progress(0.0, text="📥 Download PML")
+                file_stream = download_file_from_drive(
+                    service,
+                    pml_file_id,
+                    progress=streamlit_progress(download_bar, "📥 Download PML")
+                )
+                download_bar.empty()
+                file_hash = hashlib.sha1(file_stream.getvalue()).hexdigest()
+                df = compact_frame(pd.read_excel(file_stream))
 
                 ACCOUNTING_COLS = [
                     "Sum Insured", "Sum At Risk", "Reins Sum Insured", "Reins Sum At Risk", "Ced Retention",
@@ -1839,33 +1649,78 @@ with tab_split:
                     st.warning("Pilih minimal 1 kolom untuk split")
                     st.stop()
 
+                # ==========================
+                # RENCANA SPLIT (DRY-RUN)
+                # ==========================
+                split_confirmed = render_split_plan(
+                    df,
+                    selected_columns,
+                    spec=split_metric_spec(selected_rows.iloc[0]["Department"], selected_rows.iloc[0]["Biz Type"]),
+                    file_hash=file_hash,
+                    key_prefix="inward"
+                )
+
                 # ==========================
                 # PROSES SPLIT
                 # ==========================
-                if st.button(f"Proses Split untuk {selected_pml_id}", type="primary"):
+                if st.button(f"Proses Split untuk {selected_pml_id}", type="primary", disabled=not split_confirmed):
+
+                    # ==========================
+                    # JOB SPLIT (BACKGROUND)
+                    # ==========================
+                    # Double run dicegah oleh claim compare-and-set: job kedua
+                    # untuk PML yang sama mendapat konflik dan tidak men-split.
+                    log_pml_drive_id = ctx.pml_log_id
+
+                    expected_versions = pml_row_versions(selected_rows)
+
+                    # Lease log PML hanya dipegang saat claim dan saat penomoran +
+                    # append log PML hasil split; upload file berjalan tanpa lock,
+                    # sehingga split PML lain bisa berjalan paralel
+                    pml_lock = ctx.pml_log_lock
+
+                    def run_split(job):
 
-                    # 🔥 PREVENT DOUBLE RUN
-                    if st.session_state.is_processing_split:
-                        st.warning("⏳ Proses masih berjalan...")
-                        st.stop()
+                        # Client sendiri per worker (httplib2 tidak thread-safe)
+                        service = get_drive_service()
+                        sheets_service = init_sheets_service(creds)
 
-                    st.session_state.is_processing_split = True
+                        progress_bar = job
+                        status_text = job
 
-                    with st.spinner(f"⏳ Split {selected_pml_id} sedang diproses..."):
+                        claimed = {}
+                        split_done = False
 
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
+                        def on_wait(waited):
+                            job.text(f"⏳ Menunggu lock user lain ({int(waited)} detik)...")
 
                         try:
-                            acquire_drive_lock(service, PERIOD_DRIVE_ID)
-                            
-                            sheets_service = init_sheets_service(creds)
+                            # ==========================
+                            # CLAIM PML SUMBER (COMPARE-AND-SET)
+                            # ==========================
+                            # 🔒 Lease log PML hanya selama claim
+                            with drive_lock(service, pml_lock, on_wait=on_wait) as lease:
+                                job.text(f"🔒 Lock didapat setelah menunggu {lease.wait_seconds:.0f} detik")
+
+                                claimed, conflicts = transition_pml_status(
+                                    sheets_service,
+                                    log_pml_drive_id,
+                                    [selected_pml_id],
+                                    to_status="SPLITTED",
+                                    expected_versions=expected_versions,
+                                    lease=lease
+                                )
 
-                            log_pml_drive_id = find_drive_file(
-                                service=service,
-                                filename=get_log_pml_filename(int(year), int(month)),
-                                parent_id=PML_DRIVE_ID,
-                                mime_type="application/vnd.google-apps.spreadsheet"
+                            if not claimed:
+                                raise RuntimeError(f"{selected_pml_id}: {conflicts.get(str(selected_pml_id))}")
+
+                            # Bagian split yang sudah selesai di run sebelumnya dilewati
+                            open_entries(
+                                log_pml_drive_id,
+                                claimed,
+                                KIND_SPLIT,
+                                claim_versions=claimed,
+                                job_id=job.job_id
                             )
 
                             base_info = {
@@ -1894,6 +1749,8 @@ with tab_split:
                                     dept_type=selected_rows.iloc[0]["Department"],
                                     base_info=base_info,
                                     columns_template=columns_template,
+                                    pml_lock=pml_lock,
+                                    on_wait=on_wait,
                                     progress_bar=progress_bar,
                                     status_text=status_text
                                 )
@@ -1912,31 +1769,34 @@ with tab_split:
                                     dept_type=selected_rows.iloc[0]["Department"],
                                     base_info=base_info,
                                     columns_template=columns_template_claim,
+                                    pml_lock=pml_lock,
+                                    on_wait=on_wait,
                                     progress_bar=progress_bar,
                                     status_text=status_text
                                 )
 
-                            # 🔥 UPDATE STATUS
-                            update_pml_status_to_splitted(
-                                service=sheets_service,
-                                spreadsheet_id=log_pml_drive_id,
-                                pml_id=selected_pml_id
-                            )
-
-                            progress_bar.progress(1.0)
-                            status_text.text("✅ Selesai!")
+                            split_done = True
+                            finish(log_pml_drive_id, selected_pml_id)
 
-                            st.success("✅ Split selesai & status diupdate!")
+                            status_text.text("✅ Split selesai & status diupdate!")
 
                             for r in results:
-                                st.write(f"📄 {r['pml_id']} → {r['rows']} rows ({r['split_value']})")
-
-                        except RuntimeError:
-                            st.error("⛔ Log sedang digunakan user lain. Silakan coba lagi.")
+                                job.item(r["pml_id"], "OK", f"{r['rows']} rows ({r['split_value']})")
 
                         finally:
-                            release_drive_lock(service, PERIOD_DRIVE_ID)
-                            st.session_state.is_processing_split = False
+                            # Split gagal -> PML sumber dikembalikan ke POSTED
+                            # (lease log PML diambil lagi sebentar)
+                            if claimed and not split_done:
+                                release_claims(job, service, sheets_service, log_pml_drive_id, claimed, KIND_SPLIT, pml_lock)
+
+                    job_id = queue_job(
+                        kind="SPLIT",
+                        label=f"Split {selected_pml_id}",
+                        fn=run_split,
+                        clear_keys=[log_snapshot_key]
+                    )
+
+                    st.success(f"📥 Split {selected_pml_id} masuk antrian (job {job_id}), progress dapat dipantau di panel Job.")
 
             else:
                 st.write("Silakan pilih baris terlebih dahulu.")
@@ -1946,209 +1806,25 @@ with tab_split:
 
     elif reins_type == "OUTWARD":
 
-        columns_template_outward = [
-            "Out PL Detail ID",
-            "Retro Type",
-            "Acc With Name",
-            "Policy Category",
-            "KOB Code",
-            "Ref Offer Insured Risk ID",
-            "Main Pol No",
-            "Main Policy",
-            "Pol Holder No",
-            "Policy Holder",
-            "Certificate No",
-            "Insured Full Name",
-            "Birth Date",
-            "Gender",
-            "Issue Date",
-            "Age At",
-            "Term Year",
-            "Term Month",
-            "Expired Date",
-            "RI Period From",
-            "RI Period Until",
-            "Smoker",
-            "Medical",
-            "Ced Product Code",
-            "Ced Coverage Code",
-            "Ced Risk Code",
-            "Life Risk Detail",
-            "PA Class Category",
-            "Ccy Code",
-            "Sum Insured",
-            "Sum At Risk",
-            "Reins Sum Insured",
-            "Reins Sum At Risk",
-            "Marein Sum Insured",
-            "Marein Sum At Risk",
-            "Own Retention",
-            "Excess OR",
-            "Check_1",
-            "Retro Sum Insured",
-            "Retro Sum At Risk",
-            "Premium Ccy",
-            "Exchange Rate",
-            "Out Tty Rate",
-            "Inw Tty Rate",
-            "EM Rate",
-            "ER Rate",
-            "Retro Premium",
-            "Retro EM Premium",
-            "Retro ER Premium",
-            "Retro Oth Premium",
-            "Retro Total Premium",
-            "Retro Comm",
-            "Retro EM Comm",
-            "Retro ER Comm",
-            "Retro Oth Comm",
-            "Retro Profit Share",
-            "Retro Total Comm",
-            "Retro Tabarru",
-            "Retro Ujrah",
-            "Check_2",
-            "Retro Overriding",
-            "Retro Sliding Scale",
-            "Retro Inw Brokerage",
-            "Reins Nett Premium",
-            "Retro Nett Premium",
-            "Check_3",
-            "Is Accum Policy",
-            "Is Calculated",
-            "PL Detail ID",
-            "Inw Vouc ID",
-            "Out Vouc ID",
-            "Inw Tty Product Code",
-            "Inw Book Year",
-            "Inw Book Month",
-            "Ced Book Year",
-            "Ced Book Month",
-            "Inw Pay Period Type",
-            "Out Pay Period Type",
-            "COB",
-            "Valuation Date",
-            "Term Condition Remark",
-            "App Date",
-            "Input Date",
-            "Input Username",
-            "Modif Date",
-            "Modif Username",
-            "References No"
-        ]
-
-        columns_template_claim_outward = [
-            "No",
-            "Retro Type",
-            "Cedant Name",
-            "DLA Out Voucher ID",
-            "Main Pol No",
-            "Main Policy",
-            "Pol Holder No",
-            "Policy Holder",
-            "Certificate No",
-            "Insured Name",
-            "Birth Date",
-            "Age",
-            "Gender",
-            "Ced Product Code",
-            "Ced Coverage Code",
-            "Ced Risk Code",
-            "COB Detail",
-            "Issue Date",
-            "Term Year",
-            "Term Month",
-            "KOB Code",
-            "Smoker",
-            "Medical",
-            "Claim Date",
-            "Cause Of Claim",
-            "Inw Book Year",
-            "Inw Book Month",
-            "Ced Book Year",
-            "Ced Book Month",
-            "Method of Payment",
-            "Curr",
-            "Reins Claim",
-            "Your Share",
-            "Reinsurer Name",
-            "Voucher ID",
-            "Out Voucher ID",
-            "Voucher Desc"
-        ]
-
-        LOG_COLUMNS_OUTWARD = [
-            "Seq No",
-            "Department",
-            "Biz Type",
-            "Retro Type",
-            "Inward VIN Ref",
-            "Voucher No",
-            "Account With",
-            "Cedant Company",
-            "PIC",
-            "Product",
-            "CBY",
-            "CBM",
-            "OBY",
-            "OBM",
-            "KOB",
-            "COB",
-            "MOP",
-            "Curr",
-            "Total Contribution",
-            "Commission",
-            "Overiding",
-            "Total Commission",
-            "Gross Premium Income",
-            "Tabarru",
-            "Ujrah",
-            "Ujrah Spc",
-            "Claim",
-            "Balance",
-            "Check Balance",
-            "Rate Exchange",
-            "Kontribusi (IDR)",
-            "Commission (IDR)",
-            "Overiding (IDR)",
-            "Total Commission (IDR)",
-            "Gross Premium Income (IDR)",
-            "Tabarru (IDR)",
-            "Ujrah (IDR)",
-            "Ujrah Spc (IDR)",
-            "Claim (IDR)",
-            "Balance (IDR)",
-            "Check Balance (IDR)",
-            "REMARKS",
-            "PML ID",
-            "STATUS",
-            "CREATED AT",
-            "CREATED BY",
-            "Due Date",
-            "CANCELED AT",
-            "CANCELED BY",
-            "CANCEL OF VOUCHER",
-            "CANCEL REASON"
-        ]
-
-        drive_service = get_drive_service()
-        sheets_service = init_sheets_service(creds)
-
-        service = get_drive_service()
-
-        year = st.session_state["log_period"]["year"]
-        month = st.session_state["log_period"]["month"]
+        columns_template_outward = template_columns(TEMPLATE_OUTWARD_ADMIN)
+
+        columns_template_claim_outward = template_columns(TEMPLATE_OUTWARD_CLAIM)
+
+        ctx = get_period_context(creds, ROOT_DRIVE_FOLDER_ID)
+
+        drive_service = ctx.drive
+        sheets_service = ctx.sheets
+
+        service = ctx.drive
+
+        year = ctx.year
+        month = ctx.month
 
         # 1. SETUP PARAMETER AWAL (Di luar try agar finally bisa mengaksesnya)
-        PERIOD_DRIVE_ID = None
         df_posted = pd.DataFrame() # Default kosong agar tidak NameError
         
         # Ambil Folder ID berdasarkan Tahun/Bulan
-        drive_folders = get_period_drive_folders(
-            year=int(year),
-            month=int(month),
-            root_folder_id=ROOT_DRIVE_FOLDER_ID
-        )
-        PERIOD_DRIVE_ID = drive_folders.get("period_id")
+        PERIOD_DRIVE_ID = ctx.period_id
 
         if not PERIOD_DRIVE_ID:
             st.error("Folder periode tidak ditemukan di Drive.")
@@ -2156,28 +1832,16 @@ with tab_split:
 
         try:
             # 2. LOCKING (Gunakan Drive Service)
-            acquire_drive_lock(drive_service, PERIOD_DRIVE_ID)
+            # acquire_drive_lock(drive_service, PERIOD_DRIVE_ID)
 
             # 3. MENCARI & MEMBACA DATA
-            # Cari Folder PML
-            pml_drive_id = get_or_create_folder(
-                service=drive_service,
-                folder_name="Folder PML (Outward)",
-                parent_id=PERIOD_DRIVE_ID
-            )
-
             # Cari File Log Spreadsheet
-            log_pml_drive_id = find_drive_file(
-                service=drive_service,
-                filename=f"{get_log_pml_filename(int(year), int(month))} (Outward)",
-                parent_id=pml_drive_id,
-                mime_type="application/vnd.google-apps.spreadsheet"
-            )
+            log_pml_drive_id = ctx.pml_log_outward_id
 
             if log_pml_drive_id:
                 # PENTING: Baca isi pakai SHEETS SERVICE
-                # Pastikan load_log_from_gsheet menggunakan range "'Nama Sheet'!A:Z" (dengan kutip satu)
-                df_log = load_log_from_gsheet(sheets_service, log_pml_drive_id)
+                # Isi sheet hanya di-download ulang jika version file di Drive berubah
+                df_log, log_version = load_log_if_changed(drive_service, sheets_service, log_pml_drive_id)
                 
                 if not df_log.empty and 'STATUS' in df_log.columns:
                     # Filter hanya yang POSTED
@@ -2190,10 +1854,10 @@ with tab_split:
         except Exception as e:
             st.error(f"Terjadi kesalahan saat memproses data: {e}")
         
-        finally:
-            # 4. RELEASE LOCK (Selalu dijalankan meskipun error di atas)
-            if PERIOD_DRIVE_ID:
-                release_drive_lock(drive_service, PERIOD_DRIVE_ID)
+        # finally:
+        #     # 4. RELEASE LOCK (Selalu dijalankan meskipun error di atas)
+        #     if PERIOD_DRIVE_ID:
+        #         release_drive_lock(drive_service, PERIOD_DRIVE_ID)
 
         if not df_posted.empty:
             # ==========================
@@ -2203,6 +1867,7 @@ with tab_split:
 
             if log_snapshot_key not in st.session_state:
                 st.session_state[log_snapshot_key] = df_posted.copy()
+                st.session_state[f"{log_snapshot_key}_version"] = log_version
 
             df_working = st.session_state[log_snapshot_key]
 
@@ -2222,7 +1887,8 @@ with tab_split:
                 current_posted_count  = len(df_posted)
                 snapshot_posted_count = len(df_working)
 
-                if current_posted_count != snapshot_posted_count:
+                # Banner dipicu oleh kenaikan version file log di Drive
+                if log_version != st.session_state.get(f"{log_snapshot_key}_version"):
                     st.warning(
                         f"⚠️ Log PML telah diperbarui oleh user lain "
                         f"({snapshot_posted_count} → {current_posted_count} baris POSTED). "
@@ -2246,26 +1912,12 @@ with tab_split:
             # Data editor (CONSISTENT UI)
             cols_numeric = ["Total Contribution", "Commission", "Overriding", "Total Commission", "Gross Premium Income", "Tabarru", "Ujrah", "Claim", "Balance"]
 
-            def clean_number(x):
-                if pd.isna(x):
-                    return np.nan
-                x = str(x).strip()
-                if x.lower() in ("none", "nan", ""):
-                    return np.nan
-                if "." in x and "," in x:
-                    x = x.replace(".", "").replace(",", ".")
-                else:
-                    x = x.replace(",", "")
-                return x
-
-            for col in cols_numeric:
-                df_to_edit[col] = df_to_edit[col].apply(clean_number)
-                # 🔹 Paksa jadi float64 murni di level KOLOM, bukan elemen
-                df_to_edit[col] = pd.to_numeric(df_to_edit[col], errors="coerce")
+            # Kolom numerik sudah float64 dari log schema, tidak perlu parsing teks lagi
 
             edited_df = st.data_editor(
                 df_to_edit,
                 column_config={
+                    "ROW VERSION": None,  # versi baris (compare-and-set), tidak ditampilkan
                     "Pilih": st.column_config.CheckboxColumn(
                         "Pilih",
                         help="Pilih baris ini untuk di-split",
@@ -2308,51 +1960,33 @@ with tab_split:
                 st.success(f"✅ Baris terpilih: **{selected_pml_id}**")
 
                 # 1. Mengambil data asli dari file PML yang sudah di-upload sebelumnya
-                pml_drive = get_or_create_folder(
-                    service=service,
-                    folder_name="Folder PML (Outward)",
-                    parent_id=PERIOD_DRIVE_ID
-                )
-
-                PML_DRIVE_ID = pml_drive
+                PML_DRIVE_ID = ctx.pml_outward_folder_id
 
-
-                pml_file_id = find_drive_file(
+                # Cari file
+                pml_file_id = ctx.find_drive_file(
                     service=service,
                     filename=f"{selected_pml_id}.xlsx",
                     parent_id=PML_DRIVE_ID,
                     mime_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
 
-                service = get_drive_service()
+                if not pml_file_id:
+                    st.error("File PML tidak ditemukan")
+                    st.stop()
 
-                # Folder
-                pml_drive = get_or_create_folder(
-                    service=service,
-                    folder_name="Folder PML (Outward)",
-                    parent_id=PERIOD_DRIVE_ID
+
+                # ==========================
+                # LOAD FILE
+                # ==========================
+                download_bar = st.progress(0.0, text="📥 Download PML")
+                file_stream = download_file_from_drive(
+                    service,
+                    pml_file_id,
+                    progress=streamlit_progress(download_bar, "📥 Download PML")
                 )
-
-                PML_DRIVE_ID = pml_drive
-
-                # Cari file
-                pml_file_id = find_drive_file(
-                    service=service,
-                    filename=f"{selected_pml_id}.xlsx",
-                    parent_id=PML_DRIVE_ID,
-                    mime_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-
-                if not pml_file_id:
-                    st.error("File PML tidak ditemukan")
-                    st.stop()
-
-
-                # ==========================
-                # LOAD FILE
-                # ==========================
-                file_stream = download_file_from_drive(service, pml_file_id)
-                df = pd.read_excel(file_stream)
+                download_bar.empty()
+                file_hash = hashlib.sha1(file_stream.getvalue()).hexdigest()
+                df = compact_frame(pd.read_excel(file_stream))
 
                 ACCOUNTING_COLS = [
                     "Sum Insured", "Sum At Risk", "Reins Sum Insured", "Reins Sum At Risk",
@@ -2415,33 +2049,76 @@ with tab_split:
                     st.warning("Pilih minimal 1 kolom untuk split")
                     st.stop()
 
+                # ==========================
+                # RENCANA SPLIT (DRY-RUN)
+                # ==========================
+                split_confirmed = render_split_plan(
+                    df,
+                    selected_columns,
+                    spec=split_metric_spec(selected_rows.iloc[0]["Department"], selected_rows.iloc[0]["Biz Type"], outward=True),
+                    file_hash=file_hash,
+                    key_prefix="outward"
+                )
+
                 # ==========================
                 # PROSES SPLIT
                 # ==========================
-                if st.button(f"Proses Split untuk {selected_pml_id}", type="primary"):
+                if st.button(f"Proses Split untuk {selected_pml_id}", type="primary", disabled=not split_confirmed):
 
-                    # 🔥 PREVENT DOUBLE RUN
-                    if st.session_state.is_processing_split:
-                        st.warning("⏳ Proses masih berjalan...")
-                        # st.stop()
+                    # ==========================
+                    # JOB SPLIT (BACKGROUND)
+                    # ==========================
+                    log_pml_drive_id = ctx.pml_log_outward_id
 
-                    st.session_state.is_processing_split = True
+                    expected_versions = pml_row_versions(selected_rows)
 
-                    with st.spinner(f"⏳ Split {selected_pml_id} sedang diproses..."):
+                    # Lease log PML hanya dipegang saat claim dan saat penomoran +
+                    # append log PML hasil split; upload file berjalan tanpa lock,
+                    # sehingga split PML lain bisa berjalan paralel
+                    pml_lock = ctx.pml_log_outward_lock
 
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
+                    def run_split(job):
+
+                        # Client sendiri per worker (httplib2 tidak thread-safe)
+                        service = get_drive_service()
+                        sheets_service = init_sheets_service(creds)
 
-                        acquire_drive_lock(service, PERIOD_DRIVE_ID)
+                        progress_bar = job
+                        status_text = job
+
+                        claimed = {}
+                        split_done = False
+
+                        def on_wait(waited):
+                            job.text(f"⏳ Menunggu lock user lain ({int(waited)} detik)...")
 
                         try:
-                            sheets_service = init_sheets_service(creds)
+                            # ==========================
+                            # CLAIM PML SUMBER (COMPARE-AND-SET)
+                            # ==========================
+                            # 🔒 Lease log PML hanya selama claim
+                            with drive_lock(service, pml_lock, on_wait=on_wait) as lease:
+                                job.text(f"🔒 Lock didapat setelah menunggu {lease.wait_seconds:.0f} detik")
+
+                                claimed, conflicts = transition_pml_status(
+                                    sheets_service,
+                                    log_pml_drive_id,
+                                    [selected_pml_id],
+                                    to_status="SPLITTED",
+                                    expected_versions=expected_versions,
+                                    lease=lease
+                                )
 
-                            log_pml_drive_id = find_drive_file(
-                                service=service,
-                                filename=f"{get_log_pml_filename(int(year), int(month))} (Outward)",
-                                parent_id=PML_DRIVE_ID,
-                                mime_type="application/vnd.google-apps.spreadsheet"
+                            if not claimed:
+                                raise RuntimeError(f"{selected_pml_id}: {conflicts.get(str(selected_pml_id))}")
+
+                            # Bagian split yang sudah selesai di run sebelumnya dilewati
+                            open_entries(
+                                log_pml_drive_id,
+                                claimed,
+                                KIND_SPLIT,
+                                claim_versions=claimed,
+                                job_id=job.job_id
                             )
 
                             base_info = {
@@ -2469,6 +2146,8 @@ with tab_split:
                                     biz_type=selected_rows.iloc[0]["Biz Type"],
                                     base_info=base_info,
                                     columns_template=columns_template_outward,
+                                    pml_lock=pml_lock,
+                                    on_wait=on_wait,
                                     progress_bar=progress_bar,
                                     status_text=status_text
                                 )
@@ -2487,28 +2166,34 @@ with tab_split:
                                     biz_type=selected_rows.iloc[0]["Biz Type"],
                                     base_info=base_info,
                                     columns_template=columns_template_claim_outward,
+                                    pml_lock=pml_lock,
+                                    on_wait=on_wait,
                                     progress_bar=progress_bar,
                                     status_text=status_text
                                 )
 
-                            # 🔥 UPDATE STATUS
-                            update_pml_status_to_splitted(
-                                service=sheets_service,
-                                spreadsheet_id=log_pml_drive_id,
-                                pml_id=selected_pml_id
-                            )
-
-                            progress_bar.progress(1.0)
-                            status_text.text("✅ Selesai!")
+                            split_done = True
+                            finish(log_pml_drive_id, selected_pml_id)
 
-                            st.success("✅ Split selesai & status diupdate!")
+                            status_text.text("✅ Split selesai & status diupdate!")
 
                             for r in results:
-                                st.write(f"📄 {r['pml_id']} → {r['rows']} rows ({r['split_value']})")
+                                job.item(r["pml_id"], "OK", f"{r['rows']} rows ({r['split_value']})")
 
                         finally:
-                            release_drive_lock(service, PERIOD_DRIVE_ID)
-                            st.session_state.is_processing_split = False
+                            # Split gagal -> PML sumber dikembalikan ke POSTED
+                            # (lease log PML diambil lagi sebentar)
+                            if claimed and not split_done:
+                                release_claims(job, service, sheets_service, log_pml_drive_id, claimed, KIND_SPLIT, pml_lock)
+
+                    job_id = queue_job(
+                        kind="SPLIT",
+                        label=f"Split {selected_pml_id} (Outward)",
+                        fn=run_split,
+                        clear_keys=[log_snapshot_key]
+                    )
+
+                    st.success(f"📥 Split {selected_pml_id} masuk antrian (job {job_id}), progress dapat dipantau di panel Job.")
 
             else:
                 st.write("Silakan pilih baris terlebih dahulu.")
@@ -2521,313 +2206,16 @@ with tab_split:
 # ==========================
 # TAB CALCULATE
 # ==========================
-with tab_calc:
-
-    columns_template = [
-        "No",
-        "TL Detail ID",
-        "Trans Category",
-        "Policy Category",
-        "Certificate No",
-        "Insured Full Name",
-        "Gender",
-        "Main Pol No",
-        "Main Policy",
-        "Pol Holder No",
-        "Policy Holder",
-        "Birth Date",
-        "Age At",
-        "Issue Date",
-        "Term Year",
-        "Term Month",
-        "Expired Date",
-        "Medical",
-        "Smoker",
-        "Ced Risk Code",
-        "Life Risk Name",
-        "K.O.B Code",
-        "Ced Product Code",
-        "Ced Coverage Code",
-        "Ced Product Desc",
-        "Ccy Code",
-        "Sum Insured",
-        "Sum At Risk",
-        "Reins Sum Insured",
-        "Ced Retention",
-        "Reins Sum At Risk",
-        "Pay Period Type",
-        "Ced EM Rate",
-        "Ced ER Rate",
-        "Reins Premium",
-        "Reins EM Premium",
-        "Reins ER Premium",
-        "Reins Oth. Premium",
-        "Reins Total Premium",
-        "Reins Comm",
-        "Reins EM Comm",
-        "Reins ER Comm",
-        "Reins Oth. Comm",
-        "Reins Profit Share",
-        "Reins Overriding",
-        "Reins Broker Fee",
-        "Reins Total Comm",
-        "Reins Tabarru",
-        "Reins Ujrah",
-        "Reins Nett Premium",
-        "Valuation Date",
-        "Terminate Date",
-        "TL Detail Remarks",
-        "CBY",
-        "CBM",
-        "COB",
-        "Voucher ID",
-        "PML ID",
-        "References No",
-        "Elapse No",
-        "Ref Voucher ID"
-    ]
-
-    columns_template_claim = [
-        "BookYear",
-        "BookMonth",
-        "CedBookYear",
-        "CedBookMonth",
-        "Company Name",
-        "Policy Holder No",
-        "Policy Holder",
-        "Certificate No",
-        "Insured Name",
-        "Birth Date",
-        "Age",
-        "Gender",
-        "Sum Insured IDR",
-        "Sum Reinsured IDR",
-        "MedicalCategory",
-        "Product",
-        "Coverage Code",
-        "ClassOfBusiness",
-        "PayPeriodType",
-        "KindOfBusiness",
-        "Issue Date",
-        "Term Year",
-        "Term Month",
-        "End Date Policy",
-        "Claim Date",
-        "Claim Register Date",
-        "Payment Date",
-        "Currency",
-        "ExchangeRate",
-        "Amount of Claim IDR",
-        "Reins Claim IDR",
-        "Marein Share IDR",
-        "Cause Of Claim",
-        "Voucher ID",
-        "References No"        
-    ]
+@st.fragment
+def render_calc_tab():
 
-    LOG_COLUMNS = [
-        "Seq No", "Department", "Biz Type", "Voucher No",
-        "Account With", "Cedant Company", "PIC",
-        "Product", "CBY", "CBM", "OBY", "OBM",
-        "KOB", "COB", "MOP", "Curr",
-        "Total Contribution", "Commission", "Overriding",
-        "Total Commission", "Gross Premium Income",
-        "Tabarru", "Ujrah", "Claim", "Balance", "Check Balance",
-        "Rate Exchange",
-        "Kontribusi (IDR)", "Commission (IDR)", "Overiding (IDR)",
-        "Total Commission (IDR)", "Gross Premium Income (IDR)",
-        "Tabarru (IDR)", "Ujrah (IDR)", "Claim (IDR)",
-        "Balance (IDR)", "Check Balance (IDR)",
-        "REMARKS", "PML ID", "STATUS", "CREATED AT", "CREATED BY",
-        "Due Date", "Subject Email", "Email Date",
-        "CANCELED AT", "CANCELED BY", "CANCEL OF VOUCHER", "CANCEL REASON"
-    ]
+    columns_template = template_columns(TEMPLATE_INWARD_ADMIN)
 
+    columns_template_claim = template_columns(TEMPLATE_INWARD_CLAIM)
 
-    columns_template_outward = [
-        "Out PL Detail ID",
-        "Retro Type",
-        "Acc With Name",
-        "Policy Category",
-        "KOB Code",
-        "Ref Offer Insured Risk ID",
-        "Main Pol No",
-        "Main Policy",
-        "Pol Holder No",
-        "Policy Holder",
-        "Certificate No",
-        "Insured Full Name",
-        "Birth Date",
-        "Gender",
-        "Issue Date",
-        "Age At",
-        "Term Year",
-        "Term Month",
-        "Expired Date",
-        "RI Period From",
-        "RI Period Until",
-        "Smoker",
-        "Medical",
-        "Ced Product Code",
-        "Ced Coverage Code",
-        "Ced Risk Code",
-        "Life Risk Detail",
-        "PA Class Category",
-        "Ccy Code",
-        "Sum Insured",
-        "Sum At Risk",
-        "Reins Sum Insured",
-        "Reins Sum At Risk",
-        "Marein Sum Insured",
-        "Marein Sum At Risk",
-        "Own Retention",
-        "Excess OR",
-        "Check_1",
-        "Retro Sum Insured",
-        "Retro Sum At Risk",
-        "Premium Ccy",
-        "Exchange Rate",
-        "Out Tty Rate",
-        "Inw Tty Rate",
-        "EM Rate",
-        "ER Rate",
-        "Retro Premium",
-        "Retro EM Premium",
-        "Retro ER Premium",
-        "Retro Oth Premium",
-        "Retro Total Premium",
-        "Retro Comm",
-        "Retro EM Comm",
-        "Retro ER Comm",
-        "Retro Oth Comm",
-        "Retro Profit Share",
-        "Retro Total Comm",
-        "Retro Tabarru",
-        "Retro Ujrah",
-        "Check_2",
-        "Retro Overriding",
-        "Retro Sliding Scale",
-        "Retro Inw Brokerage",
-        "Reins Nett Premium",
-        "Retro Nett Premium",
-        "Check_3",
-        "Is Accum Policy",
-        "Is Calculated",
-        "PL Detail ID",
-        "Inw Vouc ID",
-        "Out Vouc ID",
-        "Inw Tty Product Code",
-        "Inw Book Year",
-        "Inw Book Month",
-        "Ced Book Year",
-        "Ced Book Month",
-        "Inw Pay Period Type",
-        "Out Pay Period Type",
-        "COB",
-        "Valuation Date",
-        "Term Condition Remark",
-        "App Date",
-        "Input Date",
-        "Input Username",
-        "Modif Date",
-        "Modif Username",
-        "References No"
-    ]
-
-    columns_template_claim_outward = [
-        "No",
-        "Retro Type",
-        "Cedant Name",
-        "DLA Out Voucher ID",
-        "Main Pol No",
-        "Main Policy",
-        "Pol Holder No",
-        "Policy Holder",
-        "Certificate No",
-        "Insured Name",
-        "Birth Date",
-        "Age",
-        "Gender",
-        "Ced Product Code",
-        "Ced Coverage Code",
-        "Ced Risk Code",
-        "COB Detail",
-        "Issue Date",
-        "Term Year",
-        "Term Month",
-        "KOB Code",
-        "Smoker",
-        "Medical",
-        "Claim Date",
-        "Cause Of Claim",
-        "Inw Book Year",
-        "Inw Book Month",
-        "Ced Book Year",
-        "Ced Book Month",
-        "Method of Payment",
-        "Curr",
-        "Reins Claim",
-        "Your Share",
-        "Reinsurer Name",
-        "Voucher ID",
-        "Out Voucher ID",
-        "Voucher Desc"
-    ]
-
-    LOG_COLUMNS_OUTWARD = [
-        "Seq No",
-        "Department",
-        "Biz Type",
-        "Retro Type",
-        "Inward VIN Ref",
-        "Voucher No",
-        "Account With",
-        "Cedant Company",
-        "PIC",
-        "Product",
-        "CBY",
-        "CBM",
-        "OBY",
-        "OBM",
-        "KOB",
-        "COB",
-        "MOP",
-        "Curr",
-        "Total Contribution",
-        "Commission",
-        "Overiding",
-        "Total Commission",
-        "Gross Premium Income",
-        "Tabarru",
-        "Ujrah",
-        "Ujrah Spc",
-        "Claim",
-        "Balance",
-        "Check Balance",
-        "Rate Exchange",
-        "Kontribusi (IDR)",
-        "Commission (IDR)",
-        "Overiding (IDR)",
-        "Total Commission (IDR)",
-        "Gross Premium Income (IDR)",
-        "Tabarru (IDR)",
-        "Ujrah (IDR)",
-        "Ujrah Spc (IDR)",
-        "Claim (IDR)",
-        "Balance (IDR)",
-        "Check Balance (IDR)",
-        "REMARKS",
-        "PML ID",
-        "STATUS",
-        "CREATED AT",
-        "CREATED BY",
-        "Due Date",
-        "CANCELED AT",
-        "CANCELED BY",
-        "CANCEL OF VOUCHER",
-        "CANCEL REASON"
-    ]
+    columns_template_outward = template_columns(TEMPLATE_OUTWARD_ADMIN)
 
+    columns_template_claim_outward = template_columns(TEMPLATE_OUTWARD_CLAIM)
 
     st.subheader("📊 Calculate PML")
 
@@ -2844,43 +2232,28 @@ with tab_calc:
         # ==========================
         # INIT SERVICE
         # ==========================
-        service = get_drive_service()
-        sheets_service = init_sheets_service(creds)
+        ctx = get_period_context(creds, ROOT_DRIVE_FOLDER_ID)
+
+        service = ctx.drive
+        sheets_service = ctx.sheets
 
-        year = st.session_state["log_period"]["year"]
-        month = st.session_state["log_period"]["month"]
+        year = ctx.year
+        month = ctx.month
 
         # ==========================
         # GET PERIOD FOLDER
         # ==========================
-        drive_folders = get_period_drive_folders(
-            year=int(year),
-            month=int(month),
-            root_folder_id=ROOT_DRIVE_FOLDER_ID
-        )
-
-        PERIOD_DRIVE_ID = drive_folders["period_id"]
+        PERIOD_DRIVE_ID = ctx.period_id
 
         # ==========================
         # GET PML FOLDER
         # ==========================
-        pml_drive = get_or_create_folder(
-            service=service,
-            folder_name="Folder PML",
-            parent_id=PERIOD_DRIVE_ID
-        )
-
-        PML_DRIVE_ID = pml_drive
+        PML_DRIVE_ID = ctx.pml_folder_id
 
         # ==========================
         # GET LOG PML FILE
         # ==========================
-        log_pml_drive_id = find_drive_file(
-            service=service,
-            filename=get_log_pml_filename(int(year), int(month)),
-            parent_id=PML_DRIVE_ID,
-            mime_type="application/vnd.google-apps.spreadsheet"
-        )
+        log_pml_drive_id = ctx.pml_log_id
 
         if not log_pml_drive_id:
             st.warning("⚠️ Log PML belum tersedia")
@@ -2889,10 +2262,16 @@ with tab_calc:
         # ==========================
         # LOAD LOG DATA
         # ==========================
-        log_df = load_log_from_gsheet(
-            service=sheets_service,
-            spreadsheet_id=log_pml_drive_id
-        )
+        # Log PML & log voucher dibaca sekaligus (paralel antar spreadsheet);
+        # isi sheet hanya di-download ulang jika version file di Drive berubah
+        log_ids = {KIND_PML: log_pml_drive_id, KIND_VOUCHER: ctx.voucher_log_id}
+
+        logs, log_versions = load_logs(service, sheets_service, log_ids)
+
+        # Replika SQLite lokal untuk filter & query lintas periode
+        replica_sync_logs(log_ids, logs, log_versions, year, month)
+
+        log_df, log_version = logs[KIND_PML], log_versions[KIND_PML]
 
         if log_df.empty:
             st.warning("⚠️ Log PML kosong")
@@ -2911,6 +2290,7 @@ with tab_calc:
 
         if log_snapshot_key not in st.session_state:
             st.session_state[log_snapshot_key] = log_df.copy()
+            st.session_state[f"{log_snapshot_key}_version"] = log_version
 
         # Gunakan snapshot, bukan log_df langsung
         df_working = st.session_state[log_snapshot_key]
@@ -2936,11 +2316,31 @@ with tab_calc:
             st.cache_data.clear()
             st.rerun()
 
+        # Posting terputus (job gagal / server restart) yang bisa dilanjutkan
+        render_pending_postings(
+            sheets_service,
+            log_pml_drive_id,
+            ctx.pml_log_lock,
+            log_df,
+            log_snapshot_key,
+            key_prefix="calc_inward",
+            voucher_log_df=logs[KIND_VOUCHER]
+        )
+
+        render_replica_search(ctx, KIND_PML, key_prefix="calc_inward")
+
+        render_aggregate_summary(
+            ctx,
+            {"Log Voucher": KIND_VOUCHER, "Log PML": KIND_PML},
+            key_prefix="calc_inward"
+        )
+
         # Warning jika log lebih baru dari snapshot
         current_posted_count  = len(log_df[log_df["STATUS"] == "POSTED"])
         snapshot_posted_count = len(df_working[df_working["STATUS"] == "POSTED"])
 
-        if current_posted_count != snapshot_posted_count:
+        # Banner dipicu oleh kenaikan version file log di Drive
+        if log_version != st.session_state.get(f"{log_snapshot_key}_version"):
             st.warning(
                 f"⚠️ Log PML telah diperbarui oleh user lain "
                 f"({snapshot_posted_count} → {current_posted_count} baris POSTED). "
@@ -2960,7 +2360,8 @@ with tab_calc:
         current_posted_count  = len(log_df[log_df["STATUS"] == "POSTED"])
         snapshot_posted_count = len(df_working[df_working["STATUS"] == "POSTED"])
 
-        if current_posted_count != snapshot_posted_count:
+        # Banner dipicu oleh kenaikan version file log di Drive
+        if log_version != st.session_state.get(f"{log_snapshot_key}_version"):
             st.warning(
                 f"⚠️ Log PML telah diperbarui oleh user lain "
                 f"({snapshot_posted_count} → {current_posted_count} baris POSTED). "
@@ -2972,10 +2373,11 @@ with tab_calc:
         # ==========================
         search = st.text_input("🔍 Cari PML ID")
 
+        # Pencarian & filter dijalankan di replika SQLite (terindeks),
+        # hasilnya dicocokkan ke snapshot lewat PML ID
         if search:
-            df_posted = df_posted[
-                df_posted["PML ID"].astype(str).str.contains(search, case=False, na=False)
-            ]
+            matched = replica_pml_ids(kind=KIND_PML, year=year, month=month, pml_id=search.strip())
+            df_posted = df_posted[df_posted["PML ID"].astype(str).isin(matched)]
 
         # ==========================
         # FILTER
@@ -3007,22 +2409,18 @@ with tab_calc:
                 filter_cbm = st.selectbox("CBM", cbm_options, key="filter_cbm")
 
         # Terapkan filter
-        df_filtered = df_posted.copy()
+        replica_filters = {
+            "account_with": None if filter_cedant == "(Semua)" else filter_cedant,
+            "product": filter_product.strip() or None,
+            "cby": None if filter_cby == "(Semua)" else int(filter_cby),
+            "cbm": None if filter_cbm == "(Semua)" else int(filter_cbm)
+        }
 
-        if filter_cedant != "(Semua)":
-            df_filtered = df_filtered[df_filtered["Account With"] == filter_cedant]
-
-        # ✅ Hanya filter jika ada keyword yang diketik (kosong = tampil semua)
-        if filter_product.strip():  # <-- ini yang perlu diperbaiki
-            df_filtered = df_filtered[
-                df_filtered["Product"].astype(str).str.contains(filter_product.strip(), case=False, na=False)
-            ]
-
-        if filter_cby != "(Semua)":
-            df_filtered = df_filtered[df_filtered["CBY"] == filter_cby]
+        df_filtered = df_posted.copy()
 
-        if filter_cbm != "(Semua)":
-            df_filtered = df_filtered[df_filtered["CBM"] == filter_cbm]
+        if any(v is not None for v in replica_filters.values()):
+            matched = replica_pml_ids(kind=KIND_PML, year=year, month=month, **replica_filters)
+            df_filtered = df_filtered[df_filtered["PML ID"].astype(str).isin(matched)]
 
         st.write(f"Total PML POSTED: {len(df_filtered)} {'(difilter)' if len(df_filtered) != len(df_posted) else ''}")
 
@@ -3069,47 +2467,8 @@ with tab_calc:
             cols_numeric = ["Total Contribution", "Commission", "Overriding", "Total Commission",
                             "Gross Premium Income", "Tabarru", "Ujrah", "Claim", "Balance"]
 
-            def clean_number(x):
-                if pd.isna(x):
-                    return np.nan
-
-                # Kalau sudah numerik asli (int/float), langsung pakai
-                if isinstance(x, (int, float)):
-                    return x
-
-                x = str(x).strip()
-                if x.lower() in ("none", "nan", ""):
-                    return np.nan
-
-                # 🔹 Deteksi format akuntansi: (1,234.56) → negatif
-                is_negative = False
-                if x.startswith("(") and x.endswith(")"):
-                    is_negative = True
-                    x = x[1:-1].strip()
-
-                # Buang simbol selain digit, koma, titik, minus
-                x = re.sub(r"[^\d,.\-]", "", x)
-
-                # Format US/internasional: koma = ribuan, titik = desimal
-                x = x.replace(",", "")
-
-                result = pd.to_numeric(x, errors="coerce")
-
-                if is_negative and pd.notna(result):
-                    result = -abs(result)
-
-                return result
-
-            for col in cols_numeric:
-                df_to_edit[col] = df_to_edit[col].apply(clean_number)
-                numeric_result = pd.to_numeric(df_to_edit[col], errors="coerce")
-
-                # Diagnostik: cek apakah masih ada yang gagal parse padahal aslinya tidak kosong
-                failed_mask = numeric_result.isna() & df_filtered[col].notna()
-                if failed_mask.any():
-                    st.warning(f"⚠️ Kolom '{col}': {failed_mask.sum()} nilai gagal di-parse")
-
-                df_to_edit[col] = numeric_result.fillna(0)
+            # Kolom numerik sudah float64 dari log schema
+            df_to_edit[cols_numeric] = df_to_edit[cols_numeric].fillna(0)
 
             # ==========================
             # DATA EDITOR
@@ -3117,6 +2476,7 @@ with tab_calc:
             edited_df = st.data_editor(
                 df_to_edit,
                 column_config={
+                    "ROW VERSION": None,  # versi baris (compare-and-set), tidak ditampilkan
                     "Pilih": st.column_config.CheckboxColumn(
                         "Pilih",
                         help="Pilih baris ini untuk di-calculate",
@@ -3214,7 +2574,7 @@ with tab_calc:
             rate_file_id = None
 
             if selected_account:
-                rate_file_id = find_drive_file(
+                rate_file_id = ctx.find_drive_file(
                     service=service,
                     filename=f"{selected_account}.xlsx",
                     parent_id=RATE_FOLDER_ID
@@ -3269,36 +2629,12 @@ with tab_calc:
                     validation_errors = []
                     validated_data = []
 
-                    service = get_drive_service()
-
-                    drive_folders = get_period_drive_folders(
-                        year=int(year),
-                        month=int(month),
-                        root_folder_id=ROOT_DRIVE_FOLDER_ID
-                    )
-
-                    PERIOD_DRIVE_ID = drive_folders["period_id"]
-
                     # ==========================
-                    # PREPARE GLOBAL
+                    # PREPARE GLOBAL (dari PeriodContext, tanpa discovery ulang)
                     # ==========================
-                    pml_drive = get_or_create_folder(
-                        service=service,
-                        folder_name="Folder PML",
-                        parent_id=PERIOD_DRIVE_ID
-                    )
-
-                    PML_DRIVE_ID = pml_drive
-
                     ceding_folder_name = normalize_folder_name(selected_account)
 
-                    ceding_drive = get_or_create_ceding_folders(
-                        service=service,
-                        period_folder_id=PERIOD_DRIVE_ID,
-                        ceding_name=ceding_folder_name
-                    )
-
-                    CEDING_DRIVE_ID = ceding_drive["ceding_id"]
+                    CEDING_DRIVE_ID = ctx.ceding_folder_id(ceding_folder_name)
 
                     due_date = calculate_due_date(
                         account_with=selected_account,
@@ -3310,21 +2646,17 @@ with tab_calc:
                     # ==========================
                     # LOAD / CREATE LOG
                     # ==========================
-                    log_drive_id = find_drive_file(
-                        service=service,
-                        filename=get_log_filename(int(year), int(month)),
-                        parent_id=PERIOD_DRIVE_ID,
-                        mime_type="application/vnd.google-apps.spreadsheet"
-                    )
+                    log_drive_id = ctx.voucher_log_id
 
                     if not log_drive_id:
 
                         log_drive_id = create_log_gsheet(
                             service=service,
                             parent_id=PERIOD_DRIVE_ID,
-                            filename=get_log_filename(int(year), int(month)),
+                            filename=ctx.voucher_log_name,
                             columns=LOG_COLUMNS
                         )
+                        ctx.remember_file(ctx.voucher_log_name, PERIOD_DRIVE_ID, log_drive_id)
 
                     # ==========================
                     # VALIDATION STAGE
@@ -3336,7 +2668,7 @@ with tab_calc:
                             # ==========================
                             # GET PML FILE
                             # ==========================
-                            pml_file_id = find_drive_file(
+                            pml_file_id = ctx.find_drive_file(
                                 service=service,
                                 filename=f"{row['PML ID']}.xlsx",
                                 parent_id=PML_DRIVE_ID,
@@ -3381,7 +2713,7 @@ with tab_calc:
                             # ==========================
                             validated_data.append({
                                 "row": row,
-                                "df": df
+                                "df": compact_frame(df)
                             })
 
                         except Exception as e:
@@ -3403,16 +2735,65 @@ with tab_calc:
                     st.stop()
 
                 # ==========================
-                # POSTING STAGE
+                # POSTING STAGE (BACKGROUND JOB)
                 # ==========================
-                with st.spinner("⏳ Calculation sedang berjalan, mohon tunggu..."):
+                # Lease log PML hanya dipegang saat claim (compare-and-set) dan saat
+                # claim dikembalikan; lease log voucher hanya saat nomor voucher
+                # dialokasikan + baris log ditulis per PML. Upload file berjalan
+                # tanpa lock, sehingga posting PML lain bisa berjalan paralel.
+                pml_lock = ctx.pml_log_lock
+                voucher_lock = ctx.voucher_log_lock
+
+                expected_versions = pml_row_versions(selected_rows)
+
+                def run_ceding_posting(job):
+
+                    # Client sendiri per worker (httplib2 tidak thread-safe)
+                    service = get_drive_service()
+                    sheets_service = init_sheets_service(creds)
+
+                    claimed = {}
+                    posted = set()
+                    lock_wait = 0.0
+
+                    def on_wait(waited):
+                        job.text(f"⏳ Menunggu lock user lain ({int(waited)} detik)...")
 
                     try:
+                        # ==========================
+                        # CLAIM PML (COMPARE-AND-SET)
+                        # ==========================
+                        # POSTED -> CALCULATED hanya jika baris belum diubah user lain
+                        # sejak snapshot; PML yang sudah di-claim job lain jadi konflik,
+                        # sehingga PML yang sama tidak diposting dua kali.
+                        # 🔒 Lease log PML hanya selama claim
+                        with drive_lock(service, pml_lock, on_wait=on_wait) as lease:
+                            lock_wait += lease.wait_seconds
+
+                            claimed, conflicts = transition_pml_status(
+                                sheets_service,
+                                log_pml_drive_id,
+                                [item["row"]["PML ID"] for item in validated_data],
+                                to_status="CALCULATED",
+                                expected_versions=expected_versions,
+                                lease=lease
+                            )
 
-                        # 🔒 LOCK SEKALI SAJA
-                        acquire_drive_lock(service, PERIOD_DRIVE_ID)
+                        for pml_id, reason in conflicts.items():
+                            job.item(pml_id, "CONFLICT", reason)
 
-                        sheets_service = init_sheets_service(creds)
+                        # ==========================
+                        # JOURNAL (WRITE-AHEAD)
+                        # ==========================
+                        # Entry PML yang belum selesai di run sebelumnya dipertahankan,
+                        # sehingga langkah yang sudah jalan tidak diulang (resume)
+                        open_entries(
+                            log_pml_drive_id,
+                            claimed,
+                            KIND_CEDING,
+                            claim_versions=claimed,
+                            job_id=job.job_id
+                        )
 
                         success_count = 0
 
@@ -3422,7 +2803,11 @@ with tab_calc:
                         for item in validated_data:
 
                             row = item["row"]
-                            df = item["df"]
+                            df = expand_frame(item["df"])
+
+                            # PML konflik tidak diposting
+                            if str(row["PML ID"]) not in claimed:
+                                continue
 
                             # ✅ Retry wrapper
                             max_retries = 3
@@ -3440,281 +2825,214 @@ with tab_calc:
                                         month=month
                                     )
 
-                                    # ==========================
-                                    # GENERATE VOUCHER
-                                    # ==========================
-                                    voucher, seq_no, _ = generate_vin_from_drive(
-                                        service=service,
-                                        period_folder_id=PERIOD_DRIVE_ID,
-                                        year=int(year),
-                                        month=int(month),
-                                        find_drive_file=find_drive_file,
-                                        dept_type=department_type
-                                    )
-
-                                    # ==========================
-                                    # BUILD LOG ENTRY
-                                    # ==========================
-                                    if department_type == "ADMIN" and biz_type in [
-                                        "Kontribusi",
-                                        "Refund",
-                                        "Alteration",
-                                        "Retur",
-                                        "Revise",
-                                        "Batal",
-                                        "Cancel"
-                                    ]:
-
-                                        total_contribution = df["Reins Total Premium"].sum()
-
-                                        commission = df["Reins Comm"].sum() + df["Reins EM Comm"].sum() + df["Reins ER Comm"].sum() + df["Reins Oth. Comm"].sum() + df["Reins Profit Share"].sum() + df["Reins Broker Fee"].sum()
-
-                                        overriding = (
-                                            df["Reins Overriding"].sum()
-                                            if "Reins Overriding" in df.columns
-                                            else 0
-                                        )
-
-                                        total_commission = commission + overriding
-
-                                        claim_amount = (
-                                            df["Claim"].sum()
-                                            if "Claim" in df.columns
-                                            else 0
-                                        )
-
-                                        balance = (
-                                            total_contribution
-                                            - total_commission
-                                            - claim_amount
-                                        )
-
-                                        log_entry = {
-                                            "Seq No": seq_no,
-                                            "Department": row["Department"],
-                                            "Biz Type": row["Biz Type"],
-                                            "Voucher No": voucher,
-                                            "Account With": row["Account With"],
-                                            "Cedant Company": row["Cedant Company"],
-                                            "PIC": row["PIC"],
-                                            "Product": df["References No"].iloc[0],
-                                            "CBY": df["CBY"].iloc[0],
-                                            "CBM": df["CBM"].iloc[0],
-                                            "OBY": int(year),
-                                            "OBM": int(month),
-                                            "KOB": df["K.O.B Code"].iloc[0],
-                                            "COB": df["COB"].iloc[0],
-                                            "MOP": df["Pay Period Type"].iloc[0],
-                                            "Curr": df["Ccy Code"].iloc[0],
-
-                                            "Total Contribution": total_contribution,
-                                            "Commission": commission,
-                                            "Overriding": overriding,
-                                            "Total Commission": total_commission,
-                                            "Gross Premium Income": total_contribution - total_commission,
-                                            "Tabarru": df["Reins Tabarru"].sum(),
-                                            "Ujrah": df["Reins Ujrah"].sum(),
-                                            "Claim": 0,
-                                            "Balance": balance,
-                                            "Check Balance": "",
-
-                                            "Rate Exchange": rate_exchange,
-
-                                            "Kontribusi (IDR)": total_contribution * rate_exchange,
-                                            "Commission (IDR)": commission * rate_exchange,
-                                            "Overiding (IDR)": overriding * rate_exchange,
-                                            "Total Commission (IDR)": total_commission * rate_exchange,
-                                            "Gross Premium Income (IDR)": (
-                                                total_contribution - total_commission
-                                            ) * rate_exchange,
-
-                                            "Tabarru (IDR)": (
-                                                df["Reins Tabarru"].sum()
-                                                * rate_exchange
-                                            ),
-
-                                            "Ujrah (IDR)": (
-                                                df["Reins Ujrah"].sum()
-                                                * rate_exchange
-                                            ),
-
-                                            "Claim (IDR)": 0,
-
-                                            "Balance (IDR)": (
-                                                balance * rate_exchange
-                                            ),
-
-                                            "Check Balance (IDR)": "",
-
-                                            "REMARKS": "-",
-                                            "PML ID": row["PML ID"],
-                                            "STATUS": "POSTED",
-                                            "CREATED AT": now_wib_naive(),
-                                            "CREATED BY": row["PIC"],
-                                            "Due Date": due_date,
-                                            "Subject Email": row["Subject Email"],
-                                            "Email Date": row["Email Date"],
-                                            "CANCELED AT": "-",
-                                            "CANCELED BY": "-",
-                                            "CANCEL OF VOUCHER": "-",
-                                            "CANCEL REASON": "-"
-                                        }
-
-                                    elif department_type == "CLAIM":
-
-                                        claim_amount = (
-                                            df["Marein Share IDR"].sum()
-                                            if "Marein Share IDR" in df.columns
-                                            else 0
+                                    # 🔒 Lease log voucher hanya selama penomoran + append log
+                                    with drive_lock(service, voucher_lock, on_wait=on_wait) as lease:
+                                        lock_wait += lease.wait_seconds
+
+                                        # ==========================
+                                        # GENERATE VOUCHER
+                                        # ==========================
+                                        # Nomor voucher dicatat di journal sebelum ditulis ke log;
+                                        # retry / resume memakai nomor yang sama jika sudah masuk log
+                                        entry = resolve_target(
+                                            log_pml_drive_id,
+                                            row["PML ID"],
+                                            "",
+                                            KIND_CEDING,
+                                            allocate=lambda: generate_vin_from_drive(
+                                                service=service,
+                                                period_folder_id=PERIOD_DRIVE_ID,
+                                                year=int(year),
+                                                month=int(month),
+                                                find_drive_file=ctx.find_drive_file,
+                                                dept_type=department_type
+                                            )[:2],
+                                            in_log=lambda target: log_has_row(
+                                                sheets_service,
+                                                log_drive_id,
+                                                {"Voucher No": target, "PML ID": row["PML ID"]}
+                                            )
                                         )
 
-                                        balance = -claim_amount
-
-                                        log_entry = {
-                                            "Seq No": seq_no,
-                                            "Department": row["Department"],
-                                            "Biz Type": row["Biz Type"],
-                                            "Voucher No": voucher,
-                                            "Account With": row["Account With"],
-                                            "Cedant Company": row["Cedant Company"],
-                                            "PIC": row["PIC"],
-                                            "Product": df["References No"].iloc[0],
-                                            "CBY": df["CedBookYear"].iloc[0],
-                                            "CBM": df["CedBookMonth"].iloc[0],
-                                            "OBY": int(year),
-                                            "OBM": int(month),
-                                            "KOB": df["KindOfBusiness"].iloc[0],
-                                            "COB": df["ClassOfBusiness"].iloc[0],
-                                            "MOP": df["PayPeriodType"].iloc[0],
-                                            "Curr": df["Currency"].iloc[0],
-
-                                            "Total Contribution": 0,
-                                            "Commission": 0,
-                                            "Overriding": 0,
-                                            "Total Commission": 0,
-                                            "Gross Premium Income": 0,
-                                            "Tabarru": 0,
-                                            "Ujrah": 0,
-                                            "Claim": claim_amount,
-                                            "Balance": balance,
-                                            "Check Balance": "",
-
-                                            "Rate Exchange": rate_exchange,
-
-                                            "Kontribusi (IDR)": 0,
-                                            "Commission (IDR)": 0,
-                                            "Overiding (IDR)": 0,
-                                            "Total Commission (IDR)": 0,
-                                            "Gross Premium Income (IDR)": 0,
-                                            "Tabarru (IDR)": 0,
-                                            "Ujrah (IDR)": 0,
-
-                                            "Claim (IDR)": (
-                                                claim_amount * rate_exchange
-                                            ),
-
-                                            "Balance (IDR)": (
-                                                balance * rate_exchange
-                                            ),
-
-                                            "Check Balance (IDR)": "",
-
-                                            "REMARKS": "-",
-                                            "PML ID": row["PML ID"],
-                                            "STATUS": "POSTED",
-                                            "CREATED AT": now_wib_naive(),
-                                            "CREATED BY": row["PIC"],
-                                            "Due Date": due_date,
-                                            "Subject Email": row["Subject Email"],
-                                            "Email Date": row["Email Date"],
-                                            "CANCELED AT": "-",
-                                            "CANCELED BY": "-",
-                                            "CANCEL OF VOUCHER": "-",
-                                            "CANCEL REASON": "-"
-                                        }
-
-                                    # ==========================
-                                    # APPEND LOG
-                                    # ==========================
-                                    append_gsheet(
-                                        service=sheets_service,
-                                        spreadsheet_id=log_drive_id,
-                                        row_dict=log_entry
-                                    )
+                                        voucher, seq_no = entry["target"], int(entry["seq_no"])
+
+                                        # ==========================
+                                        # BUILD LOG ENTRY
+                                        # ==========================
+                                        if department_type == "ADMIN" and biz_type in [
+                                            "Kontribusi",
+                                            "Refund",
+                                            "Alteration",
+                                            "Retur",
+                                            "Revise",
+                                            "Batal",
+                                            "Cancel"
+                                        ]:
+
+                                            metrics = build_log_metrics(
+                                                df, INWARD_ADMIN_METRICS, rate=rate_exchange
+                                            ).iloc[0].to_dict()
+
+                                            log_entry = {
+                                                "Seq No": seq_no,
+                                                "Department": row["Department"],
+                                                "Biz Type": row["Biz Type"],
+                                                "Voucher No": voucher,
+                                                "Account With": row["Account With"],
+                                                "Cedant Company": row["Cedant Company"],
+                                                "PIC": row["PIC"],
+                                                "Product": df["References No"].iloc[0],
+                                                "CBY": df["CBY"].iloc[0],
+                                                "CBM": df["CBM"].iloc[0],
+                                                "OBY": int(year),
+                                                "OBM": int(month),
+                                                "KOB": df["K.O.B Code"].iloc[0],
+                                                "COB": df["COB"].iloc[0],
+                                                "MOP": df["Pay Period Type"].iloc[0],
+                                                "Curr": df["Ccy Code"].iloc[0],
+
+                                                **metrics,
+                                                "Check Balance": "",
+                                                "Check Balance (IDR)": "",
+
+                                                "REMARKS": "-",
+                                                "PML ID": row["PML ID"],
+                                                "STATUS": "POSTED",
+                                                "CREATED AT": now_wib_naive(),
+                                                "CREATED BY": row["PIC"],
+                                                "Due Date": due_date,
+                                                "Subject Email": row["Subject Email"],
+                                                "Email Date": row["Email Date"],
+                                                "CANCELED AT": "-",
+                                                "CANCELED BY": "-",
+                                                "CANCEL OF VOUCHER": "-",
+                                                "CANCEL REASON": "-"
+                                            }
+
+                                        elif department_type == "CLAIM":
+
+                                            metrics = build_log_metrics(
+                                                df, INWARD_CLAIM_METRICS, rate=rate_exchange
+                                            ).iloc[0].to_dict()
+
+                                            log_entry = {
+                                                "Seq No": seq_no,
+                                                "Department": row["Department"],
+                                                "Biz Type": row["Biz Type"],
+                                                "Voucher No": voucher,
+                                                "Account With": row["Account With"],
+                                                "Cedant Company": row["Cedant Company"],
+                                                "PIC": row["PIC"],
+                                                "Product": df["References No"].iloc[0],
+                                                "CBY": df["CedBookYear"].iloc[0],
+                                                "CBM": df["CedBookMonth"].iloc[0],
+                                                "OBY": int(year),
+                                                "OBM": int(month),
+                                                "KOB": df["KindOfBusiness"].iloc[0],
+                                                "COB": df["ClassOfBusiness"].iloc[0],
+                                                "MOP": df["PayPeriodType"].iloc[0],
+                                                "Curr": df["Currency"].iloc[0],
+
+                                                **metrics,
+                                                "Check Balance": "",
+                                                "Check Balance (IDR)": "",
+
+                                                "REMARKS": "-",
+                                                "PML ID": row["PML ID"],
+                                                "STATUS": "POSTED",
+                                                "CREATED AT": now_wib_naive(),
+                                                "CREATED BY": row["PIC"],
+                                                "Due Date": due_date,
+                                                "Subject Email": row["Subject Email"],
+                                                "Email Date": row["Email Date"],
+                                                "CANCELED AT": "-",
+                                                "CANCELED BY": "-",
+                                                "CANCEL OF VOUCHER": "-",
+                                                "CANCEL REASON": "-"
+                                            }
+
+                                        # ==========================
+                                        # APPEND LOG
+                                        # ==========================
+                                        run_step(entry, STEP_LOG, lambda: append_gsheet(
+                                            service=sheets_service,
+                                            spreadsheet_id=log_drive_id,
+                                            row_dict=log_entry
+                                        ))
 
                                     # ==========================
                                     # UPLOAD VOUCHER FILE
                                     # ==========================
-                                    upload_dataframe_to_drive(
-                                        service=service,
-                                        df=df,
-                                        template_columns=(
-                                            columns_template
-                                            if department_type != "CLAIM"
-                                            else columns_template_claim
+                                    run_step(
+                                        entry,
+                                        STEP_FILE,
+                                        lambda: upload_dataframe_to_drive(
+                                            service=service,
+                                            df=df,
+                                            template_columns=(
+                                                columns_template
+                                                if department_type != "CLAIM"
+                                                else columns_template_claim
+                                            ),
+                                            voucher_id=voucher,
+                                            filename=f"{voucher}.xlsx",
+                                            folder_id=CEDING_DRIVE_ID,
+                                            file_type="Voucher"
                                         ),
-                                        voucher_id=voucher,
-                                        filename=f"{voucher}.xlsx",
-                                        folder_id=CEDING_DRIVE_ID,
-                                        file_type="Voucher"
+                                        exists=lambda: find_drive_file(service, f"{voucher}.xlsx", CEDING_DRIVE_ID) is not None
                                     )
 
-                                    # ==========================
-                                    # UPDATE STATUS
-                                    # ==========================
-                                    update_pml_status_to_calculated(
-                                        service=sheets_service,
-                                        spreadsheet_id=log_pml_drive_id,
-                                        pml_id=[str(row["PML ID"])]
-                                    )
+                                    finish(log_pml_drive_id, row["PML ID"])
 
                                     success_count += 1
+                                    posted.add(str(row["PML ID"]))
 
-                                    # ✅ Jeda antar PML
-                                    time.sleep(2 ** attempt)  # exponential backoff
+                                    job.item(row["PML ID"], "OK", voucher)
 
+                                    # Pacing request diatur token bucket di api_retry
                                     break  # ✅ Keluar dari retry loop jika berhasil
 
                                 except Exception as e:
-                                    if "timed out" in str(e).lower() and attempt < max_retries - 1:
-                                        st.warning(f"⚠️ Timeout pada {row['PML ID']}, retry {attempt + 1}/{max_retries - 1}...")
-                                        time.sleep(3 * (attempt + 1))  # exponential backoff
+                                    # Langkah posting idempoten (journal) -> aman diulang
+                                    if is_retryable(e) and attempt < max_retries - 1:
+                                        job.text(f"⚠️ {type(e).__name__} pada {row['PML ID']}, retry {attempt + 1}/{max_retries - 1}...")
+                                        time.sleep(backoff_delay(attempt + 1))
                                         continue
                                     else:
-                                        st.error(f"❌ Error posting PML {row['PML ID']}: {e}")
+                                        job.item(row["PML ID"], "FAILED", e)
                                         break
 
                         # ==========================
                         # DONE
                         # ==========================
-                        if success_count > 0:
-
-                            # Hapus snapshot agar next load ambil data fresh
-                            if log_snapshot_key in st.session_state:
-                                del st.session_state[log_snapshot_key]
-
-                            # Reset pilih state
-                            st.session_state["pilih_state"] = {}
-
-                            end_time = time.time()
-                            duration = int(end_time - start_time)
-
-                            st.success(
-                                f"✅ {success_count} voucher berhasil diposting "
-                                f"({duration} detik)"
-                            )
-
-
-                    except RuntimeError:
+                        end_time = time.time()
+                        duration = int(end_time - start_time)
 
-                        st.error(
-                            "⛔ Log sedang digunakan user lain. "
-                            "Silakan coba lagi."
+                        job.text(
+                            f"✅ {success_count} voucher berhasil diposting "
+                            f"({duration} detik, menunggu lock {lock_wait:.0f} detik)"
                         )
 
                     finally:
 
-                        release_drive_lock(service, PERIOD_DRIVE_ID)
+                        # PML yang sudah di-claim tapi gagal diposting dikembalikan
+                        # ke POSTED (lease log PML diambil lagi sebentar)
+                        failed = {p: v for p, v in claimed.items() if p not in posted}
+
+                        if failed:
+                            release_claims(job, service, sheets_service, log_pml_drive_id, failed, KIND_CEDING, pml_lock)
+
+                # Snapshot log (agar next load ambil data fresh) & pilih state
+                # di-reset oleh panel Job saat job selesai
+                job_id = queue_job(
+                    kind="CEDING",
+                    label=f"Ceding Calculation {selected_account} ({len(validated_data)} PML)",
+                    fn=run_ceding_posting,
+                    total=len(validated_data),
+                    clear_keys=[log_snapshot_key, "pilih_state"]
+                )
+
+                st.success(f"📥 Job {job_id} masuk antrian, progress dapat dipantau di panel Job.")
 
             elif our_clicked:
                 with st.spinner("🔍 Validating PML..."):
@@ -3726,36 +3044,12 @@ with tab_calc:
                     validation_errors = []
                     validated_data = []
 
-                    service = get_drive_service()
-
-                    drive_folders = get_period_drive_folders(
-                        year=int(year),
-                        month=int(month),
-                        root_folder_id=ROOT_DRIVE_FOLDER_ID
-                    )
-
-                    PERIOD_DRIVE_ID = drive_folders["period_id"]
-
                     # ==========================
-                    # PREPARE GLOBAL
+                    # PREPARE GLOBAL (dari PeriodContext, tanpa discovery ulang)
                     # ==========================
-                    pml_drive = get_or_create_folder(
-                        service=service,
-                        folder_name="Folder PML",
-                        parent_id=PERIOD_DRIVE_ID
-                    )
-
-                    PML_DRIVE_ID = pml_drive
-
                     ceding_folder_name = normalize_folder_name(selected_account)
 
-                    ceding_drive = get_or_create_ceding_folders(
-                        service=service,
-                        period_folder_id=PERIOD_DRIVE_ID,
-                        ceding_name=ceding_folder_name
-                    )
-
-                    CEDING_DRIVE_ID = ceding_drive["ceding_id"]
+                    CEDING_DRIVE_ID = ctx.ceding_folder_id(ceding_folder_name)
 
                     rate_exchange = get_exchange_rate(
                         service=service,
@@ -3774,21 +3068,17 @@ with tab_calc:
                     # ==========================
                     # LOAD / CREATE LOG
                     # ==========================
-                    log_drive_id = find_drive_file(
-                        service=service,
-                        filename=get_log_filename(int(year), int(month)),
-                        parent_id=PERIOD_DRIVE_ID,
-                        mime_type="application/vnd.google-apps.spreadsheet"
-                    )
+                    log_drive_id = ctx.voucher_log_id
 
                     if not log_drive_id:
 
                         log_drive_id = create_log_gsheet(
                             service=service,
                             parent_id=PERIOD_DRIVE_ID,
-                            filename=get_log_filename(int(year), int(month)),
+                            filename=ctx.voucher_log_name,
                             columns=LOG_COLUMNS
                         )
+                        ctx.remember_file(ctx.voucher_log_name, PERIOD_DRIVE_ID, log_drive_id)
 
                     # ==========================
                     # VALIDATION STAGE
@@ -3800,7 +3090,7 @@ with tab_calc:
                             # ==========================
                             # GET PML FILE
                             # ==========================
-                            pml_file_id = find_drive_file(
+                            pml_file_id = ctx.find_drive_file(
                                 service=service,
                                 filename=f"{row['PML ID']}.xlsx",
                                 parent_id=PML_DRIVE_ID,
@@ -3845,7 +3135,7 @@ with tab_calc:
                             # ==========================
                             validated_data.append({
                                 "row": row,
-                                "df": df
+                                "df": compact_frame(df)
                             })
 
                         except Exception as e:
@@ -3867,497 +3157,495 @@ with tab_calc:
                     st.stop()
 
                 # ==========================
-                # POSTING STAGE
+                # CALCULATION STAGE (BACKGROUND JOB)
                 # ==========================
-                with st.spinner("⏳ Calculation sedang berjalan, mohon tunggu..."):
+                def run_our_calculation(job):
 
-                    try:
-                        
-                        # ==========================
-                        # LOAD RATE FILE
-                        # ==========================
-                        rate_stream = download_file_from_drive(service, rate_file_id)
+                    # Client sendiri per worker (httplib2 tidak thread-safe)
+                    service = get_drive_service()
+
+                    # ==========================
+                    # LOAD RATE FILE
+                    # ==========================
+                    rate_stream = download_file_from_drive(service, rate_file_id)
+
+                    rate_df = pd.read_excel(rate_stream)
+
+                    rate_df.columns = rate_df.columns.str.strip()
+
+                    # ==========================
+                    # NORMALIZE RATE COLUMNS
+                    # ==========================
+                    rate_df["Gender"]           = rate_df["Gender"].astype(str).str.strip().str.upper()
+                    rate_df["Smoker"]           = rate_df["Smoker"].astype(str).str.strip().str.upper()
+                    rate_df["Ced Product Code"] = rate_df["Ced Product Code"].astype(str).str.strip().str.upper()
+                    rate_df["Age At"]           = pd.to_numeric(rate_df["Age At"], errors="coerce").fillna(0).astype(int)
+                    rate_df["Rate"]             = pd.to_numeric(rate_df["Rate"], errors="coerce")
+                    rate_df["Effective Start"]  = parse_date_column(rate_df["Effective Start"], template="RATE", cedant=selected_account, column="Effective Start")
+                    rate_df["Effective End"]    = parse_date_column(rate_df["Effective End"], template="RATE", cedant=selected_account, column="Effective End")
 
-                        rate_df = pd.read_excel(rate_stream)
+                    # ✅ TAMBAHKAN DI SINI — sebelum loop
+                    review_results = []
 
-                        rate_df.columns = rate_df.columns.str.strip()
+                    # ==========================
+                    # LOOP EACH PML
+                    # ==========================
+                    for validated in validated_data:
+
+                        row = validated["row"]
+                        df  = expand_frame(validated["df"])
+
+                        review_df = df.copy()
 
                         # ==========================
-                        # NORMALIZE RATE COLUMNS
+                        # NORMALIZE PML COLUMNS
                         # ==========================
-                        rate_df["Gender"]           = rate_df["Gender"].astype(str).str.strip().str.upper()
-                        rate_df["Smoker"]           = rate_df["Smoker"].astype(str).str.strip().str.upper()
-                        rate_df["Ced Product Code"] = rate_df["Ced Product Code"].astype(str).str.strip().str.upper()
-                        rate_df["Age At"]           = pd.to_numeric(rate_df["Age At"], errors="coerce").fillna(0).astype(int)
-                        rate_df["Rate"]             = pd.to_numeric(rate_df["Rate"], errors="coerce")
-                        rate_df["Effective Start"]  = pd.to_datetime(rate_df["Effective Start"], errors="coerce", dayfirst=True)
-                        rate_df["Effective End"]    = pd.to_datetime(rate_df["Effective End"], errors="coerce", dayfirst=True)
-
-                        # ✅ TAMBAHKAN DI SINI — sebelum loop
-                        review_results = []
+                        review_df["Gender"]           = review_df["Gender"].astype(str).str.strip().str.upper()
+                        review_df["Smoker"]           = review_df["Smoker"].astype(str).str.strip().str.upper()
+                        review_df["Ced Product Code"] = review_df["Ced Product Code"].astype(str).str.strip().str.upper()
+                        review_df["Age At"]           = pd.to_numeric(review_df["Age At"], errors="coerce").fillna(0).astype(int)
+                        review_df["Issue Date"]       = parse_date_column(review_df["Issue Date"], template="PML_INWARD_ADMIN", cedant=row["Account With"], column="Issue Date")
 
                         # ==========================
-                        # LOOP EACH PML
+                        # INSERT CALC COLUMNS
                         # ==========================
-                        for validated in validated_data:
+                        calc_pairs = [
+                            "Reins Premium",
+                            "Reins EM Premium",
+                            "Reins ER Premium",
+                            "Reins Oth. Premium",
+                            "Reins Total Premium",
+                            "Reins Overriding",
+                            "Reins Total Comm",
+                            "Reins Tabarru",
+                            "Reins Ujrah",
+                            "Reins Nett Premium"
+                        ]
 
-                            row = validated["row"]
-                            df  = validated["df"]
+                        premium_idx = review_df.columns.get_loc("Reins Premium")
+                        if "Rate (Calc)" not in review_df.columns:
+                            review_df.insert(premium_idx, "Rate (Calc)", None)
 
-                            review_df = df.copy()
+                        rate_calc_idx = review_df.columns.get_loc("Rate (Calc)")
+                        if "Rate" not in review_df.columns:
+                            review_df.insert(rate_calc_idx, "Rate", None)
 
-                            # ==========================
-                            # NORMALIZE PML COLUMNS
-                            # ==========================
-                            review_df["Gender"]           = review_df["Gender"].astype(str).str.strip().str.upper()
-                            review_df["Smoker"]           = review_df["Smoker"].astype(str).str.strip().str.upper()
-                            review_df["Ced Product Code"] = review_df["Ced Product Code"].astype(str).str.strip().str.upper()
-                            review_df["Age At"]           = pd.to_numeric(review_df["Age At"], errors="coerce").fillna(0).astype(int)
-                            review_df["Issue Date"]       = pd.to_datetime(review_df["Issue Date"], errors="coerce", dayfirst=True)
+                        for col in calc_pairs:
+                            idx = review_df.columns.get_loc(col)
+                            review_df.insert(idx + 1, f"{col} (Calc)", 0.0)
+
+                        if "Calculation Status" not in review_df.columns:
+                            review_df["Calculation Status"] = ""
+
+                        # ==========================
+                        # LOOP EACH ROW
+                        # ==========================
+                        for idx, data in review_df.iterrows():
+
+                            gender       = str(data["Gender"]).strip().upper()
+                            smoker       = str(data["Smoker"]).strip().upper()
+                            product_code = str(data["Ced Product Code"]).strip().upper()
+                            age          = int(pd.to_numeric(data["Age At"], errors="coerce") or 0)
+                            issue_date   = data["Issue Date"]
 
                             # ==========================
-                            # INSERT CALC COLUMNS
+                            # CARI RATE BERDASARKAN
+                            # Gender, Smoker, Product Code, Age,
+                            # dan Issue Date di antara Effective Start & End
                             # ==========================
-                            calc_pairs = [
-                                "Reins Premium",
-                                "Reins EM Premium",
-                                "Reins ER Premium",
-                                "Reins Oth. Premium",
-                                "Reins Total Premium",
-                                "Reins Overriding",
-                                "Reins Total Comm",
-                                "Reins Tabarru",
-                                "Reins Ujrah",
-                                "Reins Nett Premium"
+                            matched_rate = rate_df[
+                                (rate_df["Gender"]           == gender) &
+                                (rate_df["Smoker"]           == smoker) &
+                                (rate_df["Ced Product Code"] == product_code) &
+                                (rate_df["Age At"]           == age) &
+                                (rate_df["Effective Start"]  <= issue_date) &
+                                (rate_df["Effective End"]    >= issue_date)
                             ]
 
-                            premium_idx = review_df.columns.get_loc("Reins Premium")
-                            if "Rate (Calc)" not in review_df.columns:
-                                review_df.insert(premium_idx, "Rate (Calc)", None)
-
-                            rate_calc_idx = review_df.columns.get_loc("Rate (Calc)")
-                            if "Rate" not in review_df.columns:
-                                review_df.insert(rate_calc_idx, "Rate", None)
+                            if matched_rate.empty:
+                                review_df.at[idx, "Calculation Status"] = "RATE NOT FOUND"
+                                continue
 
-                            for col in calc_pairs:
-                                idx = review_df.columns.get_loc(col)
-                                review_df.insert(idx + 1, f"{col} (Calc)", 0.0)
+                            rate = matched_rate.iloc[0]["Rate"]
 
-                            if "Calculation Status" not in review_df.columns:
-                                review_df["Calculation Status"] = ""
+                            review_df.at[idx, "Rate (Calc)"] = rate
 
                             # ==========================
-                            # LOOP EACH ROW
+                            # NUMERIC CONVERSION
                             # ==========================
-                            for idx, data in review_df.iterrows():
-
-                                gender       = str(data["Gender"]).strip().upper()
-                                smoker       = str(data["Smoker"]).strip().upper()
-                                product_code = str(data["Ced Product Code"]).strip().upper()
-                                age          = int(pd.to_numeric(data["Age At"], errors="coerce") or 0)
-                                issue_date   = data["Issue Date"]
-
-                                # ==========================
-                                # CARI RATE BERDASARKAN
-                                # Gender, Smoker, Product Code, Age,
-                                # dan Issue Date di antara Effective Start & End
-                                # ==========================
-                                matched_rate = rate_df[
-                                    (rate_df["Gender"]           == gender) &
-                                    (rate_df["Smoker"]           == smoker) &
-                                    (rate_df["Ced Product Code"] == product_code) &
-                                    (rate_df["Age At"]           == age) &
-                                    (rate_df["Effective Start"]  <= issue_date) &
-                                    (rate_df["Effective End"]    >= issue_date)
-                                ]
-
-                                if matched_rate.empty:
-                                    review_df.at[idx, "Calculation Status"] = "RATE NOT FOUND"
-                                    continue
-
-                                rate = matched_rate.iloc[0]["Rate"]
-
-                                review_df.at[idx, "Rate (Calc)"] = rate
-
-                                # ==========================
-                                # NUMERIC CONVERSION
-                                # ==========================
-                                sum_at_risk  = pd.to_numeric(data["Reins Sum At Risk"],  errors="coerce")
-                                em_rate      = pd.to_numeric(data["Ced EM Rate"],        errors="coerce")
-                                er_rate      = pd.to_numeric(data["Ced ER Rate"],        errors="coerce")
-                                overriding   = pd.to_numeric(data["Reins Overriding"],   errors="coerce")
-                                commission   = pd.to_numeric(data["Reins Total Comm"],   errors="coerce")
-                                premium      = pd.to_numeric(data["Reins Premium"],      errors="coerce")
-                                nett_premium = pd.to_numeric(data["Reins Nett Premium"], errors="coerce")
-
-                                # ==========================
-                                # TABARRU & UJRAH %
-                                # ==========================
-                                if nett_premium and nett_premium != 0:
-                                    tabarru_percentage = data["Reins Tabarru"] / nett_premium
-                                    ujrah_percentage   = data["Reins Ujrah"]   / nett_premium
-                                else:
-                                    tabarru_percentage = 0
-                                    ujrah_percentage   = 0
-
-                                # ==========================
-                                # OVERRIDING %
-                                # ==========================
-                                reins_total_premium = pd.to_numeric(data["Reins Total Premium"], errors="coerce")
-
-                                if pd.notna(overriding) and pd.notna(reins_total_premium) and reins_total_premium != 0:
-                                    overriding_percentage = overriding / reins_total_premium
-                                else:
-                                    overriding_percentage = 0
-
-                                # ==========================
-                                # CALCULATION
-                                # ==========================
-                                rate_ced           = (premium / sum_at_risk) * 1000
-                                premium_calc       = (sum_at_risk * rate) / 1000
-                                em_premium_calc    = (premium_calc * em_rate) / 100   
-                                er_premium_calc    = (sum_at_risk * er_rate) / 1000
-                                total_premium_calc = premium_calc + em_premium_calc + er_premium_calc
-                                overriding_calc    = total_premium_calc * overriding_percentage
-                                total_comm_calc    = overriding_calc
-                                nett_premium_calc  = total_premium_calc - total_comm_calc
-                                tabarru_calc       = nett_premium_calc * tabarru_percentage
-                                ujrah_calc         = nett_premium_calc * ujrah_percentage
-
-
-                                # ==========================
-                                # SAVE RESULT
-                                # ==========================
-                                review_df.at[idx, "Rate"]                       = rate_ced
-                                review_df.at[idx, "Reins Premium (Calc)"]       = premium_calc
-                                review_df.at[idx, "Reins EM Premium (Calc)"]    = em_premium_calc
-                                review_df.at[idx, "Reins ER Premium (Calc)"]    = er_premium_calc
-                                review_df.at[idx, "Reins Total Premium (Calc)"] = total_premium_calc
-                                review_df.at[idx, "Reins Overriding (Calc)"]    = overriding_calc
-                                review_df.at[idx, "Reins Total Comm (Calc)"]    = total_comm_calc
-                                review_df.at[idx, "Reins Nett Premium (Calc)"]  = nett_premium_calc
-                                review_df.at[idx, "Reins Tabarru (Calc)"]       = tabarru_calc
-                                review_df.at[idx, "Reins Ujrah (Calc)"]         = ujrah_calc
+                            sum_at_risk  = pd.to_numeric(data["Reins Sum At Risk"],  errors="coerce")
+                            em_rate      = pd.to_numeric(data["Ced EM Rate"],        errors="coerce")
+                            er_rate      = pd.to_numeric(data["Ced ER Rate"],        errors="coerce")
+                            overriding   = pd.to_numeric(data["Reins Overriding"],   errors="coerce")
+                            premium      = pd.to_numeric(data["Reins Premium"],      errors="coerce")
+                            nett_premium = pd.to_numeric(data["Reins Nett Premium"], errors="coerce")
 
                             # ==========================
-                            # SUMMARY
+                            # TABARRU & UJRAH %
                             # ==========================
-                            total_original = (pd.to_numeric(review_df["Reins Nett Premium"], errors="coerce").fillna(0).sum())
-
-                            total_calc = (pd.to_numeric(review_df["Reins Nett Premium (Calc)"],errors="coerce").fillna(0).sum())
+                            if nett_premium and nett_premium != 0:
+                                tabarru_percentage = data["Reins Tabarru"] / nett_premium
+                                ujrah_percentage   = data["Reins Ujrah"]   / nett_premium
+                            else:
+                                tabarru_percentage = 0
+                                ujrah_percentage   = 0
 
-                            total_diff = (total_calc - total_original)
+                            # ==========================
+                            # OVERRIDING %
+                            # ==========================
+                            reins_total_premium = pd.to_numeric(data["Reins Total Premium"], errors="coerce")
 
-                            missing_rate = len(review_df[review_df["Calculation Status"] == "RATE NOT FOUND"])
+                            if pd.notna(overriding) and pd.notna(reins_total_premium) and reins_total_premium != 0:
+                                overriding_percentage = overriding / reins_total_premium
+                            else:
+                                overriding_percentage = 0
 
                             # ==========================
-                            # CREATE REVIEW SPREADSHEET
+                            # CALCULATION
                             # ==========================
-                            review_spreadsheet_url = (create_review_spreadsheet(service=service, review_df=review_df, pml_id=row["PML ID"], parent_folder_id=PML_DRIVE_ID))
+                            rate_ced           = (premium / sum_at_risk) * 1000
+                            premium_calc       = (sum_at_risk * rate) / 1000
+                            em_premium_calc    = (premium_calc * em_rate) / 100   
+                            er_premium_calc    = (sum_at_risk * er_rate) / 1000
+                            total_premium_calc = premium_calc + em_premium_calc + er_premium_calc
+                            overriding_calc    = total_premium_calc * overriding_percentage
+                            total_comm_calc    = overriding_calc
+                            nett_premium_calc  = total_premium_calc - total_comm_calc
+                            tabarru_calc       = nett_premium_calc * tabarru_percentage
+                            ujrah_calc         = nett_premium_calc * ujrah_percentage
+
 
                             # ==========================
                             # SAVE RESULT
                             # ==========================
-                            review_results.append({
+                            review_df.at[idx, "Rate"]                       = rate_ced
+                            review_df.at[idx, "Reins Premium (Calc)"]       = premium_calc
+                            review_df.at[idx, "Reins EM Premium (Calc)"]    = em_premium_calc
+                            review_df.at[idx, "Reins ER Premium (Calc)"]    = er_premium_calc
+                            review_df.at[idx, "Reins Total Premium (Calc)"] = total_premium_calc
+                            review_df.at[idx, "Reins Overriding (Calc)"]    = overriding_calc
+                            review_df.at[idx, "Reins Total Comm (Calc)"]    = total_comm_calc
+                            review_df.at[idx, "Reins Nett Premium (Calc)"]  = nett_premium_calc
+                            review_df.at[idx, "Reins Tabarru (Calc)"]       = tabarru_calc
+                            review_df.at[idx, "Reins Ujrah (Calc)"]         = ujrah_calc
 
-                                "pml_id": row["PML ID"],
+                        # ==========================
+                        # SUMMARY
+                        # ==========================
+                        total_original = (pd.to_numeric(review_df["Reins Nett Premium"], errors="coerce").fillna(0).sum())
 
-                                "review_df": review_df,
+                        total_calc = (pd.to_numeric(review_df["Reins Nett Premium (Calc)"],errors="coerce").fillna(0).sum())
 
-                                "spreadsheet_url":
-                                    review_spreadsheet_url,
+                        total_diff = (total_calc - total_original)
 
-                                "total_rows":
-                                    len(review_df),
+                        missing_rate = len(review_df[review_df["Calculation Status"] == "RATE NOT FOUND"])
 
-                                "missing_rate":
-                                    missing_rate,
+                        # ==========================
+                        # CREATE REVIEW SPREADSHEET
+                        # ==========================
+                        review_spreadsheet_url = (create_review_spreadsheet(service=service, review_df=review_df, pml_id=row["PML ID"], parent_folder_id=PML_DRIVE_ID))
 
-                                "total_original":
-                                    total_original,
+                        # ==========================
+                        # SAVE RESULT
+                        # ==========================
+                        review_results.append({
 
-                                "total_calc":
-                                    total_calc,
+                            "pml_id": row["PML ID"],
 
-                                "total_diff":
-                                    total_diff,
+                            "review_df": review_df,
 
-                                "approved":
-                                    False
-                            })
+                            "spreadsheet_url":
+                                review_spreadsheet_url,
 
-                        # ==========================
-                        # SAVE SESSION
-                        # ==========================
-                        st.session_state[
-                            "review_results"
-                        ] = review_results
+                            "total_rows":
+                                len(review_df),
 
-                        # ==========================
-                        # CUSTOM CSS
-                        # ==========================
-                        st.markdown("""
-                        <style>
+                            "missing_rate":
+                                missing_rate,
 
-                        div[data-testid="stMetricValue"] {
-                            font-size: 2rem;
-                        }
+                            "total_original":
+                                total_original,
 
-                        div[data-testid="stMetricLabel"] {
-                            font-size: 0.9rem;
-                        }
+                            "total_calc":
+                                total_calc,
 
-                        .small-status {
-                            font-size: 0.95rem !important;
-                            padding: 0.3rem 0.6rem !important;
-                        }
+                            "total_diff":
+                                total_diff,
 
-                        </style>
-                        """, unsafe_allow_html=True)
+                            "approved":
+                                False
+                        })
 
-                        # ==========================
-                        # REVIEW RESULT SECTION
-                        # ==========================
-                        if "review_results" in st.session_state:
+                        job.item(
+                            row["PML ID"],
+                            "OK" if missing_rate == 0 and abs(total_diff) <= 1 else "REVIEW",
+                            f"Missing rate: {missing_rate}, Diff: {total_diff:,.2f}"
+                        )
 
-                            review_results = (
-                                st.session_state["review_results"]
-                            )
+                    # ==========================
+                    # SAVE SESSION (diterapkan panel Job saat job selesai)
+                    # ==========================
+                    return {"session": {"review_results": review_results}}
 
-                            st.subheader(
-                                "📋 Review Calculation Result"
-                            )
+                job_id = queue_job(
+                    kind="OUR_CALC",
+                    label=f"Our Calculation {selected_account} ({len(validated_data)} PML)",
+                    fn=run_our_calculation,
+                    total=len(validated_data)
+                )
 
-                            st.caption(
-                                "Review hasil calculation sebelum proses approval dan posting."
-                            )
+                st.success(f"📥 Job {job_id} masuk antrian, hasil review tampil otomatis setelah job selesai.")
 
-                            # ==========================
-                            # LOOP RESULT
-                            # ==========================
-                            for result in review_results:
+            # ==========================
+            # REVIEW RESULT SECTION
+            # ==========================
+            if "review_results" in st.session_state:
 
-                                pml_id = result["pml_id"]
+                # ==========================
+                # CUSTOM CSS
+                # ==========================
+                st.markdown("""
+                <style>
 
-                                total_original = (
-                                    result["total_original"]
-                                )
+                div[data-testid="stMetricValue"] {
+                    font-size: 2rem;
+                }
 
-                                total_calc = (
-                                    result["total_calc"]
-                                )
+                div[data-testid="stMetricLabel"] {
+                    font-size: 0.9rem;
+                }
 
-                                total_diff = (
-                                    result["total_diff"]
-                                )
+                .small-status {
+                    font-size: 0.95rem !important;
+                    padding: 0.3rem 0.6rem !important;
+                }
 
-                                missing_rate = (
-                                    result["missing_rate"]
-                                )
+                </style>
+                """, unsafe_allow_html=True)
 
-                                spreadsheet_url = (
-                                    result["spreadsheet_url"]
-                                )
+                review_results = (
+                    st.session_state["review_results"]
+                )
 
-                                review_df = (
-                                    result["review_df"]
-                                )
+                st.subheader(
+                    "📋 Review Calculation Result"
+                )
 
-                                # ==========================
-                                # STATUS
-                                # ==========================
-                                if missing_rate > 0:
+                st.caption(
+                    "Review hasil calculation sebelum proses approval dan posting."
+                )
 
-                                    status = "⚠️ Missing Rate"
+                # ==========================
+                # LOOP RESULT
+                # ==========================
+                for result in review_results:
 
-                                    status_type = "warning"
+                    pml_id = result["pml_id"]
 
-                                elif abs(total_diff) > 1:
+                    total_original = (
+                        result["total_original"]
+                    )
 
-                                    status = "❌ Difference Detected"
+                    total_calc = (
+                        result["total_calc"]
+                    )
 
-                                    status_type = "error"
+                    total_diff = (
+                        result["total_diff"]
+                    )
 
-                                else:
+                    missing_rate = (
+                        result["missing_rate"]
+                    )
 
-                                    status = "✅ Ready for Approval"
+                    spreadsheet_url = (
+                        result["spreadsheet_url"]
+                    )
 
-                                    status_type = "success"
+                    review_df = (
+                        result["review_df"]
+                    )
 
-                                # ==========================
-                                # CONTAINER
-                                # ==========================
-                                with st.container(
-                                    border=True
-                                ):
+                    # ==========================
+                    # STATUS
+                    # ==========================
+                    if missing_rate > 0:
 
-                                    # ==========================
-                                    # HEADER
-                                    # ==========================
-                                    col1, col2 = st.columns(
-                                        [4,2]
-                                    )
+                        status_type = "warning"
 
-                                    with col1:
+                    elif abs(total_diff) > 1:
 
-                                        st.markdown(
-                                            f"## 📄 {pml_id}"
-                                        )
+                        status_type = "error"
 
-                                    with col2:
+                    else:
 
-                                        if status_type == "success":
+                        status_type = "success"
 
-                                            st.markdown(
-                                                f"""
-                                                <div class="small-status">
-                                                    ✅ Ready
-                                                </div>
-                                                """,
-                                                unsafe_allow_html=True
-                                            )
+                    # ==========================
+                    # CONTAINER
+                    # ==========================
+                    with st.container(
+                        border=True
+                    ):
 
-                                        elif status_type == "warning":
+                        # ==========================
+                        # HEADER
+                        # ==========================
+                        col1, col2 = st.columns(
+                            [4,2]
+                        )
 
-                                            st.markdown(
-                                                f"""
-                                                <div class="small-status">
-                                                    ⚠️ Missing Rate
-                                                </div>
-                                                """,
-                                                unsafe_allow_html=True
-                                            )
+                        with col1:
 
-                                        else:
+                            st.markdown(
+                                f"## 📄 {pml_id}"
+                            )
 
-                                            st.markdown(
-                                                f"""
-                                                <div class="small-status">
-                                                    
-                                                </div>
-                                                """,
-                                                unsafe_allow_html=True
-                                            )
+                        with col2:
 
-                                    # ==========================
-                                    # METRICS
-                                    # ==========================
-                                    metric1, metric2, metric3, metric4 = (
-                                        st.columns(4)
-                                    )
+                            if status_type == "success":
 
-                                    metric1.metric(
-                                        "Original",
-                                        f"{total_original:,.2f}"
-                                    )
+                                st.markdown(
+                                    f"""
+                                    <div class="small-status">
+                                        ✅ Ready
+                                    </div>
+                                    """,
+                                    unsafe_allow_html=True
+                                )
 
-                                    metric2.metric(
-                                        "Calculated",
-                                        f"{total_calc:,.2f}"
-                                    )
+                            elif status_type == "warning":
 
-                                    metric3.metric(
-                                        "Difference",
-                                        f"{total_diff:,.2f}"
-                                    )
+                                st.markdown(
+                                    f"""
+                                    <div class="small-status">
+                                        ⚠️ Missing Rate
+                                    </div>
+                                    """,
+                                    unsafe_allow_html=True
+                                )
 
-                                    metric4.metric(
-                                        "Missing Rate",
-                                        missing_rate
-                                    )
+                            else:
 
-                                    st.write("")
+                                st.markdown(
+                                    f"""
+                                    <div class="small-status">
 
-                                    # ==========================
-                                    # ACTION BUTTONS
-                                    # ==========================
-                                    btn1, btn2 = st.columns(
-                                        [2,1]
-                                    )
+                                    </div>
+                                    """,
+                                    unsafe_allow_html=True
+                                )
 
-                                    # ==========================
-                                    # OPEN SPREADSHEET
-                                    # ==========================
-                                    with btn1:
+                        # ==========================
+                        # METRICS
+                        # ==========================
+                        metric1, metric2, metric3, metric4 = (
+                            st.columns(4)
+                        )
 
-                                        st.link_button(
-                                            "📂 Open Review Spreadsheet",
-                                            spreadsheet_url,
-                                            use_container_width=True
-                                        )
+                        metric1.metric(
+                            "Original",
+                            f"{total_original:,.2f}"
+                        )
 
-                                    # ==========================
-                                    # APPROVE
-                                    # ==========================
-                                    with btn2:
-
-                                        approve_clicked = (
-                                            st.button(
-                                                "✅ Approve",
-                                                key=f"approve_{pml_id}",
-                                                type="primary",
-                                                use_container_width=True,
-                                                disabled=(
-                                                    missing_rate > 0
-                                                    or
-                                                    abs(total_diff) > 1
-                                                )
-                                            )
-                                        )
+                        metric2.metric(
+                            "Calculated",
+                            f"{total_calc:,.2f}"
+                        )
 
-                                        if approve_clicked:
+                        metric3.metric(
+                            "Difference",
+                            f"{total_diff:,.2f}"
+                        )
 
-                                            result["approved"] = True
+                        metric4.metric(
+                            "Missing Rate",
+                            missing_rate
+                        )
 
-                                            st.success(
-                                                f"{pml_id} approved"
-                                            )
+                        st.write("")
 
-                                    # ==========================
-                                    # PREVIEW DATA
-                                    # ==========================
-                                    with st.expander(
-                                        "🔍 Preview Review Data"
-                                    ):
+                        # ==========================
+                        # ACTION BUTTONS
+                        # ==========================
+                        btn1, btn2 = st.columns(
+                            [2,1]
+                        )
 
-                                        st.dataframe(
-                                            review_df,
-                                            use_container_width=True
-                                        )
+                        # ==========================
+                        # OPEN SPREADSHEET
+                        # ==========================
+                        with btn1:
 
-                                    # ==========================
-                                    # APPROVAL INFO
-                                    # ==========================
-                                    if missing_rate > 0:
+                            st.link_button(
+                                "📂 Open Review Spreadsheet",
+                                spreadsheet_url,
+                                use_container_width=True
+                            )
 
-                                        st.warning(
-                                            "Masih terdapat RATE NOT FOUND."
-                                        )
+                        # ==========================
+                        # APPROVE
+                        # ==========================
+                        with btn2:
+
+                            approve_clicked = (
+                                st.button(
+                                    "✅ Approve",
+                                    key=f"approve_{pml_id}",
+                                    type="primary",
+                                    use_container_width=True,
+                                    disabled=(
+                                        missing_rate > 0
+                                        or
+                                        abs(total_diff) > 1
+                                    )
+                                )
+                            )
 
-                                    elif abs(total_diff) > 1:
+                            if approve_clicked:
 
-                                        st.error(
-                                            "Difference terlalu besar."
-                                        )
+                                result["approved"] = True
 
-                                    else:
+                                st.success(
+                                    f"{pml_id} approved"
+                                )
 
-                                        st.success(
-                                            "Review lolos validasi."
-                                        )
+                        # ==========================
+                        # PREVIEW DATA
+                        # ==========================
+                        with st.expander(
+                            "🔍 Preview Review Data"
+                        ):
 
-                                    st.write("") 
+                            st.dataframe(
+                                review_df,
+                                use_container_width=True
+                            )
 
                         # ==========================
-                        # SUCCESS
+                        # APPROVAL INFO
                         # ==========================
-                        st.success(
-                            "✅ Calculation selesai"
-                        )
+                        if missing_rate > 0:
+
+                            st.warning(
+                                "Masih terdapat RATE NOT FOUND."
+                            )
+
+                        elif abs(total_diff) > 1:
+
+                            st.error(
+                                "Difference terlalu besar."
+                            )
+
+                        else:
+
+                            st.success(
+                                "Review lolos validasi."
+                            )
+
+                        st.write("") 
 
-                    finally:
 
-                        release_drive_lock(service, PERIOD_DRIVE_ID)
 
 
     elif reins_type == "OUTWARD":
@@ -4365,43 +3653,28 @@ with tab_calc:
         # ==========================
         # INIT SERVICE
         # ==========================
-        service = get_drive_service()
-        sheets_service = init_sheets_service(creds)
+        ctx = get_period_context(creds, ROOT_DRIVE_FOLDER_ID)
+
+        service = ctx.drive
+        sheets_service = ctx.sheets
 
-        year = st.session_state["log_period"]["year"]
-        month = st.session_state["log_period"]["month"]
+        year = ctx.year
+        month = ctx.month
 
         # ==========================
         # GET PERIOD FOLDER
         # ==========================
-        drive_folders = get_period_drive_folders(
-            year=int(year),
-            month=int(month),
-            root_folder_id=ROOT_DRIVE_FOLDER_ID
-        )
-
-        PERIOD_DRIVE_ID = drive_folders["period_id"]
+        PERIOD_DRIVE_ID = ctx.period_id
 
         # ==========================
         # GET PML FOLDER
         # ==========================
-        pml_drive = get_or_create_folder(
-            service=service,
-            folder_name="Folder PML (Outward)",
-            parent_id=PERIOD_DRIVE_ID
-        )
-
-        PML_DRIVE_ID = pml_drive
+        PML_DRIVE_ID = ctx.pml_outward_folder_id
 
         # ==========================
         # GET LOG PML FILE
         # ==========================
-        log_pml_drive_id = find_drive_file(
-            service=service,
-            filename=f"{get_log_pml_filename(int(year), int(month))} (Outward)",
-            parent_id=PML_DRIVE_ID,
-            mime_type="application/vnd.google-apps.spreadsheet"
-        )
+        log_pml_drive_id = ctx.pml_log_outward_id
 
 
         if not log_pml_drive_id:
@@ -4411,10 +3684,16 @@ with tab_calc:
         # ==========================
         # LOAD LOG DATA
         # ==========================
-        log_df = load_log_from_gsheet(
-            service=sheets_service,
-            spreadsheet_id=log_pml_drive_id
-        )
+        # Log PML & log voucher dibaca sekaligus (paralel antar spreadsheet);
+        # isi sheet hanya di-download ulang jika version file di Drive berubah
+        log_ids = {KIND_PML_OUTWARD: log_pml_drive_id, KIND_VOUCHER_OUTWARD: ctx.voucher_log_outward_id}
+
+        logs, log_versions = load_logs(service, sheets_service, log_ids)
+
+        # Replika SQLite lokal untuk filter & query lintas periode
+        replica_sync_logs(log_ids, logs, log_versions, year, month)
+
+        log_df, log_version = logs[KIND_PML_OUTWARD], log_versions[KIND_PML_OUTWARD]
 
         if log_df.empty:
             st.warning("⚠️ Log PML kosong")
@@ -4432,6 +3711,7 @@ with tab_calc:
 
         if log_snapshot_key not in st.session_state:
             st.session_state[log_snapshot_key] = log_df.copy()
+            st.session_state[f"{log_snapshot_key}_version"] = log_version
 
         df_working = st.session_state[log_snapshot_key]
 
@@ -4456,11 +3736,31 @@ with tab_calc:
             st.cache_data.clear()
             st.rerun()
 
+        # Posting terputus (job gagal / server restart) yang bisa dilanjutkan
+        render_pending_postings(
+            sheets_service,
+            log_pml_drive_id,
+            ctx.pml_log_outward_lock,
+            log_df,
+            log_snapshot_key,
+            key_prefix="calc_outward",
+            voucher_log_df=logs[KIND_VOUCHER_OUTWARD]
+        )
+
+        render_replica_search(ctx, KIND_PML_OUTWARD, key_prefix="calc_outward")
+
+        render_aggregate_summary(
+            ctx,
+            {"Log Voucher": KIND_VOUCHER_OUTWARD, "Log PML": KIND_PML_OUTWARD},
+            key_prefix="calc_outward"
+        )
+
         # Warning jika log lebih baru dari snapshot
         current_posted_count  = len(log_df[log_df["STATUS"] == "POSTED"])
         snapshot_posted_count = len(df_working[df_working["STATUS"] == "POSTED"])
 
-        if current_posted_count != snapshot_posted_count:
+        # Banner dipicu oleh kenaikan version file log di Drive
+        if log_version != st.session_state.get(f"{log_snapshot_key}_version"):
             st.warning(
                 f"⚠️ Log PML telah diperbarui oleh user lain "
                 f"({snapshot_posted_count} → {current_posted_count} baris POSTED). "
@@ -4480,7 +3780,8 @@ with tab_calc:
         current_posted_count  = len(log_df[log_df["STATUS"] == "POSTED"])
         snapshot_posted_count = len(df_working[df_working["STATUS"] == "POSTED"])
 
-        if current_posted_count != snapshot_posted_count:
+        # Banner dipicu oleh kenaikan version file log di Drive
+        if log_version != st.session_state.get(f"{log_snapshot_key}_version"):
             st.warning(
                 f"⚠️ Log PML telah diperbarui oleh user lain "
                 f"({snapshot_posted_count} → {current_posted_count} baris POSTED). "
@@ -4492,10 +3793,11 @@ with tab_calc:
         # ==========================
         search = st.text_input("🔍 Cari PML ID")
 
+        # Pencarian & filter dijalankan di replika SQLite (terindeks),
+        # hasilnya dicocokkan ke snapshot lewat PML ID
         if search:
-            df_posted = df_posted[
-                df_posted["PML ID"].astype(str).str.contains(search, case=False, na=False)
-            ]
+            matched = replica_pml_ids(kind=KIND_PML_OUTWARD, year=year, month=month, pml_id=search.strip())
+            df_posted = df_posted[df_posted["PML ID"].astype(str).isin(matched)]
 
         # ==========================
         # FILTER
@@ -4520,21 +3822,18 @@ with tab_calc:
                 filter_cbm = st.selectbox("CBM", cbm_options, key="filter_cbm_outward")
 
         # Terapkan filter
-        df_filtered = df_posted.copy()
-
-        if filter_cedant != "(Semua)":
-            df_filtered = df_filtered[df_filtered["Account With"] == filter_cedant]
+        replica_filters = {
+            "account_with": None if filter_cedant == "(Semua)" else filter_cedant,
+            "product": filter_product.strip() or None,
+            "cby": None if filter_cby == "(Semua)" else int(filter_cby),
+            "cbm": None if filter_cbm == "(Semua)" else int(filter_cbm)
+        }
 
-        if filter_product.strip():
-            df_filtered = df_filtered[
-                df_filtered["Product"].astype(str).str.contains(filter_product.strip(), case=False, na=False)
-            ]
-
-        if filter_cby != "(Semua)":
-            df_filtered = df_filtered[df_filtered["CBY"] == filter_cby]
+        df_filtered = df_posted.copy()
 
-        if filter_cbm != "(Semua)":
-            df_filtered = df_filtered[df_filtered["CBM"] == filter_cbm]
+        if any(v is not None for v in replica_filters.values()):
+            matched = replica_pml_ids(kind=KIND_PML_OUTWARD, year=year, month=month, **replica_filters)
+            df_filtered = df_filtered[df_filtered["PML ID"].astype(str).isin(matched)]
 
         st.write(f"Total PML POSTED: {len(df_filtered)} {'(difilter)' if len(df_filtered) != len(df_posted) else ''}")
 
@@ -4579,15 +3878,7 @@ with tab_calc:
             # ==========================
             cols_numeric = ["Total Contribution", "Commission", "Overriding", "Total Commission", "Gross Premium Income", "Tabarru", "Ujrah", "Claim", "Balance"]
 
-            for col in cols_numeric:
-                def clean_number(x):
-                    x = str(x)
-                    if "." in x and "," in x:
-                        x = x.replace(".", "").replace(",", ".")
-                    else:
-                        x = x.replace(",", "")
-                    return pd.to_numeric(x, errors="coerce")
-                df_to_edit[col] = df_to_edit[col].apply(clean_number)
+            # Kolom numerik sudah float64 dari log schema, tidak perlu parsing teks lagi
 
             # ==========================
             # DATA EDITOR
@@ -4595,6 +3886,7 @@ with tab_calc:
             edited_df = st.data_editor(
                 df_to_edit,
                 column_config={
+                    "ROW VERSION": None,  # versi baris (compare-and-set), tidak ditampilkan
                     "Pilih": st.column_config.CheckboxColumn(
                         "Pilih",
                         help="Pilih baris ini untuk di-calculate",
@@ -4666,7 +3958,7 @@ with tab_calc:
             rate_file_id = None
 
             if selected_account:
-                rate_file_id = find_drive_file(
+                rate_file_id = ctx.find_drive_file(
                     service=service,
                     filename=f"{selected_account}.xlsx",
                     parent_id=RATE_FOLDER_ID
@@ -4721,43 +4013,14 @@ with tab_calc:
                     validation_errors = []
                     validated_data = []
 
-                    service = get_drive_service()
-
-                    drive_folders = get_period_drive_folders(
-                        year=int(year),
-                        month=int(month),
-                        root_folder_id=ROOT_DRIVE_FOLDER_ID
-                    )
-
-                    PERIOD_DRIVE_ID = drive_folders["period_id"]
-
                     # ==========================
-                    # PREPARE GLOBAL
+                    # PREPARE GLOBAL (dari PeriodContext, tanpa discovery ulang)
                     # ==========================
-                    outward_drive_folder = get_or_create_outward_folders(
-                        service=service,
-                        period_folder_id=PERIOD_DRIVE_ID,
-                    )
-
-                    OUTWARD_DRIVE_ID = outward_drive_folder["outward_id"]
-
-                    pml_drive = get_or_create_folder(
-                        service=service,
-                        folder_name="Folder PML (Outward)",
-                        parent_id=PERIOD_DRIVE_ID
-                    )
-
-                    PML_DRIVE_ID = pml_drive
+                    OUTWARD_DRIVE_ID = ctx.outward_id
 
                     ceding_folder_name = normalize_folder_name(selected_account)
 
-                    ceding_drive = get_or_create_ceding_folders(
-                        service=service,
-                        period_folder_id=OUTWARD_DRIVE_ID,
-                        ceding_name=ceding_folder_name
-                    )
-
-                    CEDING_DRIVE_ID = ceding_drive["ceding_id"]
+                    CEDING_DRIVE_ID = ctx.ceding_folder_id(ceding_folder_name, outward=True)
 
                     rate_exchange = get_exchange_rate(
                         service=service,
@@ -4776,21 +4039,17 @@ with tab_calc:
                     # ==========================
                     # LOAD / CREATE LOG
                     # ==========================
-                    log_drive_id = find_drive_file(
-                        service=service,
-                        filename=f"{get_log_filename(int(year), int(month))} (Outward)",
-                        parent_id=OUTWARD_DRIVE_ID,
-                        mime_type="application/vnd.google-apps.spreadsheet"
-                    )
+                    log_drive_id = ctx.voucher_log_outward_id
 
                     if not log_drive_id:
 
                         log_drive_id = create_log_gsheet(
                             service=service,
                             parent_id=OUTWARD_DRIVE_ID,
-                            filename=f"{get_log_filename(int(year), int(month))} (Outward)",
+                            filename=ctx.voucher_log_outward_name,
                             columns=LOG_COLUMNS_OUTWARD
                         )
+                        ctx.remember_file(ctx.voucher_log_outward_name, OUTWARD_DRIVE_ID, log_drive_id)
 
                     # ==========================
                     # VALIDATION STAGE
@@ -4799,7 +4058,7 @@ with tab_calc:
 
                         try:
 
-                            pml_file_id = find_drive_file(
+                            pml_file_id = ctx.find_drive_file(
                                 service=service,
                                 filename=f"{row["PML ID"]}.xlsx",
                                 parent_id=PML_DRIVE_ID
@@ -4837,7 +4096,7 @@ with tab_calc:
 
                             validated_data.append({
                                 "row": row,
-                                "df": df
+                                "df": compact_frame(df)
                             })
 
                         except Exception as e:
@@ -4859,22 +4118,76 @@ with tab_calc:
                     st.stop()
 
                 # ==========================
-                # POSTING STAGE
+                # POSTING STAGE (BACKGROUND JOB)
                 # ==========================
-                with st.spinner("⏳ Calculation sedang berjalan, mohon tunggu..."):
+                # Lease log PML hanya dipegang saat claim (compare-and-set) dan saat
+                # claim dikembalikan; lease log voucher hanya saat nomor voucher
+                # dialokasikan + baris log ditulis per PML. Upload file berjalan
+                # tanpa lock, sehingga posting PML lain bisa berjalan paralel.
+                pml_lock = ctx.pml_log_outward_lock
+                voucher_lock = ctx.voucher_log_outward_lock
+
+                expected_versions = pml_row_versions(selected_rows)
+
+                def run_ceding_posting(job):
+
+                    # Client sendiri per worker (httplib2 tidak thread-safe)
+                    service = get_drive_service()
+                    sheets_service = init_sheets_service(creds)
+
+                    claimed = {}
+                    posted = set()
+                    lock_wait = 0.0
+
+                    def on_wait(waited):
+                        job.text(f"⏳ Menunggu lock user lain ({int(waited)} detik)...")
 
                     try:
+                        # ==========================
+                        # CLAIM PML (COMPARE-AND-SET)
+                        # ==========================
+                        # POSTED -> CALCULATED hanya jika baris belum diubah user lain
+                        # sejak snapshot; PML yang sudah di-claim job lain jadi konflik,
+                        # sehingga PML yang sama tidak diposting dua kali.
+                        # 🔒 Lease log PML hanya selama claim
+                        with drive_lock(service, pml_lock, on_wait=on_wait) as lease:
+                            lock_wait += lease.wait_seconds
+
+                            claimed, conflicts = transition_pml_status(
+                                sheets_service,
+                                log_pml_drive_id,
+                                [item["row"]["PML ID"] for item in validated_data],
+                                to_status="CALCULATED",
+                                expected_versions=expected_versions,
+                                lease=lease
+                            )
 
-                        acquire_drive_lock(service, OUTWARD_DRIVE_ID)
+                        for pml_id, reason in conflicts.items():
+                            job.item(pml_id, "CONFLICT", reason)
 
-                        sheets_service = init_sheets_service(creds)
+                        # ==========================
+                        # JOURNAL (WRITE-AHEAD)
+                        # ==========================
+                        # Entry PML yang belum selesai di run sebelumnya dipertahankan,
+                        # sehingga langkah yang sudah jalan tidak diulang (resume)
+                        open_entries(
+                            log_pml_drive_id,
+                            claimed,
+                            KIND_CEDING,
+                            claim_versions=claimed,
+                            job_id=job.job_id
+                        )
 
                         success_count = 0
 
                         for item in validated_data:
 
                             row = item["row"]
-                            df = item["df"]
+                            df = expand_frame(item["df"])
+
+                            # PML konflik tidak diposting
+                            if str(row["PML ID"]) not in claimed:
+                                continue
 
                             # ✅ Retry wrapper
                             max_retries = 3
@@ -4885,292 +4198,262 @@ with tab_calc:
                                     biz_type = row["Biz Type"]
                                     dept_type = row["Department"]
 
-                                    # ==========================
-                                    # GENERATE VOUCHER
-                                    # ==========================
-                                    voucher, seq_no, _ = generate_vou_from_drive(
-                                        service=service,
-                                        period_folder_id=OUTWARD_DRIVE_ID,
-                                        year=int(year),
-                                        month=int(month),
-                                        find_drive_file=find_drive_file,
-                                        dept_type=dept_type
-                                    )
-
-                                    # ==========================
-                                    # BUILD LOG ENTRY
-                                    # ==========================
-                                    if dept_type == "ADMIN" and biz_type in [
-                                        "Kontribusi",
-                                        "Refund",
-                                        "Alteration",
-                                        "Retur",
-                                        "Revise",
-                                        "Batal",
-                                        "Cancel"
-                                    ]:
-
-                                        total_contribution = df["Retro Total Premium"].sum()
-
-                                        commission = df["Retro Total Comm"].sum()
-
-                                        overriding = (
-                                            df["Retro Overriding"].sum()
-                                            if "Retro Overriding" in df.columns
-                                            else 0
-                                        )
-
-                                        total_commission = commission + overriding
-
-                                        claim_amount = (
-                                            df["Claim"].sum()
-                                            if "Claim" in df.columns
-                                            else 0
-                                        )
-
-                                        balance = (
-                                            total_contribution
-                                            - total_commission
-                                            - claim_amount
-                                        )
-
-                                        log_entry = {
-                                            "Seq No": seq_no,
-                                            "Department": row["Department"],
-                                            "Biz Type": row["Biz Type"],
-                                            "Retro Type": df["Retro Type"].iloc[0],
-                                            "Inward VIN Ref": df["Inw Vouc ID"].iloc[0],
-                                            "Voucher No": voucher,
-                                            "Account With": row["Account With"],
-                                            "Cedant Company": row["Cedant Company"],
-                                            "PIC": row["PIC"],
-                                            "Product": df["References No"].iloc[0],
-                                            "CBY": df["Ced Book Year"].iloc[0],
-                                            "CBM": df["Ced Book Month"].iloc[0],
-                                            "OBY": int(year),
-                                            "OBM": int(month),
-                                            "KOB": df["KOB Code"].iloc[0],
-                                            "COB": df["COB"].iloc[0],
-                                            "MOP": df["Out Pay Period Type"].iloc[0],
-                                            "Curr": df["Premium Ccy"].iloc[0],
-
-                                            "Total Contribution": total_contribution,
-                                            "Commission": commission,
-                                            "Overiding": overriding,
-                                            "Total Commission": total_commission,
-                                            "Gross Premium Income": total_contribution - total_commission,
-                                            "Tabarru": df["Retro Tabarru"].sum(),
-                                            "Ujrah": df["Retro Ujrah"].sum(),
-                                            "Claim": 0,
-                                            "Balance": balance,
-                                            "Check Balance": "",
-
-                                            "Rate Exchange": rate_exchange,
-
-                                            "Kontribusi (IDR)": total_contribution * rate_exchange,
-                                            "Commission (IDR)": commission * rate_exchange,
-                                            "Overiding (IDR)": overriding * rate_exchange,
-                                            "Total Commission (IDR)": total_commission * rate_exchange,
-                                            "Gross Premium Income (IDR)": (
-                                                total_contribution - total_commission
-                                            ) * rate_exchange,
-
-                                            "Tabarru (IDR)": (
-                                                df["Retro Tabarru"].sum()
-                                                * rate_exchange
-                                            ),
-
-                                            "Ujrah (IDR)": (
-                                                df["Retro Ujrah"].sum()
-                                                * rate_exchange
-                                            ),
-
-                                            "Claim (IDR)": 0,
-
-                                            "Balance (IDR)": (
-                                                balance * rate_exchange
-                                            ),
-
-                                            "Check Balance (IDR)": "",
-
-                                            "REMARKS": "-",
-                                            "PML ID": row["PML ID"],
-                                            "STATUS": "POSTED",
-                                            "CREATED AT": now_wib_naive(),
-                                            "CREATED BY": row["PIC"],
-                                            "Due Date": due_date,
-                                            "Subject Email": row["Subject Email"],
-                                            "Email Date": row["Email Date"],
-                                            "CANCELED AT": "-",
-                                            "CANCELED BY": "-",
-                                            "CANCEL OF VOUCHER": "-",
-                                            "CANCEL REASON": "-"
-                                        }
-
-                                    elif dept_type == "CLAIM":
-
-                                        claim_amount = (
-                                            df["Your Share"].sum()
-                                            if "Your Share" in df.columns
-                                            else 0
+                                    # 🔒 Lease log voucher hanya selama penomoran + append log
+                                    with drive_lock(service, voucher_lock, on_wait=on_wait) as lease:
+                                        lock_wait += lease.wait_seconds
+
+                                        # ==========================
+                                        # GENERATE VOUCHER
+                                        # ==========================
+                                        # Nomor voucher dicatat di journal sebelum ditulis ke log;
+                                        # retry / resume memakai nomor yang sama jika sudah masuk log
+                                        entry = resolve_target(
+                                            log_pml_drive_id,
+                                            row["PML ID"],
+                                            "",
+                                            KIND_CEDING,
+                                            allocate=lambda: generate_vou_from_drive(
+                                                service=service,
+                                                period_folder_id=OUTWARD_DRIVE_ID,
+                                                year=int(year),
+                                                month=int(month),
+                                                find_drive_file=ctx.find_drive_file,
+                                                dept_type=dept_type
+                                            )[:2],
+                                            in_log=lambda target: log_has_row(
+                                                sheets_service,
+                                                log_drive_id,
+                                                {"Voucher No": target, "PML ID": row["PML ID"]}
+                                            )
                                         )
 
-                                        balance = -claim_amount
-
-                                        log_entry = {
-                                            "Seq No": seq_no,
-                                            "Department": row["Department"],
-                                            "Biz Type": row["Biz Type"],
-                                            "Retro Type": df["Retro Type"].iloc[0],
-                                            "Inward VIN Ref": df["Voucher ID"].iloc[0],
-                                            "Voucher No": voucher,
-                                            "Account With": row["Account With"],
-                                            "Cedant Company": row["Cedant Company"],
-                                            "PIC": row["PIC"],
-                                            "Product": df["Voucher Desc"].iloc[0],
-                                            "CBY": df["Ced Book Year"].iloc[0],
-                                            "CBM": df["Ced Book Month"].iloc[0],
-                                            "OBY": int(year),
-                                            "OBM": int(month),
-                                            "KOB": df["KOB Code"].iloc[0],
-                                            "COB": df["COB Detail"].iloc[0],
-                                            "MOP": df["Method of Payment"].iloc[0],
-                                            "Curr": df["Curr"].iloc[0],
-
-                                            "Total Contribution": 0,
-                                            "Commission": 0,
-                                            "Overriding": 0,
-                                            "Total Commission": 0,
-                                            "Gross Premium Income": 0,
-                                            "Tabarru": 0,
-                                            "Ujrah": 0,
-                                            "Claim": claim_amount,
-                                            "Balance": balance,
-                                            "Check Balance": "",
-
-                                            "Rate Exchange": rate_exchange,
-
-                                            "Kontribusi (IDR)": 0,
-                                            "Commission (IDR)": 0,
-                                            "Overiding (IDR)": 0,
-                                            "Total Commission (IDR)": 0,
-                                            "Gross Premium Income (IDR)": 0,
-                                            "Tabarru (IDR)": 0,
-                                            "Ujrah (IDR)": 0,
-
-                                            "Claim (IDR)": (
-                                                claim_amount * rate_exchange
-                                            ),
-
-                                            "Balance (IDR)": (
-                                                balance * rate_exchange
-                                            ),
-
-                                            "Check Balance (IDR)": "",
-
-                                            "REMARKS": "-",
-                                            "PML ID": row["PML ID"],
-                                            "STATUS": "POSTED",
-                                            "CREATED AT": now_wib_naive(),
-                                            "CREATED BY": row["PIC"],
-                                            "Due Date": due_date,
-                                            "Subject Email": row["Subject Email"],
-                                            "Email Date": row["Email Date"],
-                                            "CANCELED AT": "-",
-                                            "CANCELED BY": "-",
-                                            "CANCEL OF VOUCHER": "-",
-                                            "CANCEL REASON": "-"
-                                        }
-
-                                    # ==========================
-                                    # APPEND LOG
-                                    # ==========================
-                                    append_gsheet(
-                                        service=sheets_service,
-                                        spreadsheet_id=log_drive_id,
-                                        row_dict=log_entry
-                                    )
+                                        voucher, seq_no = entry["target"], int(entry["seq_no"])
+
+                                        # ==========================
+                                        # BUILD LOG ENTRY
+                                        # ==========================
+                                        if dept_type == "ADMIN" and biz_type in [
+                                            "Kontribusi",
+                                            "Refund",
+                                            "Alteration",
+                                            "Retur",
+                                            "Revise",
+                                            "Batal",
+                                            "Cancel"
+                                        ]:
+
+                                            metrics = build_log_metrics(
+                                                df, OUTWARD_ADMIN_METRICS, rate=rate_exchange, overriding_column="Overiding"
+                                            ).iloc[0].to_dict()
+
+                                            log_entry = {
+                                                "Seq No": seq_no,
+                                                "Department": row["Department"],
+                                                "Biz Type": row["Biz Type"],
+                                                "Retro Type": df["Retro Type"].iloc[0],
+                                                "Inward VIN Ref": df["Inw Vouc ID"].iloc[0],
+                                                "Voucher No": voucher,
+                                                "Account With": row["Account With"],
+                                                "Cedant Company": row["Cedant Company"],
+                                                "PIC": row["PIC"],
+                                                "Product": df["References No"].iloc[0],
+                                                "CBY": df["Ced Book Year"].iloc[0],
+                                                "CBM": df["Ced Book Month"].iloc[0],
+                                                "OBY": int(year),
+                                                "OBM": int(month),
+                                                "KOB": df["KOB Code"].iloc[0],
+                                                "COB": df["COB"].iloc[0],
+                                                "MOP": df["Out Pay Period Type"].iloc[0],
+                                                "Curr": df["Premium Ccy"].iloc[0],
+
+                                                **metrics,
+                                                "Check Balance": "",
+                                                "Check Balance (IDR)": "",
+
+                                                "REMARKS": "-",
+                                                "PML ID": row["PML ID"],
+                                                "STATUS": "POSTED",
+                                                "CREATED AT": now_wib_naive(),
+                                                "CREATED BY": row["PIC"],
+                                                "Due Date": due_date,
+                                                "Subject Email": row["Subject Email"],
+                                                "Email Date": row["Email Date"],
+                                                "CANCELED AT": "-",
+                                                "CANCELED BY": "-",
+                                                "CANCEL OF VOUCHER": "-",
+                                                "CANCEL REASON": "-"
+                                            }
+
+                                        elif dept_type == "CLAIM":
+
+                                            metrics = build_log_metrics(
+                                                df, OUTWARD_CLAIM_METRICS, rate=rate_exchange, overriding_column="Overiding"
+                                            ).iloc[0].to_dict()
+
+                                            log_entry = {
+                                                "Seq No": seq_no,
+                                                "Department": row["Department"],
+                                                "Biz Type": row["Biz Type"],
+                                                "Retro Type": df["Retro Type"].iloc[0],
+                                                "Inward VIN Ref": df["Voucher ID"].iloc[0],
+                                                "Voucher No": voucher,
+                                                "Account With": row["Account With"],
+                                                "Cedant Company": row["Cedant Company"],
+                                                "PIC": row["PIC"],
+                                                "Product": df["Voucher Desc"].iloc[0],
+                                                "CBY": df["Ced Book Year"].iloc[0],
+                                                "CBM": df["Ced Book Month"].iloc[0],
+                                                "OBY": int(year),
+                                                "OBM": int(month),
+                                                "KOB": df["KOB Code"].iloc[0],
+                                                "COB": df["COB Detail"].iloc[0],
+                                                "MOP": df["Method of Payment"].iloc[0],
+                                                "Curr": df["Curr"].iloc[0],
+
+                                                **metrics,
+                                                "Check Balance": "",
+                                                "Check Balance (IDR)": "",
+
+                                                "REMARKS": "-",
+                                                "PML ID": row["PML ID"],
+                                                "STATUS": "POSTED",
+                                                "CREATED AT": now_wib_naive(),
+                                                "CREATED BY": row["PIC"],
+                                                "Due Date": due_date,
+                                                "Subject Email": row["Subject Email"],
+                                                "Email Date": row["Email Date"],
+                                                "CANCELED AT": "-",
+                                                "CANCELED BY": "-",
+                                                "CANCEL OF VOUCHER": "-",
+                                                "CANCEL REASON": "-"
+                                            }
+
+                                        # ==========================
+                                        # APPEND LOG
+                                        # ==========================
+                                        run_step(entry, STEP_LOG, lambda: append_gsheet(
+                                            service=sheets_service,
+                                            spreadsheet_id=log_drive_id,
+                                            row_dict=log_entry
+                                        ))
 
                                     # ==========================
                                     # UPLOAD FILE
                                     # ==========================
-                                    upload_dataframe_to_drive_outward(
-                                        service=service,
-                                        df=df,
-                                        template_columns=(
-                                            columns_template_outward
-                                            if dept_type != "CLAIM"
-                                            else columns_template_claim_outward
+                                    run_step(
+                                        entry,
+                                        STEP_FILE,
+                                        lambda: upload_dataframe_to_drive_outward(
+                                            service=service,
+                                            df=df,
+                                            template_columns=(
+                                                columns_template_outward
+                                                if dept_type != "CLAIM"
+                                                else columns_template_claim_outward
+                                            ),
+                                            voucher_id=voucher,
+                                            filename=f"{voucher}.xlsx",
+                                            folder_id=CEDING_DRIVE_ID,
+                                            dept_type=dept_type,
+                                            pic=row["PIC"],
+                                            date=now_wib_naive()
                                         ),
-                                        voucher_id=voucher,
-                                        filename=f"{voucher}.xlsx",
-                                        folder_id=CEDING_DRIVE_ID,
-                                        dept_type=dept_type,
-                                        pic=row["PIC"],
-                                        date=now_wib_naive()
+                                        exists=lambda: find_drive_file(service, f"{voucher}.xlsx", CEDING_DRIVE_ID) is not None
                                     )
 
+                                    finish(log_pml_drive_id, row["PML ID"])
+
                                     success_count += 1
+                                    posted.add(str(row["PML ID"]))
 
-                                    # ✅ Jeda antar PML
-                                    time.sleep(2 ** attempt)  # exponential backoff
+                                    job.item(row["PML ID"], "OK", voucher)
 
+                                    # Pacing request diatur token bucket di api_retry
                                     break  # ✅ Keluar dari retry loop jika berhasil
 
                                 except Exception as e:
-                                    if "timed out" in str(e).lower() and attempt < max_retries - 1:
-                                        st.warning(f"⚠️ Timeout pada {row['PML ID']}, retry {attempt + 1}/{max_retries - 1}...")
-                                        time.sleep(3 * (attempt + 1))
+                                    # Langkah posting idempoten (journal) -> aman diulang
+                                    if is_retryable(e) and attempt < max_retries - 1:
+                                        job.text(f"⚠️ {type(e).__name__} pada {row['PML ID']}, retry {attempt + 1}/{max_retries - 1}...")
+                                        time.sleep(backoff_delay(attempt + 1))
                                         continue
                                     else:
-                                        st.error(f"❌ Error posting PML {row['PML ID']}: {e}")
-                                        # 🔎 DEBUG: tampilkan detail kolom jika error length mismatch
+                                        detail = str(e)
+                                        # 🔎 DEBUG: sertakan detail kolom jika error length mismatch
                                         if "Length mismatch" in str(e):
                                             template = (
                                                 columns_template_outward
                                                 if dept_type != "CLAIM"
                                                 else columns_template_claim_outward
                                             )
-                                            with st.expander(f"🔍 Detail mismatch kolom — {row['PML ID']}"):
-                                                st.write(f"Jumlah kolom di **df** (source): `{len(df.columns)}`")
-                                                st.write(f"Jumlah kolom di **template**: `{len(template)}`")
-                                                col_a, col_b = st.columns(2)
-                                                with col_a:
-                                                    st.write("**Kolom df (source):**")
-                                                    st.write(df.columns.tolist())
-                                                with col_b:
-                                                    st.write("**Kolom template:**")
-                                                    st.write(list(template))
+                                            detail += (
+                                                f" | df ({len(df.columns)} kolom): {df.columns.tolist()}"
+                                                f" | template ({len(template)} kolom): {list(template)}"
+                                            )
+                                        job.item(row["PML ID"], "FAILED", detail)
                                         break
 
-                        # ==========================
-                        # UPDATE STATUS
-                        # ==========================
-                        update_pml_status_to_calculated(
-                            service=sheets_service,
-                            spreadsheet_id=log_pml_drive_id,
-                            pml_id=selected_rows["PML ID"].astype(str).tolist()
-                        )
-
                         end_time = time.time()
                         duration = int(end_time - start_time)
 
-                        if success_count > 0:
+                        job.text(
+                            f"✅ {success_count} voucher berhasil diposting "
+                            f"({duration} detik, menunggu lock {lock_wait:.0f} detik)"
+                        )
 
-                            st.success(
-                                f"✅ {success_count} voucher berhasil diposting "
-                                f"({duration} detik)"
-                            )
+                    finally:
 
-                    except RuntimeError:
+                        # PML yang sudah di-claim tapi gagal diposting dikembalikan
+                        # ke POSTED (lease log PML diambil lagi sebentar)
+                        failed = {p: v for p, v in claimed.items() if p not in posted}
 
-                        st.error(
-                            "⛔ Log sedang digunakan user lain. "
-                            "Silakan coba lagi."
-                        )
+                        if failed:
+                            release_claims(job, service, sheets_service, log_pml_drive_id, failed, KIND_CEDING, pml_lock)
 
-                    finally:
+                job_id = queue_job(
+                    kind="CEDING",
+                    label=f"Ceding Calculation {selected_account} ({len(validated_data)} PML, Outward)",
+                    fn=run_ceding_posting,
+                    total=len(validated_data),
+                    clear_keys=[log_snapshot_key, "pilih_state_outward"]
+                )
 
-                        release_drive_lock(service, OUTWARD_DRIVE_ID)
+                st.success(f"📥 Job {job_id} masuk antrian, progress dapat dipantau di panel Job.")
 
 
+# ==========================
+# LAYOUT TAB
+# ==========================
+# Tab di-render lazy: hanya tab yang sedang dibuka yang dieksekusi,
+# sehingga tab tersembunyi tidak memanggil Drive/Sheets sama sekali.
+# Setiap tab adalah fragment, interaksi di dalamnya hanya me-rerun tab itu.
+st.title("📄 Retakaful Voucher Tools")
+st.write("")
+
+tab_upload, tab_split, tab_calc = st.tabs(
+    [
+        "📤 Upload File",
+        "🧩 Split File",
+        "🧮 Calculate",
+        #"🔄 Update Voucher",
+        # "📥 Create Voucher",
+    ],
+    key="main_tabs",
+    on_change="rerun"
+)
+
+with tab_upload:
+    if tab_upload.open:
+        render_upload_tab()
+
+with tab_split:
+    if tab_split.open:
+        render_split_tab()
+
+with tab_calc:
+    if tab_calc.open:
+        render_calc_tab()
+
+with st.sidebar:
+    st.subheader("🗂️ Job")
+    render_job_panel()
@@ -0,0 +1,159 @@
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+
+# ==========================
+# KONFIGURASI
+# ==========================
+# Urutan penting: ISO dulu, lalu day-first (format lokal),
+# baru month-first sebagai cadangan terakhir.
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%d/%m/%Y",
+    "%d/%m/%Y %H:%M:%S",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%d-%b-%Y",
+    "%d %b %Y",
+    "%d %B %Y",
+    "%Y/%m/%d",
+    "%Y%m%d",
+    "%m/%d/%Y",
+    "%m-%d-%Y",
+]
+
+# Excel menyimpan tanggal sebagai jumlah hari sejak 30 Des 1899
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+# Rentang serial yang masuk akal (1900 s.d. ~2118)
+EXCEL_SERIAL_MIN = 1
+EXCEL_SERIAL_MAX = 80000
+
+SAMPLE_SIZE = 200
+
+# Cache format per (template, cedant, kolom)
+_FORMAT_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+# ==========================
+# DETEKSI FORMAT
+# ==========================
+def _detect_format(text: pd.Series):
+    sample = text.drop_duplicates().head(SAMPLE_SIZE)
+
+    best_format = None
+    best_score = 0.0
+
+    for fmt in DATE_FORMATS:
+        parsed = pd.to_datetime(sample, format=fmt, errors="coerce")
+        score = parsed.notna().mean()
+
+        # Format pertama yang cocok 100% langsung dipakai
+        if score == 1.0:
+            return fmt
+
+        if score > best_score:
+            best_format, best_score = fmt, score
+
+    return best_format
+
+
+def get_cached_format(template, cedant, column):
+    with _CACHE_LOCK:
+        return _FORMAT_CACHE.get((template, cedant, column))
+
+
+def remember_format(template, cedant, column, fmt):
+    with _CACHE_LOCK:
+        _FORMAT_CACHE[(template, cedant, column)] = fmt
+
+
+def clear_format_cache():
+    with _CACHE_LOCK:
+        _FORMAT_CACHE.clear()
+
+
+# ==========================
+# PARSER KOLOM
+# ==========================
+def parse_date_column(series: pd.Series, template=None, cedant=None, column=None) -> pd.Series:
+    """
+    Parse satu kolom tanggal secara vectorized.
+    Mendukung campuran objek datetime, serial Excel, dan teks.
+    Format teks dideteksi dari sampel lalu diingat per (template, cedant, kolom).
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+
+    column = column or series.name
+    result = pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+
+    not_blank = series.notna() & (series.astype(str).str.strip() != "")
+    if not not_blank.any():
+        return result
+
+    # 1. Objek datetime / date dari openpyxl
+    is_datetime = series.map(lambda v: isinstance(v, (datetime, date, np.datetime64)))
+    if is_datetime.any():
+        result[is_datetime] = pd.to_datetime(series[is_datetime], errors="coerce")
+
+    # 2. Serial Excel (angka murni)
+    numeric = pd.to_numeric(series.where(~is_datetime), errors="coerce")
+    is_serial = numeric.between(EXCEL_SERIAL_MIN, EXCEL_SERIAL_MAX)
+    if is_serial.any():
+        result[is_serial] = pd.to_datetime(
+            numeric[is_serial], unit="D", origin=EXCEL_EPOCH
+        ).dt.round("s")
+
+    # 3. Teks
+    is_text = not_blank & ~is_datetime & ~is_serial
+    if not is_text.any():
+        return result
+
+    text = series[is_text].astype(str).str.strip()
+
+    fmt = get_cached_format(template, cedant, column)
+    if fmt is not None:
+        parsed = pd.to_datetime(text, format=fmt, errors="coerce")
+
+        # Format cache hanya dipakai jika SEMUA nilai cocok. Cocok sebagian
+        # bisa berarti format lain (mis. dd/mm vs mm/dd) -> deteksi ulang
+        if parsed.notna().all():
+            result[is_text] = parsed
+            return result
+
+    fmt = _detect_format(text)
+    if fmt is None:
+        return result
+
+    parsed = pd.to_datetime(text, format=fmt, errors="coerce")
+
+    if parsed.notna().all():
+        remember_format(template, cedant, column, fmt)
+    else:
+        # Format campuran dalam satu kolom: sisa nilai di-parse per format,
+        # terakhir inferensi pandas (perilaku lama). Tidak di-cache.
+        parsed = _parse_leftover(text, parsed)
+
+    result[is_text] = parsed
+    return result
+
+
+def _parse_leftover(text, parsed):
+    for fmt in DATE_FORMATS:
+        missing = parsed.isna()
+        if not missing.any():
+            return parsed
+
+        parsed[missing] = pd.to_datetime(text[missing], format=fmt, errors="coerce")
+
+    missing = parsed.isna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(text[missing], errors="coerce")
+
+    return parsed
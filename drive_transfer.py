@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
+
+from api_retry import call_with_retry
+
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================
+# KONFIGURASI
+# ==========================
+# Ukuran chunk transfer. Upload resumable mensyaratkan kelipatan 256 KB;
+# default googleapiclient (100 MB) membuat satu workbook = satu request,
+# sehingga gangguan jaringan mengulang file dari nol.
+TRANSFER_CHUNK_UNIT = 256 * 1024
+TRANSFER_CHUNK_BYTES = max(
+    TRANSFER_CHUNK_UNIT,
+    int(float(os.getenv("TRANSFER_CHUNK_MB", "8")) * 1024 * 1024) // TRANSFER_CHUNK_UNIT * TRANSFER_CHUNK_UNIT
+)
+
+# Percobaan per chunk. Budget di-reset setiap chunk berhasil, jadi koneksi
+# yang putus-sambung tetap selesai selama masih ada kemajuan.
+TRANSFER_MAX_ATTEMPTS = int(os.getenv("TRANSFER_MAX_ATTEMPTS", "8"))
+
+# Sesi upload resumable kedaluwarsa / hilang -> mulai ulang sesi dari byte 0
+TRANSFER_SESSION_LOST_STATUS = {404, 410}
+
+# Jumlah transfer terakhir yang dipakai untuk menghitung throughput
+TRANSFER_HISTORY_SIZE = 50
+
+DIRECTION_DOWNLOAD = "download"
+DIRECTION_UPLOAD = "upload"
+
+
+# ==========================
+# THROUGHPUT
+# ==========================
+_HISTORY = {
+    DIRECTION_DOWNLOAD: deque(maxlen=TRANSFER_HISTORY_SIZE),
+    DIRECTION_UPLOAD: deque(maxlen=TRANSFER_HISTORY_SIZE),
+}
+_HISTORY_LOCK = threading.Lock()
+
+
+def _record_transfer(direction, name, n_bytes, seconds):
+    with _HISTORY_LOCK:
+        _HISTORY[direction].append((n_bytes, seconds))
+
+    rate = n_bytes / seconds / 1024 / 1024 if seconds > 0 else 0.0
+    logger.info(
+        "%s %s: %.2f MB dalam %.1f detik (%.2f MB/s)",
+        direction, name, n_bytes / 1024 / 1024, seconds, rate
+    )
+
+
+def transfer_throughput(direction):
+    """
+    Rata-rata throughput (byte/detik) transfer terakhir di proses ini,
+    None jika belum ada data.
+    """
+    with _HISTORY_LOCK:
+        history = list(_HISTORY[direction])
+
+    n_bytes = sum(b for b, _ in history)
+    seconds = sum(s for _, s in history)
+
+    if not history or seconds <= 0:
+        return None
+
+    return n_bytes / seconds
+
+
+# ==========================
+# PROGRESS
+# ==========================
+def streamlit_progress(bar, label=""):
+    """
+    Callback progress(done_bytes, total_bytes) untuk st.progress / JobReporter.
+    Ukuran total tidak diketahui (export Google Sheets) -> hanya teks.
+    """
+
+    def report(done_bytes, total_bytes):
+        text = f"{label} {done_bytes / 1024 / 1024:.1f} MB".strip()
+
+        if total_bytes:
+            text += f" / {total_bytes / 1024 / 1024:.1f} MB"
+            bar.progress(min(done_bytes / total_bytes, 1.0), text=text)
+        else:
+            bar.progress(0.0, text=text)
+
+    return report
+
+
+# ==========================
+# DOWNLOAD
+# ==========================
+def download_media(request, file_obj, name="", chunk_size=TRANSFER_CHUNK_BYTES, progress=None):
+    """
+    Download media (get_media / export_media) ke file_obj per chunk.
+    Setiap chunk di-retry sendiri: MediaIoBaseDownload hanya memajukan offset
+    setelah chunk diterima utuh, jadi percobaan ulang meminta Range mulai dari
+    byte terakhir yang sudah tersimpan (bukan dari nol).
+    Error yang tetap gagal setelah TRANSFER_MAX_ATTEMPTS di-raise.
+    """
+    downloader = MediaIoBaseDownload(file_obj, request, chunksize=chunk_size)
+    started = time.monotonic()
+
+    # next_chunk() memanggil http langsung (tidak lewat PacedHttpRequest),
+    # jadi pacing token bucket & retry per chunk dipasang di sini
+    done = False
+    while not done:
+        status, done = call_with_retry(
+            downloader.next_chunk,
+            api="drive",
+            max_attempts=TRANSFER_MAX_ATTEMPTS
+        )
+
+        if progress is not None and status is not None:
+            progress(status.resumable_progress, status.total_size)
+
+    _record_transfer(DIRECTION_DOWNLOAD, name, file_obj.tell(), time.monotonic() - started)
+
+    file_obj.seek(0)
+    return file_obj
+
+
+# ==========================
+# UPLOAD
+# ==========================
+def _upload_chunk(request):
+    try:
+        return request.next_chunk()
+
+    except HttpError as e:
+        if request.resumable_uri and e.resp.status not in TRANSFER_SESSION_LOST_STATUS:
+            # 5xx di tengah sesi: chunk berikutnya menanyakan dulu byte
+            # yang sudah diterima server (PUT bytes */size) lalu lanjut dari situ
+            request._in_error_state = True
+        raise
+
+
+def upload_media(request, name="", progress=None):
+    """
+    Jalankan request create/update dengan media resumable per chunk.
+    Chunk yang gagal dilanjutkan dari byte terakhir yang diterima server,
+    sehingga aman di-retry (file baru dibuat hanya saat chunk terakhir selesai).
+    Sesi yang hilang (404/410) dibuka ulang dari byte 0.
+    Return body response (metadata file).
+    """
+    started = time.monotonic()
+    restarts = 0
+
+    response = None
+    while response is None:
+        try:
+            # Seperti download: chunk dipacing lewat call_with_retry
+            status, response = call_with_retry(
+                lambda: _upload_chunk(request),
+                api="drive",
+                max_attempts=TRANSFER_MAX_ATTEMPTS
+            )
+
+        except HttpError as e:
+            # 404/410 tidak termasuk status retryable call_with_retry:
+            # sesi tidak dikenal server lagi, buka sesi baru dari awal
+            if not request.resumable_uri or e.resp.status not in TRANSFER_SESSION_LOST_STATUS:
+                raise
+
+            restarts += 1
+            if restarts >= TRANSFER_MAX_ATTEMPTS:
+                raise
+
+            logger.warning("Sesi upload hilang (%s), mulai ulang dari byte 0", e.resp.status)
+            request.resumable_uri = None
+            request.resumable_progress = 0
+            continue
+
+        if progress is not None and status is not None:
+            progress(status.resumable_progress, status.total_size)
+
+    size = request.resumable.size() if request.resumable is not None else 0
+
+    if progress is not None:
+        progress(size, size)
+
+    _record_transfer(DIRECTION_UPLOAD, name, size, time.monotonic() - started)
+
+    return response
+
+
+def resumable_media(file_obj, mimetype, chunk_size=TRANSFER_CHUNK_BYTES):
+    """MediaIoBaseUpload resumable dengan ukuran chunk transfer."""
+    return MediaIoBaseUpload(
+        file_obj,
+        mimetype=mimetype,
+        chunksize=chunk_size,
+        resumable=True
+    )
@@ -2,14 +2,25 @@ import streamlit as st
 import io
 import pandas as pd
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
-from io import BytesIO
-from googleapiclient.http import MediaIoBaseUpload
-from googleapiclient.http import MediaIoBaseDownload
 import calendar
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from googleapiclient.errors import HttpError
+from log_schema import apply_log_schema, ROW_VERSION_COLUMN, LEDGER_KEY_COLUMN
+from api_retry import build_service
+from ledger import ledger_append, ledger_pending_rows, flush_ledger, start_replicator
+from log_replica import replica_append, replica_update_status
+from excel_export import write_xlsx, frame_to_xlsx, template_columns_from_frame, HEADER_STYLE, XLSX_MIME
+from frame_utils import expand_frame
+from drive_transfer import download_media, upload_media, resumable_media, TRANSFER_CHUNK_BYTES
+import os
+import random
+import socket
+import threading
+import time
+import uuid
 
 
 SCOPES = [
@@ -24,7 +35,7 @@ def get_drive_service():
         dict(st.secrets["gcp_service_account"]),
         scopes=SCOPES
     )
-    return build("drive", "v3", credentials=credentials)
+    return build_service("drive", "v3", credentials=credentials)
 
 
 def upload_or_update_drive_file(
@@ -40,15 +51,20 @@ def upload_or_update_drive_file(
 
     service = get_drive_service()
 
-    media = MediaFileUpload(file_path, resumable=True)
+    check_leases()
+
+    media = MediaFileUpload(file_path, chunksize=TRANSFER_CHUNK_BYTES, resumable=True)
 
     # UPDATE
     if file_id:
-        updated = service.files().update(
-            fileId=file_id,
-            media_body=media,
-            supportsAllDrives=True
-        ).execute()
+        updated = upload_media(
+            service.files().update(
+                fileId=file_id,
+                media_body=media,
+                supportsAllDrives=True
+            ),
+            name=filename
+        )
         return updated["id"]
 
     # CREATE
@@ -57,12 +73,15 @@ def upload_or_update_drive_file(
         "parents": [folder_id]
     }
 
-    created = service.files().create(
-        body=file_metadata,
-        media_body=media,
-        fields="id",
-        supportsAllDrives=True
-    ).execute()
+    created = upload_media(
+        service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields="id",
+            supportsAllDrives=True
+        ),
+        name=filename
+    )
 
     return created["id"]
 
@@ -186,26 +205,16 @@ def find_drive_file(service, filename, parent_id, mime_type=None):
     files = results.get("files", [])
     return files[0]["id"] if files else None
 
-def download_file_from_drive(service, file_id):
+def download_file_from_drive(service, file_id, progress=None):
+    """
+    Download file ke BytesIO per chunk (resume dari byte terakhir jika gagal).
+    progress: callback(done_bytes, total_bytes), lihat drive_transfer.streamlit_progress.
+    """
     request = service.files().get_media(fileId=file_id)
-    file_stream = io.BytesIO()
-
-    downloader = MediaIoBaseDownload(file_stream, request)
-
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-
-    file_stream.seek(0)
-    return file_stream
 
-def download_file_csv_from_drive(service, file_id):
+    return download_media(request, io.BytesIO(), name=file_id, progress=progress)
 
-    import io
-
-    from googleapiclient.http import (
-        MediaIoBaseDownload
-    )
+def download_file_csv_from_drive(service, file_id, progress=None):
 
     # ==========================
     # GET FILE METADATA
@@ -241,92 +250,234 @@ def download_file_csv_from_drive(service, file_id):
     # ==========================
     # DOWNLOAD
     # ==========================
-    file_stream = io.BytesIO()
-
-    downloader = MediaIoBaseDownload(
-        file_stream,
-        request
+    return download_media(
+        request,
+        io.BytesIO(),
+        name=file_id,
+        progress=progress
     )
 
-    done = False
 
-    while not done:
+# ==========================
+# STATUS PML (OPTIMISTIC CONCURRENCY)
+# ==========================
+# Setiap baris log PML punya kolom ROW VERSION ("<n>-<token>").
+# Perubahan status hanya berhasil jika status & versi baris masih sama
+# dengan yang diharapkan. Sheets tidak punya compare-and-set atomik,
+# jadi baca-bandingkan-tulis dijalankan di bawah lease lock log PML:
+# lease membuat CAS serial antar proses/host, versi baris menolak
+# snapshot user yang sudah basi.
 
-        _, done = downloader.next_chunk()
 
-    file_stream.seek(0)
+def _column_letter(idx):
+    letters = ""
+    idx += 1
 
-    return file_stream
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(65 + rem) + letters
 
+    return letters
 
-def update_pml_status_to_splitted(service, spreadsheet_id, pml_id):
-    result = service.spreadsheets().values().get(
-        spreadsheetId=spreadsheet_id,
-        range="A:Z"
-    ).execute()
 
-    values = result.get("values", [])
+def _version_number(version):
+    try:
+        return int(str(version).split("-")[0])
+    except ValueError:
+        return 0
 
-    if not values:
-        return False
 
-    headers = values[0]
+def _normalize_version(version):
+    if version is None or (not isinstance(version, str) and pd.isna(version)):
+        return ""
+    return str(version).strip()
+
+
+def pml_row_versions(df):
+    """Map PML ID -> ROW VERSION (baris pertama PML) dari snapshot log yang dilihat user."""
+    if ROW_VERSION_COLUMN not in df.columns:
+        return None
+
+    versions = {}
+    for pml_id, version in zip(df["PML ID"], df[ROW_VERSION_COLUMN]):
+        versions.setdefault(str(pml_id), _normalize_version(version))
+
+    return versions
+
+
+def transition_pml_status(
+    service,
+    spreadsheet_id,
+    pml_ids,
+    to_status,
+    from_status="POSTED",
+    expected_versions=None,
+    lease=None
+):
+    """
+    Compare-and-set STATUS untuk beberapa PML sekaligus (semua baris PML).
+    lease: DriveLease lock log PML, wajib dipegang pemanggil selama
+    claim sampai posting selesai / claim dikembalikan.
+    Return (applied, conflicts):
+      applied   = {pml_id: versi_baru}
+      conflicts = {pml_id: alasan}
+    """
+    if lease is None:
+        raise RuntimeError("transition_pml_status harus dijalankan di bawah lock log PML")
+
+    lease.check()
+
+    pml_ids = [str(p) for p in pml_ids]
+
+    # Baris PML yang masih di ledger harus sudah ada di Sheets sebelum CAS
+    if not flush_ledger([spreadsheet_id]):
+        print(f"⚠️ Ledger {spreadsheet_id} belum selesai direplikasi, status dibaca dari Sheets")
+
+    # Cukup header + kolom PML ID / STATUS / ROW VERSION, bukan seluruh log
+    header_values = service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id,
+        range="1:1"
+    ).execute().get("values", [])
+
+    if not header_values:
+        return {}, {p: "log PML kosong" for p in pml_ids}
+
+    headers = [str(h).strip() for h in header_values[0]]
 
     pml_col = headers.index("PML ID")
     status_col = headers.index("STATUS")
 
-    for i, row in enumerate(values[1:], start=2):
-        if len(row) > pml_col and row[pml_col] == pml_id:
+    # Log lama belum punya kolom versi -> tambahkan header-nya
+    if ROW_VERSION_COLUMN not in headers:
+        version_col = len(headers)
 
-            col_letter = chr(65 + status_col)
-            range_update = f"{col_letter}{i}"
+        service.spreadsheets().values().update(
+            spreadsheetId=spreadsheet_id,
+            range=f"{_column_letter(version_col)}1",
+            valueInputOption="RAW",
+            body={"values": [[ROW_VERSION_COLUMN]]}
+        ).execute()
 
-            service.spreadsheets().values().update(
-                spreadsheetId=spreadsheet_id,
-                range=range_update,
-                valueInputOption="RAW",
-                body={"values": [["SPLITTED"]]}
-            ).execute()
+    else:
+        version_col = headers.index(ROW_VERSION_COLUMN)
 
-            return True
+    columns = [pml_col, status_col, version_col]
 
-    return False
+    column_values = service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id,
+        ranges=[f"{_column_letter(c)}2:{_column_letter(c)}" for c in columns]
+    ).execute().get("valueRanges", [])
+
+    pml_cells, status_cells, version_cells = [vr.get("values", []) for vr in column_values]
+
+    def cell(cells, i):
+        return cells[i][0] if i < len(cells) and cells[i] else ""
+
+    # Semua baris per PML ID (satu PML bisa punya beberapa baris log)
+    rows_by_pml = {}
+    for i in range(len(pml_cells)):
+        pml_value = cell(pml_cells, i)
+        if pml_value == "":
+            continue
+
+        row = {pml_col: pml_value, status_col: cell(status_cells, i), version_col: cell(version_cells, i)}
+        rows_by_pml.setdefault(str(pml_value), []).append((i + 2, row))
+
+    # ==========================
+    # COMPARE
+    # ==========================
+    token = uuid.uuid4().hex[:8]
+    candidates = {}
+    conflicts = {}
+
+    for pml_id in pml_ids:
+
+        if pml_id not in rows_by_pml:
+            conflicts[pml_id] = "PML tidak ditemukan di log"
+            continue
+
+        rows = rows_by_pml[pml_id]
+
+        other_status = next((r[status_col] for _, r in rows if r[status_col] != from_status), None)
+        if other_status is not None:
+            conflicts[pml_id] = f"status sudah {other_status}"
+            continue
 
+        # Versi PML = versi baris pertama (sama dengan pml_row_versions)
+        current = _normalize_version(rows[0][1][version_col])
 
-def update_pml_status_to_calculated(service, spreadsheet_id, pml_id):
-    result = service.spreadsheets().values().get(
+        if expected_versions is not None and pml_id in expected_versions:
+            if _normalize_version(expected_versions[pml_id]) != current:
+                conflicts[pml_id] = "baris sudah diubah user lain"
+                continue
+
+        number = max(_version_number(_normalize_version(r[version_col])) for _, r in rows)
+        candidates[pml_id] = ([row_no for row_no, _ in rows], f"{number + 1}-{token}")
+
+    if not candidates:
+        return {}, conflicts
+
+    # ==========================
+    # SET (STATUS + VERSI DALAM SATU REQUEST)
+    # ==========================
+    data = []
+    for row_nos, new_version in candidates.values():
+        for row_no in row_nos:
+            data.append({
+                "range": f"{_column_letter(status_col)}{row_no}",
+                "values": [[to_status]]
+            })
+            data.append({
+                "range": f"{_column_letter(version_col)}{row_no}",
+                "values": [[new_version]]
+            })
+
+    # Fencing: lease harus masih dipegang tepat sebelum menulis
+    lease.check()
+
+    service.spreadsheets().values().batchUpdate(
         spreadsheetId=spreadsheet_id,
-        range="A:Z"
+        body={"valueInputOption": "RAW", "data": data}
     ).execute()
 
-    values = result.get("values", [])
+    applied = {pml_id: new_version for pml_id, (_, new_version) in candidates.items()}
 
-    if not values:
-        return False
+    replica_update_status(spreadsheet_id, applied.keys(), to_status)
 
-    headers = values[0]
+    return applied, conflicts
 
-    pml_col = headers.index("PML ID")
-    status_col = headers.index("STATUS")
 
-    updated = False  # flag
+def log_has_row(service, spreadsheet_id, match):
+    """
+    Cek apakah log sudah punya baris dengan nilai kolom sesuai match
+    (mis. {"Voucher No": ..., "PML ID": ...}). Dipakai untuk verifikasi
+    append yang timeout sebelum diulang.
+    """
+    # Baris yang masih di ledger (belum direplikasi) juga dihitung
+    for entry in ledger_pending_rows(spreadsheet_id):
+        if all(str(entry["row"].get(col)) == str(value) for col, value in match.items()):
+            return True
+
+    values = service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id,
+        range="A:ZZ"
+    ).execute().get("values", [])
 
-    for i, row in enumerate(values[1:], start=2):
-        if len(row) > pml_col and str(row[pml_col]) in pml_id:
+    if not values:
+        return False
 
-            col_letter = chr(65 + status_col)
-            range_update = f"{col_letter}{i}"
+    headers = [str(h).strip() for h in values[0]]
 
-            service.spreadsheets().values().update(
-                spreadsheetId=spreadsheet_id,
-                range=range_update,
-                valueInputOption="RAW",
-                body={"values": [["CALCULATED"]]}
-            ).execute()
+    if any(col not in headers for col in match):
+        return False
+
+    cols = {headers.index(col): str(value) for col, value in match.items()}
 
-            updated = True  # tandai bahwa ada update
+    for row in values[1:]:
+        if all(len(row) > i and str(row[i]) == value for i, value in cols.items()):
+            return True
 
-    return updated
+    return False
 
 
 def delete_drive_file(file_id: str):
@@ -338,7 +489,173 @@ def delete_drive_file(file_id: str):
     ).execute()
 
 
-def acquire_drive_lock(service, parent_id, lock_name="log_produksi.lock"):
+# ==========================
+# DRIVE LOCK (LEASE)
+# ==========================
+# Lock berupa file di folder Drive. Pemilik & masa berlaku disimpan di
+# appProperties, diperpanjang oleh heartbeat selama proses berjalan.
+# Lease yang kedaluwarsa (session crash) boleh diambil alih.
+LOCK_LEASE_SECONDS = 120
+LOCK_HEARTBEAT_SECONDS = 15
+# Tulis di bawah lease ditolak jika sisa lease (sejak perpanjangan terakhir
+# yang berhasil) kurang dari margin ini
+LOCK_SAFETY_MARGIN_SECONDS = 20
+# Tunggu ledger tereplikasi sebelum lock dilepas. Hanya perlu jika app jalan
+# di lebih dari satu host: di satu host semua pembaca nomor (get_last_seq_no,
+# load_log_from_gsheet, log_has_row) sudah ikut membaca ledger lokal.
+LOCK_FLUSH_ON_RELEASE = os.getenv("LOCK_FLUSH_ON_RELEASE", "0") == "1"
+LOCK_FLUSH_TIMEOUT = 120
+LOCK_WAIT_TIMEOUT = 180
+LOCK_POLL_SECONDS = 2
+
+_HELD_LOCKS = {}
+_HELD_LOCKS_GUARD = threading.Lock()
+
+
+class LeaseLostError(RuntimeError):
+    """Lease lock habis / diambil alih; tulis di bawah lease harus berhenti."""
+
+
+class DriveLease:
+    """
+    Lease aktif atas satu file lock. Heartbeat berjalan di thread sendiri
+    dengan client Drive sendiri (httplib2 tidak thread-safe).
+    Setiap heartbeat memastikan file lock masih milik lease ini (fencing);
+    jika tidak, atau perpanjangan gagal sampai lease hampir habis,
+    lease ditandai hilang dan check() me-raise LeaseLostError.
+    """
+
+    def __init__(self, parent_id, lock_name, file_id, owner, wait_seconds, expires_at):
+        self.parent_id = parent_id
+        self.lock_name = lock_name
+        self.file_id = file_id
+        self.owner = owner
+        self.wait_seconds = wait_seconds
+        self.expires_at = expires_at
+        self.acquired_at = time.time()
+        self.lost_reason = None
+
+        # Spreadsheet yang ditulis (lewat ledger) selama lease dipegang
+        self.spreadsheets = set()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._heartbeat,
+            name=f"lease-{lock_name}",
+            daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def hold_seconds(self):
+        return time.time() - self.acquired_at
+
+    def _mark_lost(self, reason):
+        if self.lost_reason is None:
+            self.lost_reason = reason
+            print(f"⛔ Lease lock {self.lock_name} hilang: {reason}")
+
+    def _verify(self, service):
+        """Pastikan file lock masih ada, milik lease ini, dan pemenang tiebreak."""
+        now = time.time()
+        lock_files = _list_lock_files(service, self.parent_id, self.lock_name)
+
+        mine = next((f for f in lock_files if f["id"] == self.file_id), None)
+
+        if mine is None:
+            return "file lock sudah dihapus (diambil alih proses lain)"
+
+        if (mine.get("appProperties") or {}).get("owner") != self.owner:
+            return "file lock berganti pemilik"
+
+        # Listing Drive eventually consistent: lawan yang dibuat bersamaan
+        # bisa baru terlihat sekarang -> aturan pemenang diterapkan ulang
+        contenders = [f for f in lock_files if f["id"] == self.file_id or _lease_expires_at(f) >= now]
+        winner = min(contenders, key=lambda f: (f["createdTime"], f["id"]))
+
+        if winner["id"] != self.file_id:
+            return f"kalah tiebreak dengan lock {winner['id']}"
+
+        return None
+
+    def _heartbeat(self):
+        service = None
+
+        while not self._stop.wait(LOCK_HEARTBEAT_SECONDS):
+            try:
+                service = service or get_drive_service()
+
+                reason = self._verify(service)
+                if reason:
+                    self._mark_lost(reason)
+                    return
+
+                # Masa berlaku dihitung dari sebelum request (konservatif)
+                renewed_until = time.time() + LOCK_LEASE_SECONDS
+
+                service.files().update(
+                    fileId=self.file_id,
+                    body={"appProperties": {
+                        "expires_at": str(renewed_until)
+                    }},
+                    supportsAllDrives=True
+                ).execute()
+
+                self.expires_at = renewed_until
+
+            except HttpError as e:
+                if e.resp.status == 404:
+                    self._mark_lost("file lock sudah dihapus (diambil alih proses lain)")
+                    return
+
+                print(f"Heartbeat lock {self.lock_name} gagal: {e}")
+
+            except Exception as e:
+                # Gagal sekali masih aman selama lease belum habis
+                print(f"Heartbeat lock {self.lock_name} gagal: {e}")
+
+            if time.time() >= self.expires_at - LOCK_SAFETY_MARGIN_SECONDS:
+                self._mark_lost("perpanjangan gagal sampai lease hampir habis")
+                return
+
+    def check(self):
+        """Raise LeaseLostError jika lease tidak lagi aman untuk menulis."""
+        if self.lost_reason is None and time.time() >= self.expires_at - LOCK_SAFETY_MARGIN_SECONDS:
+            self._mark_lost("lease hampir habis tanpa perpanjangan")
+
+        if self.lost_reason is not None:
+            raise LeaseLostError(f"Lock {self.lock_name} tidak lagi dipegang: {self.lost_reason}")
+
+    def stop(self):
+        self._stop.set()
+
+
+def _thread_leases():
+    ident = threading.get_ident()
+
+    with _HELD_LOCKS_GUARD:
+        return [lease for (_, _, thread), lease in _HELD_LOCKS.items() if thread == ident]
+
+
+def check_leases(spreadsheet_id=None):
+    """
+    Fencing sebelum menulis: raise LeaseLostError jika salah satu lease
+    yang dipegang thread ini sudah hilang. Tanpa lease -> tidak ada cek.
+    spreadsheet_id: baris ledger untuk spreadsheet ini harus sudah
+    direplikasi sebelum lease dilepas.
+    """
+    for lease in _thread_leases():
+        lease.check()
+
+        if spreadsheet_id is not None:
+            lease.spreadsheets.add(str(spreadsheet_id))
+
+
+def _lock_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex[:8]}"
+
+
+def _list_lock_files(service, parent_id, lock_name):
     query = (
         f"name='{lock_name}' "
         f"and '{parent_id}' in parents "
@@ -347,154 +664,233 @@ def acquire_drive_lock(service, parent_id, lock_name="log_produksi.lock"):
 
     result = service.files().list(
         q=query,
-        fields="files(id)",
+        fields="files(id, createdTime, appProperties)",
         supportsAllDrives=True,
         includeItemsFromAllDrives=True,
     ).execute()
 
-    if result.get("files"):
-        raise RuntimeError("LOG SEDANG DIGUNAKAN USER LAIN")
+    return result.get("files", [])
 
-    service.files().create(
-        body={
-            "name": lock_name,
-            "parents": [parent_id]
-        },
-        supportsAllDrives=True
-    ).execute()
 
+def _lease_expires_at(lock_file):
+    props = lock_file.get("appProperties") or {}
+
+    if "expires_at" in props:
+        return float(props["expires_at"])
+
+    # File lock lama (tanpa appProperties): anggap berlaku sejak dibuat
+    created = pd.Timestamp(lock_file["createdTime"]).timestamp()
+    return created + LOCK_LEASE_SECONDS
+
+
+def acquire_drive_lock(
+    service,
+    parent_id,
+    lock_name="log_produksi.lock",
+    wait_timeout=LOCK_WAIT_TIMEOUT,
+    on_wait=None
+):
+    """
+    Ambil lease lock di folder parent_id. Jika lock dipegang user lain,
+    tunggu (maks wait_timeout detik) lalu raise RuntimeError.
+    on_wait(detik_menunggu) dipanggil selama menunggu.
+    """
+    owner = _lock_owner()
+    start = time.time()
+
+    while True:
+
+        lock_files = _list_lock_files(service, parent_id, lock_name)
+        now = time.time()
+
+        # ==========================
+        # AMBIL ALIH LEASE KEDALUWARSA
+        # ==========================
+        stale = [f for f in lock_files if _lease_expires_at(f) < now]
+
+        for f in stale:
+            try:
+                service.files().delete(fileId=f["id"], supportsAllDrives=True).execute()
+                print(f"Lock {lock_name} kedaluwarsa diambil alih (owner lama: {(f.get('appProperties') or {}).get('owner', '-')})")
+            except HttpError:
+                # Sudah dihapus proses lain
+                pass
+
+        active = [f for f in lock_files if f not in stale]
+
+        if not active:
+
+            created = service.files().create(
+                body={
+                    "name": lock_name,
+                    "parents": [parent_id],
+                    "appProperties": {
+                        "owner": owner,
+                        "expires_at": str(now + LOCK_LEASE_SECONDS)
+                    }
+                },
+                fields="id, createdTime",
+                supportsAllDrives=True
+            ).execute()
+
+            # Cek ulang: jika dua proses membuat bersamaan,
+            # pemenangnya file dengan createdTime paling awal
+            # (file sendiri selalu ikut: listing bisa belum memuatnya)
+            contenders = [
+                f for f in _list_lock_files(service, parent_id, lock_name)
+                if _lease_expires_at(f) >= now and f["id"] != created["id"]
+            ] + [created]
+            winner = min(contenders, key=lambda f: (f["createdTime"], f["id"]))
+
+            if winner["id"] == created["id"]:
+
+                lease = DriveLease(
+                    parent_id, lock_name, created["id"], owner, now - start,
+                    expires_at=now + LOCK_LEASE_SECONDS
+                )
+
+                with _HELD_LOCKS_GUARD:
+                    _HELD_LOCKS[(parent_id, lock_name, threading.get_ident())] = lease
+
+                print(f"Lock {lock_name} didapat setelah menunggu {lease.wait_seconds:.1f} detik")
+                return lease
 
-def release_drive_lock(service, parent_id, lock_name="log_produksi.lock"):
+            service.files().delete(fileId=created["id"], supportsAllDrives=True).execute()
+
+        # ==========================
+        # TUNGGU (ANTRIAN)
+        # ==========================
+        waited = time.time() - start
+
+        if waited > wait_timeout:
+            raise RuntimeError(
+                f"LOG SEDANG DIGUNAKAN USER LAIN (menunggu {int(waited)} detik)"
+            )
+
+        if on_wait:
+            on_wait(waited)
+
+        time.sleep(LOCK_POLL_SECONDS + random.uniform(0, 1))
+
+
+def release_drive_lock(service, parent_id, lock_name="log_produksi.lock", lease=None):
     # 1. VALIDASI AWAL: Cegah ID kosong yang menyebabkan Error 400
     if not parent_id or parent_id == "" or parent_id is None:
         print("Log: parent_id kosong, tidak ada kunci yang perlu dilepas.")
         return
 
-    try:
-        # 2. QUERY: Mencari file lock di dalam folder tertentu
-        query = (
-            f"name='{lock_name}' "
-            f"and '{parent_id}' in parents "
-            f"and trashed=false"
-        )
+    # 2. Hanya lease milik thread ini yang dilepas,
+    #    lock milik user lain tidak pernah dihapus
+    with _HELD_LOCKS_GUARD:
+        held = _HELD_LOCKS.pop((parent_id, lock_name, threading.get_ident()), None)
 
-        result = service.files().list(
-            q=query,
-            fields="files(id)",
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True,
-        ).execute()
+    lease = lease or held
+    if lease is None:
+        return
 
-        files_to_delete = result.get("files", [])
-        
-        # 3. PENGHAPUSAN: Hapus semua file lock yang ditemukan
-        for f in files_to_delete:
-            try:
-                service.files().delete(
-                    fileId=f["id"],
-                    supportsAllDrives=True
-                ).execute()
-            except Exception as e:
-                # Jika file sudah dihapus proses lain, jangan hentikan aplikasi
-                print(f"Gagal hapus file gembok {f['id']}: {e}")
+    # Multi-host: baris yang ditulis di bawah lock harus sudah ada di Sheets
+    # sebelum lock dilepas, karena host lain menentukan Seq No / PML ID /
+    # nomor voucher berikutnya dari Sheets saja (tanpa ledger lokal ini).
+    # Heartbeat tetap berjalan selama menunggu.
+    flushed = (
+        not LOCK_FLUSH_ON_RELEASE
+        or not lease.spreadsheets
+        or flush_ledger(list(lease.spreadsheets), timeout=LOCK_FLUSH_TIMEOUT)
+    )
+
+    lease.stop()
+
+    if not flushed:
+        # File lock dibiarkan sampai kedaluwarsa sendiri (LOCK_LEASE_SECONDS),
+        # memberi waktu tambahan bagi replikator sebelum proses lain masuk
+        print(f"⚠️ Ledger {sorted(lease.spreadsheets)} belum tereplikasi, lock {lock_name} dibiarkan kedaluwarsa")
+        return
+
+    try:
+        service.files().delete(
+            fileId=lease.file_id,
+            supportsAllDrives=True
+        ).execute()
 
     except Exception as e:
-        # Menangkap error API lainnya agar tidak merusak UI Streamlit
-        print(f"Error pada release_drive_lock: {e}")
+        # Jika file sudah dihapus proses lain, jangan hentikan aplikasi
+        print(f"Gagal hapus file gembok {lease.file_id}: {e}")
+
+    print(
+        f"Lock {lock_name} dilepas: menunggu {lease.wait_seconds:.1f} detik, "
+        f"dipegang {lease.hold_seconds:.1f} detik"
+    )
+
+
+def acquire_drive_locks(service, resources, wait_timeout=LOCK_WAIT_TIMEOUT, on_wait=None):
+    """
+    Ambil beberapa lock sekaligus. resources: list (parent_id, lock_name).
+    Diambil dalam urutan kanonik (terurut) agar bebas deadlock;
+    jika salah satu gagal, lock yang sudah didapat dilepas lagi.
+    """
+    leases = []
+
+    try:
+        for parent_id, lock_name in sorted(set(resources)):
+            leases.append(
+                acquire_drive_lock(
+                    service,
+                    parent_id,
+                    lock_name=lock_name,
+                    wait_timeout=wait_timeout,
+                    on_wait=on_wait
+                )
+            )
 
+    except Exception:
+        release_drive_locks(service, leases)
+        raise
 
-def upload_dataframe_to_drive(service, df, template_columns, voucher_id, filename, folder_id, file_type):
-    buffer = BytesIO()
+    return leases
 
-    # 1. Buat mapping (case-insensitive)
-    mapping_lower_to_template = {col.strip().lower(): col for col in template_columns}
 
-    # 2. Inisialisasi DataFrame hasil dengan kolom sesuai template
-    final_df = pd.DataFrame(columns=template_columns)
+def release_drive_locks(service, leases):
+    for lease in reversed(leases):
+        release_drive_lock(service, lease.parent_id, lease.lock_name, lease=lease)
 
-    # 3. Pindahkan data dari df ke final_df berdasarkan kecocokan nama kolom
-    for col_original in df.columns:
-        col_lower = col_original.strip().lower()
-        if col_lower in mapping_lower_to_template:
-            target_col = mapping_lower_to_template[col_lower]
-            final_df[target_col] = df[col_original]
 
-    # 4. Pastikan Voucher ID terisi di final_df
-    # Cari nama asli kolom Voucher ID di template (misal: "Voucher ID" atau "VOUCHER ID")
+@contextmanager
+def drive_lock(service, resource, wait_timeout=LOCK_WAIT_TIMEOUT, on_wait=None):
+    """
+    Lease satu resource (parent_id, lock_name) yang hanya dipegang selama
+    blok with, untuk bagian singkat yang harus berurutan (claim status,
+    penomoran + append log). Yield DriveLease.
+    """
+    leases = acquire_drive_locks(service, [resource], wait_timeout=wait_timeout, on_wait=on_wait)
+
+    try:
+        yield leases[0]
+    finally:
+        release_drive_locks(service, leases)
+
+
+def upload_dataframe_to_drive(service, df, template_columns, voucher_id, filename, folder_id, file_type, progress=None):
+    # 1. Kolom sesuai template (case-insensitive)
+    # Voucher ID / PML ID diisi nilai tetap (nama kolom template: "Voucher ID", "VOUCHER ID", ...)
+    fixed_values = {}
+
     if file_type == "PML":
-        pml_id_col = mapping_lower_to_template.get("pml id")
-        if pml_id_col:
-            final_df[pml_id_col] = voucher_id
+        fixed_values["pml id"] = voucher_id
 
     elif file_type == "Voucher":
-        voucher_id_col = mapping_lower_to_template.get("voucher id")
-        if voucher_id_col:
-            final_df[voucher_id_col] = voucher_id
-
-    # 5. Tulis ke Excel dengan Format BOLD pada Header & Auto-Fit
-    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-        # Tulis data mulai dari baris kedua
-        final_df.to_excel(writer, index=False, sheet_name='Sheet1', header=False, startrow=1)
-        
-        workbook  = writer.book
-        worksheet = writer.sheets['Sheet1']
-
-        # Format header
-        header_format = workbook.add_format({
-            'bold': True,
-            'text_wrap': False,
-            'valign': 'vcenter',
-            'border': 1
-        })
-
-        # Tulis header manual & Hitung Auto-fit
-        for col_num, value in enumerate(final_df.columns.values):
-            # 1. Tulis header
-            worksheet.write(0, col_num, value, header_format)
-            
-            # 2. Ambil data kolom dan bersihkan (Convert ke string & tangani NaN)
-            # Kita gunakan list comprehension agar lebih stabil dibanding .map(len)
-            column_values = final_df.iloc[:, col_num].astype(str).replace('nan', '').tolist()
-            
-            # Cari yang paling panjang antara isi data vs nama header
-            max_data_len = max([len(str(x)) for x in column_values] + [0])
-            header_len = len(str(value))
-            
-            # Ambil nilai tertinggi dan tambah padding
-            final_len = max(max_data_len, header_len) + 3
-            
-            # Batasi lebar maksimal (misal 50) agar tidak terlalu lebar jika ada teks sangat panjang
-            final_len = min(final_len, 50)
-            
-            # Terapkan lebar
-            worksheet.set_column(col_num, col_num, final_len)
-
-    buffer.seek(0)
-
-    # 6. Upload ke Google Drive
-    media = MediaIoBaseUpload(
-        buffer,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        resumable=True
-    )
+        fixed_values["voucher id"] = voucher_id
 
-    file_metadata = {
-        "name": filename,
-        "parents": [folder_id]
-    }
-
-    file = service.files().create(
-        body=file_metadata,
-        media_body=media,
-        fields="id",
-        supportsAllDrives=True
-    ).execute()
+    columns = template_columns_from_frame(df, template_columns, fixed_values)
 
-    return file.get("id")
+    # 2. Tulis ke Excel (streaming) dengan Format BOLD pada Header & Auto-Fit
+    output = write_xlsx(columns, len(df), header_style=HEADER_STYLE)
 
-def upload_dataframe_to_drive_outward(service, df, template_columns, voucher_id, filename, folder_id, dept_type, pic, date):
-    buffer = BytesIO()
+    try:
+        return _upload_xlsx(service, output, filename, folder_id, progress=progress)
+    finally:
+        output.close()
 
+def upload_dataframe_to_drive_outward(service, df, template_columns, voucher_id, filename, folder_id, dept_type, pic, date, progress=None):
     if dept_type == "ADMIN":
         df["Out Vouc ID"] = voucher_id
         df["Is Calculated"] = "TRUE"
@@ -510,26 +906,34 @@ def upload_dataframe_to_drive_outward(service, df, template_columns, voucher_id,
  
     df.columns = template_columns
 
-    df.to_excel(buffer, index=False)
-    buffer.seek(0)
+    output = frame_to_xlsx(df, header_style=HEADER_STYLE, autofit=False)
 
-    media = MediaIoBaseUpload(
-        buffer,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        resumable=True
-    )
+    try:
+        return _upload_xlsx(service, output, filename, folder_id, progress=progress)
+    finally:
+        output.close()
+
+
+def _upload_xlsx(service, file_obj, filename, folder_id, progress=None):
+    check_leases()
+
+    media = resumable_media(file_obj, XLSX_MIME)
 
     file_metadata = {
         "name": filename,
         "parents": [folder_id]
     }
 
-    file = service.files().create(
-        body=file_metadata,
-        media_body=media,
-        fields="id",
-        supportsAllDrives=True
-    ).execute()
+    file = upload_media(
+        service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields="id",
+            supportsAllDrives=True
+        ),
+        name=filename,
+        progress=progress
+    )
 
     return file.get("id")
 
@@ -540,78 +944,325 @@ def load_log_from_drive(service, filename, parent_id):
     if not file_id:
         return pd.DataFrame()
 
-    request = service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
+    fh = download_file_from_drive(service, file_id)
+    return pd.read_excel(fh)
 
-    while not done:
-        _, done = downloader.next_chunk()
 
-    fh.seek(0)
-    return pd.read_excel(fh)
+# Nilai mentah: angka tetap angka, tanggal sebagai serial number
+LOG_VALUE_OPTIONS = {
+    "valueRenderOption": "UNFORMATTED_VALUE",
+    "dateTimeRenderOption": "SERIAL_NUMBER"
+}
+
+
+def _rows_to_frame(header, rows):
+    width = len(header)
+
+    # Sheets API memotong sel kosong di ujung baris
+    padded = [
+        list(row[:width]) + [None] * (width - len(row))
+        for row in rows
+    ]
+
+    return pd.DataFrame(padded, columns=header)
+
+
+def _trim_row(row):
+    row = list(row)
+    while row and row[-1] in ("", None):
+        row.pop()
+    return row
+
+
+def _finish_log_frame(df, spreadsheet_id, read_started):
+    # Sheet kosong total (tanpa header)
+    if len(df.columns) == 0:
+        return df
+
+    # Baris di ledger yang belum terlihat di Sheets ikut ditampilkan.
+    # Baris yang tereplikasi selama baca bisa sudah ada di df -> buang per LEDGER KEY
+    pending = ledger_pending_rows(spreadsheet_id, replicated_since=read_started)
+
+    if LEDGER_KEY_COLUMN in df.columns:
+        seen = set(df[LEDGER_KEY_COLUMN].dropna().astype(str))
+        pending = [e for e in pending if e["row_key"] not in seen]
+        df = df.drop(columns=[LEDGER_KEY_COLUMN])
+
+    if pending:
+        df = pd.concat(
+            [df, pd.DataFrame([e["row"] for e in pending]).reindex(columns=df.columns)],
+            ignore_index=True
+        )
+
+    df = df.replace("", None)
+
+    return apply_log_schema(df)
 
 
 def load_log_from_gsheet(service, spreadsheet_id):
-    sheets_service = build(
+    sheets_service = build_service(
         "sheets",
         "v4",
         credentials=service._http.credentials
     )
 
-    result = sheets_service.spreadsheets().values().get(
+    cached = refresh_log_cache(sheets_service, spreadsheet_id)
+
+    return _finish_log_frame(cached["df"].copy(), spreadsheet_id, cached["read_started"])
+
+
+# ==========================
+# TAIL CACHE
+# ==========================
+# Cache isi log per spreadsheet (bersama untuk semua session di proses ini).
+# Log praktis append-only, jadi refresh cukup membaca baris setelah baris
+# terakhir yang sudah di-cache. Header, beberapa baris sampel, dan kolom
+# ROW VERSION ikut dicek supaya edit di atas tail tetap terdeteksi.
+TAIL_SAMPLE_ROWS = 3
+TAIL_MAX_CHANGED_ROWS = 50
+
+_LOG_CACHE = {}
+_LOG_CACHE_LOCK = threading.Lock()
+_LOG_REFRESH_LOCKS = {}
+
+
+def _full_read(sheets_service, spreadsheet_id):
+    values = sheets_service.spreadsheets().values().get(
         spreadsheetId=spreadsheet_id,
-        range="Sheet1"
+        range="Sheet1",
+        **LOG_VALUE_OPTIONS
+    ).execute().get("values", [])
+
+    header = [str(h).strip() for h in values[0]] if values else []
+
+    return header, values[1:]
+
+
+def _batch_get(sheets_service, spreadsheet_id, ranges):
+    result = sheets_service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id,
+        ranges=ranges,
+        **LOG_VALUE_OPTIONS
     ).execute()
 
-    values = result.get("values", [])
+    return [vr.get("values", []) for vr in result.get("valueRanges", [])]
 
-    if not values:
-        return pd.DataFrame()
 
-    df = pd.DataFrame(values[1:], columns=values[0])
-    return df
+def _tail_read(sheets_service, spreadsheet_id, header, rows, version_bumped):
+    """
+    Return (rows_baru, ada_perubahan), atau None jika perlu full reload.
+    """
+    if not header or not rows:
+        return None
 
-def update_gsheet(service, spreadsheet_id, df):
-    sheets_service = build(
-        "sheets",
-        "v4",
-        credentials=service._http.credentials
+    last_row = len(rows) + 1  # nomor baris sheet terakhir di cache
+
+    samples = sorted(
+        {2, last_row}
+        | set(random.sample(range(2, last_row + 1), min(TAIL_SAMPLE_ROWS, last_row - 1)))
     )
 
-    df = df.copy()
-    df = df.where(pd.notnull(df), None)
+    ranges = ["Sheet1!1:1", f"Sheet1!A{last_row + 1}:ZZ"]
+    ranges += [f"Sheet1!A{r}:ZZ{r}" for r in samples]
 
-    values = [df.columns.tolist()] + df.values.tolist()
+    version_col = header.index(ROW_VERSION_COLUMN) if ROW_VERSION_COLUMN in header else None
+    if version_col is not None:
+        letter = _column_letter(version_col)
+        ranges.append(f"Sheet1!{letter}2:{letter}{last_row}")
 
-    # 1️⃣ CLEAR DULU
-    sheets_service.spreadsheets().values().clear(
-        spreadsheetId=spreadsheet_id,
-        range="Log Produksi"
+    value_ranges = _batch_get(sheets_service, spreadsheet_id, ranges)
+
+    head, tail = value_ranges[0], value_ranges[1]
+    sampled = value_ranges[2:2 + len(samples)]
+
+    # Header berubah (kolom baru / urutan) -> full reload
+    if [str(h).strip() for h in (head[0] if head else [])] != header:
+        return None
+
+    # Baris sampel berbeda / hilang -> ada edit atau hapus di atas tail
+    for r, got in zip(samples, sampled):
+        if _trim_row(got[0] if got else []) != _trim_row(rows[r - 2]):
+            return None
+
+    # Baris yang ROW VERSION-nya berubah (status diubah via compare-and-set)
+    changed = []
+    if version_col is not None:
+        versions = value_ranges[-1]
+
+        for i, row in enumerate(rows):
+            new = _normalize_version(versions[i][0] if i < len(versions) and versions[i] else "")
+            old = _normalize_version(row[version_col] if len(row) > version_col else "")
+
+            if new != old:
+                changed.append(i + 2)
+
+    if len(changed) > TAIL_MAX_CHANGED_ROWS:
+        return None
+
+    # Version file naik tapi tidak ada yang terlihat berubah -> edit lain
+    if version_bumped and not tail and not changed:
+        return None
+
+    rows = list(rows)
+
+    if changed:
+        refetched = _batch_get(sheets_service, spreadsheet_id, [f"Sheet1!A{r}:ZZ{r}" for r in changed])
+
+        for r, got in zip(changed, refetched):
+            rows[r - 2] = got[0] if got else []
+
+    rows.extend(tail)
+
+    return rows, bool(tail or changed)
+
+
+def refresh_log_cache(sheets_service, spreadsheet_id, version_bumped=False):
+    """
+    Perbarui cache log (tail read, full reload jika perlu) dan kembalikan entry-nya:
+    {"header", "rows", "df", "read_started", "version"}.
+    """
+    with _LOG_CACHE_LOCK:
+        refresh_lock = _LOG_REFRESH_LOCKS.setdefault(spreadsheet_id, threading.Lock())
+
+    with refresh_lock:
+        cached = _LOG_CACHE.get(spreadsheet_id)
+        read_started = time.time()
+
+        tail = None
+        if cached is not None:
+            tail = _tail_read(sheets_service, spreadsheet_id, cached["header"], cached["rows"], version_bumped)
+
+        if tail is None:
+            header, rows = _full_read(sheets_service, spreadsheet_id)
+            df = _rows_to_frame(header, rows)
+
+            print(f"📥 Log {spreadsheet_id}: full read {len(rows)} baris")
+
+        else:
+            header = cached["header"]
+            rows, touched = tail
+
+            if touched:
+                df = _rows_to_frame(header, rows)
+                print(f"📥 Log {spreadsheet_id}: tail read, {len(rows) - len(cached['rows'])} baris baru")
+            else:
+                df = cached["df"]
+
+        fresh = {
+            "header": header,
+            "rows": rows,
+            "df": df,
+            "read_started": read_started,
+            "version": cached["version"] if cached else None
+        }
+
+        with _LOG_CACHE_LOCK:
+            _LOG_CACHE[spreadsheet_id] = fresh
+
+    return fresh
+
+
+# ==========================
+# FRESHNESS PROBE
+# ==========================
+def get_file_version(drive_service, file_id):
+    meta = drive_service.files().get(
+        fileId=file_id,
+        fields="version, modifiedTime",
+        supportsAllDrives=True
     ).execute()
 
-    # 2️⃣ UPDATE ULANG
-    try:
-        sheets_service.spreadsheets().values().update(
-            spreadsheetId=spreadsheet_id,
-            range="'Log Produksi'!A1:ZZ",
-            valueInputOption="USER_ENTERED",
-            body={"values": values}
-        ).execute()
+    return str(meta.get("version") or meta.get("modifiedTime"))
+
+
+def load_log_if_changed(drive_service, sheets_service, spreadsheet_id):
+    """
+    Return (log_df, version). Cek murah via files.get (version),
+    isi sheet hanya dibaca (tail) jika version berbeda dari cache.
+    """
+    version = get_file_version(drive_service, spreadsheet_id)
+
+    with _LOG_CACHE_LOCK:
+        cached = _LOG_CACHE.get(spreadsheet_id)
+
+    if cached is None or cached["version"] != version:
+        cached = refresh_log_cache(
+            sheets_service,
+            spreadsheet_id,
+            version_bumped=cached is not None
+        )
+        cached["version"] = version
+
+    df = _finish_log_frame(cached["df"].copy(), spreadsheet_id, cached["read_started"])
+
+    return df, version
+
+
+# ==========================
+# MULTI LOG LOADER
+# ==========================
+LOG_LOADER_WORKERS = 4
+
+
+def _load_log_worker(creds, spreadsheet_id):
+    # httplib2 tidak thread-safe: tiap thread memakai client sendiri
+    drive_service = build_service("drive", "v3", credentials=creds)
+    sheets_service = init_sheets_service(creds)
+
+    return load_log_if_changed(drive_service, sheets_service, spreadsheet_id)
+
+
+def load_logs(drive_service, sheets_service, logs, max_workers=LOG_LOADER_WORKERS):
+    """
+    Muat beberapa log sekaligus. logs: {kind: spreadsheet_id} (None = log belum ada).
+    Return ({kind: log_df}, {kind: version}).
+
+    batchGet tidak bisa lintas spreadsheet, jadi tiap spreadsheet dibaca
+    dengan satu request (tail read menggabungkan semua range-nya), dan
+    spreadsheet yang berbeda dibaca paralel.
+    """
+    spreadsheet_ids = list(dict.fromkeys(sid for sid in logs.values() if sid))
+
+    results = {}
+
+    if len(spreadsheet_ids) == 1:
+        results[spreadsheet_ids[0]] = load_log_if_changed(drive_service, sheets_service, spreadsheet_ids[0])
+
+    elif spreadsheet_ids:
+        creds = drive_service._http.credentials
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(spreadsheet_ids))) as pool:
+            futures = {
+                sid: pool.submit(_load_log_worker, creds, sid)
+                for sid in spreadsheet_ids
+            }
+
+            for sid, future in futures.items():
+                results[sid] = future.result()
+
+    frames, versions = {}, {}
+
+    for kind, sid in logs.items():
+        if sid:
+            df, version = results[sid]
+            frames[kind] = df.copy()
+            versions[kind] = version
+        else:
+            frames[kind] = pd.DataFrame()
+            versions[kind] = None
+
+    return frames, versions
 
-    except Exception as e:
-        st.error(e)
 
 #Update
 import httplib2
 from google_auth_httplib2 import AuthorizedHttp
-from googleapiclient.discovery import build
 
 def init_sheets_service(creds):
     http = httplib2.Http(timeout=60)
     authed_http = AuthorizedHttp(creds, http=http)
 
-    return build("sheets", "v4", http=authed_http)
+    return build_service("sheets", "v4", http=authed_http)
 
 @st.cache_data(ttl=600)
 def get_headers(_service, spreadsheet_id):
@@ -621,66 +1272,139 @@ def get_headers(_service, spreadsheet_id):
     ).execute()
     return result.get("values", [[]])[0]
 
-import time
+def _clean_sheet_value(value):
+    import numpy as np
+    from datetime import date
+    from decimal import Decimal
+
+    if value is None or pd.isna(value):
+        return None
+
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+
+    if isinstance(value, Decimal):
+        return float(value)
+
+    if isinstance(value, (np.integer,)):
+        return int(value)
+
+    if isinstance(value, (np.floating,)):
+        return float(value)
+
+    if isinstance(value, (np.bool_,)):
+        return bool(value)
+
+    if not isinstance(value, (str, int, float, bool)):
+        return str(value)
+
+    return value
 
-def execute_with_retry(request, max_retries=3):
-    for i in range(max_retries):
-        try:
-            return request.execute()
-        except Exception as e:
-            if i == max_retries - 1:
-                raise e
-            time.sleep(2 ** i)  # exponential backoff
 
 def append_gsheet(service, spreadsheet_id, row_dict):
-    import pandas as pd
-    import numpy as np
-    from datetime import datetime, date
-    from decimal import Decimal
+    """
+    Tulis baris log ke ledger lokal (write-behind).
+    Replikator mengirimnya ke spreadsheet dalam batch di background.
+    """
+    cleaned_row = {
+        str(col): _clean_sheet_value(value)
+        for col, value in row_dict.items()
+    }
 
-    def clean_value(value):
-        if value is None or pd.isna(value):
-            return None
+    # Kunci unik per baris (bukan Voucher No / PML ID: satu PML bisa punya beberapa baris)
+    row_key = uuid.uuid4().hex
+
+    # Nomor baris ini dialokasikan di bawah lock: jangan tulis jika lock hilang,
+    # dan lock baru dilepas setelah baris ini tereplikasi
+    check_leases(spreadsheet_id)
 
-        if isinstance(value, (datetime, pd.Timestamp)):
-            return value.strftime("%Y-%m-%d %H:%M:%S")
+    row_id = ledger_append(spreadsheet_id, cleaned_row, row_key=row_key)
 
-        if isinstance(value, date):
-            return value.strftime("%Y-%m-%d")
+    # Agregat di replika lokal langsung ikut baris baru
+    replica_append(spreadsheet_id, cleaned_row, row_id)
 
-        if isinstance(value, Decimal):
-            return float(value)
+    return row_id
 
-        if isinstance(value, (np.integer,)):
-            return int(value)
 
-        if isinstance(value, (np.floating,)):
-            return float(value)
+_REPLICA_CLIENT = {}
 
-        if isinstance(value, (np.bool_,)):
-            return bool(value)
 
-        if not isinstance(value, (str, int, float, bool)):
-            return str(value)
+def _replica_sheets_service():
+    # Client khusus thread replikator (httplib2 tidak thread-safe)
+    if "sheets" not in _REPLICA_CLIENT:
+        credentials = service_account.Credentials.from_service_account_info(
+            dict(st.secrets["gcp_service_account"]),
+            scopes=SCOPES
+        )
+        _REPLICA_CLIENT["sheets"] = init_sheets_service(credentials)
+
+    return _REPLICA_CLIENT["sheets"]
 
-        return value
 
-    headers = get_headers(service, spreadsheet_id)
+def _push_ledger_rows(spreadsheet_id, entries):
+    service = _replica_sheets_service()
+
+    header_values = service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id,
+        range="Sheet1!1:1"
+    ).execute().get("values", [])
+
+    headers = [str(h).strip() for h in (header_values[0] if header_values else [])]
+
+    # Log lama belum punya kolom LEDGER KEY -> tambahkan header-nya
+    if headers and LEDGER_KEY_COLUMN not in headers:
+        service.spreadsheets().values().update(
+            spreadsheetId=spreadsheet_id,
+            range=f"Sheet1!{_column_letter(len(headers))}1",
+            valueInputOption="RAW",
+            body={"values": [[LEDGER_KEY_COLUMN]]}
+        ).execute()
+
+        headers.append(LEDGER_KEY_COLUMN)
+
+    # Batch yang pernah dicoba mungkin sudah masuk sebagian -> lewati yang
+    # LEDGER KEY-nya sudah ada (cukup baca kolom itu saja)
+    if any(e["attempts"] > 1 for e in entries) and LEDGER_KEY_COLUMN in headers:
+        key_col = _column_letter(headers.index(LEDGER_KEY_COLUMN))
+
+        key_values = service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range=f"Sheet1!{key_col}2:{key_col}"
+        ).execute().get("values", [])
+
+        existing = {str(r[0]) for r in key_values if r}
+
+        entries = [
+            e for e in entries
+            if e["attempts"] <= 1 or e["row_key"] not in existing
+        ]
+
+    if not entries:
+        return
 
-    cleaned_row = [
-        clean_value(row_dict.get(col, None))
-        for col in headers
+    rows = [
+        [e["row_key"] if col == LEDGER_KEY_COLUMN else e["row"].get(col) for col in headers]
+        for e in entries
     ]
 
-    request = service.spreadsheets().values().append(
+    service.spreadsheets().values().append(
         spreadsheetId=spreadsheet_id,
         range="Sheet1!A1",
         valueInputOption="USER_ENTERED",
         insertDataOption="INSERT_ROWS",
-        body={"values": [cleaned_row]}
-    )
+        body={"values": rows}
+    ).execute()
 
-    return execute_with_retry(request)
+
+def start_ledger_replicator():
+    """
+    Replikasi ledger -> Sheets (termasuk sisa baris dari proses sebelumnya).
+    Dipanggil sekali dari entry point app (bukan saat import).
+    """
+    start_replicator(_push_ledger_rows)
 
 # def append_gsheet(service, spreadsheet_id, row_dict):
 #     from googleapiclient.discovery import build
@@ -751,6 +1475,8 @@ def append_gsheet(service, spreadsheet_id, row_dict):
 
 template_id = "1FbnbPq8fitRRRCSXeo4WakUr4QQLgAyXsVHbxSeXBhw"
 def create_log_gsheet(service, parent_id, filename, columns=None):
+    check_leases()
+
     try:
         # 1️⃣ BUAT SPREADSHEET BARU
         file_metadata = {
@@ -770,7 +1496,7 @@ def create_log_gsheet(service, parent_id, filename, columns=None):
 
         # 2️⃣ ISI HEADER
         if columns:
-            sheets_service = build(
+            sheets_service = build_service(
                 "sheets", 
                 "v4", 
                 credentials=service._http.credentials,
@@ -794,31 +1520,35 @@ def create_log_gsheet(service, parent_id, filename, columns=None):
 
 
 def upload_log_dataframe(service, df, filename, folder_id, file_id=None):
+    check_leases()
+
     output = io.BytesIO()
     df.to_excel(output, index=False)
     output.seek(0)
 
-    media = MediaIoBaseUpload(
-        output,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        resumable=True
-    )
+    media = resumable_media(output, XLSX_MIME)
 
     if file_id:
-        service.files().update(
-            fileId=file_id,
-            media_body=media,
-            supportsAllDrives=True
-        ).execute()
+        upload_media(
+            service.files().update(
+                fileId=file_id,
+                media_body=media,
+                supportsAllDrives=True
+            ),
+            name=filename
+        )
     else:
-        service.files().create(
-            body={
-                "name": filename,
-                "parents": [folder_id]
-            },
-            media_body=media,
-            supportsAllDrives=True
-        ).execute()
+        upload_media(
+            service.files().create(
+                body={
+                    "name": filename,
+                    "parents": [folder_id]
+                },
+                media_body=media,
+                supportsAllDrives=True
+            ),
+            name=filename
+        )
 
 
 def load_voucher_excel_from_drive(service, voucher_no, ceding_folder_id):
@@ -850,16 +1580,7 @@ def load_voucher_excel_from_drive(service, voucher_no, ceding_folder_id):
     file_id = files[0]["id"]
 
     # 📥 Download file ke memory (tanpa simpan local)
-    request = service.files().get_media(fileId=file_id)
-    file_stream = io.BytesIO()
-
-    downloader = MediaIoBaseDownload(file_stream, request)
-
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-
-    file_stream.seek(0)
+    file_stream = download_file_from_drive(service, file_id)
 
     # 📊 Convert ke DataFrame
     df = pd.read_excel(file_stream)
@@ -970,8 +1691,6 @@ def create_review_spreadsheet(
 
     from googleapiclient.http import MediaIoBaseUpload
     from google.oauth2.credentials import Credentials
-    from google.oauth2 import service_account
-    import gspread
 
     # ==========================
     # FILE NAME
@@ -1000,35 +1719,15 @@ def create_review_spreadsheet(
     spreadsheet_id = spreadsheet_file["id"]
 
     # ==========================
-    # AUTHORIZE GSPREAD
-    # ==========================
-    creds = service_account.Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"],
-        scopes=[
-            "https://www.googleapis.com/auth/drive",
-            "https://www.googleapis.com/auth/spreadsheets"
-        ]
-    )
-
-    gc = gspread.authorize(creds)
-
-    spreadsheet = gc.open_by_key(
-        spreadsheet_id
-    )
-
-    # ==========================
-    # MAIN SHEET
+    # SHEETS CLIENT
     # ==========================
-    worksheet = spreadsheet.sheet1
-
-    worksheet.update_title(
-        "REVIEW"
-    )
+    # Lewat PacedHttpRequest (token bucket & retry), bukan gspread
+    sheets_service = init_sheets_service(service._http.credentials)
 
     # ==========================
     # CLEAN DATAFRAME
     # ==========================
-    export_df = review_df.copy()
+    export_df = expand_frame(review_df.copy())
 
     export_df = export_df.fillna("")
 
@@ -1074,32 +1773,53 @@ def create_review_spreadsheet(
     # ==========================
     # UPLOAD DATAFRAME
     # ==========================
-    worksheet.update(
-        range_name="A1",
-        values=[
-            export_df.columns.tolist()
-        ] + export_df.values.tolist()
-    )
-
-    # ==========================
-    # FREEZE HEADER
-    # ==========================
-    worksheet.freeze(
-        rows=1
-    )
-
-    # ==========================
-    # AUTO FILTER
-    # ==========================
-    worksheet.set_basic_filter()
+    sheets_service.spreadsheets().values().update(
+        spreadsheetId=spreadsheet_id,
+        range="A1",
+        valueInputOption="RAW",
+        body={
+            "values": [
+                export_df.columns.tolist()
+            ] + export_df.values.tolist()
+        }
+    ).execute()
 
     # ==========================
-    # AUTO RESIZE
+    # TITLE, FREEZE HEADER, AUTO FILTER, AUTO RESIZE
     # ==========================
-    worksheet.columns_auto_resize(
-        0,
-        len(export_df.columns)
-    )
+    # Satu batchUpdate; sheet pertama spreadsheet baru selalu sheetId 0
+    sheets_service.spreadsheets().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={
+            "requests": [
+                {
+                    "updateSheetProperties": {
+                        "properties": {
+                            "sheetId": 0,
+                            "title": "REVIEW",
+                            "gridProperties": {"frozenRowCount": 1}
+                        },
+                        "fields": "title,gridProperties.frozenRowCount"
+                    }
+                },
+                {
+                    "setBasicFilter": {
+                        "filter": {"range": {"sheetId": 0}}
+                    }
+                },
+                {
+                    "autoResizeDimensions": {
+                        "dimensions": {
+                            "sheetId": 0,
+                            "dimension": "COLUMNS",
+                            "startIndex": 0,
+                            "endIndex": len(export_df.columns)
+                        }
+                    }
+                }
+            ]
+        }
+    ).execute()
 
     # ==========================
     # GET URL
@@ -1131,17 +1851,7 @@ def get_pml_metadata(_service, pml_id, pml_drive_id):
         if not file_id:
             return {"product": "-", "cby": "-", "cbm": "-"}
 
-        from googleapiclient.http import MediaIoBaseDownload
-        import io
-
-        request = _service.files().get_media(fileId=file_id)
-        buffer = io.BytesIO()
-        downloader = MediaIoBaseDownload(buffer, request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-
-        buffer.seek(0)
+        buffer = download_file_from_drive(_service, file_id)
         df_pml = pd.read_excel(buffer, nrows=2)  # header + baris pertama saja
         df_pml.columns = df_pml.columns.str.strip()
 
@@ -1164,15 +1874,3 @@ def get_pml_metadata(_service, pml_id, pml_drive_id):
 
     except Exception:
         return {"product": "-", "cby": "-", "cbm": "-"}
-
-
-def download_with_retry(service, file_id, max_retries=3, delay=2):
-    """Download file dengan retry jika timeout."""
-    for attempt in range(max_retries):
-        try:
-            return download_file_from_drive(service, file_id)
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(delay * (attempt + 1))  # exponential backoff
-                continue
-            raise e
\ No newline at end of file
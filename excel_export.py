@@ -0,0 +1,202 @@
+import datetime as dt
+import tempfile
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from template_registry import projection_plan
+
+
+# ==========================
+# KONFIGURASI
+# ==========================
+# File hasil tetap di RAM sampai ukuran ini, lebih besar -> file temp di disk
+EXPORT_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# Lebar kolom diperkirakan dari sampel baris (bukan semua sel)
+EXPORT_WIDTH_SAMPLE_ROWS = 2000
+EXPORT_WIDTH_PADDING = 3
+EXPORT_MAX_COLUMN_WIDTH = 50
+
+# Sel dikonversi ke nilai Python per blok baris, bukan sekaligus satu frame
+EXPORT_ROW_CHUNK = 5000
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+HEADER_STYLE = {
+    "bold": True,
+    "text_wrap": False,
+    "valign": "vcenter",
+    "border": 1
+}
+
+# Sama dengan format tanggal default pandas.to_excel
+DATETIME_FORMAT = "YYYY-MM-DD HH:MM:SS"
+DATE_FORMAT = "YYYY-MM-DD"
+
+
+# ==========================
+# KOLOM
+# ==========================
+def template_columns_from_frame(df, template_columns, fixed_values=None):
+    """
+    Susun kolom export sesuai template memakai projection_plan (di-cache per
+    signature header): kolom df dicocokkan tanpa membedakan huruf besar/kecil,
+    kolom template yang tidak ada di df dibiarkan kosong.
+    fixed_values: {nama kolom (lower): nilai tetap}.
+    Tidak ada frame baru yang dibuat, data tetap dibaca dari df.
+    """
+    fixed_values = fixed_values or {}
+
+    plan = projection_plan(
+        tuple(template_columns),
+        tuple(df.columns),
+        tuple(sorted(fixed_values))
+    )
+
+    return [
+        (
+            header,
+            fixed_values[fixed] if fixed is not None
+            else df.iloc[:, position] if position is not None
+            else None
+        )
+        for header, position, fixed in plan
+    ]
+
+
+def _is_date(value):
+    return isinstance(value, (dt.datetime, dt.date))
+
+
+def _cell_values(source, n_rows):
+    """Nilai satu kolom sebagai iterator nilai Python (NaN -> None, inf -> "inf")."""
+    if not isinstance(source, pd.Series):
+        return repeat(None if source is None or pd.isna(source) else source, n_rows)
+
+    values = source.astype(object).where(source.notna(), None)
+
+    if pd.api.types.is_float_dtype(source.dtype):
+        numbers = source.to_numpy(dtype=float, na_value=np.nan)
+        values[np.isposinf(numbers)] = "inf"
+        values[np.isneginf(numbers)] = "-inf"
+
+    return values.tolist()
+
+
+def _has_dates(source):
+    if isinstance(source, pd.Series):
+        if pd.api.types.is_datetime64_any_dtype(source.dtype):
+            return True
+
+        if source.dtype == object:
+            first = source.dropna()
+            return not first.empty and _is_date(first.iloc[0])
+
+        return False
+
+    return _is_date(source)
+
+
+def _data_width(source):
+    """Perkiraan panjang teks terpanjang di kolom (vektor, dari sampel / aturan dtype)."""
+    if source is None:
+        return 0
+
+    if not isinstance(source, pd.Series):
+        return 0 if pd.isna(source) else len(str(source))
+
+    dtype = source.dtype
+
+    if pd.api.types.is_bool_dtype(dtype):
+        return 5
+
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        # Tanpa jam (semua tengah malam) -> "YYYY-MM-DD"
+        sample = source.iloc[:EXPORT_WIDTH_SAMPLE_ROWS].dropna()
+        return 10 if (sample == sample.dt.normalize()).all() else 19
+
+    if pd.api.types.is_integer_dtype(dtype):
+        if source.empty:
+            return 0
+        return max(len(str(source.min())), len(str(source.max())))
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        categories = dtype.categories
+        return int(categories.astype(str).str.len().max()) if len(categories) else 0
+
+    sample = source.iloc[:EXPORT_WIDTH_SAMPLE_ROWS].dropna()
+    if sample.empty:
+        return 0
+
+    return int(sample.astype(str).str.len().max())
+
+
+# ==========================
+# WRITER
+# ==========================
+def write_xlsx(columns, n_rows, sheet_name="Sheet1", header_style=None, autofit=True):
+    """
+    Tulis kolom [(header, Series / nilai tetap / None)] ke file xlsx.
+    Memakai xlsxwriter constant_memory (baris ditulis berurutan dan langsung
+    di-flush) ke SpooledTemporaryFile, sehingga workbook tidak pernah utuh
+    di RAM. Return file object (posisi 0) yang harus di-close pemanggil.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    worksheet = workbook.add_worksheet(sheet_name)
+
+    datetime_format = workbook.add_format({"num_format": DATETIME_FORMAT})
+    date_format = workbook.add_format({"num_format": DATE_FORMAT})
+    header_format = workbook.add_format(header_style) if header_style else None
+
+    headers = [header for header, _ in columns]
+
+    # Lebar kolom harus di-set sebelum baris data ditulis
+    if autofit:
+        for col_num, (header, source) in enumerate(columns):
+            width = max(_data_width(source), len(str(header))) + EXPORT_WIDTH_PADDING
+            worksheet.set_column(col_num, col_num, min(width, EXPORT_MAX_COLUMN_WIDTH))
+
+    worksheet.write_row(0, 0, headers, header_format)
+
+    date_columns = [i for i, (_, source) in enumerate(columns) if _has_dates(source)]
+
+    for start in range(0, n_rows, EXPORT_ROW_CHUNK):
+        end = min(start + EXPORT_ROW_CHUNK, n_rows)
+
+        cells = [
+            _cell_values(source.iloc[start:end] if isinstance(source, pd.Series) else source, end - start)
+            for _, source in columns
+        ]
+
+        for row_num, row in enumerate(zip(*cells), start=start + 1):
+            worksheet.write_row(row_num, 0, row)
+
+            # Tanggal ditulis ulang dengan format (masih di baris yang sama)
+            for col_num in date_columns:
+                value = row[col_num]
+
+                if isinstance(value, dt.datetime):
+                    worksheet.write_datetime(row_num, col_num, value, datetime_format)
+                elif isinstance(value, dt.date):
+                    worksheet.write_datetime(row_num, col_num, value, date_format)
+
+    workbook.close()
+
+    output.seek(0)
+    return output
+
+
+def frame_to_xlsx(df, columns=None, **kwargs):
+    """Shortcut write_xlsx untuk satu DataFrame (header = nama kolom atau `columns`)."""
+    headers = columns if columns is not None else list(df.columns)
+
+    return write_xlsx(
+        [(header, df.iloc[:, i]) for i, header in enumerate(headers)],
+        len(df),
+        **kwargs
+    )
@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+
+# ==========================
+# KOLOM KATEGORI (LOW-CARDINALITY)
+# ==========================
+# Nama kolom dicocokkan tanpa membedakan huruf besar/kecil,
+# sehingga berlaku untuk frame PML (Title Case) maupun upload (lowercase).
+CATEGORY_COLUMNS = [
+    "Gender", "Smoker", "Medical",
+    "K.O.B Code", "KOB Code", "KindOfBusiness",
+    "COB", "COB Detail", "ClassOfBusiness",
+    "Ccy Code", "Premium Ccy", "Currency", "Curr",
+    "Pay Period Type", "Out Pay Period Type", "Inw Pay Period Type", "PayPeriodType",
+    "Policy Category", "Trans Category", "Retro Type",
+    "Ced Product Code", "Ced Coverage Code", "Product", "Coverage Code",
+    "Account With", "Acc With Name", "Cedant Name", "Company Name", "Reinsurer Name",
+    "MedicalCategory", "Method Of Payment",
+]
+
+# Kolom integer kecil (umur, tahun, bulan) yang aman di-downcast.
+# Kolom uang TIDAK di-downcast: float32 tidak cukup presisi untuk 2 desimal.
+SMALL_INTEGER_COLUMNS = [
+    "Age At", "Age", "Term Year", "Term Month",
+    "CBY", "CBM", "CedBookYear", "CedBookMonth",
+    "Ced Book Year", "Ced Book Month", "Inw Book Year", "Inw Book Month",
+    "BookYear", "BookMonth",
+]
+
+_CATEGORY_KEYS = {c.lower() for c in CATEGORY_COLUMNS}
+_INTEGER_KEYS = {c.lower() for c in SMALL_INTEGER_COLUMNS}
+
+# Kolom dengan nilai unik lebih dari rasio ini terhadap jumlah baris
+# tidak dijadikan categorical (kode + kamus justru lebih besar)
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ubah kolom low-cardinality menjadi categorical (kategori per frame)
+    dan downcast kolom integer kecil. Nilai tidak berubah, hanya representasi.
+    """
+    for col in df.columns:
+        key = str(col).strip().lower()
+        series = df[col]
+
+        if key in _CATEGORY_KEYS:
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                continue
+
+            # Campuran tipe (angka & teks) dibiarkan apa adanya
+            values = series.dropna().unique()
+            if len({type(v) for v in values}) > 1:
+                continue
+
+            if len(values) > CATEGORY_MAX_UNIQUE_RATIO * len(series):
+                continue
+
+            df[col] = series.astype(pd.CategoricalDtype(categories=sorted(values, key=str)))
+
+        elif key in _INTEGER_KEYS and pd.api.types.is_integer_dtype(series):
+            df[col] = pd.to_numeric(series, downcast="integer")
+
+    return df
+
+
+def expand_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Kebalikan compact_frame: kolom categorical kembali ke object dan integer
+    kecil ke int64. Dipanggil sekali sebelum frame dimutasi (fillna, set sel)
+    atau diexport, karena categorical menolak nilai di luar kategorinya.
+    """
+    dtypes = {}
+
+    for col in df.columns:
+        dtype = df[col].dtype
+
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtypes[col] = object
+
+        elif pd.api.types.is_integer_dtype(dtype) and dtype.itemsize < 8:
+            dtypes[col] = "int64"
+
+    if not dtypes:
+        return df
+
+    return df.astype(dtypes)
+
+
+def frame_memory_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+
+# ==========================
+# SPLIT ENGINE (SEKALI SORT)
+# ==========================
+# Label nilai kunci kosong (NaN) di nama grup split
+MISSING_KEY_LABEL = "(kosong)"
+
+
+def _factorize_key(series):
+    try:
+        codes, uniques = pd.factorize(series, sort=True)
+    except TypeError:
+        # Campuran tipe (angka & teks) tidak bisa diurutkan -> urutan kemunculan
+        codes, uniques = pd.factorize(series)
+
+    return codes, list(uniques)
+
+
+def split_frame(df: pd.DataFrame, split_columns, missing="group"):
+    """
+    Bagi frame berdasarkan kolom split dengan SEKALI sort.
+    Baris diurutkan sekali (satu salinan), lalu setiap grup adalah potongan
+    berurutan (start, end) dari frame terurut tersebut.
+
+    missing: perlakuan baris dengan kunci kosong (NaN)
+      "group" -> dijadikan grup tersendiri (diurutkan paling akhir)
+      "drop"  -> dibuang
+      "error" -> ValueError
+    """
+    if missing not in ("group", "drop", "error"):
+        raise ValueError(f"missing tidak dikenal: {missing}")
+
+    codes, uniques = [], []
+    for col in split_columns:
+        c, u = _factorize_key(df[col])
+        codes.append(c)
+        uniques.append(u)
+
+    codes = np.vstack(codes) if codes else np.empty((0, len(df)), dtype=np.intp)
+    missing_mask = (codes < 0).any(axis=0)
+    missing_rows = int(missing_mask.sum())
+
+    if missing_rows and missing == "error":
+        raise ValueError(f"{missing_rows} baris memiliki nilai kosong di kolom split {list(split_columns)}")
+
+    # NaN (-1) diurutkan paling akhir di setiap kolom
+    sort_codes = np.where(codes < 0, np.iinfo(np.intp).max, codes)
+
+    # lexsort: kunci terakhir = kunci utama
+    order = np.lexsort(sort_codes[::-1]) if len(split_columns) else np.arange(len(df))
+
+    if missing_rows and missing == "drop":
+        order = order[~missing_mask[order]]
+
+    sorted_codes = sort_codes[:, order]
+
+    if len(order):
+        change = np.empty(len(order), dtype=bool)
+        change[0] = True
+        change[1:] = (sorted_codes[:, 1:] != sorted_codes[:, :-1]).any(axis=0)
+        starts = np.flatnonzero(change)
+    else:
+        starts = np.empty(0, dtype=np.intp)
+
+    bounds = list(zip(starts.tolist(), np.append(starts[1:], len(order)).tolist()))
+
+    keys = []
+    for start, _ in bounds:
+        key = tuple(
+            uniques[j][sorted_codes[j, start]] if sorted_codes[j, start] < len(uniques[j]) else np.nan
+            for j in range(len(split_columns))
+        )
+        keys.append(key)
+
+    # Frame yang sudah terurut tidak perlu disalin
+    in_place = len(order) == len(df) and bool((order == np.arange(len(df))).all())
+
+    return {
+        "frame": df if in_place else df.take(order),
+        # Nomor grup per baris frame terurut (untuk agregasi per grup)
+        "labels": np.cumsum(change) - 1 if len(order) else np.empty(0, dtype=np.intp),
+        "bounds": bounds,
+        "keys": keys,
+        "missing_rows": missing_rows,
+    }
+
+
+def iter_split_groups(split):
+    """(key, group) per grup; group adalah view dari frame terurut, tanpa salinan per grup."""
+    frame = split["frame"]
+
+    for key, (start, end) in zip(split["keys"], split["bounds"]):
+        yield key, frame.iloc[start:end]
@@ -0,0 +1,347 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+# ==========================
+# KONFIGURASI
+# ==========================
+# Semua store SQLite lokal berada di APP_DATA_DIR (default ./data)
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(os.getenv("APP_DATA_DIR", "data"), "jobs.sqlite3"))
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "4"))
+
+# Hasil job yang tidak diambil dibuang setelah sekian detik
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+
+STATUS_QUEUED = "QUEUED"
+STATUS_RUNNING = "RUNNING"
+STATUS_DONE = "DONE"
+STATUS_FAILED = "FAILED"
+STATUS_INTERRUPTED = "INTERRUPTED"
+
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+_DB_LOCK = threading.Lock()
+
+# Hasil job (DataFrame, dsb.) hanya disimpan di memori proses,
+# yang dipersist ke SQLite hanya status, progress, dan item.
+# job_id -> (waktu selesai, hasil)
+_RESULTS = {}
+
+# Job yang memakai resource (lock key) yang sama dijalankan berurutan
+# di proses ini, supaya batch yang diantrikan tidak saling rebut lock Drive.
+# Job yang key-nya sedang dipakai menunggu di _WAITING (bukan di worker),
+# sehingga worker tetap tersedia untuk job lain.
+_BUSY_KEYS = set()
+_WAITING = deque()
+_SCHEDULE_LOCK = threading.Lock()
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="job")
+
+# Proses pemilik job (host:pid), untuk menandai job yang prosesnya sudah mati
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+# ==========================
+# DATABASE
+# ==========================
+@contextmanager
+def _connect():
+    conn = sqlite3.connect(JOB_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _owner_alive(owner):
+    # Job dari versi sebelum kolom owner
+    if not owner:
+        return False
+
+    host, _, pid = owner.rpartition(":")
+
+    # Host lain tidak bisa dicek dari sini -> anggap masih jalan
+    if host != socket.gethostname():
+        return True
+
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def init_job_queue():
+    """
+    Buat database job dan tandai job milik proses yang sudah mati.
+    Dipanggil sekali dari entry point app (bukan saat import).
+    """
+    os.makedirs(os.path.dirname(JOB_DB_PATH) or ".", exist_ok=True)
+
+    with _DB_LOCK, _connect() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                label TEXT,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                total INTEGER DEFAULT 0,
+                done INTEGER DEFAULT 0,
+                progress REAL DEFAULT 0,
+                message TEXT DEFAULT '',
+                items TEXT DEFAULT '[]',
+                error TEXT,
+                owner TEXT
+            )
+            """
+        )
+
+        # Database dari versi sebelum kolom owner
+        columns = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+        # Worker thread tidak bertahan setelah proses restart; job proses
+        # lain yang masih hidup (mis. server kedua) tidak disentuh
+        active = conn.execute(
+            "SELECT id, owner FROM jobs WHERE status IN (?, ?)",
+            ACTIVE_STATUSES
+        ).fetchall()
+
+        dead = [r["id"] for r in active if not _owner_alive(r["owner"])]
+
+        if dead:
+            conn.execute(
+                f"UPDATE jobs SET status = ?, finished_at = ?, message = ? "
+                f"WHERE id IN ({', '.join('?' for _ in dead)})",
+                (STATUS_INTERRUPTED, time.time(), "Server restart saat job berjalan", *dead)
+            )
+
+
+def _update(job_id, **fields):
+    if "items" in fields:
+        fields["items"] = json.dumps(fields["items"], default=str)
+
+    columns = ", ".join(f"{k} = ?" for k in fields)
+
+    with _DB_LOCK, _connect() as conn:
+        conn.execute(
+            f"UPDATE jobs SET {columns} WHERE id = ?",
+            (*fields.values(), job_id)
+        )
+
+
+def _row_to_job(row):
+    job = dict(row)
+    job["items"] = json.loads(job["items"] or "[]")
+    job["eta"] = job_eta(job)
+    return job
+
+
+# ==========================
+# REPORTER
+# ==========================
+class JobReporter:
+    """
+    Dipakai fungsi job untuk melaporkan progress.
+    Punya method progress() dan text() sehingga bisa dipakai sebagai
+    progress_bar / status_text di split_upload_with_log.
+    """
+
+    def __init__(self, job_id, total=0):
+        self.job_id = job_id
+        self.total = total
+        self.done = 0
+        self.items = []
+
+    def progress(self, value):
+        _update(self.job_id, progress=max(0.0, min(1.0, float(value))))
+
+    def text(self, message):
+        _update(self.job_id, message=str(message))
+
+    def item(self, name, status, detail=""):
+        self.items.append({"name": str(name), "status": status, "detail": str(detail)})
+        self.done += 1
+
+        fields = {"items": self.items, "done": self.done}
+        if self.total:
+            fields["progress"] = min(1.0, self.done / self.total)
+
+        _update(self.job_id, **fields)
+
+
+# ==========================
+# RUNNER
+# ==========================
+def _start_ready():
+    """
+    Kirim job yang menunggu ke worker jika semua key-nya bebas (FIFO per key:
+    job tidak mendahului job lebih lama yang menunggu key yang sama).
+    Dipanggil dengan _SCHEDULE_LOCK dipegang.
+    """
+    blocked = set()
+    still_waiting = deque()
+
+    for job in _WAITING:
+        keys = job[3]
+
+        if keys & (_BUSY_KEYS | blocked):
+            blocked |= keys
+            still_waiting.append(job)
+            continue
+
+        _BUSY_KEYS.update(keys)
+        _EXECUTOR.submit(_run, *job)
+
+    _WAITING.clear()
+    _WAITING.extend(still_waiting)
+
+
+def _evict_results():
+    cutoff = time.time() - JOB_RESULT_TTL_SECONDS
+
+    for job_id, (finished_at, _) in list(_RESULTS.items()):
+        if finished_at < cutoff:
+            _RESULTS.pop(job_id, None)
+
+
+def _run(job_id, fn, total, lock_keys, kwargs):
+    try:
+        _update(job_id, status=STATUS_RUNNING, started_at=time.time())
+
+        reporter = JobReporter(job_id, total=total)
+        result = fn(reporter, **kwargs)
+
+        _evict_results()
+        _RESULTS[job_id] = (time.time(), result)
+
+        _update(
+            job_id,
+            status=STATUS_DONE,
+            finished_at=time.time(),
+            progress=1.0
+        )
+
+    except Exception as e:
+        traceback.print_exc()
+
+        _update(
+            job_id,
+            status=STATUS_FAILED,
+            finished_at=time.time(),
+            error=str(e)
+        )
+
+    finally:
+        with _SCHEDULE_LOCK:
+            _BUSY_KEYS.difference_update(lock_keys)
+            _start_ready()
+
+
+def submit_job(kind, label, fn, total=0, lock_keys=None, **kwargs) -> str:
+    """
+    Antrikan fn(reporter, **kwargs) ke worker thread.
+    Job tetap berjalan walaupun session Streamlit rerun / ditutup.
+    """
+    job_id = uuid.uuid4().hex[:12]
+
+    with _DB_LOCK, _connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, label, status, created_at, total, owner) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, label, STATUS_QUEUED, time.time(), total, _OWNER)
+        )
+
+    with _SCHEDULE_LOCK:
+        _WAITING.append((job_id, fn, total, frozenset(lock_keys or []), kwargs))
+        _start_ready()
+
+    return job_id
+
+
+# ==========================
+# QUERY
+# ==========================
+def get_job(job_id):
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    return _row_to_job(row) if row else None
+
+
+def list_jobs(kinds=None, limit=20):
+    query = "SELECT * FROM jobs"
+    params = []
+
+    if kinds:
+        query += f" WHERE kind IN ({', '.join('?' for _ in kinds)})"
+        params.extend(kinds)
+
+    query += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limit)
+
+    with _connect() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    return [_row_to_job(r) for r in rows]
+
+
+def get_job_result(job_id, pop=False):
+    """Hasil job selesai. pop=True -> hasil dibuang setelah diambil."""
+    entry = _RESULTS.pop(job_id, None) if pop else _RESULTS.get(job_id)
+    return entry[1] if entry else None
+
+
+def job_eta(job):
+    """Perkiraan sisa detik berdasarkan laju progress sejauh ini."""
+    if job["status"] != STATUS_RUNNING or not job["started_at"]:
+        return None
+
+    progress = job["progress"] or 0
+    if progress <= 0:
+        return None
+
+    elapsed = time.time() - job["started_at"]
+    return elapsed * (1 - progress) / progress
+
+
+def job_throughput(kind, limit=20):
+    """
+    Rata-rata detik per item dari job DONE terakhir (kind yang sama),
+    atau None jika belum ada riwayat.
+    """
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT SUM(finished_at - started_at), SUM(done) FROM ("
+            "  SELECT finished_at, started_at, done FROM jobs"
+            "  WHERE kind = ? AND status = ? AND done > 0 AND started_at IS NOT NULL"
+            "  ORDER BY created_at DESC LIMIT ?"
+            ")",
+            (kind, STATUS_DONE, limit)
+        ).fetchone()
+
+    seconds, items = row
+    if not items:
+        return None
+
+    return seconds / items
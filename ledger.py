@@ -0,0 +1,281 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+
+# ==========================
+# KONFIGURASI
+# ==========================
+LEDGER_DB_PATH = os.getenv("LEDGER_DB_PATH", os.path.join(os.getenv("APP_DATA_DIR", "data"), "ledger.sqlite3"))
+
+# Jumlah baris maksimum per request append ke Sheets
+LEDGER_BATCH_SIZE = int(os.getenv("LEDGER_BATCH_SIZE", "200"))
+
+LEDGER_POLL_SECONDS = 1.0
+
+# Backoff per spreadsheet setelah replikasi gagal (10, 20, 40, ... maks 5 menit);
+# spreadsheet lain tetap direplikasi selama itu
+LEDGER_RETRY_SECONDS = 10.0
+LEDGER_RETRY_MAX_SECONDS = 300.0
+
+_DB_LOCK = threading.Lock()
+
+# Dibangunkan setiap ada baris baru / permintaan flush
+_WAKE = threading.Event()
+
+_REPLICATOR = {"thread": None, "push": None, "last_error": None}
+_REPLICATOR_GUARD = threading.Lock()
+
+# spreadsheet_id -> (waktu boleh dicoba lagi, jumlah gagal berturut-turut)
+_BACKOFF = {}
+
+
+# ==========================
+# DATABASE
+# ==========================
+@contextmanager
+def _connect():
+    conn = sqlite3.connect(LEDGER_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def init_ledger():
+    """Buat database ledger. Dipanggil sekali dari entry point app (bukan saat import)."""
+    os.makedirs(os.path.dirname(LEDGER_DB_PATH) or ".", exist_ok=True)
+
+    with _DB_LOCK, _connect() as conn:
+        # WAL: penulis (posting) tidak menunggu pembaca (tab / replikator)
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                spreadsheet_id TEXT NOT NULL,
+                row_key TEXT,
+                row TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                replicated_at REAL,
+                attempts INTEGER DEFAULT 0,
+                error TEXT
+            )
+            """
+        )
+
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ledger_pending "
+            "ON ledger (spreadsheet_id, replicated_at)"
+        )
+
+
+def _row_to_entry(row):
+    entry = dict(row)
+    entry["row"] = json.loads(entry["row"])
+    return entry
+
+
+# ==========================
+# TULIS
+# ==========================
+def ledger_append(spreadsheet_id, row, row_key=None) -> int:
+    """
+    Catat satu baris log (dict kolom -> nilai yang sudah JSON-safe).
+    Commit lokal dalam milidetik, replikasi ke Sheets menyusul di background.
+    """
+    with _DB_LOCK, _connect() as conn:
+        cursor = conn.execute(
+            "INSERT INTO ledger (spreadsheet_id, row_key, row, created_at) VALUES (?, ?, ?, ?)",
+            (str(spreadsheet_id), row_key, json.dumps(row), time.time())
+        )
+        row_id = cursor.lastrowid
+
+    _WAKE.set()
+    return row_id
+
+
+# ==========================
+# BACA
+# ==========================
+def ledger_pending_rows(spreadsheet_id, replicated_since=None):
+    """
+    Baris yang belum (pasti) terlihat di Sheets.
+    replicated_since: baris yang direplikasi setelah waktu ini ikut dikembalikan,
+    karena mungkin belum ada di hasil baca Sheets yang dimulai pada waktu itu.
+    """
+    query = "SELECT * FROM ledger WHERE spreadsheet_id = ? AND (replicated_at IS NULL"
+    params = [str(spreadsheet_id)]
+
+    if replicated_since is not None:
+        query += " OR replicated_at >= ?"
+        params.append(replicated_since)
+
+    query += ") ORDER BY id"
+
+    with _connect() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    return [_row_to_entry(r) for r in rows]
+
+
+def ledger_status():
+    """Ringkasan lag replikasi untuk ditampilkan di UI."""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) AS pending, MIN(created_at) AS oldest "
+            "FROM ledger WHERE replicated_at IS NULL"
+        ).fetchone()
+
+    return {
+        "pending": row["pending"],
+        "lag": time.time() - row["oldest"] if row["oldest"] else 0.0,
+        "error": _REPLICATOR["last_error"]
+    }
+
+
+# ==========================
+# REPLIKATOR
+# ==========================
+def _next_batch():
+    """Batch spreadsheet dengan baris pending tertua yang tidak sedang backoff."""
+    now = time.time()
+
+    with _connect() as conn:
+        pending = conn.execute(
+            "SELECT spreadsheet_id FROM ledger WHERE replicated_at IS NULL "
+            "GROUP BY spreadsheet_id ORDER BY MIN(id)"
+        ).fetchall()
+
+        spreadsheet_id = next(
+            (
+                r["spreadsheet_id"] for r in pending
+                if _BACKOFF.get(r["spreadsheet_id"], (0, 0))[0] <= now
+            ),
+            None
+        )
+
+        if spreadsheet_id is None:
+            return None, []
+
+        rows = conn.execute(
+            "SELECT * FROM ledger WHERE spreadsheet_id = ? AND replicated_at IS NULL "
+            "ORDER BY id LIMIT ?",
+            (spreadsheet_id, LEDGER_BATCH_SIZE)
+        ).fetchall()
+
+    return spreadsheet_id, [_row_to_entry(r) for r in rows]
+
+
+def _mark(ids, **fields):
+    columns = ", ".join(f"{k} = ?" for k in fields)
+    placeholders = ", ".join("?" for _ in ids)
+
+    with _DB_LOCK, _connect() as conn:
+        conn.execute(
+            f"UPDATE ledger SET {columns} WHERE id IN ({placeholders})",
+            (*fields.values(), *ids)
+        )
+
+
+def _replicate_loop():
+    while True:
+        _WAKE.wait(LEDGER_POLL_SECONDS)
+        _WAKE.clear()
+
+        while True:
+            spreadsheet_id, batch = _next_batch()
+            if not batch:
+                break
+
+            ids = [e["id"] for e in batch]
+
+            # attempts dinaikkan SEBELUM push: jika proses mati di tengah,
+            # push berikutnya tahu baris ini mungkin sudah ada di Sheets
+            with _DB_LOCK, _connect() as conn:
+                conn.execute(
+                    f"UPDATE ledger SET attempts = attempts + 1 "
+                    f"WHERE id IN ({', '.join('?' for _ in ids)})",
+                    ids
+                )
+
+            try:
+                _REPLICATOR["push"](spreadsheet_id, batch)
+
+                _mark(ids, replicated_at=time.time(), error=None)
+                _BACKOFF.pop(spreadsheet_id, None)
+
+                if not _BACKOFF:
+                    _REPLICATOR["last_error"] = None
+
+                print(f"🔁 Ledger: {len(batch)} baris direplikasi ke {spreadsheet_id}")
+
+            except Exception as e:
+                traceback.print_exc()
+
+                _mark(ids, error=str(e))
+                _REPLICATOR["last_error"] = f"{spreadsheet_id}: {e}"
+
+                # Hanya spreadsheet ini yang ditunda, lanjut ke spreadsheet berikutnya
+                failures = _BACKOFF.get(spreadsheet_id, (0, 0))[1] + 1
+                delay = min(LEDGER_RETRY_MAX_SECONDS, LEDGER_RETRY_SECONDS * 2 ** (failures - 1))
+                _BACKOFF[spreadsheet_id] = (time.time() + delay, failures)
+
+                print(f"⚠️ Ledger: replikasi ke {spreadsheet_id} gagal ({failures}x), dicoba lagi dalam {delay:.0f} detik")
+
+
+def start_replicator(push):
+    """
+    Jalankan thread replikator (sekali per proses).
+    push(spreadsheet_id, entries) menulis batch ke Sheets; entry dengan
+    attempts > 1 mungkin sudah pernah masuk sehingga perlu dicek dulu.
+    """
+    with _REPLICATOR_GUARD:
+        _REPLICATOR["push"] = push
+
+        thread = _REPLICATOR["thread"]
+        if thread is not None and thread.is_alive():
+            return
+
+        thread = threading.Thread(target=_replicate_loop, name="ledger-replicator", daemon=True)
+        thread.start()
+
+        _REPLICATOR["thread"] = thread
+
+
+def flush_ledger(spreadsheet_ids=None, timeout=60) -> bool:
+    """
+    Tunggu sampai baris untuk spreadsheet tertentu sudah direplikasi.
+    Dipakai sebelum operasi yang membaca/menulis Sheets secara langsung
+    (mis. compare-and-set status). Return False jika timeout.
+    """
+    deadline = time.time() + timeout
+
+    query = "SELECT COUNT(*) FROM ledger WHERE replicated_at IS NULL"
+    params = []
+
+    if spreadsheet_ids:
+        query += f" AND spreadsheet_id IN ({', '.join('?' for _ in spreadsheet_ids)})"
+        params.extend(str(s) for s in spreadsheet_ids)
+
+    while True:
+        with _connect() as conn:
+            remaining = conn.execute(query, params).fetchone()[0]
+
+        if remaining == 0:
+            return True
+
+        if time.time() >= deadline or _REPLICATOR["thread"] is None:
+            return False
+
+        _WAKE.set()
+        time.sleep(0.2)
@@ -0,0 +1,584 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from log_schema import apply_log_schema
+
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================
+# KONFIGURASI
+# ==========================
+# Replika lokal (read-only) dari semua log periode untuk filter & query lintas periode.
+# Sumber kebenaran tetap Google Sheets; replika di-sync setiap log dimuat.
+REPLICA_DB_PATH = os.getenv("REPLICA_DB_PATH", os.path.join(os.getenv("APP_DATA_DIR", "data"), "log_replica.sqlite3"))
+
+KIND_PML = "pml"
+KIND_PML_OUTWARD = "pml_outward"
+KIND_VOUCHER = "voucher"
+KIND_VOUCHER_OUTWARD = "voucher_outward"
+
+# Kolom log -> kolom terindeks di tabel replika
+INDEXED_COLUMNS = {
+    "PML ID": "pml_id",
+    "Voucher No": "voucher_no",
+    "Account With": "account_with",
+    "STATUS": "status",
+    "Product": "product",
+    "CBY": "cby",
+    "CBM": "cbm",
+}
+
+# Agregat (materialized) per Account With x COB x Curr x Biz Type x STATUS per log & periode
+AGG_DIMENSIONS = {
+    "Account With": "account_with",
+    "COB": "cob",
+    "Curr": "curr",
+    "Biz Type": "biz_type",
+    "STATUS": "status",
+}
+
+AGG_MEASURES = {
+    "Total Contribution": "contribution",
+    "Total Commission": "commission",
+    "Tabarru": "tabarru",
+    "Ujrah": "ujrah",
+    "Claim": "claim",
+    "Balance": "balance",
+    "Kontribusi (IDR)": "contribution_idr",
+    "Total Commission (IDR)": "commission_idr",
+    "Tabarru (IDR)": "tabarru_idr",
+    "Ujrah (IDR)": "ujrah_idr",
+    "Claim (IDR)": "claim_idr",
+    "Balance (IDR)": "balance_idr",
+}
+
+_AGG_KEY_FIELDS = ["kind", "year", "month"] + list(AGG_DIMENSIONS.values())
+_AGG_VALUE_FIELDS = ["row_count"] + list(AGG_MEASURES.values())
+
+_DB_LOCK = threading.Lock()
+
+
+# ==========================
+# DATABASE
+# ==========================
+@contextmanager
+def _connect():
+    conn = sqlite3.connect(REPLICA_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def init_log_replica():
+    """Buat database replika. Dipanggil sekali dari entry point app (bukan saat import)."""
+    os.makedirs(os.path.dirname(REPLICA_DB_PATH) or ".", exist_ok=True)
+
+    with _DB_LOCK, _connect() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS log_sources (
+                spreadsheet_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                version TEXT,
+                row_count INTEGER DEFAULT 0,
+                synced_at REAL
+            )
+            """
+        )
+
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS log_rows (
+                spreadsheet_id TEXT NOT NULL,
+                row_no INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                pml_id TEXT,
+                voucher_no TEXT,
+                account_with TEXT,
+                status TEXT,
+                product TEXT,
+                cby INTEGER,
+                cbm INTEGER,
+                data TEXT NOT NULL,
+                PRIMARY KEY (spreadsheet_id, row_no)
+            )
+            """
+        )
+
+        # Dimensi kosong disimpan sebagai '' (NULL tidak unik di PRIMARY KEY)
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS aggregates (
+                kind TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                {", ".join(f"{d} TEXT NOT NULL DEFAULT ''" for d in AGG_DIMENSIONS.values())},
+                row_count INTEGER NOT NULL DEFAULT 0,
+                {", ".join(f"{m} REAL NOT NULL DEFAULT 0" for m in AGG_MEASURES.values())},
+                PRIMARY KEY ({", ".join(_AGG_KEY_FIELDS)})
+            )
+            """
+        )
+
+        for name, columns in {
+            "idx_rows_pml": "pml_id",
+            "idx_rows_voucher": "voucher_no",
+            "idx_rows_account": "account_with, status",
+            "idx_rows_status": "status, kind, year, month",
+            "idx_rows_period": "kind, year, month",
+        }.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON log_rows ({columns})")
+
+        # Replika lama (sebelum ada tabel agregat) -> bangun dari baris yang ada
+        if conn.execute("SELECT COUNT(*) FROM aggregates").fetchone()[0] == 0:
+            _apply_deltas(conn, _compute_aggregates(conn))
+
+
+def _frame_payloads(log_df):
+    """Satu string JSON per baris (tanggal sebagai teks, kosong sebagai null)."""
+    df = log_df.copy()
+    df.columns = [str(c) for c in df.columns]
+
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+
+    df = df.astype(object).where(df.notna(), None)
+
+    return [json.dumps(row, default=str) for row in df.to_dict("records")]
+
+
+def _indexed_value(column, value):
+    if value is None:
+        return None
+
+    if column in ("cby", "cbm"):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    return str(value).strip()
+
+
+def _row_params(spreadsheet_id, row_no, kind, year, month, payload):
+    row = json.loads(payload)
+
+    return (
+        spreadsheet_id, row_no, kind, int(year), int(month),
+        *(_indexed_value(field, row.get(column)) for column, field in INDEXED_COLUMNS.items()),
+        payload
+    )
+
+
+# ==========================
+# AGREGAT
+# ==========================
+def _measure(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if value != value else value
+
+
+def _add_to_deltas(deltas, kind, year, month, payload, sign):
+    row = json.loads(payload) if isinstance(payload, str) else payload
+
+    key = (kind, int(year), int(month)) + tuple(
+        "" if row.get(column) is None else str(row.get(column)).strip()
+        for column in AGG_DIMENSIONS
+    )
+
+    values = deltas.setdefault(key, [0] + [0.0] * len(AGG_MEASURES))
+    values[0] += sign
+
+    for i, column in enumerate(AGG_MEASURES, start=1):
+        values[i] += sign * _measure(row.get(column))
+
+
+def _apply_deltas(conn, deltas):
+    if not deltas:
+        return
+
+    columns = _AGG_KEY_FIELDS + _AGG_VALUE_FIELDS
+
+    conn.executemany(
+        f"""
+        INSERT INTO aggregates ({", ".join(columns)})
+        VALUES ({", ".join("?" for _ in columns)})
+        ON CONFLICT ({", ".join(_AGG_KEY_FIELDS)}) DO UPDATE SET
+        {", ".join(f"{c} = {c} + excluded.{c}" for c in _AGG_VALUE_FIELDS)}
+        """,
+        [key + tuple(values) for key, values in deltas.items()]
+    )
+
+    conn.execute("DELETE FROM aggregates WHERE row_count <= 0")
+
+
+def _compute_aggregates(conn):
+    deltas = {}
+
+    for row in conn.execute("SELECT kind, year, month, data FROM log_rows"):
+        _add_to_deltas(deltas, row["kind"], row["year"], row["month"], row["data"], 1)
+
+    return deltas
+
+
+def rebuild_aggregates():
+    """Hitung ulang seluruh agregat dari baris replika. Return jumlah grup."""
+    with _DB_LOCK, _connect() as conn:
+        deltas = _compute_aggregates(conn)
+
+        conn.execute("DELETE FROM aggregates")
+        _apply_deltas(conn, deltas)
+
+    logger.info("Agregat dibangun ulang: %d grup", len(deltas))
+
+    return len(deltas)
+
+
+def verify_aggregates(tolerance=0.01):
+    """
+    Bandingkan agregat tersimpan dengan hasil hitung ulang dari nol.
+    Return list key grup yang berbeda (kosong = konsisten).
+    """
+    with _connect() as conn:
+        expected = {k: v for k, v in _compute_aggregates(conn).items() if v[0] > 0}
+        stored = {
+            tuple(r[c] for c in _AGG_KEY_FIELDS): [r[c] for c in _AGG_VALUE_FIELDS]
+            for r in conn.execute("SELECT * FROM aggregates")
+        }
+
+    mismatched = []
+
+    for key in set(expected) | set(stored):
+        a, b = expected.get(key), stored.get(key)
+
+        if a is None or b is None or any(abs(x - y) > tolerance for x, y in zip(a, b)):
+            mismatched.append(key)
+
+    return mismatched
+
+
+def aggregate_summary(kind=None, year=None, month=None, status=None,
+                      group_by=("account_with", "cob", "curr", "biz_type")) -> pd.DataFrame:
+    """Total per grup dari tabel agregat (tanpa scan baris log)."""
+    group_by = [g for g in group_by if g in AGG_DIMENSIONS.values() or g in ("year", "month")]
+
+    clauses, params = [], []
+
+    for field, value in (("kind", kind), ("year", year), ("month", month), ("status", status)):
+        if value is None:
+            continue
+
+        if isinstance(value, (list, tuple, set)):
+            value = list(value)
+            clauses.append(f"{field} IN ({', '.join('?' for _ in value)})")
+            params.extend(value)
+        else:
+            clauses.append(f"{field} = ?")
+            params.append(value)
+
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    select = ", ".join(group_by + [f"SUM({c}) AS {c}" for c in _AGG_VALUE_FIELDS])
+    group = f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}" if group_by else ""
+
+    with _connect() as conn:
+        rows = conn.execute(f"SELECT {select} FROM aggregates{where}{group}", params).fetchall()
+
+    labels = {v: k for k, v in {**AGG_DIMENSIONS, **AGG_MEASURES}.items()}
+    labels.update({"row_count": "Jumlah Baris", "year": "Tahun", "month": "Bulan"})
+
+    df = pd.DataFrame([dict(r) for r in rows], columns=group_by + _AGG_VALUE_FIELDS)
+
+    return df.rename(columns=labels)
+
+
+# ==========================
+# SYNC
+# ==========================
+def replica_version(spreadsheet_id):
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT version FROM log_sources WHERE spreadsheet_id = ?",
+            (str(spreadsheet_id),)
+        ).fetchone()
+
+    return row["version"] if row else None
+
+
+def replica_sync(spreadsheet_id, kind, year, month, log_df, version=None):
+    """
+    Sinkronkan satu log ke replika. Dilewati jika version Drive sama;
+    selain itu hanya baris yang isinya berubah / baru yang ditulis.
+    Return jumlah baris yang ditulis.
+    """
+    spreadsheet_id = str(spreadsheet_id)
+
+    if version is not None and replica_version(spreadsheet_id) == str(version):
+        return 0
+
+    payloads = _frame_payloads(log_df)
+
+    with _DB_LOCK, _connect() as conn:
+        existing = dict(conn.execute(
+            "SELECT row_no, data FROM log_rows WHERE spreadsheet_id = ?",
+            (spreadsheet_id,)
+        ).fetchall())
+
+        changed = [
+            (row_no, payload)
+            for row_no, payload in enumerate(payloads)
+            if existing.get(row_no) != payload
+        ]
+
+        # Agregat: kurangi versi lama, tambah versi baru. Baris provisional
+        # (row_no < 0, dari append_gsheet) sudah ikut di log_df via ledger.
+        deltas = {}
+        previous = _source_period(conn, spreadsheet_id)
+
+        for row_no, old_payload in existing.items():
+            if row_no < 0 or row_no >= len(payloads) or existing.get(row_no) != payloads[row_no]:
+                _add_to_deltas(deltas, *(previous or (kind, year, month)), old_payload, -1)
+
+        for row_no, payload in changed:
+            _add_to_deltas(deltas, kind, year, month, payload, 1)
+
+        _apply_deltas(conn, deltas)
+
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO log_rows (
+                spreadsheet_id, row_no, kind, year, month,
+                pml_id, voucher_no, account_with, status, product, cby, cbm, data
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                _row_params(spreadsheet_id, row_no, kind, year, month, payload)
+                for row_no, payload in changed
+            ]
+        )
+
+        # Baris yang sudah tidak ada di sheet + baris provisional
+        conn.execute(
+            "DELETE FROM log_rows WHERE spreadsheet_id = ? AND (row_no >= ? OR row_no < 0)",
+            (spreadsheet_id, len(payloads))
+        )
+
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO log_sources
+                (spreadsheet_id, kind, year, month, version, row_count, synced_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (spreadsheet_id, kind, int(year), int(month),
+             None if version is None else str(version), len(payloads), time.time())
+        )
+
+    if changed:
+        logger.info("Replika %s %s-%02d: %d baris diperbarui", kind, year, int(month), len(changed))
+
+    return len(changed)
+
+
+def _source_period(conn, spreadsheet_id):
+    row = conn.execute(
+        "SELECT kind, year, month FROM log_sources WHERE spreadsheet_id = ?",
+        (spreadsheet_id,)
+    ).fetchone()
+
+    return (row["kind"], row["year"], row["month"]) if row else None
+
+
+def replica_append(spreadsheet_id, row, provisional_id):
+    """
+    Catat baris yang baru di-append (sebelum terlihat di Sheets) sebagai baris
+    provisional, supaya agregat langsung ikut berubah. Diganti baris asli pada
+    replica_sync berikutnya. Log yang belum pernah di-sync dilewati.
+    """
+    spreadsheet_id = str(spreadsheet_id)
+    payload = json.dumps(row, default=str)
+
+    with _DB_LOCK, _connect() as conn:
+        source = _source_period(conn, spreadsheet_id)
+
+        if source is None:
+            return False
+
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO log_rows (
+                spreadsheet_id, row_no, kind, year, month,
+                pml_id, voucher_no, account_with, status, product, cby, cbm, data
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            _row_params(spreadsheet_id, -int(provisional_id), *source, payload)
+        )
+
+        deltas = {}
+        _add_to_deltas(deltas, *source, payload, 1)
+        _apply_deltas(conn, deltas)
+
+    return True
+
+
+def replica_update_status(spreadsheet_id, pml_ids, status):
+    """Terapkan perubahan STATUS (compare-and-set yang berhasil) ke replika & agregat."""
+    pml_ids = [str(p) for p in pml_ids]
+
+    if not pml_ids:
+        return 0
+
+    with _DB_LOCK, _connect() as conn:
+        rows = conn.execute(
+            f"SELECT row_no, kind, year, month, data FROM log_rows "
+            f"WHERE spreadsheet_id = ? AND pml_id IN ({', '.join('?' for _ in pml_ids)})",
+            (str(spreadsheet_id), *pml_ids)
+        ).fetchall()
+
+        deltas = {}
+        updates = []
+
+        for r in rows:
+            data = json.loads(r["data"])
+            _add_to_deltas(deltas, r["kind"], r["year"], r["month"], data, -1)
+
+            data["STATUS"] = status
+            _add_to_deltas(deltas, r["kind"], r["year"], r["month"], data, 1)
+
+            updates.append((status, json.dumps(data, default=str), str(spreadsheet_id), r["row_no"]))
+
+        conn.executemany(
+            "UPDATE log_rows SET status = ?, data = ? WHERE spreadsheet_id = ? AND row_no = ?",
+            updates
+        )
+
+        _apply_deltas(conn, deltas)
+
+    return len(updates)
+
+
+def replica_sync_logs(log_ids, frames, versions, year, month):
+    """Sync beberapa log sekaligus (hasil drive_utils.load_logs, kind = kind replika)."""
+    for kind, spreadsheet_id in log_ids.items():
+        if spreadsheet_id:
+            replica_sync(spreadsheet_id, kind, year, month, frames[kind], versions.get(kind))
+
+
+# ==========================
+# QUERY
+# ==========================
+def _where(kind=None, year=None, month=None, status=None, account_with=None,
+           product=None, cby=None, cbm=None, pml_id=None, voucher_no=None):
+    clauses, params = [], []
+
+    def add(clause, value):
+        if isinstance(value, (list, tuple, set)):
+            value = list(value)
+            clauses.append(f"{clause} IN ({', '.join('?' for _ in value)})")
+            params.extend(value)
+        else:
+            clauses.append(f"{clause} = ?")
+            params.append(value)
+
+    for clause, value in (
+        ("kind", kind), ("year", year), ("month", month), ("status", status),
+        ("account_with", account_with), ("cby", cby), ("cbm", cbm),
+        ("voucher_no", voucher_no)
+    ):
+        if value is not None:
+            add(clause, value)
+
+    # Product & PML ID: pencarian teks sebagian (LIKE tidak case-sensitive)
+    if product:
+        clauses.append("product LIKE ?")
+        params.append(f"%{product}%")
+
+    if pml_id:
+        clauses.append("pml_id LIKE ?")
+        params.append(f"%{pml_id}%")
+
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def replica_query(limit=None, **filters) -> pd.DataFrame:
+    """
+    Baris log dari replika sesuai filter (kind, year, month, status,
+    account_with, product, cby, cbm, pml_id, voucher_no), bertipe log schema.
+    Nilai filter berupa list berarti IN (...).
+    """
+    where, params = _where(**filters)
+    query = f"SELECT year, month, kind, data FROM log_rows{where} ORDER BY year, month, kind, row_no"
+
+    if limit:
+        query += f" LIMIT {int(limit)}"
+
+    with _connect() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    if not rows:
+        return pd.DataFrame()
+
+    df = apply_log_schema(pd.DataFrame([json.loads(r["data"]) for r in rows]))
+
+    df.insert(0, "Periode", [f"{r['year']}-{r['month']:02d}" for r in rows])
+    df.insert(1, "Log", [r["kind"] for r in rows])
+
+    return df
+
+
+def replica_pml_ids(**filters) -> set:
+    """Set PML ID yang lolos filter (dipakai untuk memfilter snapshot di UI)."""
+    where, params = _where(**filters)
+
+    with _connect() as conn:
+        rows = conn.execute(f"SELECT DISTINCT pml_id FROM log_rows{where}", params).fetchall()
+
+    return {r["pml_id"] for r in rows if r["pml_id"] is not None}
+
+
+def replica_distinct(field, **filters) -> list:
+    """Nilai unik satu kolom terindeks (mis. account_with) untuk pilihan filter."""
+    if field not in INDEXED_COLUMNS.values():
+        raise ValueError(f"Kolom replika tidak dikenal: {field}")
+
+    where, params = _where(**filters)
+
+    with _connect() as conn:
+        rows = conn.execute(
+            f"SELECT DISTINCT {field} FROM log_rows{where} ORDER BY {field}",
+            params
+        ).fetchall()
+
+    return [r[field] for r in rows if r[field] is not None]
+
+
+def replica_periods():
+    """Periode yang sudah ada di replika: list (year, month, kind, row_count, synced_at)."""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT year, month, kind, row_count, synced_at FROM log_sources ORDER BY year, month, kind"
+        ).fetchall()
+
+    return [tuple(r) for r in rows]
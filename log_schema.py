@@ -0,0 +1,198 @@
+import logging
+import re
+
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================
+# LAYOUT LOG
+# ==========================
+LOG_COLUMNS = [
+    "Seq No", "Department", "Biz Type", "Voucher No",
+    "Account With", "Cedant Company", "PIC",
+    "Product", "CBY", "CBM", "OBY", "OBM",
+    "KOB", "COB", "MOP", "Curr",
+    "Total Contribution", "Commission", "Overriding",
+    "Total Commission", "Gross Premium Income",
+    "Tabarru", "Ujrah", "Claim", "Balance", "Check Balance",
+    "Rate Exchange",
+    "Kontribusi (IDR)", "Commission (IDR)", "Overiding (IDR)",
+    "Total Commission (IDR)", "Gross Premium Income (IDR)",
+    "Tabarru (IDR)", "Ujrah (IDR)", "Claim (IDR)",
+    "Balance (IDR)", "Check Balance (IDR)",
+    "REMARKS", "PML ID", "STATUS", "CREATED AT", "CREATED BY",
+    "Due Date", "Subject Email", "Email Date",
+    "CANCELED AT", "CANCELED BY", "CANCEL OF VOUCHER", "CANCEL REASON"
+]
+
+LOG_COLUMNS_OUTWARD = [
+    "Seq No", "Department", "Biz Type", "Retro Type", "Inward VIN Ref",
+    "Voucher No", "Account With", "Cedant Company", "PIC",
+    "Product", "CBY", "CBM", "OBY", "OBM",
+    "KOB", "COB", "MOP", "Curr",
+    "Total Contribution", "Commission", "Overiding",
+    "Total Commission", "Gross Premium Income",
+    "Tabarru", "Ujrah", "Ujrah Spc", "Claim", "Balance", "Check Balance",
+    "Rate Exchange",
+    "Kontribusi (IDR)", "Commission (IDR)", "Overiding (IDR)",
+    "Total Commission (IDR)", "Gross Premium Income (IDR)",
+    "Tabarru (IDR)", "Ujrah (IDR)", "Ujrah Spc (IDR)", "Claim (IDR)",
+    "Balance (IDR)", "Check Balance (IDR)",
+    "REMARKS", "PML ID", "STATUS", "CREATED AT", "CREATED BY",
+    "Due Date",
+    "CANCELED AT", "CANCELED BY", "CANCEL OF VOUCHER", "CANCEL REASON"
+]
+
+# Log PML (inward & outward memakai layout yang sama)
+LOG_PML_COLUMNS = [
+    "Seq No", "Department", "Biz Type", "PML ID",
+    "Account With", "Cedant Company", "PIC",
+    "Product", "CBY", "CBM", "Curr",
+    "Total Contribution", "Commission", "Overriding",
+    "Total Commission", "Gross Premium Income",
+    "Tabarru", "Ujrah", "Claim", "Balance",
+    "REMARKS", "STATUS", "CREATED AT", "CREATED BY",
+    "Subject Email", "Email Date",
+    "CANCELED AT", "CANCELED BY", "CANCEL OF VOUCHER", "CANCEL REASON",
+    "ROW VERSION"
+]
+
+# Versi baris untuk compare-and-set status PML ("<n>-<token>")
+ROW_VERSION_COLUMN = "ROW VERSION"
+
+# Kunci unik baris ledger; ditambahkan replikator ke header log (tersembunyi)
+LEDGER_KEY_COLUMN = "LEDGER KEY"
+
+
+# ==========================
+# TIPE KOLOM
+# ==========================
+LOG_MONEY_COLUMNS = [
+    "Total Contribution", "Commission", "Overriding", "Overiding",
+    "Total Commission", "Gross Premium Income",
+    "Tabarru", "Ujrah", "Ujrah Spc", "Claim", "Balance", "Check Balance",
+    "Rate Exchange",
+    "Kontribusi (IDR)", "Commission (IDR)", "Overiding (IDR)",
+    "Total Commission (IDR)", "Gross Premium Income (IDR)",
+    "Tabarru (IDR)", "Ujrah (IDR)", "Ujrah Spc (IDR)", "Claim (IDR)",
+    "Balance (IDR)", "Check Balance (IDR)"
+]
+
+LOG_INTEGER_COLUMNS = ["Seq No", "CBY", "CBM", "OBY", "OBM"]
+
+LOG_DATE_COLUMNS = ["CREATED AT", "Due Date", "Email Date", "CANCELED AT"]
+
+LOG_CATEGORY_COLUMNS = ["STATUS", "Department", "Biz Type"]
+
+
+def _build_log_schema():
+    schema = {}
+
+    for col in LOG_COLUMNS + LOG_COLUMNS_OUTWARD + LOG_PML_COLUMNS:
+        if col in LOG_MONEY_COLUMNS:
+            schema[col] = "float64"
+        elif col in LOG_INTEGER_COLUMNS:
+            schema[col] = "Int64"
+        elif col in LOG_DATE_COLUMNS:
+            schema[col] = "datetime64[ns]"
+        elif col in LOG_CATEGORY_COLUMNS:
+            schema[col] = "category"
+        else:
+            schema[col] = "object"
+
+    return schema
+
+
+LOG_SCHEMA = _build_log_schema()
+
+# Google Sheets menyimpan tanggal sebagai jumlah hari sejak 30 Des 1899
+SHEETS_EPOCH = pd.Timestamp("1899-12-30")
+
+
+def _sheets_to_datetime(series: pd.Series) -> pd.Series:
+    numeric = pd.to_numeric(series, errors="coerce")
+
+    converted = pd.to_datetime(numeric, unit="D", origin=SHEETS_EPOCH).dt.round("s")
+
+    # Sel yang tersimpan sebagai teks (bukan serial date)
+    text_mask = numeric.isna() & series.notna() & (series.astype(str).str.strip() != "")
+    if text_mask.any():
+        parsed = pd.to_datetime(
+            series[text_mask].astype(str).str.strip(),
+            errors="coerce",
+            format="mixed"
+        )
+        converted = converted.where(~text_mask, parsed)
+
+    return converted
+
+
+def _clean_number(x):
+    """
+    Angka yang tersimpan sebagai teks di sheet: "1,234.56", "1.234,56",
+    "(1,234.56)" (akuntansi = negatif), "Rp 1,000".
+    """
+    x = str(x).strip()
+
+    negative = x.startswith("(") and x.endswith(")")
+    if negative:
+        x = x[1:-1].strip()
+
+    # Buang simbol mata uang / karakter selain digit, koma, titik, minus
+    x = re.sub(r"[^\d,.\-]", "", x)
+
+    # Titik & koma sekaligus: yang terakhir adalah desimal
+    if "." in x and "," in x and x.rfind(",") > x.rfind("."):
+        x = x.replace(".", "").replace(",", ".")
+    else:
+        x = x.replace(",", "")
+
+    result = pd.to_numeric(x, errors="coerce")
+
+    if negative and pd.notna(result):
+        result = -abs(result)
+
+    return result
+
+
+def _to_money(series: pd.Series, col) -> pd.Series:
+    numeric = pd.to_numeric(series, errors="coerce")
+
+    # Sel teks (bukan angka) dibersihkan dulu, bukan langsung jadi NaN
+    text_mask = numeric.isna() & series.notna() & (series.astype(str).str.strip() != "")
+    if text_mask.any():
+        numeric = numeric.where(~text_mask, series[text_mask].map(_clean_number))
+
+        unparsed = int(numeric[text_mask].isna().sum())
+        logger.warning(
+            "Kolom %s: %d sel teks dikonversi ke angka, %d gagal (jadi kosong)",
+            col, int(text_mask.sum()) - unparsed, unparsed
+        )
+
+    return numeric.astype("float64")
+
+
+def apply_log_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast hasil baca log (UNFORMATTED_VALUE + SERIAL_NUMBER) ke LOG_SCHEMA.
+    Kolom yang tidak dikenal dibiarkan apa adanya.
+    """
+    for col in df.columns:
+        dtype = LOG_SCHEMA.get(col)
+
+        if dtype == "float64":
+            df[col] = _to_money(df[col], col)
+
+        elif dtype == "Int64":
+            df[col] = pd.to_numeric(df[col], errors="coerce").round().astype("Int64")
+
+        elif dtype == "datetime64[ns]":
+            df[col] = _sheets_to_datetime(df[col])
+
+        elif dtype == "category":
+            df[col] = df[col].replace("", None).astype("category")
+
+    return df
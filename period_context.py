@@ -0,0 +1,359 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+
+from drive_utils import get_drive_service, init_sheets_service, get_or_create_folder, find_drive_file, load_logs
+from vin_generator import get_log_filename, get_log_pml_filename
+from log_replica import replica_sync, KIND_PML, KIND_PML_OUTWARD, KIND_VOUCHER, KIND_VOUCHER_OUTWARD
+from log_schema import LOG_CATEGORY_COLUMNS
+
+
+logger = logging.getLogger(__name__)
+
+SPREADSHEET_MIME = "application/vnd.google-apps.spreadsheet"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+PML_FOLDER_NAME = "Folder PML"
+PML_OUTWARD_FOLDER_NAME = "Folder PML (Outward)"
+OUTWARD_FOLDER_NAME = "OUTWARD"
+
+# Nama file lock per resource yang ditulis (semua disimpan di folder periode)
+PML_LOG_LOCK = "log_pml.lock"
+PML_LOG_OUTWARD_LOCK = "log_pml_outward.lock"
+VOUCHER_LOG_LOCK = "log_voucher.lock"
+VOUCHER_LOG_OUTWARD_LOCK = "log_voucher_outward.lock"
+
+
+# ==========================
+# PERIOD CONTEXT
+# ==========================
+class PeriodContext:
+    """
+    Semua ID Drive untuk satu periode (folder periode, folder PML, log,
+    folder ceding) beserta client Drive/Sheets. Setiap ID di-resolve sekali
+    lalu disimpan, sehingga handler tombol tidak perlu discovery ulang.
+    """
+
+    def __init__(self, year, month, root_folder_id, creds):
+        self.year = int(year)
+        self.month = int(month)
+        self.root_folder_id = root_folder_id
+
+        self._creds = creds
+        self._drive = None
+        self._sheets = None
+
+        self._folders = {}
+        self._files = {}
+
+    # ==========================
+    # CLIENT
+    # ==========================
+    @property
+    def drive(self):
+        if self._drive is None:
+            self._drive = get_drive_service()
+        return self._drive
+
+    @property
+    def sheets(self):
+        if self._sheets is None:
+            self._sheets = init_sheets_service(self._creds)
+        return self._sheets
+
+    # ==========================
+    # RESOLVER (MEMO)
+    # ==========================
+    def folder(self, folder_name, parent_id):
+        key = (folder_name, parent_id)
+
+        if key not in self._folders:
+            self._folders[key] = get_or_create_folder(
+                self.drive,
+                folder_name=folder_name,
+                parent_id=parent_id
+            )
+
+        return self._folders[key]
+
+    def find_drive_file(self, service, filename, parent_id, mime_type=None):
+        # Signature sama dengan drive_utils.find_drive_file supaya bisa
+        # dipakai sebagai parameter find_drive_file di generate_*_from_drive.
+        key = (filename, parent_id, mime_type)
+
+        if key not in self._files:
+            file_id = find_drive_file(
+                service=service or self.drive,
+                filename=filename,
+                parent_id=parent_id,
+                mime_type=mime_type
+            )
+
+            # File yang belum ada tidak di-cache (bisa dibuat user lain)
+            if not file_id:
+                return None
+
+            self._files[key] = file_id
+
+        return self._files[key]
+
+    def remember_file(self, filename, parent_id, file_id, mime_type=SPREADSHEET_MIME):
+        self._files[(filename, parent_id, mime_type)] = file_id
+
+    def forget_file(self, filename, parent_id, mime_type=None):
+        self._files.pop((filename, parent_id, mime_type), None)
+
+    # ==========================
+    # FOLDER
+    # ==========================
+    @property
+    def period_id(self):
+        return self.folder(f"{self.year}_{self.month:02d}", self.root_folder_id)
+
+    @property
+    def pml_folder_id(self):
+        return self.folder(PML_FOLDER_NAME, self.period_id)
+
+    @property
+    def pml_outward_folder_id(self):
+        return self.folder(PML_OUTWARD_FOLDER_NAME, self.period_id)
+
+    @property
+    def outward_id(self):
+        return self.folder(OUTWARD_FOLDER_NAME, self.period_id)
+
+    def ceding_folder_id(self, ceding_name, outward=False):
+        parent_id = self.outward_id if outward else self.period_id
+        return self.folder(ceding_name, parent_id)
+
+    # ==========================
+    # LOG
+    # ==========================
+    @property
+    def pml_log_name(self):
+        return get_log_pml_filename(self.year, self.month)
+
+    @property
+    def pml_log_outward_name(self):
+        return f"{self.pml_log_name} (Outward)"
+
+    @property
+    def voucher_log_name(self):
+        return get_log_filename(self.year, self.month)
+
+    @property
+    def voucher_log_outward_name(self):
+        return f"{self.voucher_log_name} (Outward)"
+
+    @property
+    def pml_log_id(self):
+        return self.find_drive_file(self.drive, self.pml_log_name, self.pml_folder_id, SPREADSHEET_MIME)
+
+    @property
+    def pml_log_outward_id(self):
+        return self.find_drive_file(self.drive, self.pml_log_outward_name, self.pml_outward_folder_id, SPREADSHEET_MIME)
+
+    @property
+    def voucher_log_id(self):
+        return self.find_drive_file(self.drive, self.voucher_log_name, self.period_id, SPREADSHEET_MIME)
+
+    @property
+    def voucher_log_outward_id(self):
+        return self.find_drive_file(self.drive, self.voucher_log_outward_name, self.outward_id, SPREADSHEET_MIME)
+
+    # ==========================
+    # LOCK (PER RESOURCE)
+    # ==========================
+    # (parent_id, lock_name) untuk acquire_drive_locks
+    @property
+    def pml_log_lock(self):
+        return (self.period_id, PML_LOG_LOCK)
+
+    @property
+    def pml_log_outward_lock(self):
+        return (self.period_id, PML_LOG_OUTWARD_LOCK)
+
+    @property
+    def voucher_log_lock(self):
+        return (self.period_id, VOUCHER_LOG_LOCK)
+
+    @property
+    def voucher_log_outward_lock(self):
+        return (self.period_id, VOUCHER_LOG_OUTWARD_LOCK)
+
+
+def get_period_context(creds, root_folder_id) -> PeriodContext:
+    """
+    Ambil PeriodContext untuk periode aktif (st.session_state["log_period"]).
+    Dibuat ulang hanya jika periode berubah.
+    """
+    period = st.session_state["log_period"]
+    year, month = int(period["year"]), int(period["month"])
+
+    ctx = st.session_state.get("period_context")
+
+    if ctx is None or (ctx.year, ctx.month, ctx.root_folder_id) != (year, month, root_folder_id):
+        ctx = PeriodContext(year, month, root_folder_id, creds)
+        st.session_state["period_context"] = ctx
+
+    return ctx
+
+
+# ==========================
+# MULTI PERIODE
+# ==========================
+PERIOD_LOADER_WORKERS = 6
+
+# (root_folder_id, year, month) -> {kind: spreadsheet_id}, bersama untuk semua session.
+# Hanya log yang ditemukan yang di-cache (log yang belum ada bisa dibuat kemudian).
+_PERIOD_LOG_IDS = {}
+_PERIOD_LOG_IDS_LOCK = threading.Lock()
+
+
+def iter_periods(start, end):
+    """(year, month) dari start sampai end (inklusif)."""
+    year, month = int(start[0]), int(start[1])
+
+    while (year, month) <= (int(end[0]), int(end[1])):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _list_children(drive_service, parent_ids):
+    query = " or ".join(f"'{p}' in parents" for p in parent_ids)
+
+    files, page_token = [], None
+
+    while True:
+        result = drive_service.files().list(
+            q=f"({query}) and trashed=false",
+            spaces="drive",
+            fields="nextPageToken, files(id, name, mimeType, parents)",
+            pageSize=1000,
+            pageToken=page_token,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True,
+        ).execute()
+
+        files.extend(result.get("files", []))
+        page_token = result.get("nextPageToken")
+
+        if not page_token:
+            return files
+
+
+def _resolve_period_log_ids(drive_service, root_folder_id, year, month):
+    """
+    Cari ID semua log satu periode tanpa membuat folder baru
+    (3 request files.list: folder periode, isi periode, isi subfolder).
+    """
+    period_id = find_drive_file(drive_service, f"{year}_{month:02d}", root_folder_id, FOLDER_MIME)
+
+    if not period_id:
+        return {}
+
+    found = {}
+
+    def index(files):
+        for f in files:
+            for parent in f.get("parents", []):
+                found.setdefault((f["name"], parent, f["mimeType"]), f["id"])
+
+    index(_list_children(drive_service, [period_id]))
+
+    folders = {
+        name: found.get((name, period_id, FOLDER_MIME))
+        for name in (PML_FOLDER_NAME, PML_OUTWARD_FOLDER_NAME, OUTWARD_FOLDER_NAME)
+    }
+
+    if any(folders.values()):
+        index(_list_children(drive_service, [f for f in folders.values() if f]))
+
+    pml_log_name = get_log_pml_filename(year, month)
+    voucher_log_name = get_log_filename(year, month)
+
+    locations = {
+        KIND_PML: (pml_log_name, folders[PML_FOLDER_NAME]),
+        KIND_PML_OUTWARD: (f"{pml_log_name} (Outward)", folders[PML_OUTWARD_FOLDER_NAME]),
+        KIND_VOUCHER: (voucher_log_name, period_id),
+        KIND_VOUCHER_OUTWARD: (f"{voucher_log_name} (Outward)", folders[OUTWARD_FOLDER_NAME]),
+    }
+
+    return {
+        kind: found[(name, parent, SPREADSHEET_MIME)]
+        for kind, (name, parent) in locations.items()
+        if parent and (name, parent, SPREADSHEET_MIME) in found
+    }
+
+
+def _period_log_id(root_folder_id, year, month, kind):
+    key = (root_folder_id, year, month)
+
+    with _PERIOD_LOG_IDS_LOCK:
+        cached = _PERIOD_LOG_IDS.get(key, {})
+
+    if kind not in cached:
+        # Client per thread (httplib2 tidak thread-safe)
+        cached = _resolve_period_log_ids(get_drive_service(), root_folder_id, year, month)
+
+        with _PERIOD_LOG_IDS_LOCK:
+            _PERIOD_LOG_IDS[key] = cached
+
+    return cached.get(kind)
+
+
+def load_period_logs(creds, root_folder_id, start, end, kind=KIND_PML, max_workers=PERIOD_LOADER_WORKERS):
+    """
+    Muat satu jenis log untuk rentang periode (mis. year-to-date / kuartal).
+    ID folder & log di-resolve dari cache, semua log dibaca paralel, dan
+    hasilnya digabung menjadi satu frame bertipe dengan kolom "Periode".
+    Setiap log yang dimuat ikut di-sync ke replika lokal.
+    """
+    periods = list(iter_periods(start, end))
+
+    if not periods:
+        return pd.DataFrame()
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(periods))) as pool:
+        resolved = pool.map(lambda p: _period_log_id(root_folder_id, p[0], p[1], kind), periods)
+        log_ids = {p: sid for p, sid in zip(periods, resolved) if sid}
+
+    if not log_ids:
+        return pd.DataFrame()
+
+    frames, versions = load_logs(
+        get_drive_service(),
+        init_sheets_service(creds),
+        log_ids,
+        max_workers=max_workers
+    )
+
+    tagged = []
+
+    for (year, month), spreadsheet_id in log_ids.items():
+        df = frames[(year, month)]
+
+        replica_sync(spreadsheet_id, kind, year, month, df, versions[(year, month)])
+
+        if df.empty:
+            continue
+
+        df.insert(0, "Periode", f"{year}-{month:02d}")
+        tagged.append(df)
+
+    if not tagged:
+        return pd.DataFrame()
+
+    combined = pd.concat(tagged, ignore_index=True)
+
+    # Kategori per periode berbeda -> concat menjadi object, samakan lagi
+    for col in LOG_CATEGORY_COLUMNS:
+        if col in combined.columns:
+            combined[col] = combined[col].astype("category")
+
+    logger.info("%s: %d periode dimuat (%d baris)", kind, len(log_ids), len(combined))
+
+    return combined
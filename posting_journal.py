@@ -0,0 +1,268 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ==========================
+# KONFIGURASI
+# ==========================
+JOURNAL_DB_PATH = os.getenv("JOURNAL_DB_PATH", os.path.join(os.getenv("APP_DATA_DIR", "data"), "posting_journal.sqlite3"))
+
+KIND_CEDING = "CEDING"
+KIND_SPLIT = "SPLIT"
+
+# Langkah posting yang dicatat
+STEP_LOG = "log"
+STEP_FILE = "file"
+
+_DB_LOCK = threading.Lock()
+
+
+# ==========================
+# DATABASE
+# ==========================
+@contextmanager
+def _connect():
+    conn = sqlite3.connect(JOURNAL_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def init_posting_journal():
+    """Buat database journal. Dipanggil sekali dari entry point app (bukan saat import)."""
+    os.makedirs(os.path.dirname(JOURNAL_DB_PATH) or ".", exist_ok=True)
+
+    with _DB_LOCK, _connect() as conn:
+        # Satu baris per idempotency key:
+        #   scope  = spreadsheet log tujuan
+        #   source = PML sumber
+        #   part   = "" untuk entry induk, nilai split untuk PML hasil split
+        #   target = voucher / PML hasil split yang dialokasikan
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS journal (
+                scope TEXT NOT NULL,
+                source TEXT NOT NULL,
+                part TEXT NOT NULL DEFAULT '',
+                kind TEXT NOT NULL,
+                target TEXT,
+                seq_no INTEGER,
+                steps TEXT DEFAULT '[]',
+                claim_version TEXT,
+                job_id TEXT,
+                done INTEGER DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (scope, source, part)
+            )
+            """
+        )
+
+
+def _row_to_entry(row):
+    entry = dict(row)
+    entry["steps"] = json.loads(entry["steps"] or "[]")
+    return entry
+
+
+def get_entry(scope, source, part=""):
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT * FROM journal WHERE scope = ? AND source = ? AND part = ?",
+            (str(scope), str(source), str(part))
+        ).fetchone()
+
+    return _row_to_entry(row) if row else None
+
+
+# ==========================
+# WRITE-AHEAD
+# ==========================
+def open_entries(scope, sources, kind, claim_versions=None, job_id=None):
+    """
+    Catat niat posting untuk PML yang baru di-claim (sebelum ada yang ditulis).
+    Entry yang belum selesai dipertahankan (resume), entry yang sudah
+    selesai dianggap posting baru sehingga langkah & target lamanya dihapus.
+    """
+    claim_versions = claim_versions or {}
+    now = time.time()
+
+    with _DB_LOCK, _connect() as conn:
+        for source in sources:
+            source = str(source)
+
+            row = conn.execute(
+                "SELECT done FROM journal WHERE scope = ? AND source = ? AND part = ''",
+                (str(scope), source)
+            ).fetchone()
+
+            if row is not None and row["done"]:
+                conn.execute(
+                    "DELETE FROM journal WHERE scope = ? AND source = ?",
+                    (str(scope), source)
+                )
+                row = None
+
+            if row is None:
+                conn.execute(
+                    "INSERT INTO journal (scope, source, part, kind, claim_version, job_id, updated_at) "
+                    "VALUES (?, ?, '', ?, ?, ?, ?)",
+                    (str(scope), source, kind, claim_versions.get(source), job_id, now)
+                )
+            else:
+                conn.execute(
+                    "UPDATE journal SET kind = ?, claim_version = ?, job_id = ?, updated_at = ? "
+                    "WHERE scope = ? AND source = ? AND part = ''",
+                    (kind, claim_versions.get(source), job_id, now, str(scope), source)
+                )
+
+
+def reserve(scope, source, part, kind, target, seq_no=None):
+    """Simpan target (voucher / PML) yang dialokasikan sebelum ditulis ke log."""
+    with _DB_LOCK, _connect() as conn:
+        conn.execute(
+            "INSERT INTO journal (scope, source, part, kind, target, seq_no, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (scope, source, part) DO UPDATE SET "
+            "target = excluded.target, seq_no = excluded.seq_no, steps = '[]', "
+            "updated_at = excluded.updated_at",
+            (str(scope), str(source), str(part), kind, str(target), seq_no, time.time())
+        )
+
+    return get_entry(scope, source, part)
+
+
+def release_target(scope, source, part=""):
+    """Lepas target yang belum sempat masuk log, supaya nomornya bisa dipakai lagi."""
+    with _DB_LOCK, _connect() as conn:
+        conn.execute(
+            "UPDATE journal SET target = NULL, seq_no = NULL, steps = '[]', updated_at = ? "
+            "WHERE scope = ? AND source = ? AND part = ?",
+            (time.time(), str(scope), str(source), str(part))
+        )
+
+
+def mark_step(scope, source, part, step):
+    with _DB_LOCK, _connect() as conn:
+        row = conn.execute(
+            "SELECT steps FROM journal WHERE scope = ? AND source = ? AND part = ?",
+            (str(scope), str(source), str(part))
+        ).fetchone()
+
+        if row is None:
+            return
+
+        steps = json.loads(row["steps"] or "[]")
+        if step not in steps:
+            steps.append(step)
+
+        conn.execute(
+            "UPDATE journal SET steps = ?, updated_at = ? "
+            "WHERE scope = ? AND source = ? AND part = ?",
+            (json.dumps(steps), time.time(), str(scope), str(source), str(part))
+        )
+
+
+def finish(scope, source, part=""):
+    with _DB_LOCK, _connect() as conn:
+        conn.execute(
+            "UPDATE journal SET done = 1, updated_at = ? "
+            "WHERE scope = ? AND source = ? AND part = ?",
+            (time.time(), str(scope), str(source), str(part))
+        )
+
+
+def discard(scope, source):
+    """Hapus seluruh entry PML (mis. setelah dikembalikan manual ke POSTED tanpa sisa tulisan)."""
+    with _DB_LOCK, _connect() as conn:
+        conn.execute(
+            "DELETE FROM journal WHERE scope = ? AND source = ?",
+            (str(scope), str(source))
+        )
+
+
+# ==========================
+# LANGKAH IDEMPOTEN
+# ==========================
+def resolve_target(scope, source, part, kind, allocate, in_log):
+    """
+    Ambil target untuk (source, part):
+      - target lama yang sudah tercatat di log dipakai lagi,
+      - target lama yang tidak ada di log dilepas,
+      - selain itu allocate() -> (target, seq_no) lalu dicatat dulu.
+    Entry hasil punya flag "reused" (True jika target berasal dari run sebelumnya).
+    """
+    entry = get_entry(scope, source, part)
+
+    if entry and entry["target"] and STEP_LOG not in entry["steps"]:
+        # Append mungkin sukses walaupun request-nya timeout -> cek log
+        if in_log(entry["target"]):
+            mark_step(scope, source, part, STEP_LOG)
+        else:
+            release_target(scope, source, part)
+
+        entry = get_entry(scope, source, part)
+
+    if entry and entry["target"]:
+        entry["reused"] = True
+        return entry
+
+    target, seq_no = allocate()
+
+    entry = reserve(scope, source, part, kind, target, seq_no)
+    entry["reused"] = False
+    return entry
+
+
+def run_step(entry, step, action, exists=None):
+    """
+    Jalankan action() sekali saja untuk langkah ini.
+    exists() (opsional) mengecek state Drive/Sheets untuk entry hasil resume.
+    Return True jika action dijalankan.
+    """
+    scope, source, part = entry["scope"], entry["source"], entry["part"]
+
+    if step in entry["steps"]:
+        return False
+
+    if exists is not None and entry.get("reused") and exists():
+        mark_step(scope, source, part, step)
+        entry["steps"].append(step)
+        return False
+
+    action()
+
+    mark_step(scope, source, part, step)
+    entry["steps"].append(step)
+    return True
+
+
+# ==========================
+# QUERY
+# ==========================
+def pending_entries(scope=None, kind=None):
+    """Entry induk yang belum selesai (posting terputus / gagal)."""
+    query = "SELECT * FROM journal WHERE part = '' AND done = 0"
+    params = []
+
+    if scope is not None:
+        query += " AND scope = ?"
+        params.append(str(scope))
+
+    if kind is not None:
+        query += " AND kind = ?"
+        params.append(kind)
+
+    query += " ORDER BY updated_at"
+
+    with _connect() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    return [_row_to_entry(r) for r in rows]
@@ -0,0 +1,462 @@
+from functools import lru_cache
+
+from log_schema import (
+    LOG_COLUMNS, LOG_COLUMNS_OUTWARD, LOG_PML_COLUMNS,
+    LOG_MONEY_COLUMNS, LOG_INTEGER_COLUMNS, LOG_DATE_COLUMNS
+)
+
+
+# ==========================
+# NAMA TEMPLATE
+# ==========================
+TEMPLATE_INWARD_ADMIN = "INWARD_ADMIN"
+TEMPLATE_INWARD_CLAIM = "INWARD_CLAIM"
+TEMPLATE_OUTWARD_ADMIN = "OUTWARD_ADMIN"
+TEMPLATE_OUTWARD_CLAIM = "OUTWARD_CLAIM"
+
+TEMPLATE_LOG_VOUCHER = "LOG_VOUCHER"
+TEMPLATE_LOG_VOUCHER_OUTWARD = "LOG_VOUCHER_OUTWARD"
+TEMPLATE_LOG_PML = "LOG_PML"
+
+# Tipe kolom
+TYPE_TEXT = "text"
+TYPE_NUMBER = "number"
+TYPE_INTEGER = "integer"
+TYPE_DATE = "date"
+
+
+# ==========================
+# LAYOUT FILE VOUCHER / PML
+# ==========================
+# Urutan kolom file yang ditulis ke Drive (header asli template)
+INWARD_ADMIN_COLUMNS = [
+    "No",
+    "TL Detail ID",
+    "Trans Category",
+    "Policy Category",
+    "Certificate No",
+    "Insured Full Name",
+    "Gender",
+    "Main Pol No",
+    "Main Policy",
+    "Pol Holder No",
+    "Policy Holder",
+    "Birth Date",
+    "Age At",
+    "Issue Date",
+    "Term Year",
+    "Term Month",
+    "Expired Date",
+    "Medical",
+    "Smoker",
+    "Ced Risk Code",
+    "Life Risk Name",
+    "K.O.B Code",
+    "Ced Product Code",
+    "Ced Coverage Code",
+    "Ced Product Desc",
+    "Ccy Code",
+    "Sum Insured",
+    "Sum At Risk",
+    "Reins Sum Insured",
+    "Ced Retention",
+    "Reins Sum At Risk",
+    "Pay Period Type",
+    "Ced EM Rate",
+    "Ced ER Rate",
+    "Reins Premium",
+    "Reins EM Premium",
+    "Reins ER Premium",
+    "Reins Oth. Premium",
+    "Reins Total Premium",
+    "Reins Comm",
+    "Reins EM Comm",
+    "Reins ER Comm",
+    "Reins Oth. Comm",
+    "Reins Profit Share",
+    "Reins Overriding",
+    "Reins Broker Fee",
+    "Reins Total Comm",
+    "Reins Tabarru",
+    "Reins Ujrah",
+    "Reins Nett Premium",
+    "Valuation Date",
+    "Terminate Date",
+    "TL Detail Remarks",
+    "CBY",
+    "CBM",
+    "COB",
+    "Voucher ID",
+    "PML ID",
+    "References No",
+    "Elapse No",
+    "Ref Voucher ID"
+]
+
+INWARD_CLAIM_COLUMNS = [
+    "BookYear",
+    "BookMonth",
+    "CedBookYear",
+    "CedBookMonth",
+    "Company Name",
+    "Policy Holder No",
+    "Policy Holder",
+    "Certificate No",
+    "Insured Name",
+    "Birth Date",
+    "Age",
+    "Gender",
+    "Sum Insured IDR",
+    "Sum Reinsured IDR",
+    "MedicalCategory",
+    "Product",
+    "Coverage Code",
+    "ClassOfBusiness",
+    "PayPeriodType",
+    "KindOfBusiness",
+    "Issue Date",
+    "Term Year",
+    "Term Month",
+    "End Date Policy",
+    "Claim Date",
+    "Claim Register Date",
+    "Payment Date",
+    "Currency",
+    "ExchangeRate",
+    "Amount of Claim IDR",
+    "Reins Claim IDR",
+    "Marein Share IDR",
+    "Cause Of Claim",
+    "Voucher ID",
+    "References No"
+]
+
+OUTWARD_ADMIN_COLUMNS = [
+    "Out PL Detail ID",
+    "Retro Type",
+    "Acc With Name",
+    "Policy Category",
+    "KOB Code",
+    "Ref Offer Insured Risk ID",
+    "Main Pol No",
+    "Main Policy",
+    "Pol Holder No",
+    "Policy Holder",
+    "Certificate No",
+    "Insured Full Name",
+    "Birth Date",
+    "Gender",
+    "Issue Date",
+    "Age At",
+    "Term Year",
+    "Term Month",
+    "Expired Date",
+    "RI Period From",
+    "RI Period Until",
+    "Smoker",
+    "Medical",
+    "Ced Product Code",
+    "Ced Coverage Code",
+    "Ced Risk Code",
+    "Life Risk Detail",
+    "PA Class Category",
+    "Ccy Code",
+    "Sum Insured",
+    "Sum At Risk",
+    "Reins Sum Insured",
+    "Reins Sum At Risk",
+    "Marein Sum Insured",
+    "Marein Sum At Risk",
+    "Own Retention",
+    "Excess OR",
+    "Check_1",
+    "Retro Sum Insured",
+    "Retro Sum At Risk",
+    "Premium Ccy",
+    "Exchange Rate",
+    "Out Tty Rate",
+    "Inw Tty Rate",
+    "EM Rate",
+    "ER Rate",
+    "Retro Premium",
+    "Retro EM Premium",
+    "Retro ER Premium",
+    "Retro Oth Premium",
+    "Retro Total Premium",
+    "Retro Comm",
+    "Retro EM Comm",
+    "Retro ER Comm",
+    "Retro Oth Comm",
+    "Retro Profit Share",
+    "Retro Total Comm",
+    "Retro Tabarru",
+    "Retro Ujrah",
+    "Check_2",
+    "Retro Overriding",
+    "Retro Sliding Scale",
+    "Retro Inw Brokerage",
+    "Reins Nett Premium",
+    "Retro Nett Premium",
+    "Check_3",
+    "Is Accum Policy",
+    "Is Calculated",
+    "PL Detail ID",
+    "Inw Vouc ID",
+    "Out Vouc ID",
+    "Inw Tty Product Code",
+    "Inw Book Year",
+    "Inw Book Month",
+    "Ced Book Year",
+    "Ced Book Month",
+    "Inw Pay Period Type",
+    "Out Pay Period Type",
+    "COB",
+    "Valuation Date",
+    "Term Condition Remark",
+    "App Date",
+    "Input Date",
+    "Input Username",
+    "Modif Date",
+    "Modif Username",
+    "References No"
+]
+
+OUTWARD_CLAIM_COLUMNS = [
+    "No",
+    "Retro Type",
+    "Cedant Name",
+    "DLA Out Voucher ID",
+    "Main Pol No",
+    "Main Policy",
+    "Pol Holder No",
+    "Policy Holder",
+    "Certificate No",
+    "Insured Name",
+    "Birth Date",
+    "Age",
+    "Gender",
+    "Ced Product Code",
+    "Ced Coverage Code",
+    "Ced Risk Code",
+    "COB Detail",
+    "Issue Date",
+    "Term Year",
+    "Term Month",
+    "KOB Code",
+    "Smoker",
+    "Medical",
+    "Claim Date",
+    "Cause Of Claim",
+    "Inw Book Year",
+    "Inw Book Month",
+    "Ced Book Year",
+    "Ced Book Month",
+    "Method of Payment",
+    "Curr",
+    "Reins Claim",
+    "Your Share",
+    "Reinsurer Name",
+    "Voucher ID",
+    "Out Voucher ID",
+    "Voucher Desc"
+]
+
+
+# ==========================
+# TIPE & ROLE KOLOM
+# ==========================
+# Nama kolom lowercase (setelah normalisasi header di validator).
+# required: wajib ada di file upload; date / number / integer: tipe kolom.
+_LAYOUTS = {
+    TEMPLATE_INWARD_ADMIN: {
+        "columns": INWARD_ADMIN_COLUMNS,
+        "required": [
+            "trans category", "policy category", "certificate no", "insured full name",
+            "gender", "main pol no", "main policy", "pol holder no", "policy holder",
+            "birth date", "age at", "issue date", "term year", "term month",
+            "expired date", "medical", "smoker", "k.o.b code", "ced product code",
+            "ced coverage code", "ccy code", "sum insured", "sum at risk",
+            "reins sum insured", "reins sum at risk", "pay period type", "ced em rate",
+            "ced er rate", "reins total premium", "reins total comm", "reins tabarru",
+            "reins ujrah", "reins nett premium", "valuation date", "cby", "cbm",
+            "cob", "voucher id", "references no"
+        ],
+        "date": [
+            "birth date", "issue date", "valuation date"
+        ],
+        "number": [
+            "sum insured", "sum at risk", "reins sum insured", "reins sum at risk",
+            "reins total premium", "reins total comm", "reins tabarru", "reins ujrah",
+            "reins nett premium"
+        ],
+        "integer": [
+            "age at", "term year", "term month"
+        ],
+    },
+    TEMPLATE_INWARD_CLAIM: {
+        "columns": INWARD_CLAIM_COLUMNS,
+        "required": [
+            "bookyear", "bookmonth", "cedbookyear", "cedbookmonth", "company name",
+            "policy holder no", "policy holder", "certificate no", "insured name",
+            "birth date", "age", "gender", "sum insured idr", "sum reinsured idr",
+            "medicalcategory", "product", "coverage code", "classofbusiness",
+            "payperiodtype", "issue date", "term year", "term month", "end date policy",
+            "claim date", "claim register date", "payment date", "currency",
+            "exchangerate", "amount of claim idr", "reins claim idr", "marein share idr",
+            "cause of claim", "voucher id", "references no"
+        ],
+        "date": [
+            "birth date", "issue date", "end date policy", "claim date"
+        ],
+        "number": [
+            "sum insured idr", "sum reinsured idr", "amount of claim idr",
+            "reins claim idr", "marein share idr"
+        ],
+        "integer": [
+            "term year", "term month", "bookyear", "bookmonth", "cedbookyear",
+            "cedbookmonth", "age"
+        ],
+    },
+    TEMPLATE_OUTWARD_ADMIN: {
+        "columns": OUTWARD_ADMIN_COLUMNS,
+        "required": [
+            "retro type", "acc with name", "policy category", "kob code", "main pol no",
+            "main policy", "pol holder no", "policy holder", "certificate no",
+            "insured full name", "birth date", "gender", "issue date", "age at",
+            "term year", "term month", "expired date", "smoker", "medical",
+            "ced product code", "ced coverage code", "ccy code", "sum insured",
+            "sum at risk", "reins sum insured", "reins sum at risk", "retro sum insured",
+            "retro sum at risk", "out pay period type", "retro total premium",
+            "retro total comm", "retro tabarru", "retro ujrah", "retro overriding",
+            "retro nett premium", "valuation date", "inw vouc id", "cob", "references no"
+        ],
+        "date": [
+            "birth date", "issue date", "valuation date"
+        ],
+        "number": [
+            "sum insured", "sum at risk", "reins sum insured", "reins sum at risk",
+            "retro sum insured", "retro sum at risk", "retro total premium",
+            "retro total comm", "retro tabarru", "retro ujrah", "retro overriding",
+            "retro nett premium"
+        ],
+        "integer": [
+            "age at", "term year", "term month"
+        ],
+    },
+    TEMPLATE_OUTWARD_CLAIM: {
+        "columns": OUTWARD_CLAIM_COLUMNS,
+        "required": [
+            "cedant name", "main pol no", "main policy", "pol holder no", "policy holder",
+            "certificate no", "insured name", "birth date", "age", "gender",
+            "ced product code", "ced coverage code", "cob detail", "issue date",
+            "term year", "term month", "kob code", "smoker", "medical", "claim date",
+            "cause of claim", "inw book year", "inw book month", "ced book year",
+            "ced book month", "curr", "reins claim", "your share", "reinsurer name",
+            "voucher id", "voucher desc", "method of payment"
+        ],
+        "date": [
+            "birth date", "issue date", "claim date"
+        ],
+        "number": [
+            "reins claim", "your share"
+        ],
+        "integer": [
+            "term year", "term month", "inw book year", "inw book month", "ced book year",
+            "ced book month", "age"
+        ],
+    },
+}
+
+# Log (layout & tipe dari log_schema)
+for _name, _columns in (
+    (TEMPLATE_LOG_VOUCHER, LOG_COLUMNS),
+    (TEMPLATE_LOG_VOUCHER_OUTWARD, LOG_COLUMNS_OUTWARD),
+    (TEMPLATE_LOG_PML, LOG_PML_COLUMNS),
+):
+    _LAYOUTS[_name] = {
+        "columns": _columns,
+        "required": [],
+        "date": [c.lower() for c in LOG_DATE_COLUMNS if c in _columns],
+        "number": [c.lower() for c in LOG_MONEY_COLUMNS if c in _columns],
+        "integer": [c.lower() for c in LOG_INTEGER_COLUMNS if c in _columns],
+    }
+
+
+# ==========================
+# KOMPILASI (SEKALI SAAT IMPORT)
+# ==========================
+_ROLES = ("required", "date", "number", "integer")
+
+
+def _compile_layout(name, layout):
+    headers = list(layout["columns"])
+    keys = [h.strip().lower() for h in headers]
+
+    for role in _ROLES:
+        unknown = [c for c in layout[role] if c not in keys]
+        if unknown:
+            raise ValueError(f"Template {name}: kolom {role} tidak ada di layout: {unknown}")
+
+    types = {}
+    for role, type_ in (("date", TYPE_DATE), ("number", TYPE_NUMBER), ("integer", TYPE_INTEGER)):
+        for key in layout[role]:
+            if key in types and types[key] != type_:
+                raise ValueError(f"Template {name}: kolom {key} bertipe {types[key]} dan {type_}")
+            types[key] = type_
+
+    required = set(layout["required"])
+
+    return {
+        "name": name,
+        "headers": tuple(headers),
+        "columns": [
+            {"name": h, "key": k, "type": types.get(k, TYPE_TEXT), "required": k in required}
+            for h, k in zip(headers, keys)
+        ],
+        "roles": {role: list(dict.fromkeys(layout[role])) for role in _ROLES},
+    }
+
+
+TEMPLATES = {name: _compile_layout(name, layout) for name, layout in _LAYOUTS.items()}
+
+
+# ==========================
+# API
+# ==========================
+def template_columns(name):
+    """Header template (list baru, aman diubah pemanggil)."""
+    return list(TEMPLATES[name]["headers"])
+
+
+def template_role(name, role):
+    """Kolom (lowercase) dengan role / tipe tertentu: required, date, number, integer."""
+    return list(TEMPLATES[name]["roles"][role])
+
+
+def template_types(name):
+    """{header: tipe kolom} untuk satu template."""
+    return {c["name"]: c["type"] for c in TEMPLATES[name]["columns"]}
+
+
+@lru_cache(maxsize=256)
+def projection_plan(template_headers, source_headers, fixed_keys=()):
+    """
+    Rencana proyeksi kolom sumber -> template, di-cache per signature header.
+    Kolom dicocokkan tanpa membedakan huruf besar/kecil (kolom sumber terakhir
+    menang jika ada duplikat). Return tuple (header, posisi kolom sumber / None,
+    key nilai tetap / None) sesuai urutan template.
+    """
+    position_by_key = {}
+    for position, header in enumerate(source_headers):
+        position_by_key[str(header).strip().lower()] = position
+
+    plan = []
+    for header in template_headers:
+        key = str(header).strip().lower()
+
+        if key in fixed_keys:
+            plan.append((header, None, key))
+        else:
+            plan.append((header, position_by_key.get(key), None))
+
+    return tuple(plan)
@@ -0,0 +1,11 @@
+import os
+import sys
+
+import streamlit as st
+
+# Modul aplikasi berada di root repo (tanpa package)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# drive_utils membaca ID folder dari secrets saat import; tes tidak memanggil Google API
+if not st.secrets.load_if_toml_exists():
+    st.secrets._secrets = {"gcp_service_account": {}, "config_folder_id": "config"}
@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from date_parser import parse_date_column, get_cached_format, clear_format_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_format_cache()
+    yield
+    clear_format_cache()
+
+
+def test_parse_date_column_mixed_sources():
+    series = pd.Series([datetime(2024, 1, 31), 45292, "15/02/2024", None, ""])
+
+    result = parse_date_column(series, column="issue date")
+
+    assert list(result[:3]) == [
+        pd.Timestamp("2024-01-31"), pd.Timestamp("2024-01-01"), pd.Timestamp("2024-02-15")
+    ]
+    assert result[3:].isna().all()
+
+
+def test_parse_date_column_prefers_day_first():
+    result = parse_date_column(pd.Series(["03/04/2024", "10/11/2024"]), column="birth date")
+
+    assert list(result) == [pd.Timestamp("2024-04-03"), pd.Timestamp("2024-11-10")]
+
+
+def test_parse_date_column_remembers_format_per_cedant():
+    parse_date_column(pd.Series(["2024-01-05"]), template="inward", cedant="A", column="issue date")
+
+    assert get_cached_format("inward", "A", "issue date") == "%Y-%m-%d"
+    assert get_cached_format("inward", "B", "issue date") is None
+
+
+def test_parse_date_column_redetects_on_partial_cache_match():
+    parse_date_column(pd.Series(["05/01/2024"]), template="inward", cedant="A", column="issue date")
+    assert get_cached_format("inward", "A", "issue date") == "%d/%m/%Y"
+
+    # File berikutnya dari cedant yang sama memakai format lain
+    result = parse_date_column(
+        pd.Series(["2024-01-05", "2024-02-06"]), template="inward", cedant="A", column="issue date"
+    )
+
+    assert list(result) == [pd.Timestamp("2024-01-05"), pd.Timestamp("2024-02-06")]
+    assert get_cached_format("inward", "A", "issue date") == "%Y-%m-%d"
+
+
+def test_parse_date_column_mixed_text_formats_are_not_cached():
+    result = parse_date_column(pd.Series(["2024-01-05", "06/02/2024", "bukan tanggal"]), column="claim date")
+
+    assert list(result[:2]) == [pd.Timestamp("2024-01-05"), pd.Timestamp("2024-02-06")]
+    assert pd.isna(result[2])
+    assert get_cached_format(None, None, "claim date") is None
+
+
+def test_parse_date_column_keeps_datetime_series():
+    series = pd.Series(pd.to_datetime(["2024-01-01", None]))
+
+    assert parse_date_column(series) is series
+
+
+def test_parse_date_column_reads_yyyymmdd_numbers_as_text():
+    # Di luar rentang serial Excel -> diperlakukan sebagai teks
+    result = parse_date_column(pd.Series([45292, 20240105, 99999999]), column="issue date")
+
+    assert list(result[:2]) == [pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-05")]
+    assert pd.isna(result[2])
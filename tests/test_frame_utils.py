@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from frame_utils import compact_frame, expand_frame, split_frame, iter_split_groups
+
+
+def pml_frame(n=20):
+    return pd.DataFrame({
+        "Medical": (["M", "N", np.nan, "M"] * n)[:n],
+        "K.O.B Code": (["K1", "K2"] * n)[:n],
+        "Policy No": [f"P{i}" for i in range(n)],
+        "Age At": (np.arange(n) % 60 + 20).astype("int64"),
+        "Reins Premium": np.linspace(0, 1000, n),
+    })
+
+
+def test_compact_frame_categorizes_low_cardinality_columns():
+    df = compact_frame(pml_frame())
+
+    assert isinstance(df["Medical"].dtype, pd.CategoricalDtype)
+    assert isinstance(df["K.O.B Code"].dtype, pd.CategoricalDtype)
+    assert df["Age At"].dtype == np.int8
+
+    # Kolom ID dan uang tidak diubah
+    assert df["Policy No"].dtype == object
+    assert df["Reins Premium"].dtype == np.float64
+
+
+def test_compact_frame_keeps_values():
+    original = pml_frame()
+    df = compact_frame(original.copy())
+
+    pd.testing.assert_frame_equal(expand_frame(df), original, check_dtype=False)
+
+
+def test_compact_frame_categories_are_per_frame():
+    first = compact_frame(pd.DataFrame({"Gender": ["M", "F"] * 5}))
+    second = compact_frame(pd.DataFrame({"Gender": ["X"] * 10}))
+
+    assert list(first["Gender"].cat.categories) == ["F", "M"]
+    assert list(second["Gender"].cat.categories) == ["X"]
+
+
+def test_compact_frame_skips_high_cardinality_columns():
+    df = compact_frame(pd.DataFrame({"Product": [f"PRD{i}" for i in range(10)]}))
+
+    assert df["Product"].dtype == object
+
+
+def test_expand_frame_allows_fillna_and_new_values():
+    df = compact_frame(pml_frame())
+
+    expanded = expand_frame(df)
+
+    assert expanded["Medical"].dtype == object
+    assert expanded["Age At"].dtype == np.int64
+    assert expanded.fillna("")["Medical"].tolist()[:4] == ["M", "N", "", "M"]
+
+    expanded.at[0, "Medical"] = "BARU"
+    expanded.at[0, "Age At"] = 300
+    assert expanded.at[0, "Age At"] == 300
+
+
+def test_expand_frame_returns_plain_frame_unchanged():
+    df = pd.DataFrame({"A": [1.0, 2.0]})
+
+    assert expand_frame(df) is df
+
+
+def split_source():
+    return pd.DataFrame({
+        "Product": ["B", "A", np.nan, "B", "A", "B"],
+        "Year": [2024, 2024, 2024, 2023, 2024, 2024],
+        "Premium": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+    })
+
+
+def test_split_frame_matches_groupby():
+    df = split_source()
+    split = split_frame(df, ["Product", "Year"])
+
+    groups = {key: group["Premium"].tolist() for key, group in iter_split_groups(split)}
+    expected = {
+        key: group["Premium"].tolist()
+        for key, group in df.dropna(subset=["Product"]).groupby(["Product", "Year"])
+    }
+
+    assert {k: v for k, v in groups.items() if not pd.isna(k[0])} == expected
+    assert split["labels"].tolist() == [0, 0, 1, 2, 2, 3]
+
+
+def test_split_frame_missing_keys():
+    df = split_source()
+
+    grouped = split_frame(df, ["Product"])
+    assert grouped["missing_rows"] == 1
+    assert pd.isna(grouped["keys"][-1][0])
+    assert grouped["bounds"][-1] == (5, 6)
+
+    dropped = split_frame(df, ["Product"], missing="drop")
+    assert len(dropped["frame"]) == 5
+    assert [k[0] for k in dropped["keys"]] == ["A", "B"]
+
+    with pytest.raises(ValueError):
+        split_frame(df, ["Product"], missing="error")
+
+
+def test_split_frame_sorted_frame_is_not_copied():
+    df = pd.DataFrame({"Product": ["A", "A", "B"], "Premium": [1.0, 2.0, 3.0]})
+
+    assert split_frame(df, ["Product"])["frame"] is df
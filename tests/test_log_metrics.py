@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from vin_generator import (
+    build_log_metrics, INWARD_ADMIN_METRICS, INWARD_CLAIM_METRICS, OUTWARD_ADMIN_METRICS,
+    LOG_IDR_COLUMNS
+)
+
+
+RATE = 15500.0
+
+
+def inward_admin_frame():
+    rng = np.random.default_rng(7)
+    n = 12
+
+    df = pd.DataFrame({
+        col: rng.uniform(0, 1000, n).round(2)
+        for col in [
+            "Reins Total Premium", "Reins Comm", "Reins EM Comm", "Reins ER Comm",
+            "Reins Oth. Comm", "Reins Profit Share", "Reins Broker Fee",
+            "Reins Overriding", "Reins Tabarru", "Reins Ujrah", "Claim"
+        ]
+    })
+    df["Product"] = ["A", "B", "C"] * 4
+    return df
+
+
+def old_inward_admin(df, rate):
+    # Rumus inline lama di tab Calculate (sebelum build_log_metrics)
+    total_contribution = df["Reins Total Premium"].sum()
+    commission = df["Reins Comm"].sum() + df["Reins EM Comm"].sum() + df["Reins ER Comm"].sum() + df["Reins Oth. Comm"].sum() + df["Reins Profit Share"].sum() + df["Reins Broker Fee"].sum()
+    overriding = df["Reins Overriding"].sum() if "Reins Overriding" in df.columns else 0
+    total_commission = commission + overriding
+    claim_amount = df["Claim"].sum() if "Claim" in df.columns else 0
+    balance = total_contribution - total_commission - claim_amount
+
+    return {
+        "Total Contribution": total_contribution,
+        "Commission": commission,
+        "Overriding": overriding,
+        "Total Commission": total_commission,
+        "Gross Premium Income": total_contribution - total_commission,
+        "Tabarru": df["Reins Tabarru"].sum(),
+        "Ujrah": df["Reins Ujrah"].sum(),
+        "Claim": 0,
+        "Balance": balance,
+        "Rate Exchange": rate,
+        "Kontribusi (IDR)": total_contribution * rate,
+        "Commission (IDR)": commission * rate,
+        "Overiding (IDR)": overriding * rate,
+        "Total Commission (IDR)": total_commission * rate,
+        "Gross Premium Income (IDR)": (total_contribution - total_commission) * rate,
+        "Tabarru (IDR)": df["Reins Tabarru"].sum() * rate,
+        "Ujrah (IDR)": df["Reins Ujrah"].sum() * rate,
+        "Balance (IDR)": balance * rate,
+    }
+
+
+def assert_metrics_equal(metrics, expected):
+    for col, value in expected.items():
+        assert metrics[col] == pytest.approx(value), col
+
+
+@pytest.mark.parametrize("drop", [[], ["Reins Overriding", "Claim"]])
+def test_inward_admin_matches_old_formulas(drop):
+    df = inward_admin_frame().drop(columns=drop)
+
+    metrics = build_log_metrics(df, INWARD_ADMIN_METRICS, rate=RATE).iloc[0]
+
+    assert_metrics_equal(metrics, old_inward_admin(df, RATE))
+
+
+def test_inward_claim_matches_old_formulas():
+    df = pd.DataFrame({"Marein Share IDR": [100.0, 250.5, 49.5]})
+
+    metrics = build_log_metrics(df, INWARD_CLAIM_METRICS, rate=1.0).iloc[0]
+
+    claim_amount = df["Marein Share IDR"].sum()
+    assert_metrics_equal(metrics, {
+        "Total Contribution": 0, "Commission": 0, "Total Commission": 0,
+        "Claim": claim_amount, "Balance": -claim_amount, "Claim (IDR)": claim_amount,
+    })
+
+
+def test_outward_admin_matches_old_formulas_with_lowercase_columns():
+    df = pd.DataFrame({
+        "retro total premium": [1000.0, 2000.0],
+        "retro total comm": [100.0, 150.0],
+        "retro overriding": [10.0, 20.0],
+        "retro tabarru": [300.0, 600.0],
+        "retro ujrah": [50.0, 70.0],
+        "claim": [5.0, 0.0],
+    })
+
+    metrics = build_log_metrics(df, OUTWARD_ADMIN_METRICS, overriding_column="Overiding").iloc[0]
+
+    # Rumus inline lama di posting PML outward
+    assert_metrics_equal(metrics, {
+        "Total Contribution": df["retro total premium"].sum(),
+        "Commission": df["retro total comm"].sum(),
+        "Overiding": df["retro overriding"].sum(),
+        "Total Commission": df["retro total comm"].sum() + df["retro overriding"].sum(),
+        "Gross Premium Income": df["retro total premium"].sum() - (df["retro total comm"].sum() + df["retro overriding"].sum()),
+        "Tabarru": df["retro tabarru"].sum(),
+        "Ujrah": df["retro ujrah"].sum(),
+        "Claim": 0,
+        "Balance": df["retro total premium"].sum() - df["retro total comm"].sum() - df["retro overriding"].sum() - df["claim"].sum(),
+    })
+    assert "Overriding" not in metrics.index
+
+
+def test_grouped_metrics_match_per_group_calls():
+    df = inward_admin_frame()
+    rates = pd.Series([1.0, 2.0, 3.0], index=["A", "B", "C"])
+
+    grouped = build_log_metrics(df, INWARD_ADMIN_METRICS, by="Product", rate=rates)
+
+    for product, group in df.groupby("Product"):
+        single = build_log_metrics(group, INWARD_ADMIN_METRICS, rate=rates[product]).iloc[0]
+        expected = grouped.loc[product]
+
+        for col in ["Total Contribution", "Balance", "Rate Exchange", *LOG_IDR_COLUMNS.values()]:
+            assert expected[col] == pytest.approx(single[col]), (product, col)
+
+
+def test_missing_required_column_raises():
+    with pytest.raises(KeyError, match="Reins Tabarru"):
+        build_log_metrics(inward_admin_frame().drop(columns=["Reins Tabarru"]), INWARD_ADMIN_METRICS)
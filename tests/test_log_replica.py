@@ -0,0 +1,107 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import log_replica
+from log_replica import (
+    init_log_replica, replica_sync, replica_append, replica_update_status,
+    verify_aggregates, rebuild_aggregates, aggregate_summary, replica_query, KIND_PML
+)
+
+
+SHEET = "sheet-pml"
+
+
+@pytest.fixture(autouse=True)
+def replica_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_replica, "REPLICA_DB_PATH", str(tmp_path / "replica.sqlite3"))
+    init_log_replica()
+
+
+def log_row(pml_id, status, contribution, account="ACME"):
+    return {
+        "PML ID": pml_id,
+        "Account With": account,
+        "COB": "LIFE",
+        "Curr": "IDR",
+        "Biz Type": "Kontribusi",
+        "STATUS": status,
+        "Total Contribution": contribution,
+        "Balance": contribution * 0.8,
+    }
+
+
+def totals(status=None):
+    summary = aggregate_summary(kind=KIND_PML, year=2024, month=1, status=status, group_by=())
+    row = summary.iloc[0]
+    return int(row["Jumlah Baris"] or 0), float(row["Total Contribution"] or 0)
+
+
+def test_aggregates_follow_sync_append_and_status_change():
+    rows = [log_row("P1", "POSTED", 100.0), log_row("P2", "POSTED", 200.0)]
+    replica_sync(SHEET, KIND_PML, 2024, 1, pd.DataFrame(rows), version="1")
+
+    assert verify_aggregates() == []
+    assert totals() == (2, 300.0)
+
+    # Baris baru (provisional) sebelum terlihat di Sheets
+    appended = log_row("P3", "POSTED", 50.0)
+    assert replica_append(SHEET, appended, provisional_id=7)
+
+    assert verify_aggregates() == []
+    assert totals() == (3, 350.0)
+
+    # Compare-and-set status berhasil
+    assert replica_update_status(SHEET, ["P1"], "SPLITTED") == 1
+
+    assert verify_aggregates() == []
+    assert totals("SPLITTED") == (1, 100.0)
+    assert totals("POSTED") == (2, 250.0)
+
+    # Sync berikutnya: baris provisional diganti baris asli dari sheet
+    rows[0]["STATUS"] = "SPLITTED"
+    replica_sync(SHEET, KIND_PML, 2024, 1, pd.DataFrame(rows + [appended]), version="2")
+
+    assert verify_aggregates() == []
+    assert totals() == (3, 350.0)
+    assert len(replica_query(kind=KIND_PML)) == 3
+
+
+def test_sync_with_removed_and_edited_rows():
+    rows = [log_row("P1", "POSTED", 100.0), log_row("P2", "POSTED", 200.0, account="OTHER")]
+    replica_sync(SHEET, KIND_PML, 2024, 1, pd.DataFrame(rows), version="1")
+
+    rows = [log_row("P1", "POSTED", 120.0)]
+    replica_sync(SHEET, KIND_PML, 2024, 1, pd.DataFrame(rows), version="2")
+
+    assert verify_aggregates() == []
+    assert totals() == (1, 120.0)
+
+
+def test_sync_skips_unchanged_version():
+    replica_sync(SHEET, KIND_PML, 2024, 1, pd.DataFrame([log_row("P1", "POSTED", 100.0)]), version="1")
+
+    assert replica_sync(SHEET, KIND_PML, 2024, 1, pd.DataFrame([log_row("P1", "POSTED", 999.0)]), version="1") == 0
+    assert totals() == (1, 100.0)
+
+
+def test_append_to_unsynced_log_is_skipped():
+    assert not replica_append("never-synced", log_row("P9", "POSTED", 10.0), provisional_id=1)
+    assert verify_aggregates() == []
+
+
+def test_verify_detects_drift_and_rebuild_fixes_it():
+    replica_sync(SHEET, KIND_PML, 2024, 1, pd.DataFrame([log_row("P1", "POSTED", 100.0)]), version="1")
+
+    conn = sqlite3.connect(log_replica.REPLICA_DB_PATH)
+    with conn:
+        conn.execute("UPDATE aggregates SET contribution = contribution + 5")
+    conn.close()
+
+    assert len(verify_aggregates()) == 1
+
+    rebuild_aggregates()
+
+    assert verify_aggregates() == []
+    assert totals() == (1, 100.0)
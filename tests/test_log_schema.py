@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from log_schema import apply_log_schema
+
+
+def test_apply_log_schema_casts_known_columns():
+    df = apply_log_schema(pd.DataFrame({
+        "Seq No": [1, 2.0, None],
+        "Commission": [1.5, 2, None],
+        "CREATED AT": [45292, 45292.5, None],
+        "STATUS": ["CALCULATED", "", None],
+        "Catatan": ["a", "b", "c"],
+    }))
+
+    assert df["Seq No"].dtype == "Int64"
+    assert df["Commission"].dtype == np.float64
+    assert isinstance(df["STATUS"].dtype, pd.CategoricalDtype)
+
+    # Kolom di luar schema tidak disentuh
+    assert df["Catatan"].dtype == object
+
+    assert df["CREATED AT"].iloc[0] == pd.Timestamp("2024-01-01")
+    assert df["CREATED AT"].iloc[1] == pd.Timestamp("2024-01-01 12:00")
+    assert pd.isna(df["STATUS"].iloc[1])
+
+
+def test_apply_log_schema_parses_text_dates():
+    df = apply_log_schema(pd.DataFrame({"Due Date": [45292, "2024-02-15", ""]}))
+
+    assert list(df["Due Date"][:2]) == [pd.Timestamp("2024-01-01"), pd.Timestamp("2024-02-15")]
+    assert pd.isna(df["Due Date"].iloc[2])
+
+
+def test_apply_log_schema_cleans_money_stored_as_text(caplog):
+    df = apply_log_schema(pd.DataFrame({
+        "Balance": [10.0, "1.234,56", "10,223.84", "(1,234.56)", "Rp 1,000", "abc", ""],
+    }))
+
+    assert df["Balance"].dtype == np.float64
+    assert list(df["Balance"][:5]) == [10.0, 1234.56, 10223.84, -1234.56, 1000.0]
+    assert df["Balance"][5:].isna().all()
+
+    assert "4 sel teks dikonversi ke angka, 1 gagal" in caplog.text
@@ -0,0 +1,68 @@
+import pytest
+
+from template_registry import (
+    _compile_layout, projection_plan, template_columns, template_role, template_types,
+    TEMPLATES, TEMPLATE_INWARD_ADMIN, TEMPLATE_LOG_PML,
+    TYPE_TEXT, TYPE_NUMBER, TYPE_INTEGER, TYPE_DATE
+)
+
+
+def layout(**roles):
+    base = {
+        "columns": ["Policy No", "Issue Date", "Reins Premium", "Age", "Remarks"],
+        "required": [],
+        "date": [],
+        "number": [],
+        "integer": [],
+    }
+    base.update(roles)
+    return base
+
+
+def test_compile_layout_types_and_required():
+    compiled = _compile_layout("T", layout(
+        required=["policy no", "policy no"],
+        date=["issue date"],
+        number=["reins premium"],
+        integer=["age"],
+    ))
+
+    assert compiled["headers"] == ("Policy No", "Issue Date", "Reins Premium", "Age", "Remarks")
+    assert [(c["key"], c["type"], c["required"]) for c in compiled["columns"]] == [
+        ("policy no", TYPE_TEXT, True),
+        ("issue date", TYPE_DATE, False),
+        ("reins premium", TYPE_NUMBER, False),
+        ("age", TYPE_INTEGER, False),
+        ("remarks", TYPE_TEXT, False),
+    ]
+
+    # Duplikat role dibuang, urutan dipertahankan
+    assert compiled["roles"]["required"] == ["policy no"]
+
+
+def test_compile_layout_rejects_unknown_column():
+    with pytest.raises(ValueError, match="tidak ada di layout"):
+        _compile_layout("T", layout(date=["claim date"]))
+
+
+def test_compile_layout_rejects_conflicting_types():
+    with pytest.raises(ValueError, match="bertipe"):
+        _compile_layout("T", layout(date=["age"], integer=["age"]))
+
+
+def test_registered_templates_compile():
+    assert TEMPLATE_INWARD_ADMIN in TEMPLATES
+
+    columns = template_columns(TEMPLATE_INWARD_ADMIN)
+    columns.append("X")
+    assert "X" not in template_columns(TEMPLATE_INWARD_ADMIN)
+
+    assert template_types(TEMPLATE_LOG_PML)["Total Contribution"] == TYPE_NUMBER
+    assert "created at" in template_role(TEMPLATE_LOG_PML, "date")
+
+
+def test_projection_plan_matches_case_insensitively():
+    plan = projection_plan(("Policy No", "Age", "Remarks"), (" policy no", "AGE", "age"), ("remarks",))
+
+    # Kolom sumber terakhir menang untuk header duplikat
+    assert plan == (("Policy No", 0, None), ("Age", 2, None), ("Remarks", None, "remarks"))
@@ -1,264 +1,42 @@
 import pandas as pd
 import numpy as np
+from date_parser import parse_date_column
+from template_registry import template_role, TEMPLATE_INWARD_ADMIN, TEMPLATE_INWARD_CLAIM, TEMPLATE_OUTWARD_ADMIN, TEMPLATE_OUTWARD_CLAIM
 
 
+# Daftar kolom per template diambil dari template_registry (didefinisikan sekali)
 # Admin
-REQUIRED_COLUMNS_INWARD = [
-    "trans category",
-    "policy category",
-    "certificate no",
-    "insured full name",
-    "gender",
-    "main pol no",
-    "main policy",
-    "pol holder no",
-    "policy holder",
-    "birth date",
-    "age at",
-    "issue date",
-    "term year",
-    "term month",
-    "expired date",
-    "medical",
-    "smoker",
-    "k.o.b code",
-    "ced product code",
-    "ced coverage code",
-    "ccy code",
-    "sum insured",
-    "sum at risk",
-    "reins sum insured",
-    "reins sum at risk",
-    "pay period type",
-    "ced em rate",
-    "ced er rate",
-    "reins total premium",
-    "reins total comm",
-    "reins tabarru",
-    "reins ujrah",
-    "reins nett premium",
-    "valuation date",
-    "cby",
-    "cbm",
-    "cob",
-    "voucher id",
-    "references no"
-]
-
-# Admin
-REQUIRED_COLUMNS_OUTWARD = [
-    "retro type",
-    "acc with name",
-    "policy category",
-    "kob code",
-    "main pol no",
-    "main policy",
-    "pol holder no",
-    "policy holder",
-    "certificate no",
-    "insured full name",
-    "birth date",
-    "gender",
-    "issue date",
-    "age at",
-    "issue date",
-    "term year",
-    "term month",
-    "expired date",
-    "smoker",
-    "medical",
-    "ced product code",
-    "ced coverage code",
-    "ccy code",
-    "sum insured",
-    "sum at risk",
-    "reins sum insured",
-    "reins sum at risk",
-    "retro sum insured",
-    "retro sum at risk",
-    "out pay period type",
-    "retro total premium",
-    "retro total comm",
-    "retro tabarru",
-    "retro ujrah",
-    "retro overriding",
-    "retro nett premium",
-    "valuation date",
-    "inw vouc id",
-    "retro type",
-    "cob",
-    "references no"
-]
+REQUIRED_COLUMNS_INWARD = template_role(TEMPLATE_INWARD_ADMIN, "required")
+REQUIRED_COLUMNS_OUTWARD = template_role(TEMPLATE_OUTWARD_ADMIN, "required")
 
 # Claim
-REQUIRED_COLUMNS_CLAIM_INWARD = [
-    "bookyear",
-    "bookmonth",
-    "cedbookyear",
-    "cedbookmonth",
-    "company name",
-    "policy holder no",
-    "policy holder",
-    "certificate no",
-    "insured name",
-    "birth date",
-    "age",
-    "gender",
-    "sum insured idr",
-    "sum reinsured idr",
-    "medicalcategory",
-    "product",
-    "coverage code",
-    "classofbusiness",
-    "payperiodtype",
-    "issue date",
-    "term year",
-    "term month",
-    "end date policy",
-    "claim date",
-    "claim register date",
-    "payment date",
-    "currency",
-    "exchangerate",
-    "amount of claim idr",
-    "reins claim idr",
-    "marein share idr",
-    "cause of claim",
-    "voucher id",
-    "references no"
-]
+REQUIRED_COLUMNS_CLAIM_INWARD = template_role(TEMPLATE_INWARD_CLAIM, "required")
+REQUIRED_COLUMNS_CLAIM_OUTWARD = template_role(TEMPLATE_OUTWARD_CLAIM, "required")
+
+# Admin (inward & outward sama)
+DATE_COLUMNS = template_role(TEMPLATE_INWARD_ADMIN, "date")
 
 # Claim
-REQUIRED_COLUMNS_CLAIM_OUTWARD = [
-    "cedant name",
-    "main pol no",
-    "main policy",
-    "pol holder no",
-    "policy holder",
-    "certificate no",
-    "insured name",
-    "birth date",
-    "age",
-    "gender",
-    "ced product code",
-    "ced coverage code",
-    "cob detail",
-    "issue date",
-    "term year",
-    "term month",
-    "kob code",
-    "smoker",
-    "medical",
-    "claim date",
-    "cause of claim",
-    "inw book year",
-    "inw book month",
-    "ced book year",
-    "ced book month",
-    "curr",
-    "reins claim",
-    "your share",
-    "reinsurer name",
-    "voucher id",
-    "voucher desc",
-    "method of payment"
-]
+DATE_COLUMNS_CLAIM_INWARD = template_role(TEMPLATE_INWARD_CLAIM, "date")
+DATE_COLUMNS_CLAIM_OUTWARD = template_role(TEMPLATE_OUTWARD_CLAIM, "date")
 
 # Admin
-DATE_COLUMNS = [
-    "birth date", 
-    "issue date",
-    # "ri period from",
-    # "ri period until",
-    "valuation date"
-]
+NUMERIC_COLUMNS_INWARD = template_role(TEMPLATE_INWARD_ADMIN, "number")
+NUMERIC_COLUMNS_OUTWARD = template_role(TEMPLATE_OUTWARD_ADMIN, "number")
 
 # Claim
-DATE_COLUMNS_CLAIM_INWARD = [
-    "birth date", 
-    "issue date",
-    "end date policy",
-    "claim date"
-]
-
-DATE_COLUMNS_CLAIM_OUTWARD = [
-    "birth date", 
-    "issue date",
-    "claim date"
-]
-
-# Admin
-NUMERIC_COLUMNS_INWARD = [
-    "sum insured", 
-    "sum at risk",
-    "reins sum insured",
-    "reins sum at risk",
-    "reins total premium",
-    "reins total comm",
-    "reins tabarru",
-    "reins ujrah",
-    "reins nett premium"
-]
-
-NUMERIC_COLUMNS_OUTWARD = [
-    "sum insured", 
-    "sum at risk",
-    "reins sum insured",
-    "reins sum at risk",
-    "retro sum insured",
-    "retro sum at risk",
-    "retro total premium",
-    "retro total comm",
-    "retro tabarru",
-    "retro ujrah",
-    "retro overriding",
-    "retro nett premium"
-]
-
-#Claim
-NUMERIC_COLUMNS_CLAIM_INWARD = [
-    "sum insured idr",
-    "sum reinsured idr",
-    "amount of claim idr",
-    "reins claim idr",
-    "marein share idr"
-]
-
-NUMERIC_COLUMNS_CLAIM_OUTWARD = [
-    "reins claim",
-    "your share"
-]
+NUMERIC_COLUMNS_CLAIM_INWARD = template_role(TEMPLATE_INWARD_CLAIM, "number")
+NUMERIC_COLUMNS_CLAIM_OUTWARD = template_role(TEMPLATE_OUTWARD_CLAIM, "number")
 
-# Admin
-INTEGER_COLUMNS = [
-    "age at", 
-    "term year",
-    "term month"
-]
+# Admin (inward & outward sama)
+INTEGER_COLUMNS = template_role(TEMPLATE_INWARD_ADMIN, "integer")
 
 # Claim
-INTEGER_COLUMNS_CLAIM_INWARD = [
-    "term year", 
-    "term month",
-    "bookyear", 
-    "bookmonth",
-    "cedbookyear",
-    "cedbookmonth",
-    "age"
-]
-
-INTEGER_COLUMNS_CLAIM_OUTWARD = [
-    "term year", 
-    "term month",
-    "inw book year", 
-    "inw book month",
-    "ced book year",
-    "ced book month",
-    "age"
-]
-
-
-def validate_voucher(df, department: str, biz_type: str, reins_type:str):
+INTEGER_COLUMNS_CLAIM_INWARD = template_role(TEMPLATE_INWARD_CLAIM, "integer")
+INTEGER_COLUMNS_CLAIM_OUTWARD = template_role(TEMPLATE_OUTWARD_CLAIM, "integer")
+
+
+def validate_voucher(df, department: str, biz_type: str, reins_type:str, cedant: str = None):
 
     def clean_numeric_id(series: pd.Series) -> pd.Series:
         s = series.astype(str).str.strip()
@@ -326,17 +104,27 @@ def validate_voucher(df, department: str, biz_type: str, reins_type:str):
     # =========================
     # 2. DATE VALIDATION
     # =========================
+    # Format tanggal diingat per template (reins type + department) dan cedant.
+    # Cedant dibaca dari file: form Account With baru tampil setelah validasi.
+    date_template = f"{reins_type}_{department}"
+
+    if not cedant:
+        for cedant_col in ["company name", "cedant name", "acc with name"]:
+            if cedant_col in df.columns and df[cedant_col].notna().any():
+                cedant = str(df[cedant_col].dropna().iloc[0]).strip()
+                break
+
     if reins_type == "INWARD":
         if department in "ADMIN":
             for col in DATE_COLUMNS:
-                converted = pd.to_datetime(df[col], errors="coerce")
+                converted = parse_date_column(df[col], template=date_template, cedant=cedant, column=col)
                 if converted.isna().any():
                     errors.append(f"Kolom {col} harus bertipe tanggal (date)")
                 df[col] = converted
 
         elif department == "CLAIM":
             for col in DATE_COLUMNS_CLAIM_INWARD:
-                converted = pd.to_datetime(df[col], errors="coerce")
+                converted = parse_date_column(df[col], template=date_template, cedant=cedant, column=col)
                 if converted.isna().any():
                     errors.append(f"Kolom {col} harus bertipe tanggal (date)")
                 df[col] = converted
@@ -348,7 +136,7 @@ def validate_voucher(df, department: str, biz_type: str, reins_type:str):
                 if col not in df.columns:
                     errors.append(f"Kolom {col} tidak ditemukan di file")
                     continue
-                converted = pd.to_datetime(df[col], errors="coerce")
+                converted = parse_date_column(df[col], template=date_template, cedant=cedant, column=col)
                 
                 if converted.isna().any():
                     errors.append(f"Kolom {col} harus bertipe tanggal (date)")
@@ -356,7 +144,7 @@ def validate_voucher(df, department: str, biz_type: str, reins_type:str):
 
         elif department in "CLAIM":
             for col in DATE_COLUMNS_CLAIM_OUTWARD:
-                converted = pd.to_datetime(df[col], errors="coerce")
+                converted = parse_date_column(df[col], template=date_template, cedant=cedant, column=col)
                 if converted.isna().any():
                     errors.append(f"Kolom {col} harus bertipe tanggal (date)")
                 df[col] = converted
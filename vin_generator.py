@@ -1,11 +1,17 @@
 import io
 import os
+import threading
+import numpy as np
 import pandas as pd
 import streamlit as st
 from datetime import datetime
-from googleapiclient.http import MediaIoBaseDownload
-from googleapiclient.http import MediaIoBaseUpload
-from drive_utils import load_log_from_gsheet, find_drive_file, append_gsheet, upload_dataframe_to_drive
+from drive_transfer import upload_media, resumable_media
+from excel_export import XLSX_MIME
+from drive_utils import check_leases, drive_lock, load_log_from_gsheet, find_drive_file, append_gsheet, upload_dataframe_to_drive, log_has_row, refresh_log_cache
+from ledger import ledger_pending_rows
+from frame_utils import split_frame, iter_split_groups, MISSING_KEY_LABEL
+from job_queue import job_throughput
+from posting_journal import get_entry, resolve_target, run_step, finish, KIND_SPLIT, STEP_LOG, STEP_FILE
 from zoneinfo import ZoneInfo
 
 MONTH_ID = [
@@ -122,8 +128,8 @@ def generate_vin_from_drive(
         if log_df.empty or "Seq No" not in log_df.columns:
             next_seq = 1
         else:
-            seq_series = pd.to_numeric(log_df["Seq No"], errors="coerce")
-            seq_series = seq_series.dropna()
+            # "Seq No" sudah bertipe Int64 dari log schema
+            seq_series = log_df["Seq No"].dropna()
 
             if seq_series.empty:
                 next_seq = 1
@@ -173,8 +179,8 @@ def generate_vou_from_drive(
         if log_df.empty or "Seq No" not in log_df.columns:
             next_seq = 1
         else:
-            seq_series = pd.to_numeric(log_df["Seq No"], errors="coerce")
-            seq_series = seq_series.dropna()
+            # "Seq No" sudah bertipe Int64 dari log schema
+            seq_series = log_df["Seq No"].dropna()
 
             if seq_series.empty:
                 next_seq = 1
@@ -226,8 +232,8 @@ def generate_pml_from_drive(
         if log_df.empty or "Seq No" not in log_df.columns:
             next_seq = 1
         else:
-            seq_series = pd.to_numeric(log_df["Seq No"], errors="coerce")
-            seq_series = seq_series.dropna()
+            # "Seq No" sudah bertipe Int64 dari log schema
+            seq_series = log_df["Seq No"].dropna()
 
             if seq_series.empty:
                 next_seq = 1
@@ -279,8 +285,8 @@ def generate_pml_outward_from_drive(
         if log_df.empty or "Seq No" not in log_df.columns:
             next_seq = 1
         else:
-            seq_series = pd.to_numeric(log_df["Seq No"], errors="coerce")
-            seq_series = seq_series.dropna()
+            # "Seq No" sudah bertipe Int64 dari log schema
+            seq_series = log_df["Seq No"].dropna()
 
             if seq_series.empty:
                 next_seq = 1
@@ -365,17 +371,150 @@ def upload_excel_bytes(service, file_bytes, filename, parent_id):
         "parents": [parent_id]
     }
 
-    media = MediaIoBaseUpload(
-        file_bytes,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    check_leases()
+
+    media = resumable_media(file_bytes, XLSX_MIME)
+
+    upload_media(
+        service.files().create(
+            body=file_metadata,
+            media_body=media,
+            supportsAllDrives=True
+        ),
+        name=filename
     )
 
-    service.files().create(
-        body=file_metadata,
-        media_body=media,
-        supportsAllDrives=True
-    ).execute()
 
+# ==========================
+# METRIK LOG (SEKALI AGREGASI)
+# ==========================
+# Kolom sumber per metrik. Nama dicocokkan tanpa membedakan huruf besar/kecil
+# (frame upload memakai lowercase, frame PML memakai Title Case).
+INWARD_ADMIN_METRICS = {
+    "contribution": ["Reins Total Premium"],
+    "commission": [
+        "Reins Comm", "Reins EM Comm", "Reins ER Comm",
+        "Reins Oth. Comm", "Reins Profit Share", "Reins Broker Fee"
+    ],
+    "overriding": ["Reins Overriding"],
+    "tabarru": ["Reins Tabarru"],
+    "ujrah": ["Reins Ujrah"],
+    "claim_deduction": ["Claim"],
+}
+
+# Split memakai total komisi yang sudah ada di file PML, tanpa potongan claim
+INWARD_ADMIN_SPLIT_METRICS = {
+    **INWARD_ADMIN_METRICS,
+    "commission": ["Reins Total Comm"],
+    "claim_deduction": [],
+}
+
+INWARD_CLAIM_METRICS = {"claim": ["Marein Share IDR"]}
+
+OUTWARD_ADMIN_METRICS = {
+    "contribution": ["Retro Total Premium"],
+    "commission": ["Retro Total Comm"],
+    "overriding": ["Retro Overriding"],
+    "tabarru": ["Retro Tabarru"],
+    "ujrah": ["Retro Ujrah"],
+    "claim_deduction": ["Claim"],
+}
+
+OUTWARD_ADMIN_SPLIT_METRICS = {**OUTWARD_ADMIN_METRICS, "claim_deduction": []}
+
+OUTWARD_CLAIM_METRICS = {"claim": ["Your Share"]}
+
+# Kolom yang boleh tidak ada di file (dihitung 0)
+OPTIONAL_METRICS = {"overriding", "claim_deduction", "claim"}
+
+# Kolom log (mata uang asli) -> kolom IDR
+LOG_IDR_COLUMNS = {
+    "Total Contribution": "Kontribusi (IDR)",
+    "Commission": "Commission (IDR)",
+    "Overriding": "Overiding (IDR)",
+    "Total Commission": "Total Commission (IDR)",
+    "Gross Premium Income": "Gross Premium Income (IDR)",
+    "Tabarru": "Tabarru (IDR)",
+    "Ujrah": "Ujrah (IDR)",
+    "Claim": "Claim (IDR)",
+    "Balance": "Balance (IDR)",
+}
+
+
+def build_log_metrics(df, spec, by=None, rate=None, overriding_column="Overriding"):
+    """
+    Hitung semua nilai uang untuk baris log dengan satu agregasi.
+    by: kolom / label grup -> satu baris hasil per grup (urutan sama dengan df.groupby(by, observed=True)).
+    rate: kurs (skalar / Series per grup) -> kolom IDR ikut dihitung.
+    """
+    lookup = {str(c).strip().lower(): c for c in df.columns}
+
+    sources = {}
+    for metric, columns in spec.items():
+        found = [lookup[c.lower()] for c in columns if c.lower() in lookup]
+
+        if len(found) < len(columns) and metric not in OPTIONAL_METRICS:
+            missing = [c for c in columns if c.lower() not in lookup]
+            raise KeyError(f"Kolom tidak ditemukan untuk {metric}: {missing}")
+
+        sources[metric] = found
+
+    needed = list(dict.fromkeys(c for cols in sources.values() for c in cols))
+
+    if by is None:
+        sums = df[needed].sum().to_frame().T
+    else:
+        sums = df.groupby(by, observed=True)[needed].sum()
+
+    def total(metric):
+        cols = sources.get(metric, [])
+        return sums[cols].sum(axis=1) if cols else pd.Series(0.0, index=sums.index)
+
+    contribution = total("contribution")
+    commission = total("commission")
+    overriding = total("overriding")
+    total_commission = commission + overriding
+
+    if "claim" in spec:
+        # Departemen CLAIM: hanya nilai claim, balance = -claim
+        zero = pd.Series(0.0, index=sums.index)
+        claim = total("claim")
+
+        metrics = pd.DataFrame({
+            "Total Contribution": zero,
+            "Commission": zero,
+            "Overriding": zero,
+            "Total Commission": zero,
+            "Gross Premium Income": zero,
+            "Tabarru": zero,
+            "Ujrah": zero,
+            "Claim": claim,
+            "Balance": -claim,
+        })
+
+    else:
+        metrics = pd.DataFrame({
+            "Total Contribution": contribution,
+            "Commission": commission,
+            "Overriding": overriding,
+            "Total Commission": total_commission,
+            "Gross Premium Income": contribution - total_commission,
+            "Tabarru": total("tabarru"),
+            "Ujrah": total("ujrah"),
+            "Claim": 0.0,
+            "Balance": contribution - total_commission - total("claim_deduction"),
+        })
+
+    if rate is not None:
+        metrics["Rate Exchange"] = rate
+
+        idr = metrics[list(LOG_IDR_COLUMNS)].mul(metrics["Rate Exchange"], axis=0)
+        metrics[list(LOG_IDR_COLUMNS.values())] = idr.to_numpy()
+
+    if overriding_column != "Overriding":
+        metrics = metrics.rename(columns={"Overriding": overriding_column})
+
+    return metrics
 
 
 def create_cancel_row(original_row, new_voucher, seq_no, year, month, user, reason):
@@ -429,21 +568,23 @@ def now_wib_naive():
     return datetime.now(ZoneInfo("Asia/Jakarta")).replace(tzinfo=None)
 
 def get_last_seq_no(sheets_service, spreadsheet_id):
-    result = sheets_service.spreadsheets().values().get(
-        spreadsheetId=spreadsheet_id,
-        range="A:Z"
-    ).execute()
+    # Baris ledger yang belum direplikasi juga sudah memakai nomor
+    seq_numbers = []
+    for entry in ledger_pending_rows(spreadsheet_id):
+        try:
+            seq_numbers.append(int(entry["row"].get("Seq No")))
+        except (TypeError, ValueError):
+            continue
 
-    values = result.get("values", [])
+    # Tail read: hanya baris baru sejak refresh terakhir yang diambil
+    cached = refresh_log_cache(sheets_service, spreadsheet_id)
 
-    if len(values) <= 1:
-        return 0
+    if not cached["rows"]:
+        return max(seq_numbers) if seq_numbers else 0
 
-    headers = values[0]
-    seq_col = headers.index("Seq No")
+    seq_col = cached["header"].index("Seq No")
 
-    seq_numbers = []
-    for row in values[1:]:
+    for row in cached["rows"]:
         if len(row) > seq_col:
             try:
                 seq_numbers.append(int(row[seq_col]))
@@ -464,10 +605,122 @@ def generate_pml_id(seq_no, year, month, department, biz_type):
     return voucher, new_seq
 
 def format_split_key(split_columns, key):
-    if isinstance(key, tuple):
-        return ", ".join([f"{col}={val}" for col, val in zip(split_columns, key)])
-    else:
-        return f"{split_columns[0]}={key}"
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    return ", ".join([
+        f"{col}={MISSING_KEY_LABEL if pd.isna(val) else val}"
+        for col, val in zip(split_columns, key)
+    ])
+
+
+def split_metric_spec(department, biz_type, outward=False):
+    """Spec metrik log untuk PML hasil split (None jika departemen/biz type tidak dikenali)."""
+    if department == "ADMIN" and biz_type in ["Kontribusi", "Refund", "Alteration", "Retur", "Revise", "Batal", "Cancel"]:
+        return OUTWARD_ADMIN_SPLIT_METRICS if outward else INWARD_ADMIN_SPLIT_METRICS
+
+    if department == "CLAIM":
+        return OUTWARD_CLAIM_METRICS if outward else INWARD_CLAIM_METRICS
+
+    return None
+
+
+# ==========================
+# SPLIT PLANNER (DRY-RUN)
+# ==========================
+# Di atas jumlah PML ini split harus dikonfirmasi dulu
+SPLIT_CONFIRM_GROUPS = 50
+
+# Dipakai jika belum ada riwayat job SPLIT untuk mengukur laju
+SPLIT_DEFAULT_SECONDS_PER_GROUP = 3.0
+SPLIT_SAMPLE_ROWS = 200
+
+# Per PML hasil split: upload file (resumable: init + isi) & append log
+SPLIT_DRIVE_CALLS_PER_GROUP = 2
+SPLIT_SHEETS_CALLS_PER_GROUP = 1
+# Per job: lock, claim & finish status PML sumber, nomor urut
+SPLIT_FIXED_CALLS = 6
+
+SPLIT_PLAN_CACHE_SIZE = 32
+
+# (file_hash, kolom split) -> plan, bersama untuk semua session
+_SPLIT_PLANS = {}
+_SPLIT_PLANS_LOCK = threading.Lock()
+
+
+def _xlsx_size(df):
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False, engine="xlsxwriter")
+    return buffer.tell()
+
+
+def plan_split(df, split_columns, spec=None, file_hash=None):
+    """
+    Dry-run split: jumlah grup, baris & total kontrol per grup, serta
+    perkiraan API call, ukuran file dan waktu. Tidak ada yang ditulis.
+    Hasil di-cache per (file_hash, kolom split).
+    """
+    cache_key = (file_hash, tuple(split_columns)) if file_hash else None
+
+    if cache_key:
+        with _SPLIT_PLANS_LOCK:
+            cached = _SPLIT_PLANS.get(cache_key)
+
+        if cached:
+            return cached
+
+    split = split_frame(df, split_columns)
+
+    bounds = np.asarray(split["bounds"], dtype=np.int64).reshape(-1, 2)
+    group_count = len(bounds)
+
+    groups = pd.DataFrame({
+        "Split Key": [format_split_key(split_columns, k) for k in split["keys"]],
+        "Rows": bounds[:, 1] - bounds[:, 0],
+    })
+
+    control_diff = 0.0
+
+    if spec and group_count:
+        metrics = build_log_metrics(split["frame"], spec, by=split["labels"]).reset_index(drop=True)
+        groups = pd.concat([groups, metrics], axis=1)
+
+        # Total semua grup harus sama dengan total file sumber
+        source = build_log_metrics(df, spec).iloc[0]
+        control_diff = float((metrics.sum() - source).abs().max())
+
+    # Ukuran file: overhead per file + byte per baris (diukur dari sampel)
+    overhead = _xlsx_size(df.head(0))
+    sample = df.head(SPLIT_SAMPLE_ROWS)
+    bytes_per_row = (_xlsx_size(sample) - overhead) / len(sample) if len(sample) else 0
+
+    measured = job_throughput("SPLIT")
+    seconds_per_group = measured or SPLIT_DEFAULT_SECONDS_PER_GROUP
+
+    plan = {
+        "groups": groups,
+        "group_count": group_count,
+        "rows": len(split["frame"]),
+        "missing_rows": split["missing_rows"],
+        "control_diff": control_diff,
+        "api_calls": {
+            "drive": group_count * SPLIT_DRIVE_CALLS_PER_GROUP,
+            "sheets": group_count * SPLIT_SHEETS_CALLS_PER_GROUP + SPLIT_FIXED_CALLS,
+        },
+        "bytes": int(group_count * overhead + len(split["frame"]) * bytes_per_row),
+        "seconds": group_count * seconds_per_group,
+        "throughput_measured": measured is not None,
+        "needs_confirmation": group_count > SPLIT_CONFIRM_GROUPS,
+    }
+
+    if cache_key:
+        with _SPLIT_PLANS_LOCK:
+            if len(_SPLIT_PLANS) >= SPLIT_PLAN_CACHE_SIZE:
+                _SPLIT_PLANS.pop(next(iter(_SPLIT_PLANS)))
+
+            _SPLIT_PLANS[cache_key] = plan
+
+    return plan
 
 def split_upload_with_log(
     service,
@@ -482,158 +735,199 @@ def split_upload_with_log(
     dept_type,
     base_info,
     columns_template,
+    pml_lock,
+    on_wait=None,
     progress_bar=None,
     status_text=None
 ):
     results = []
 
     df.columns = df.columns.str.strip()
-    df = df.dropna(subset=split_columns)
 
-    grouped = list(df.groupby(split_columns))
-    total = len(grouped)
+    # 🔥 sort SEKALI, setiap grup = view dari frame terurut
+    split = split_frame(df, split_columns)
+    total = len(split["bounds"])
 
-    # 🔥 ambil sequence SEKALI
-    current_seq = get_last_seq_no(sheets_service, log_pml_drive_id)
+    if split["missing_rows"]:
+        print(f"⚠️ {split['missing_rows']} baris dengan kolom split kosong dijadikan grup {MISSING_KEY_LABEL}")
 
-    for i, (key, group) in enumerate(grouped):
+    # 🔥 nilai semua grup SEKALI agregasi (urutan = grup split)
+    spec = split_metric_spec(dept_type, base_info["biz_type"])
+    if spec:
+        group_metrics = build_log_metrics(split["frame"], spec, by=split["labels"])
 
-        if group.empty:
-            continue
+    source_pml = str(base_info["source_pml"])
 
-        formatted_key = format_split_key(split_columns, key)
-        # 🔥 UPDATE UI
-        if status_text:
-            status_text.text(f"Processing {i+1}/{total} → {formatted_key}")
+    # ==========================
+    # PENOMORAN + LOG (DI BAWAH LEASE)
+    # ==========================
+    # Lease log PML hanya dipegang selama nomor PML dialokasikan dan baris
+    # log ditulis; upload file (bagian paling lama) berjalan setelah dilepas
+    uploads = []
 
-        if progress_bar:
-            progress_bar.progress((i + 1) / total)
-
-        # ==========================
-        # GENERATE PML (BENAR)
-        # ==========================
-        pml_id, current_seq = generate_pml_id(
-            current_seq,
-            year,
-            month,
-            base_info["department"],
-            base_info["biz_type"]
-        )
+    with drive_lock(service, pml_lock, on_wait=on_wait):
+
+        # 🔥 ambil sequence SEKALI
+        current_seq = get_last_seq_no(sheets_service, log_pml_drive_id)
 
-        # ==========================
-        # HITUNG NILAI
-        # ==========================
-        if dept_type == "ADMIN" and base_info["biz_type"] in ["Kontribusi", "Refund", "Alteration", "Retur", "Revise", "Batal", "Cancel"]:
-            product = group["References No"].iloc[0]
-            cby = group["CBY"].iloc[0]
-            cbm = group["CBM"].iloc[0]
-            total_contribution = group["Reins Total Premium"].sum()
-            commission = group["Reins Total Comm"].sum()
-            overriding = group["Reins Overriding"].sum() if "Reins Overriding" in group.columns else 0
-            total_commission = commission + overriding
-            tabarru = group["Reins Tabarru"].sum()
-            ujrah = group["Reins Ujrah"].sum()
+        for i, (key, group) in enumerate(iter_split_groups(split)):
+
+            if group.empty:
+                continue
+
+            formatted_key = format_split_key(split_columns, key)
+            # 🔥 UPDATE UI
+            if status_text:
+                status_text.text(f"Processing {i+1}/{total} → {formatted_key}")
 
             # ==========================
-            # LOG
+            # JOURNAL (IDEMPOTEN)
             # ==========================
-            log_pml = {
-                "Seq No": current_seq,
-                "Department": base_info["department"],
-                "Biz Type": base_info["biz_type"],
-                "PML ID": pml_id,
-                "Account With": base_info["account_with"],
-                "Cedant Company": base_info["cedant_company"],
-                "PIC": base_info["pic"],
-                "Product": product,
-                "CBY": cby,
-                "CBM": cbm,
-                "Curr": base_info["curr"],
-                "Total Contribution": total_contribution,
-                "Commission": commission,
-                "Overriding": overriding,
-                "Total Commission": total_commission,
-                "Gross Premium Income": total_contribution - total_commission,
-                "Tabarru": tabarru,
-                "Ujrah": ujrah,
-                "Claim": 0,
-                "Balance": total_contribution - total_commission,
-                "REMARKS": f"Split from {base_info['source_pml']}",
-                "STATUS": "POSTED",
-                "CREATED AT": now_wib_naive(),
-                "CREATED BY": base_info["pic"],
-                "Subject Email": base_info["subject_email"],
-                "Email Date": base_info["email_date"],
-                "CANCELED AT": "-",
-                "CANCELED BY": "-",
-                "CANCEL OF VOUCHER": "-",
-                "CANCEL REASON": "-"
-            }
-
-        elif dept_type == "CLAIM":
-            claim = group["Marein Share IDR"].sum()
-            product = group["References No"].iloc[0]
-            cby = group["CedBookYear"].iloc[0]
-            cbm = group["CedBookMonth"].iloc[0]
+            # Bagian yang sudah selesai di run sebelumnya tidak diulang
+            done_entry = get_entry(log_pml_drive_id, source_pml, formatted_key)
+
+            if done_entry and done_entry["done"]:
+                results.append({
+                    "pml_id": done_entry["target"],
+                    "rows": len(group),
+                    "split_value": formatted_key
+                })
+                continue
 
             # ==========================
-            # LOG
+            # GENERATE PML (BENAR)
             # ==========================
-            log_pml = {
-                "Seq No": current_seq,
-                "Department": base_info["department"],
-                "Biz Type": base_info["biz_type"],
-                "PML ID": pml_id,
-                "Account With": base_info["account_with"],
-                "Cedant Company": base_info["cedant_company"],
-                "PIC": base_info["pic"],
-                "Product": product,
-                "CBY": cby,
-                "CBM": cbm,
-                "Curr": base_info["curr"],
-                "Total Contribution": 0,
-                "Commission": 0,
-                "Overriding": 0,
-                "Total Commission": 0,
-                "Gross Premium Income": 0,
-                "Tabarru": 0,
-                "Ujrah": 0,
-                "Claim": claim,
-                "Balance": claim*-1,
-                "REMARKS": f"Split from {base_info['source_pml']}",
-                "STATUS": "POSTED",
-                "CREATED AT": now_wib_naive(),
-                "CREATED BY": base_info["pic"],
-                "Subject Email": base_info["subject_email"],
-                "Email Date": base_info["email_date"],
-                "CANCELED AT": "-",
-                "CANCELED BY": "-",
-                "CANCEL OF VOUCHER": "-",
-                "CANCEL REASON": "-"
-            }
-
-        # ==========================
-        # APPEND LOG
-        # ==========================
-        append_gsheet(
-            service=sheets_service,
-            spreadsheet_id=log_pml_drive_id,
-            row_dict=log_pml
-        )
+            # Nomor PML dicatat di journal sebelum ditulis ke log
+            entry = resolve_target(
+                log_pml_drive_id,
+                source_pml,
+                formatted_key,
+                KIND_SPLIT,
+                allocate=lambda: generate_pml_id(
+                    current_seq,
+                    year,
+                    month,
+                    base_info["department"],
+                    base_info["biz_type"]
+                ),
+                in_log=lambda target: log_has_row(sheets_service, log_pml_drive_id, {"PML ID": target})
+            )
+
+            pml_id, seq_no = entry["target"], int(entry["seq_no"])
+            current_seq = max(current_seq, seq_no)
 
-        # ==========================
-        # UPLOAD FILE
-        # ==========================
-        upload_dataframe_to_drive(
-            service=service,
-            df=group,
-            template_columns=columns_template,
-            voucher_id=pml_id,
-            filename=f"{pml_id}.xlsx",
-            folder_id=pml_folder_id,
-            file_type="PML"
+            # ==========================
+            # HITUNG NILAI
+            # ==========================
+            if dept_type == "ADMIN" and base_info["biz_type"] in ["Kontribusi", "Refund", "Alteration", "Retur", "Revise", "Batal", "Cancel"]:
+                product = group["References No"].iloc[0]
+                cby = group["CBY"].iloc[0]
+                cbm = group["CBM"].iloc[0]
+                metrics = group_metrics.iloc[i].to_dict()
+
+                # ==========================
+                # LOG
+                # ==========================
+                log_pml = {
+                    "Seq No": seq_no,
+                    "Department": base_info["department"],
+                    "Biz Type": base_info["biz_type"],
+                    "PML ID": pml_id,
+                    "Account With": base_info["account_with"],
+                    "Cedant Company": base_info["cedant_company"],
+                    "PIC": base_info["pic"],
+                    "Product": product,
+                    "CBY": cby,
+                    "CBM": cbm,
+                    "Curr": base_info["curr"],
+                    **metrics,
+                    "REMARKS": f"Split from {base_info['source_pml']}",
+                    "STATUS": "POSTED",
+                    "CREATED AT": now_wib_naive(),
+                    "CREATED BY": base_info["pic"],
+                    "Subject Email": base_info["subject_email"],
+                    "Email Date": base_info["email_date"],
+                    "CANCELED AT": "-",
+                    "CANCELED BY": "-",
+                    "CANCEL OF VOUCHER": "-",
+                    "CANCEL REASON": "-"
+                }
+
+            elif dept_type == "CLAIM":
+                metrics = group_metrics.iloc[i].to_dict()
+                product = group["References No"].iloc[0]
+                cby = group["CedBookYear"].iloc[0]
+                cbm = group["CedBookMonth"].iloc[0]
+
+                # ==========================
+                # LOG
+                # ==========================
+                log_pml = {
+                    "Seq No": seq_no,
+                    "Department": base_info["department"],
+                    "Biz Type": base_info["biz_type"],
+                    "PML ID": pml_id,
+                    "Account With": base_info["account_with"],
+                    "Cedant Company": base_info["cedant_company"],
+                    "PIC": base_info["pic"],
+                    "Product": product,
+                    "CBY": cby,
+                    "CBM": cbm,
+                    "Curr": base_info["curr"],
+                    **metrics,
+                    "REMARKS": f"Split from {base_info['source_pml']}",
+                    "STATUS": "POSTED",
+                    "CREATED AT": now_wib_naive(),
+                    "CREATED BY": base_info["pic"],
+                    "Subject Email": base_info["subject_email"],
+                    "Email Date": base_info["email_date"],
+                    "CANCELED AT": "-",
+                    "CANCELED BY": "-",
+                    "CANCEL OF VOUCHER": "-",
+                    "CANCEL REASON": "-"
+                }
+
+            # ==========================
+            # APPEND LOG
+            # ==========================
+            run_step(entry, STEP_LOG, lambda: append_gsheet(
+                service=sheets_service,
+                spreadsheet_id=log_pml_drive_id,
+                row_dict=log_pml
+            ))
+
+            uploads.append((formatted_key, group, entry))
+
+    # ==========================
+    # UPLOAD FILE
+    # ==========================
+    for i, (formatted_key, group, entry) in enumerate(uploads):
+
+        pml_id = entry["target"]
+
+        if status_text:
+            status_text.text(f"Upload {i+1}/{len(uploads)} → {formatted_key}")
+
+        if progress_bar:
+            progress_bar.progress((i + 1) / len(uploads))
+
+        run_step(
+            entry,
+            STEP_FILE,
+            lambda: upload_dataframe_to_drive(
+                service=service,
+                df=group,
+                template_columns=columns_template,
+                voucher_id=pml_id,
+                filename=f"{pml_id}.xlsx",
+                folder_id=pml_folder_id,
+                file_type="PML"
+            ),
+            exists=lambda: find_drive_file(service, f"{pml_id}.xlsx", pml_folder_id) is not None
         )
 
+        finish(log_pml_drive_id, source_pml, formatted_key)
+
         results.append({
             "pml_id": pml_id,
             "rows": len(group),
@@ -656,159 +950,199 @@ def split_upload_with_log_outward(
     biz_type,
     base_info,
     columns_template,
+    pml_lock,
+    on_wait=None,
     progress_bar=None,
     status_text=None
 ):
     results = []
 
     df.columns = df.columns.str.strip()
-    df = df.dropna(subset=split_columns)
 
-    grouped = list(df.groupby(split_columns))
-    total = len(grouped)
+    # 🔥 sort SEKALI, setiap grup = view dari frame terurut
+    split = split_frame(df, split_columns)
+    total = len(split["bounds"])
 
-    # 🔥 ambil sequence SEKALI
-    current_seq = get_last_seq_no(sheets_service, log_pml_drive_id)
+    if split["missing_rows"]:
+        print(f"⚠️ {split['missing_rows']} baris dengan kolom split kosong dijadikan grup {MISSING_KEY_LABEL}")
 
-    for i, (key, group) in enumerate(grouped):
+    # 🔥 nilai semua grup SEKALI agregasi (urutan = grup split)
+    spec = split_metric_spec(base_info["department"], biz_type, outward=True)
+    if spec:
+        group_metrics = build_log_metrics(split["frame"], spec, by=split["labels"])
 
-        if group.empty:
-            continue
+    source_pml = str(base_info["source_pml"])
 
-        formatted_key = format_split_key(split_columns, key)
-        # 🔥 UPDATE UI
-        if status_text:
-            status_text.text(f"Processing {i+1}/{total} → {formatted_key}")
+    # ==========================
+    # PENOMORAN + LOG (DI BAWAH LEASE)
+    # ==========================
+    # Lease log PML hanya dipegang selama nomor PML dialokasikan dan baris
+    # log ditulis; upload file (bagian paling lama) berjalan setelah dilepas
+    uploads = []
 
-        if progress_bar:
-            progress_bar.progress((i + 1) / total)
-
-        # ==========================
-        # GENERATE PML (BENAR)
-        # ==========================
-        pml_id, current_seq = generate_pml_id(
-            current_seq,
-            year,
-            month,
-            base_info["department"],
-            biz_type
-        )
+    with drive_lock(service, pml_lock, on_wait=on_wait):
+
+        # 🔥 ambil sequence SEKALI
+        current_seq = get_last_seq_no(sheets_service, log_pml_drive_id)
+
+        for i, (key, group) in enumerate(iter_split_groups(split)):
+
+            if group.empty:
+                continue
 
-        # ==========================
-        # HITUNG NILAI
-        # ==========================
-        if base_info["department"] == "ADMIN" and biz_type in ["Kontribusi", "Refund", "Alteration", "Retur", "Revise", "Batal", "Cancel"]:
-            product = group["References No"].iloc[0]
-            cby = group["Ced Book Year"].iloc[0]
-            cbm = group["Ced Book Month"].iloc[0]
-
-            total_contribution = group["Retro Total Premium"].sum()
-            commission = group["Retro Total Comm"].sum()
-            overriding = group["Retro Overriding"].sum() if "Retro Overriding" in group.columns else 0
-            total_commission = commission + overriding
-            tabarru = group["Retro Tabarru"].sum()
-            ujrah = group["Retro Ujrah"].sum()
+            formatted_key = format_split_key(split_columns, key)
+            # 🔥 UPDATE UI
+            if status_text:
+                status_text.text(f"Processing {i+1}/{total} → {formatted_key}")
 
             # ==========================
-            # LOG
+            # JOURNAL (IDEMPOTEN)
             # ==========================
-            log_pml = {
-                "Seq No": current_seq,
-                "Department": base_info["department"],
-                "Biz Type": biz_type,
-                "PML ID": pml_id,
-                "Account With": base_info["account_with"],
-                "Cedant Company": base_info["cedant_company"],
-                "PIC": base_info["pic"],
-                "Product": product,
-                "CBY": cby,
-                "CBM": cbm,
-                "Curr": base_info["curr"],
-                "Total Contribution": total_contribution,
-                "Commission": commission,
-                "Overriding": overriding,
-                "Total Commission": total_commission,
-                "Gross Premium Income": total_contribution - total_commission,
-                "Tabarru": tabarru,
-                "Ujrah": ujrah,
-                "Claim": 0,
-                "Balance": total_contribution - total_commission,
-                "REMARKS": f"Split from {base_info['source_pml']}",
-                "STATUS": "POSTED",
-                "CREATED AT": now_wib_naive(),
-                "CREATED BY": base_info["pic"],
-                "Subject Email": base_info["subject_email"],
-                "Email Date": base_info["email_date"],
-                "CANCELED AT": "-",
-                "CANCELED BY": "-",
-                "CANCEL OF VOUCHER": "-",
-                "CANCEL REASON": "-"
-            }
-
-        elif base_info["department"] == "CLAIM":
-            claim = group["Your Share"].sum()
-            product = group["Voucher Desc"].iloc[0]
-            cby = group["Ced Book Year"].iloc[0]
-            cbm = group["Ced Book Month"].iloc[0]
+            # Bagian yang sudah selesai di run sebelumnya tidak diulang
+            done_entry = get_entry(log_pml_drive_id, source_pml, formatted_key)
+
+            if done_entry and done_entry["done"]:
+                results.append({
+                    "pml_id": done_entry["target"],
+                    "rows": len(group),
+                    "split_value": formatted_key
+                })
+                continue
 
             # ==========================
-            # LOG
+            # GENERATE PML (BENAR)
             # ==========================
-            log_pml = {
-                "Seq No": current_seq,
-                "Department": base_info["department"],
-                "Biz Type": biz_type,
-                "PML ID": pml_id,
-                "Account With": base_info["account_with"],
-                "Cedant Company": base_info["cedant_company"],
-                "PIC": base_info["pic"],
-                "Product": product,
-                "CBY": cby,
-                "CBM": cbm,
-                "Curr": base_info["curr"],
-                "Total Contribution": 0,
-                "Commission": 0,
-                "Overriding": 0,
-                "Total Commission": 0,
-                "Gross Premium Income": 0,
-                "Tabarru": 0,
-                "Ujrah": 0,
-                "Claim": claim,
-                "Balance": claim*-1,
-                "REMARKS": f"Split from {base_info['source_pml']}",
-                "STATUS": "POSTED",
-                "CREATED AT": now_wib_naive(),
-                "CREATED BY": base_info["pic"],
-                "Subject Email": base_info["subject_email"],
-                "Email Date": base_info["email_date"],
-                "CANCELED AT": "-",
-                "CANCELED BY": "-",
-                "CANCEL OF VOUCHER": "-",
-                "CANCEL REASON": "-"
-            }
-
-        # ==========================
-        # APPEND LOG
-        # ==========================
-        append_gsheet(
-            service=sheets_service,
-            spreadsheet_id=log_pml_drive_id,
-            row_dict=log_pml
-        )
+            # Nomor PML dicatat di journal sebelum ditulis ke log
+            entry = resolve_target(
+                log_pml_drive_id,
+                source_pml,
+                formatted_key,
+                KIND_SPLIT,
+                allocate=lambda: generate_pml_id(
+                    current_seq,
+                    year,
+                    month,
+                    base_info["department"],
+                    biz_type
+                ),
+                in_log=lambda target: log_has_row(sheets_service, log_pml_drive_id, {"PML ID": target})
+            )
+
+            pml_id, seq_no = entry["target"], int(entry["seq_no"])
+            current_seq = max(current_seq, seq_no)
 
-        # ==========================
-        # UPLOAD FILE
-        # ==========================
-        upload_dataframe_to_drive(
-            service=service,
-            df=group,
-            template_columns=columns_template,
-            voucher_id=pml_id,
-            filename=f"{pml_id}.xlsx",
-            folder_id=pml_folder_id,
-            file_type="PML"
+            # ==========================
+            # HITUNG NILAI
+            # ==========================
+            if base_info["department"] == "ADMIN" and biz_type in ["Kontribusi", "Refund", "Alteration", "Retur", "Revise", "Batal", "Cancel"]:
+                product = group["References No"].iloc[0]
+                cby = group["Ced Book Year"].iloc[0]
+                cbm = group["Ced Book Month"].iloc[0]
+                metrics = group_metrics.iloc[i].to_dict()
+
+                # ==========================
+                # LOG
+                # ==========================
+                log_pml = {
+                    "Seq No": seq_no,
+                    "Department": base_info["department"],
+                    "Biz Type": biz_type,
+                    "PML ID": pml_id,
+                    "Account With": base_info["account_with"],
+                    "Cedant Company": base_info["cedant_company"],
+                    "PIC": base_info["pic"],
+                    "Product": product,
+                    "CBY": cby,
+                    "CBM": cbm,
+                    "Curr": base_info["curr"],
+                    **metrics,
+                    "REMARKS": f"Split from {base_info['source_pml']}",
+                    "STATUS": "POSTED",
+                    "CREATED AT": now_wib_naive(),
+                    "CREATED BY": base_info["pic"],
+                    "Subject Email": base_info["subject_email"],
+                    "Email Date": base_info["email_date"],
+                    "CANCELED AT": "-",
+                    "CANCELED BY": "-",
+                    "CANCEL OF VOUCHER": "-",
+                    "CANCEL REASON": "-"
+                }
+
+            elif base_info["department"] == "CLAIM":
+                metrics = group_metrics.iloc[i].to_dict()
+                product = group["Voucher Desc"].iloc[0]
+                cby = group["Ced Book Year"].iloc[0]
+                cbm = group["Ced Book Month"].iloc[0]
+
+                # ==========================
+                # LOG
+                # ==========================
+                log_pml = {
+                    "Seq No": seq_no,
+                    "Department": base_info["department"],
+                    "Biz Type": biz_type,
+                    "PML ID": pml_id,
+                    "Account With": base_info["account_with"],
+                    "Cedant Company": base_info["cedant_company"],
+                    "PIC": base_info["pic"],
+                    "Product": product,
+                    "CBY": cby,
+                    "CBM": cbm,
+                    "Curr": base_info["curr"],
+                    **metrics,
+                    "REMARKS": f"Split from {base_info['source_pml']}",
+                    "STATUS": "POSTED",
+                    "CREATED AT": now_wib_naive(),
+                    "CREATED BY": base_info["pic"],
+                    "Subject Email": base_info["subject_email"],
+                    "Email Date": base_info["email_date"],
+                    "CANCELED AT": "-",
+                    "CANCELED BY": "-",
+                    "CANCEL OF VOUCHER": "-",
+                    "CANCEL REASON": "-"
+                }
+
+            # ==========================
+            # APPEND LOG
+            # ==========================
+            run_step(entry, STEP_LOG, lambda: append_gsheet(
+                service=sheets_service,
+                spreadsheet_id=log_pml_drive_id,
+                row_dict=log_pml
+            ))
+
+            uploads.append((formatted_key, group, entry))
+
+    # ==========================
+    # UPLOAD FILE
+    # ==========================
+    for i, (formatted_key, group, entry) in enumerate(uploads):
+
+        pml_id = entry["target"]
+
+        if status_text:
+            status_text.text(f"Upload {i+1}/{len(uploads)} → {formatted_key}")
+
+        if progress_bar:
+            progress_bar.progress((i + 1) / len(uploads))
+
+        run_step(
+            entry,
+            STEP_FILE,
+            lambda: upload_dataframe_to_drive(
+                service=service,
+                df=group,
+                template_columns=columns_template,
+                voucher_id=pml_id,
+                filename=f"{pml_id}.xlsx",
+                folder_id=pml_folder_id,
+                file_type="PML"
+            ),
+            exists=lambda: find_drive_file(service, f"{pml_id}.xlsx", pml_folder_id) is not None
         )
 
+        finish(log_pml_drive_id, source_pml, formatted_key)
+
         results.append({
             "pml_id": pml_id,
             "rows": len(group),